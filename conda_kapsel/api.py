@@ -257,6 +257,77 @@ class AnacondaProject(object):
                                                io_loop=io_loop,
                                                show_url=show_url)
 
+    def prepare_plan(self,
+                     project,
+                     environ,
+                     mode=provide.PROVIDE_MODE_DEVELOPMENT,
+                     provide_whitelist=None,
+                     env_spec_name=None,
+                     command_name=None,
+                     command=None,
+                     check_sizes=True):
+        """Describe what preparing the project would do, without doing any of it.
+
+        The plan lists a step for each thing prepare would do, such
+        as creating the environment, downloading a file, or starting
+        a service, with the size of the downloads where they can be
+        found out in advance.
+
+        Args:
+            project (Project): from the ``load_project`` method
+            environ (dict): os.environ or the previously-prepared environ; not modified in-place
+            mode (str): mode prepare would use, ``PROVIDE_MODE_PRODUCTION`` or ``PROVIDE_MODE_DEVELOPMENT``
+            provide_whitelist (iterable of str): ONLY plan the listed env vars' requirements
+            env_spec_name (str): the package set name to require, or None for default
+            command_name (str): which named command to choose from the project, None for default
+            command (ProjectCommand): a command object (alternative to command_name)
+            check_sizes (bool): False to skip asking servers for download sizes
+
+        Returns:
+            a ``PreparePlan`` instance, which has a ``failed`` flag
+
+        """
+        return prepare.prepare_plan(project=project,
+                                    environ=environ,
+                                    mode=mode,
+                                    provide_whitelist=provide_whitelist,
+                                    env_spec_name=env_spec_name,
+                                    command_name=command_name,
+                                    command=command,
+                                    check_sizes=check_sizes)
+
+    def prepare_projects(self,
+                         projects,
+                         environ,
+                         mode=provide.PROVIDE_MODE_DEVELOPMENT,
+                         env_spec_name=None,
+                         jobs=None,
+                         on_result=None):
+        """Prepare several projects at once without asking questions.
+
+        This is cheaper than preparing each project separately,
+        because the projects share this process's caches. A failure
+        in one project doesn't stop the others.
+
+        Args:
+            projects (list of Project): from the ``load_project`` method
+            environ (dict): os.environ or the previously-prepared environ; not modified in-place
+            mode (str): mode from ``PROVIDE_MODE_PRODUCTION``, ``PROVIDE_MODE_DEVELOPMENT``, ``PROVIDE_MODE_CHECK``
+            env_spec_name (str): the package set name to require, or None for each project's default
+            jobs (int): how many projects to prepare at once, or None for a default
+            on_result (callable): if not None, called with ``(project, result)`` as each project finishes
+
+        Returns:
+            a list of ``PrepareResult``, in the same order as projects
+
+        """
+        return prepare.prepare_projects_without_interaction(projects=projects,
+                                                            environ=environ,
+                                                            mode=mode,
+                                                            env_spec_name=env_spec_name,
+                                                            jobs=jobs,
+                                                            on_result=on_result)
+
     def unprepare(self, project, prepare_result, whitelist=None):
         """Attempt to clean up project-scoped resources allocated by prepare().
 
@@ -494,6 +565,44 @@ class AnacondaProject(object):
         """
         return project_ops.remove_packages(project=project, env_spec_name=env_spec_name, packages=packages)
 
+    def lock(self, project, env_spec_name=None):
+        """Write a lockfile listing the exact packages for each environment spec.
+
+        Environments are then created from the lockfile without
+        running the conda solver, until the env spec changes.
+        Lockfiles which are already up to date are left alone.
+
+        Returns a ``Status`` subtype (it won't be a
+        ``RequirementStatus`` as with some other functions, just a
+        plain status).
+
+        Args:
+            project (Project): the project
+            env_spec_name (str): environment spec name or None for all environment specs
+
+        Returns:
+            ``Status`` instance
+        """
+        return project_ops.lock(project=project, env_spec_name=env_spec_name)
+
+    def prepare_env_specs(self, project, env_spec_names=None, jobs=None, fix=True):
+        """Create or update the environments for several env specs at once.
+
+        A failure in one environment doesn't stop the others; the
+        returned status has a ``deviations`` dict with what was wrong
+        with each env spec, and ``errors`` for any that failed.
+
+        Args:
+            project (Project): the project
+            env_spec_names (list of str): env spec names or None for all environment specs
+            jobs (int): how many environments to work on at once, or None for a default
+            fix (bool): False to only check the environments without changing them
+
+        Returns:
+            ``Status`` instance
+        """
+        return project_ops.prepare_env_specs(project=project, env_spec_names=env_spec_names, jobs=jobs, fix=fix)
+
     def add_command(self, project, name, command_type, command, env_spec_name=None):
         """Add a command to kapsel.yml.
 
@@ -9,9 +9,9 @@ from __future__ import absolute_import, print_function
 
 import codecs
 import errno
-import fnmatch
 import os
 import platform
+import re
 import subprocess
 import tarfile
 import uuid
@@ -20,89 +20,230 @@ import zipfile
 from conda_kapsel.internal.simple_status import SimpleStatus
 from conda_kapsel.internal.directory_contains import subdirectory_relative_to_directory
 from conda_kapsel.internal.rename import rename_over_existing
+from conda_kapsel.internal import trace
 
 
 class _FileInfo(object):
-    def __init__(self, project_directory, filename, is_directory):
-        self.full_path = os.path.abspath(filename)
-        self.relative_path = os.path.relpath(self.full_path, start=project_directory)
+    # there's one of these for every file in the project, so they
+    # are kept small and compute most of their paths on demand
+    __slots__ = ('project_directory', 'relative_path', 'is_directory')
+
+    def __init__(self, project_directory, relative_path, is_directory):
+        self.project_directory = project_directory
+        self.relative_path = relative_path
+        self.is_directory = is_directory
+
+    @property
+    def full_path(self):
+        return os.path.join(self.project_directory, self.relative_path)
+
+    @property
+    def unixified_relative_path(self):
         if platform.system() == 'Windows':
-            self.unixified_relative_path = self.relative_path.replace("\\", "/")
+            return self.relative_path.replace("\\", "/")
         else:
-            self.unixified_relative_path = self.relative_path
-        self.basename = os.path.basename(self.full_path)
-        self.is_directory = is_directory
+            return self.relative_path
+
+    @property
+    def basename(self):
+        return os.path.basename(self.relative_path)
+
+
+class _ListdirEntry(object):
+    # the parts of os.scandir()'s DirEntry we use, for Pythons without it
+    __slots__ = ('name', 'path')
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+def _scan_directory(path):
+    # returns (name, is_directory, should_recurse) for each entry,
+    # in the order we archive them
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:
+        entries = [_ListdirEntry(path, name) for name in os.listdir(path)]  # pragma: no cover (no scandir)
+    else:
+        entries = list(scandir(path))
+
+    result = []
+    for entry in entries:
+        # like os.walk, count links to directories as directories
+        # but don't follow them; DirEntry usually knows all this
+        # without a stat().
+        try:
+            is_directory = entry.is_dir()
+            recurse = is_directory and not entry.is_symlink()
+        except OSError:
+            is_directory = False
+            recurse = False
+        result.append((entry.name, is_directory, recurse))
+
+    # a directory sorts as "name/" because that's how its
+    # contents start, so we produce paths in sorted order
+    result.sort(key=lambda item: (item[0] + "/") if item[1] else item[0])
+    return result
+
+
+def _walk_project(project_directory, ignore_filter):
+    # lists the top directory right away, so failing to do that
+    # raises OSError here rather than while iterating
+    project_directory = os.path.abspath(project_directory)
+    top = _scan_directory(project_directory)
+    return _walk_entries(project_directory, top, ignore_filter)
+
+
+def _walk_entries(project_directory, top, ignore_filter):
+    stack = [('', iter(top))]
+    while len(stack) > 0:
+        (parent, remaining) = stack[-1]
+        for (name, is_directory, recurse) in remaining:
+            if parent == '':
+                relative_path = name
+            else:
+                relative_path = os.path.join(parent, name)
+            info = _FileInfo(project_directory=project_directory,
+                             relative_path=relative_path,
+                             is_directory=is_directory)
+            # don't even recurse into filtered-out directories,
+            # mostly because recursing into "envs" is very slow
+            if ignore_filter(info):
+                continue
+            yield info
+
+            if recurse:
+                try:
+                    children = _scan_directory(info.full_path)
+                except OSError:
+                    # as with os.walk, skip directories we can't list
+                    children = []
+                stack.append((relative_path, iter(children)))
+                break
+        else:
+            stack.pop()
 
 
 def _list_project(project_directory, ignore_filter, errors):
+    """Iterate over unignored files and directories, each directory just before its contents, sorted by path."""
     try:
-        file_infos = []
-        for root, dirs, files in os.walk(project_directory):
-            filtered_dirs = []
-            for d in dirs:
-                info = _FileInfo(project_directory=project_directory, filename=os.path.join(root, d), is_directory=True)
-                if ignore_filter(info):
-                    continue
-                else:
-                    filtered_dirs.append(d)
-                    file_infos.append(info)
-
-            # don't even recurse into filtered-out directories, mostly because recursing into
-            # "envs" is very slow
-            dirs[:] = filtered_dirs
-
-            for f in files:
-                info = _FileInfo(project_directory=project_directory,
-                                 filename=os.path.join(root, f),
-                                 is_directory=False)
-                if not ignore_filter(info):
-                    file_infos.append(info)
-
-        return file_infos
+        return _walk_project(project_directory, ignore_filter)
     except OSError as e:
         errors.append("Could not list files in %s: %s." % (project_directory, str(e)))
         return None
 
 
+def _glob_to_regex(pattern):
+    # this is fnmatch.translate() without the end-of-string anchor,
+    # so that we can match a pattern against any parent of a path.
+    i = 0
+    n = len(pattern)
+    result = ''
+    while i < n:
+        c = pattern[i]
+        i = i + 1
+        if c == '*':
+            result = result + '.*'
+        elif c == '?':
+            result = result + '.'
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j = j + 1
+            if j < n and pattern[j] == ']':
+                j = j + 1
+            while j < n and pattern[j] != ']':
+                j = j + 1
+            if j >= n:
+                result = result + '\\['
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] == '^':
+                    stuff = '\\' + stuff
+                result = '%s[%s]' % (result, stuff)
+        else:
+            result = result + re.escape(c)
+    return result
+
+
+def _compile_globs(globs):
+    if len(globs) == 0:
+        return None
+    # A path matches if the glob matches the path or one of its
+    # parents, which is to say some part of the path that ends
+    # at a "/" or at the end. Patterns aren't case-sensitive
+    # where filenames aren't, as with fnmatch.
+    flags = re.DOTALL
+    if os.path.normcase('A') == 'a':
+        flags = flags | re.IGNORECASE  # pragma: no cover (Windows)
+    alternatives = "|".join("(?:%s)" % _glob_to_regex(glob) for glob in globs)
+    return re.compile("(?:%s)(?=/|\\Z)" % alternatives, flags)
+
+
+class _PatternMatcher(object):
+    """A set of ignore patterns, compiled so that testing a path against all of them is one regex match."""
+
+    def __init__(self, patterns):
+        # Unlike .gitignore, this is a path-unaware match; "*"
+        # matches "/" as it does with fnmatch. However, on Windows,
+        # we have fixed up unixified_relative_path to have / instead
+        # of \, so that it will match patterns specified with /.
+        any_file = []
+        directories_only = []
+        for pattern in patterns:
+            if pattern.startswith("/"):
+                # we have to match the full path or one of its parents exactly
+                glob = pattern
+            else:
+                # we only have to match the end of the path (implicit "*/")
+                glob = "*/" + pattern
+
+            # ending with / means only match directories
+            if glob.endswith("/"):
+                glob = glob[:-1]
+                if glob == '':
+                    # "/" alone never matched anything
+                    continue
+                directories_only.append(glob)
+            else:
+                any_file.append(glob)
+
+        self._files_regex = _compile_globs(any_file)
+        self._directories_regex = _compile_globs(any_file + directories_only)
+
+    def matches(self, info):
+        if info.is_directory:
+            regex = self._directories_regex
+        else:
+            regex = self._files_regex
+        if regex is None:
+            return False
+        # So that */ matches even plain "foo" we need to start with /
+        return regex.match("/" + info.unixified_relative_path) is not None
+
+
 class _FilePattern(object):
     def __init__(self, pattern):
         assert pattern != ''
         # the glob string
         self.pattern = pattern
+        self._matcher = None
 
     def matches(self, info):
-        # Unlike .gitignore, this is a path-unaware match; fnmatch doesn't pay
-        # any attention to "/" as a special character. However, on Windows, we
-        # have fixed up unixified_relative_path to have / instead of \, so that
-        # it will match patterns specified with /.
-        def match(path, pattern):
-            assert path.startswith("/")
-            while path != '/':
-                if fnmatch.fnmatch(path, pattern):
-                    return True
-                # this assumes that on Windows, dirname on a unixified path
-                # will do the right thing...
-                path = os.path.dirname(path)
-            return False
-
-        if self.pattern.startswith("/"):
-            # we have to match the full path or one of its parents exactly
-            pattern = self.pattern
-        else:
-            # we only have to match the end of the path (implicit "*/")
-            pattern = "*/" + self.pattern
-
-        # So that */ matches even plain "foo" we need to start with /
-        match_against = "/" + info.unixified_relative_path
-
-        # ending with / means only match directories
-        if pattern.endswith("/"):
-            if info.is_directory:
-                return match(match_against, pattern[:-1])
-            else:
-                return False
-        else:
-            return match(match_against, pattern)
+        # to check a lot of paths against a lot of patterns, use
+        # one _PatternMatcher for all the patterns instead
+        if self._matcher is None:
+            self._matcher = _PatternMatcher([self.pattern])
+        return self._matcher.matches(info)
 
 
 def _parse_ignore_file(filename, errors):
@@ -140,6 +281,22 @@ def _load_ignore_file(project_directory, errors):
     return _parse_ignore_file(ignore_file, errors)
 
 
+def _split_git_output(output):
+    return [path for path in output.decode('utf-8').split("\0") if path != '']
+
+
+def _git_check_ignore(project_directory, paths):
+    # returns the set of paths that are ignored themselves (or are in an ignored directory)
+    args = ['git', 'check-ignore', '-z', '--stdin']
+    with trace.span("git check-ignore", 'subprocess', directory=project_directory):
+        popen = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=project_directory)
+        (output, _) = popen.communicate("".join([path + "\0" for path in paths]).encode('utf-8'))
+    # exit code 1 means none of them are ignored
+    if popen.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(popen.returncode, args, output=output)
+    return set([path.rstrip("/") for path in _split_git_output(output)])
+
+
 def _git_ignored_files(project_directory, errors):
     if not os.path.exists(os.path.join(project_directory, ".git")):
         return []
@@ -154,12 +311,38 @@ def _git_ignored_files(project_directory, errors):
     # --other means show untracked (not added) files
     # --ignored means show ignored files
     # --exclude-standard means use the usual .gitignore and other configuration
+    # --directory means list an entirely-ignored directory as "dir/" instead
+    #   of listing everything in it, which matters a lot for envs/
+    # -z means don't quote unusual filenames
     try:
-        output = subprocess.check_output(
-            ['git', 'ls-files', '--others', '--ignored', '--exclude-standard'],
-            cwd=project_directory)
+        with trace.span("git ls-files", 'subprocess', directory=project_directory):
+            output = subprocess.check_output(
+                ['git', 'ls-files', '--others', '--ignored', '--exclude-standard', '--directory', '-z'],
+                cwd=project_directory)
+        paths = _split_git_output(output)
+
+        # --directory also collapses a directory whose files all happen to
+        # be ignored, though the directory itself isn't. A file added there
+        # later may not be ignored, so we have to walk into it (the notebook
+        # index watches the mtimes of the directories we walk).
+        directories = [path for path in paths if path.endswith("/")]
+        if len(directories) > 0:
+            ignored_directories = _git_check_ignore(project_directory, [path.rstrip("/") for path in directories])
+            not_ignored = [path for path in directories if path.rstrip("/") not in ignored_directories]
+            if len(not_ignored) > 0:
+                with trace.span("git ls-files", 'subprocess', directory=project_directory):
+                    output = subprocess.check_output(
+                        ['git', 'ls-files', '--others', '--ignored', '--exclude-standard', '-z', '--'] + not_ignored,
+                        cwd=project_directory)
+                not_ignored = set(not_ignored)
+                paths = [path for path in paths if path not in not_ignored]
+                already_listed = set(paths)
+                paths.extend([path for path in _split_git_output(output) if path not in already_listed])
+
+        # git paths are always separated by "/"
+        paths = [path.rstrip("/").replace("/", os.sep) for path in paths]
         # for whatever reason, git doesn't include the ".git" in the ignore list
-        return [".git"] + output.decode('utf-8').splitlines()
+        return [".git"] + paths
     except subprocess.CalledProcessError as e:
         message = e.output.decode('utf-8').replace("\n", " ")
         errors.append("'git ls-files' failed to list ignored files: %s." % (message))
@@ -189,41 +372,36 @@ def _git_filter(project_directory, errors):
     return is_git_ignored
 
 
-def _ignore_file_filter(project_directory, errors):
+# function exported for internal/notebook_index.py
+def _plugin_ignore_patterns(requirements):
+    patterns = set()
+    for req in requirements:
+        patterns = patterns.union(req.ignore_patterns)
+    return sorted(patterns)
+
+
+def _ignore_patterns_filter(project_directory, errors, requirements):
+    # .kapselignore and the plugins' patterns all go in one matcher
     patterns = _load_ignore_file(project_directory, errors)
     if patterns is None:
         assert errors
         return None
 
-    def matches_some_pattern(info):
-        for pattern in patterns:
-            if pattern.matches(info):
-                return True
-        return False
-
-    return matches_some_pattern
+    matcher = _PatternMatcher([pattern.pattern for pattern in patterns] + _plugin_ignore_patterns(requirements))
+    return matcher.matches
 
 
+# function exported for internal/notebook_index.py
 def _enumerate_archive_files(project_directory, errors, requirements):
+    # returns an iterator (see _list_project), or None on error
     git_filter = _git_filter(project_directory, errors)
-    ignore_file_filter = _ignore_file_filter(project_directory, errors)
-    if git_filter is None or ignore_file_filter is None:
+    patterns_filter = _ignore_patterns_filter(project_directory, errors, requirements)
+    if git_filter is None or patterns_filter is None:
         assert errors
         return None
 
-    plugin_patterns = set()
-    for req in requirements:
-        plugin_patterns = plugin_patterns.union(req.ignore_patterns)
-    plugin_patterns = [_FilePattern(s) for s in plugin_patterns]
-
-    def is_plugin_generated(info):
-        for pattern in plugin_patterns:
-            if pattern.matches(info):
-                return True
-        return False
-
     def all_filters(info):
-        return git_filter(info) or ignore_file_filter(info) or is_plugin_generated(info)
+        return git_filter(info) or patterns_filter(info)
 
     infos = _list_project(project_directory, all_filters, errors)
     if infos is None:
@@ -234,18 +412,19 @@ def _enumerate_archive_files(project_directory, errors, requirements):
 
 
 def _leaf_infos(infos):
-    all_by_name = dict()
-    for info in infos:
-        all_by_name[info.relative_path] = info
+    # infos are in _list_project() order, so a directory is a leaf
+    # unless the next info is inside it
+    directory = None
     for info in infos:
-        parent = os.path.dirname(info.relative_path)
-        while parent != '':
-            assert parent != '/'  # would be infinite loop
-            if parent in all_by_name:
-                del all_by_name[parent]
-            parent = os.path.dirname(parent)
-
-    return sorted(all_by_name.values(), key=lambda x: x.relative_path)
+        if directory is not None and not info.relative_path.startswith(directory.relative_path + os.sep):
+            yield directory
+        if info.is_directory:
+            directory = info
+        else:
+            directory = None
+            yield info
+    if directory is not None:
+        yield directory
 
 
 def _write_tar(archive_root_name, infos, filename, compression, logs):
@@ -268,14 +447,6 @@ def _write_zip(archive_root_name, infos, filename, logs):
             zf.write(info.full_path, arcname=arcname)
 
 
-# function exported for project.py
-def _list_relative_paths_for_unignored_project_files(project_directory, errors, requirements):
-    infos = _enumerate_archive_files(project_directory, errors, requirements=requirements)
-    if infos is None:
-        return None
-    return [info.relative_path for info in infos]
-
-
 # function exported for project_ops.py
 def _archive_project(project, filename):
     """Make an archive of the non-ignored files in the project.
@@ -297,13 +468,18 @@ def _archive_project(project, filename):
         return SimpleStatus(success=False, description="Failed to list files in the project.", errors=errors)
 
     # don't put the destination zip into itself, since it's fairly natural to
-    # create a archive right in the project directory
-    relative_dest_file = subdirectory_relative_to_directory(filename, project.directory_path)
-    if not os.path.isabs(relative_dest_file):
-        infos = [info for info in infos if info.relative_path != relative_dest_file]
+    # create a archive right in the project directory. We list files while
+    # we write, so the temporary file may show up too.
+    tmp_filename = filename + ".tmp-" + str(uuid.uuid4())
+    excluded = set()
+    for path in (filename, tmp_filename):
+        relative_path = subdirectory_relative_to_directory(path, project.directory_path)
+        if not os.path.isabs(relative_path):
+            excluded.add(relative_path)
+    if excluded:
+        infos = (info for info in infos if info.relative_path not in excluded)
 
     logs = []
-    tmp_filename = filename + ".tmp-" + str(uuid.uuid4())
     try:
         if filename.lower().endswith(".zip"):
             _write_zip(project.name, infos, tmp_filename, logs)
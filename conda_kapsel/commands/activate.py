@@ -14,8 +14,10 @@ try:
 except ImportError:  # pragma: no cover (py2 only)
     from pipes import quote
 
-from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors
+from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors, UI_MODE_BROWSER
 from conda_kapsel.commands.project_load import load_project
+from conda_kapsel.internal.environ_overlay import changed_since
+from conda_kapsel.internal.prepared_stamp import load_prepared_stamp, save_prepared_stamp
 
 
 def activate(dirname, ui_mode, conda_environment):
@@ -26,19 +28,25 @@ def activate(dirname, ui_mode, conda_environment):
     Returns:
         None on failure or a list of lines to print.
     """
-    project = load_project(dirname)
-    result = prepare_with_ui_mode_printing_errors(project, ui_mode=ui_mode, env_spec_name=conda_environment)
-    if result.failed:
-        return None
+    stamp_request = ['activate', ui_mode, conda_environment]
+    if ui_mode == UI_MODE_BROWSER:
+        result = None
+    else:
+        result = load_prepared_stamp(dirname, stamp_request)
+
+    if result is None:
+        project = load_project(dirname)
+        result = prepare_with_ui_mode_printing_errors(project, ui_mode=ui_mode, env_spec_name=conda_environment)
+        if result.failed:
+            return None
+        elif ui_mode != UI_MODE_BROWSER:
+            save_prepared_stamp(project, result, stamp_request)
 
     exports = []
+    changed = changed_since(result.environ, os.environ)
     # sort so we have deterministic output order for tests
-    sorted_keys = list(result.environ.keys())
-    sorted_keys.sort()
-    for key in sorted_keys:
-        value = result.environ[key]
-        if key not in os.environ or os.environ[key] != value:
-            exports.append("export {key}={value}".format(key=key, value=quote(value)))
+    for key in sorted(changed.keys()):
+        exports.append("export {key}={value}".format(key=key, value=quote(changed[key])))
     return exports
 
 
@@ -62,6 +62,18 @@ def remove_packages(project, environment, packages):
     return _handle_status(status, success_message)
 
 
+def lock(project_dir, env_spec_name):
+    """Write lockfiles for the environment specs in the project."""
+    project = load_project(project_dir)
+    status = project_ops.lock(project, env_spec_name=env_spec_name)
+    if status:
+        print(status.status_description)
+        return 0
+    else:
+        console_utils.print_status_errors(status)
+        return 1
+
+
 def list_env_specs(project_dir):
     """List environments in the project."""
     project = load_project(project_dir)
@@ -108,6 +120,11 @@ def main_remove_packages(args):
     return remove_packages(args.directory, args.env_spec, args.packages)
 
 
+def main_lock(args):
+    """Start the lock command and return exit status code."""
+    return lock(args.directory, args.env_spec)
+
+
 def main_list_env_specs(args):
     """Start the list environments command and return exit status code."""
     return list_env_specs(args.directory)
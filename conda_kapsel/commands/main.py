@@ -8,19 +8,23 @@
 from __future__ import absolute_import, print_function
 
 import os
+import signal
 import sys
 from argparse import ArgumentParser, REMAINDER
 
-from conda_kapsel.commands.prepare_with_mode import (UI_MODE_TEXT_ASK_QUESTIONS,
+from conda_kapsel.commands.prepare_with_mode import (UI_MODE_TEXT_ASK_QUESTIONS, UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT,
                                                      UI_MODE_TEXT_DEVELOPMENT_DEFAULTS_OR_ASK, _all_ui_modes)
 from conda_kapsel.version import version
 from conda_kapsel.project import ALL_COMMAND_TYPES
 from conda_kapsel.plugins.registry import PluginRegistry
 from conda_kapsel.plugins.requirements.download import _hash_algorithms
+from conda_kapsel.internal import streaming_popen
+from conda_kapsel.internal import trace
 import conda_kapsel
 import conda_kapsel.commands.init as init
 import conda_kapsel.commands.run as run
 import conda_kapsel.commands.prepare as prepare
+import conda_kapsel.commands.plan as plan
 import conda_kapsel.commands.clean as clean
 import conda_kapsel.commands.archive as archive
 import conda_kapsel.commands.upload as upload
@@ -41,6 +45,11 @@ def _parse_args_and_run_subcommand(argv):
     subparsers = parser.add_subparsers(help="Sub-commands")
 
     parser.add_argument('-v', '--version', action='version', version=version)
+    parser.add_argument('--trace',
+                        metavar='TRACE_FILE',
+                        default=None,
+                        action='store',
+                        help="Save timings of what we did to TRACE_FILE, as Chrome trace event JSON")
 
     def add_directory_arg(preset):
         preset.add_argument('--directory',
@@ -91,8 +100,54 @@ def _parse_args_and_run_subcommand(argv):
 
     preset = subparsers.add_parser('prepare', help="Set up the project requirements, but does not run the project")
     add_prepare_args(preset)
+    preset.add_argument('--all-env-specs',
+                        action='store_true',
+                        help="Create or update the environments for every environment spec, not only the one used")
+    preset.add_argument('--jobs',
+                        metavar='N',
+                        type=int,
+                        default=None,
+                        action='store',
+                        help="How many environments to work on at once with --all-env-specs")
     preset.set_defaults(main=prepare.main)
 
+    preset = subparsers.add_parser('prepare-many', help="Set up the requirements of several projects at once")
+    add_env_spec_arg(preset)
+    preset.add_argument('--mode',
+                        metavar='MODE',
+                        default=UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT,
+                        choices=prepare.MANY_UI_MODES,
+                        action='store',
+                        help="One of " + ", ".join(prepare.MANY_UI_MODES))
+    preset.add_argument('--jobs',
+                        metavar='N',
+                        type=int,
+                        default=None,
+                        action='store',
+                        help="How many projects to prepare at once")
+    preset.add_argument('directories',
+                        metavar='PROJECT_DIR',
+                        nargs='+',
+                        help="Project directories containing kapsel.yml")
+    preset.set_defaults(main=prepare.main_many)
+
+    preset = subparsers.add_parser('plan', help="Show what prepare would do, and how much it would download")
+    add_directory_arg(preset)
+    add_env_spec_arg(preset)
+    preset.add_argument('--production',
+                        action='store_true',
+                        help="Plan with production defaults rather than development defaults")
+    preset.add_argument('--no-sizes',
+                        action='store_true',
+                        help="Don't ask servers for the size of each download")
+    preset.add_argument('--json', action='store_true', help="Print the plan as JSON")
+    preset.add_argument('command',
+                        metavar='COMMAND_NAME',
+                        default=None,
+                        nargs='?',
+                        help="A command name from kapsel.yml")
+    preset.set_defaults(main=plan.main)
+
     preset = subparsers.add_parser('clean',
                                    help="Removes generated state (stops services, deletes environment files, etc)")
     add_directory_arg(preset)
@@ -210,6 +265,11 @@ def _parse_args_and_run_subcommand(argv):
     add_directory_arg(preset)
     preset.set_defaults(main=environment_commands.main_list_env_specs)
 
+    preset = subparsers.add_parser('lock', help="Lock environment specs to exact package versions")
+    add_directory_arg(preset)
+    add_env_spec_arg(preset)
+    preset.set_defaults(main=environment_commands.main_lock)
+
     preset = subparsers.add_parser('add-packages', help="Add packages to one or all project environments")
     add_directory_arg(preset)
     add_env_spec_arg(preset)
@@ -249,6 +309,10 @@ def _parse_args_and_run_subcommand(argv):
     add_directory_arg(preset)
     preset.set_defaults(main=command_commands.main_list)
 
+    # so we know which subcommand ran without searching argv for it
+    for (name, subparser) in subparsers.choices.items():
+        subparser.set_defaults(subcommand=name)
+
     # argparse doesn't do this for us for whatever reason
     if len(argv) < 2:
         print("Must specify a subcommand.", file=sys.stderr)
@@ -263,7 +327,40 @@ def _parse_args_and_run_subcommand(argv):
     # '--directory' is used for all subcommands now, but may not be always
     if 'directory' in args:
         args.directory = os.path.abspath(args.directory)
-    return args.main(args)
+
+    if args.trace is None:
+        return args.main(args)
+
+    trace.record_to_file(args.trace, summary_file=sys.stderr)
+    try:
+        with trace.span("conda-kapsel " + args.subcommand, 'command'):
+            return args.main(args)
+    finally:
+        # 'run' saves the trace (including this span) before it execs; this does nothing then
+        trace.write_files()
+
+
+def _stop_children_and_exit(signum, frame):
+    # don't leave conda or pip running on after we're gone
+    streaming_popen.cancel_all(signum, wait=True)
+    if signum == signal.SIGINT:
+        raise KeyboardInterrupt()
+    # now die of the signal, as we would have without this handler
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def _install_signal_handlers():
+    """Install our handlers, returning a dict from signal to the handler it had before."""
+    signums = [signal.SIGINT]
+    if os.name != 'nt':
+        signums.append(signal.SIGTERM)
+    return dict((signum, signal.signal(signum, _stop_children_and_exit)) for signum in signums)
+
+
+def _restore_signal_handlers(old_handlers):
+    for (signum, handler) in old_handlers.items():
+        signal.signal(signum, handler)
 
 
 def main():
@@ -272,4 +369,8 @@ def main():
     Conda expects us to take no args and return an exit code.
     """
     conda_kapsel._enter_beta_test_mode()
-    return _parse_args_and_run_subcommand(sys.argv)
+    old_handlers = _install_signal_handlers()
+    try:
+        return _parse_args_and_run_subcommand(sys.argv)
+    finally:
+        _restore_signal_handlers(old_handlers)
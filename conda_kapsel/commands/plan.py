@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""The ``plan`` command shows what ``prepare`` would do, without doing it."""
+from __future__ import absolute_import, print_function
+
+import json
+import sys
+
+from conda_kapsel.commands.project_load import load_project
+from conda_kapsel.prepare import prepare_plan
+from conda_kapsel.provide import PROVIDE_MODE_DEVELOPMENT, PROVIDE_MODE_PRODUCTION
+
+
+def _format_bytes(count):
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB':
+            break
+        count = count / 1024.0
+    if unit == 'bytes':
+        return "%d bytes" % count
+    else:
+        return "%.1f%s" % (count, unit)
+
+
+def _format_step(step):
+    extras = []
+    if step.download_bytes is not None and step.download_bytes > 0:
+        extras.append("~" + _format_bytes(step.download_bytes))
+    elif step.download_bytes is None:
+        extras.append("size unknown")
+    if step.resumable:
+        extras.append("resumable")
+    if len(extras) > 0:
+        return "%s: %s" % (step.description, ", ".join(extras))
+    else:
+        return step.description
+
+
+def plan_command(project_dir, conda_environment, command_name, production=False, check_sizes=True,
+                 print_json=False):
+    """Show what prepare would do to the project.
+
+    Returns:
+        exit code
+    """
+    project = load_project(project_dir)
+    if production:
+        mode = PROVIDE_MODE_PRODUCTION
+    else:
+        mode = PROVIDE_MODE_DEVELOPMENT
+    plan = prepare_plan(project,
+                        mode=mode,
+                        env_spec_name=conda_environment,
+                        command_name=command_name,
+                        check_sizes=check_sizes)
+
+    if print_json:
+        print(json.dumps(plan.to_json(), indent=2, sort_keys=True))
+    elif plan:
+        if len(plan.steps) == 0:
+            print("Nothing to do; the project is ready to run.")
+        else:
+            for step in plan.steps:
+                print(_format_step(step))
+            total = _format_bytes(plan.total_download_bytes)
+            if plan.has_unknown_sizes:
+                print("Total download: at least %s (some sizes are unknown)" % total)
+            else:
+                print("Total download: %s" % total)
+
+    if plan:
+        return 0
+    else:
+        if not print_json:
+            for error in plan.errors:
+                print(error, file=sys.stderr)
+        return 1
+
+
+def main(args):
+    """Start the plan command and return exit status code."""
+    return plan_command(args.directory,
+                        args.env_spec,
+                        args.command,
+                        production=args.production,
+                        check_sizes=(not args.no_sizes),
+                        print_json=args.json)
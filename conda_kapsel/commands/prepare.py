@@ -7,17 +7,44 @@
 """The ``prepare`` command configures a project to run, asking the user questions if necessary."""
 from __future__ import absolute_import, print_function
 
-from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors
+import os
+import sys
+
+from conda_kapsel.commands.prepare_with_mode import (prepare_with_ui_mode_printing_errors,
+                                                     UI_MODE_TEXT_ASSUME_NO, UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT,
+                                                     UI_MODE_TEXT_ASSUME_YES_PRODUCTION)
 from conda_kapsel.commands.project_load import load_project
+from conda_kapsel.commands import console_utils
+from conda_kapsel import project_ops
+from conda_kapsel.prepare import prepare_projects_without_interaction
+from conda_kapsel.project import Project
+from conda_kapsel.provide import PROVIDE_MODE_CHECK, PROVIDE_MODE_DEVELOPMENT, PROVIDE_MODE_PRODUCTION
+
+# prepare-many can't ask questions, so it only has these modes
+MANY_UI_MODES = (UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, UI_MODE_TEXT_ASSUME_YES_PRODUCTION, UI_MODE_TEXT_ASSUME_NO)
+_provide_modes = {UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT: PROVIDE_MODE_DEVELOPMENT,
+                  UI_MODE_TEXT_ASSUME_YES_PRODUCTION: PROVIDE_MODE_PRODUCTION,
+                  UI_MODE_TEXT_ASSUME_NO: PROVIDE_MODE_CHECK}
 
 
-def prepare_command(project_dir, ui_mode, conda_environment):
+def prepare_command(project_dir, ui_mode, conda_environment, all_env_specs=False, jobs=None):
     """Configure the project to run.
 
+    If all_env_specs is True, the environments for every env spec
+    are created or updated first, up to ``jobs`` at a time.
+
     Returns:
         Prepare result (can be treated as True on success).
     """
     project = load_project(project_dir)
+    if all_env_specs and not project.problems:
+        status = project_ops.prepare_env_specs(project, jobs=jobs, fix=(ui_mode != UI_MODE_TEXT_ASSUME_NO))
+        if not status:
+            console_utils.print_status_errors(status)
+            return status
+        for log in status.logs:
+            print(log)
+
     result = prepare_with_ui_mode_printing_errors(project, env_spec_name=conda_environment, ui_mode=ui_mode)
 
     return result
@@ -25,9 +52,51 @@ def prepare_command(project_dir, ui_mode, conda_environment):
 
 def main(args):
     """Start the prepare command and return exit status code."""
-    if prepare_command(args.directory, args.mode, args.env_spec):
+    if prepare_command(args.directory,
+                       args.mode,
+                       args.env_spec,
+                       all_env_specs=args.all_env_specs,
+                       jobs=args.jobs):
         print("The project is ready to run commands.")
         print("Use `conda-kapsel list-commands` to see what's available.")
         return 0
     else:
         return 1
+
+
+def prepare_many_command(project_dirs, ui_mode, conda_environment, jobs=None):
+    """Configure several projects to run, in this one process.
+
+    Each project's outcome is printed as soon as it's done.
+
+    Returns:
+        exit code
+    """
+    projects = [Project(os.path.abspath(dirname)) for dirname in project_dirs]
+
+    def print_result(project, result):
+        if result:
+            print("%s: ready" % project.directory_path)
+        else:
+            print("%s: failed" % project.directory_path)
+            for error in result.errors:
+                print("  %s" % error, file=sys.stderr)
+        sys.stdout.flush()
+
+    results = prepare_projects_without_interaction(projects,
+                                                   mode=_provide_modes[ui_mode],
+                                                   env_spec_name=conda_environment,
+                                                   jobs=jobs,
+                                                   on_result=print_result)
+
+    ready = len([result for result in results if result])
+    print("%d of %d projects are ready to run." % (ready, len(results)))
+    if ready == len(results):
+        return 0
+    else:
+        return 1
+
+
+def main_many(args):
+    """Start the prepare-many command and return exit status code."""
+    return prepare_many_command(args.directories, args.mode, args.env_spec, jobs=args.jobs)
@@ -9,8 +9,9 @@ from __future__ import absolute_import, print_function
 
 import sys
 
-from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors
+from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors, UI_MODE_BROWSER
 from conda_kapsel.commands.project_load import load_project
+from conda_kapsel.internal.prepared_stamp import load_prepared_stamp, save_prepared_stamp
 from conda_kapsel.project_commands import ProjectCommand
 
 
@@ -36,22 +37,32 @@ def run_command(project_dir, ui_mode, conda_environment, command_name, extra_com
     Returns:
         Does not return if successful.
     """
-    project = load_project(project_dir)
-    environ = None
-
-    command = _command_from_name(project, command_name)
-
-    result = prepare_with_ui_mode_printing_errors(project,
-                                                  ui_mode=ui_mode,
-                                                  env_spec_name=conda_environment,
-                                                  command=command,
-                                                  extra_command_args=extra_command_args,
-                                                  environ=environ)
-
-    if result.failed:
-        # errors were printed already
-        return
-    elif result.command_exec_info is None:
+    stamp_request = ['run', ui_mode, conda_environment, command_name, extra_command_args]
+    if ui_mode == UI_MODE_BROWSER:
+        result = None
+    else:
+        result = load_prepared_stamp(project_dir, stamp_request)
+
+    if result is None:
+        project = load_project(project_dir)
+        environ = None
+
+        command = _command_from_name(project, command_name)
+
+        result = prepare_with_ui_mode_printing_errors(project,
+                                                      ui_mode=ui_mode,
+                                                      env_spec_name=conda_environment,
+                                                      command=command,
+                                                      extra_command_args=extra_command_args,
+                                                      environ=environ)
+
+        if result.failed:
+            # errors were printed already
+            return
+        elif ui_mode != UI_MODE_BROWSER:
+            save_prepared_stamp(project, result, stamp_request)
+
+    if result.command_exec_info is None:
         print("No known run command for project %s; try adding a 'commands:' section to kapsel.yml" % project_dir,
               file=sys.stderr)
     else:
@@ -322,6 +322,48 @@ def test_remove_packages_from_specific_environment(capsys, monkeypatch):
     with_directory_contents_completing_project_file(dict(), check)
 
 
+def test_lock(capsys, monkeypatch):
+    def check(dirname):
+        _monkeypatch_pwd(monkeypatch, dirname)
+        params = {}
+
+        def mock_lock(*args, **kwargs):
+            params['args'] = args
+            params['kwargs'] = kwargs
+            return SimpleStatus(success=True, description="Updated lockfiles for: foo.")
+
+        monkeypatch.setattr('conda_kapsel.project_ops.lock', mock_lock)
+
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'lock', '--env-spec', 'foo'])
+        assert code == 0
+
+        out, err = capsys.readouterr()
+        assert 'Updated lockfiles for: foo.\n' == out
+        assert '' == err
+        assert dict(env_spec_name='foo') == params['kwargs']
+
+    with_directory_contents_completing_project_file(dict(), check)
+
+
+def test_lock_fails(capsys, monkeypatch):
+    def check(dirname):
+        _monkeypatch_pwd(monkeypatch, dirname)
+
+        def mock_lock(*args, **kwargs):
+            return SimpleStatus(success=False, description="Could not lock environment spec default.", errors=['Nope'])
+
+        monkeypatch.setattr('conda_kapsel.project_ops.lock', mock_lock)
+
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'lock'])
+        assert code == 1
+
+        out, err = capsys.readouterr()
+        assert '' == out
+        assert 'Nope\nCould not lock environment spec default.\n' == err
+
+    with_directory_contents_completing_project_file(dict(), check)
+
+
 def test_list_environments(capsys, monkeypatch):
     def check_list_not_empty(dirname):
         code = _parse_args_and_run_subcommand(['conda-kapsel', 'list-env-specs', '--directory', dirname])
@@ -7,16 +7,22 @@
 from __future__ import absolute_import, print_function
 from functools import partial
 
+import codecs
+import json
 import os
+import signal
+
+import pytest
 
 import conda_kapsel
 from conda_kapsel.commands.main import _parse_args_and_run_subcommand
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
 
-all_subcommands = ('init', 'run', 'prepare', 'clean', 'activate', 'archive', 'upload', 'add-variable',
-                   'remove-variable', 'list-variables', 'set-variable', 'unset-variable', 'add-download',
-                   'remove-download', 'list-downloads', 'add-service', 'remove-service', 'list-services',
-                   'add-env-spec', 'remove-env-spec', 'list-env-specs', 'add-packages', 'remove-packages',
-                   'list-packages', 'add-command', 'remove-command', 'list-commands')
+all_subcommands = ('init', 'run', 'prepare', 'prepare-many', 'plan', 'clean', 'activate', 'archive', 'upload',
+                   'add-variable', 'remove-variable', 'list-variables', 'set-variable', 'unset-variable',
+                   'add-download', 'remove-download', 'list-downloads', 'add-service', 'remove-service',
+                   'list-services', 'add-env-spec', 'remove-env-spec', 'list-env-specs', 'lock', 'add-packages',
+                   'remove-packages', 'list-packages', 'add-command', 'remove-command', 'list-commands')
 all_subcommands_in_curlies = "{" + ",".join(all_subcommands) + "}"
 all_subcommands_comma_space = ", ".join(["'" + s + "'" for s in all_subcommands])
 
@@ -29,7 +35,7 @@ def test_main_no_subcommand(capsys):
     out, err = capsys.readouterr()
     assert "" == out
     expected_error_msg = ('Must specify a subcommand.\n'
-                          'usage: conda-kapsel [-h] [-v]\n'
+                          'usage: conda-kapsel [-h] [-v] [--trace TRACE_FILE]\n'
                           '                    %s\n'
                           '                    ...\n') % all_subcommands_in_curlies
     assert expected_error_msg == err
@@ -39,7 +45,7 @@ def test_main_bad_subcommand(capsys):
     code = _parse_args_and_run_subcommand(['project', 'foo'])
 
     out, err = capsys.readouterr()
-    expected_error_msg = ("usage: conda-kapsel [-h] [-v]\n"
+    expected_error_msg = ("usage: conda-kapsel [-h] [-v] [--trace TRACE_FILE]\n"
                           "                    %s\n"
                           "                    ...\nconda-kapsel: error: invalid choice: 'foo' "
                           "(choose from %s)\n") % (all_subcommands_in_curlies, all_subcommands_comma_space)
@@ -50,7 +56,7 @@ def test_main_bad_subcommand(capsys):
 
 
 expected_usage_msg_format = \
-        'usage: conda-kapsel [-h] [-v]\n' \
+        'usage: conda-kapsel [-h] [-v] [--trace TRACE_FILE]\n' \
         '                    %s\n' \
         '                    ...\n' \
         '\n' \
@@ -64,6 +70,9 @@ expected_usage_msg_format = \
         '    run                 Run the project, setting up requirements first\n' \
         '    prepare             Set up the project requirements, but does not run the\n' \
         '                        project\n' \
+        '    prepare-many        Set up the requirements of several projects at once\n' \
+        '    plan                Show what prepare would do, and how much it would\n' \
+        '                        download\n' \
         '    clean               Removes generated state (stops services, deletes\n' \
         '                        environment files, etc)\n' \
         '%s' \
@@ -86,6 +95,7 @@ expected_usage_msg_format = \
         '    add-env-spec        Add a new environment spec to the project\n' \
         '    remove-env-spec     Remove an environment spec from the project\n' \
         '    list-env-specs      List all environment specs for the project\n' \
+        '    lock                Lock environment specs to exact package versions\n' \
         '    add-packages        Add packages to one or all project environments\n' \
         '    remove-packages     Remove packages from one or all project environments\n' \
         '    list-packages       List packages for an environment on the project\n' \
@@ -95,7 +105,9 @@ expected_usage_msg_format = \
         '\n' \
         'optional arguments:\n' \
         '  -h, --help            show this help message and exit\n' \
-        "  -v, --version         show program's version number and exit\n"
+        "  -v, --version         show program's version number and exit\n" \
+        '  --trace TRACE_FILE    Save timings of what we did to TRACE_FILE, as Chrome\n' \
+        '                        trace event JSON\n'
 
 activate_help = '    activate            Set up the project and output shell export commands\n' \
                 '                        reflecting the setup\n'
@@ -135,6 +147,55 @@ def test_main_help_via_entry_point(capsys, monkeypatch):
     conda_kapsel._beta_test_mode = False
 
 
+def test_main_installs_and_restores_signal_handlers(monkeypatch):
+    from conda_kapsel.commands.main import main, _stop_children_and_exit
+
+    handlers = []
+
+    def mock_subcommand(argv):
+        handlers.append(signal.getsignal(signal.SIGINT))
+        handlers.append(signal.getsignal(signal.SIGTERM))
+        return 0
+
+    monkeypatch.setattr('conda_kapsel.commands.main._parse_args_and_run_subcommand', mock_subcommand)
+    before = signal.getsignal(signal.SIGTERM)
+    assert 0 == main()
+    assert [_stop_children_and_exit, _stop_children_and_exit] == handlers
+    assert before == signal.getsignal(signal.SIGTERM)
+
+    # undo this side effect
+    conda_kapsel._beta_test_mode = False
+
+
+def test_signal_stops_children(monkeypatch):
+    from conda_kapsel.commands.main import _stop_children_and_exit
+
+    cancelled = []
+    killed = []
+
+    def mock_cancel_all(signum=None, wait=False):
+        cancelled.append((signum, wait))
+
+    def mock_kill(pid, signum):
+        killed.append((pid, signum, signal.getsignal(signum)))
+
+    monkeypatch.setattr('conda_kapsel.internal.streaming_popen.cancel_all', mock_cancel_all)
+    monkeypatch.setattr('os.kill', mock_kill)
+
+    with pytest.raises(KeyboardInterrupt):
+        _stop_children_and_exit(signal.SIGINT, None)
+    assert [(signal.SIGINT, True)] == cancelled
+
+    old_handler = signal.getsignal(signal.SIGTERM)
+    try:
+        _stop_children_and_exit(signal.SIGTERM, None)
+    finally:
+        signal.signal(signal.SIGTERM, old_handler)
+    assert [(signal.SIGINT, True), (signal.SIGTERM, True)] == cancelled
+    # we die of the signal as if we had never caught it
+    assert [(os.getpid(), signal.SIGTERM, signal.SIG_DFL)] == killed
+
+
 def _main_calls_subcommand(monkeypatch, capsys, subcommand):
     def mock_subcommand_main(subcommand, args):
         print("Hi I am subcommand {}".format(subcommand))
@@ -151,6 +212,47 @@ def _main_calls_subcommand(monkeypatch, capsys, subcommand):
     assert "" == err
 
 
+def test_main_trace(monkeypatch, capsys):
+    def mock_subcommand_main(args):
+        from conda_kapsel.internal import trace
+        with trace.span("inside prepare", 'test'):
+            pass
+        return 0
+
+    def check(dirname):
+        monkeypatch.setattr('conda_kapsel.commands.prepare.main', mock_subcommand_main)
+        filename = os.path.join(dirname, "trace.json")
+        code = _parse_args_and_run_subcommand(['conda-kapsel', '--trace', filename, 'prepare'])
+        assert 0 == code
+
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            saved = json.load(f)
+        assert ["inside prepare", "conda-kapsel prepare"] == [event['name'] for event in saved['traceEvents']]
+
+        out, err = capsys.readouterr()
+        assert "" == out
+        assert "conda-kapsel prepare" in err
+
+    with_directory_contents(dict(), check)
+
+
+def test_main_trace_file_named_like_a_subcommand(monkeypatch, capsys):
+    def mock_subcommand_main(args):
+        return 0
+
+    def check(dirname):
+        monkeypatch.setattr('conda_kapsel.commands.prepare.main', mock_subcommand_main)
+        monkeypatch.chdir(dirname)
+        code = _parse_args_and_run_subcommand(['conda-kapsel', '--trace', 'run', 'prepare'])
+        assert 0 == code
+
+        with codecs.open(os.path.join(dirname, 'run'), 'r', 'utf-8') as f:
+            saved = json.load(f)
+        assert ["conda-kapsel prepare"] == [event['name'] for event in saved['traceEvents']]
+
+    with_directory_contents(dict(), check)
+
+
 def test_main_calls_run(monkeypatch, capsys):
     _main_calls_subcommand(monkeypatch, capsys, 'run')
 
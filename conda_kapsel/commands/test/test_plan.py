@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import json
+
+from conda_kapsel.commands.main import _parse_args_and_run_subcommand
+from conda_kapsel.commands.plan import _format_bytes
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents_completing_project_file
+from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
+
+_project_with_download = """
+variables:
+  FOO: { default: "foo" }
+downloads:
+  DATAFILE: http://example.com/data.csv
+"""
+
+
+def _monkeypatch_fetch_sizes(monkeypatch):
+    def mock_fetch_sizes(urls):
+        return dict((url, (3 * 1024 * 1024 * 1024, True)) for url in urls)
+
+    monkeypatch.setattr('conda_kapsel.internal.http_client.fetch_sizes', mock_fetch_sizes)
+
+
+def test_format_bytes():
+    assert "0 bytes" == _format_bytes(0)
+    assert "1023 bytes" == _format_bytes(1023)
+    assert "1.5KB" == _format_bytes(1536)
+    assert "2.0MB" == _format_bytes(2 * 1024 * 1024)
+    assert "2048.0GB" == _format_bytes(2 * 1024 * 1024 * 1024 * 1024)
+
+
+def test_plan_command(capsys, monkeypatch):
+    _monkeypatch_fetch_sizes(monkeypatch)
+
+    def check(dirname):
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'plan', '--directory', dirname, '--production'])
+        assert code == 0
+
+        out, err = capsys.readouterr()
+        lines = out.splitlines()
+        assert "download DATAFILE from http://example.com/data.csv: ~3.0GB, resumable" in lines
+        assert lines[-1].startswith("Total download: at least 3.0GB")
+        assert '' == err
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: _project_with_download}, check)
+
+
+def test_plan_command_json_without_sizes(capsys, monkeypatch):
+    def mock_fetch_sizes(urls):
+        raise AssertionError("should not have asked for sizes")
+
+    monkeypatch.setattr('conda_kapsel.internal.http_client.fetch_sizes', mock_fetch_sizes)
+
+    def check(dirname):
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'plan', '--directory', dirname, '--json',
+                                               '--no-sizes'])
+        assert code == 0
+
+        out, err = capsys.readouterr()
+        plan = json.loads(out)
+        assert [] == plan['errors']
+        download = [step for step in plan['steps'] if step['action'] == 'download'][0]
+        assert 'DATAFILE' == download['env_var']
+        assert ['http://example.com/data.csv'] == download['urls']
+        assert download['download_bytes'] is None
+        assert plan['has_unknown_sizes']
+        assert '' == err
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: _project_with_download}, check)
+
+
+def test_plan_command_on_invalid_project(capsys):
+    def check(dirname):
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'plan', '--directory', dirname])
+        assert code == 1
+
+        out, err = capsys.readouterr()
+        assert '' == out
+        assert ('variables section contains wrong value type 42,' + ' should be dict or list of requirements\n' +
+                'Unable to load the project.\n') == err
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "variables:\n  42"}, check)
@@ -12,7 +12,9 @@ from conda_kapsel.commands.main import _parse_args_and_run_subcommand
 from conda_kapsel.commands.prepare import prepare_command, main
 from conda_kapsel.commands.prepare_with_mode import (UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT,
                                                      UI_MODE_TEXT_ASSUME_YES_PRODUCTION, UI_MODE_TEXT_ASSUME_NO)
-from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents_completing_project_file
+from conda_kapsel.internal.test.tmpfile_utils import (with_directory_contents,
+                                                      with_directory_contents_completing_project_file,
+                                                      complete_project_file_content)
 from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 from conda_kapsel.local_state_file import LocalStateFile
 
@@ -26,6 +28,8 @@ class Args(object):
         self.directory = "."
         self.env_spec = None
         self.mode = UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT
+        self.all_env_specs = False
+        self.jobs = None
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
@@ -291,6 +295,65 @@ env_specs:
     assert err == ""
 
 
+def test_prepare_command_all_env_specs(capsys, monkeypatch):
+    created = []
+
+    def mock_conda_create(prefix, pkgs, channels):
+        from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+        created.append(os.path.basename(prefix))
+        metadir = os.path.join(prefix, "conda-meta")
+        makedirs_ok_if_exists(metadir)
+        for p in pkgs:
+            pkgmeta = os.path.join(metadir, "%s-0.1-pyNN.json" % p)
+            open(pkgmeta, 'a').close()
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_conda_create)
+    monkeypatch.setenv('CONDA_KAPSEL_TEMPLATE_ENVS_MAX_MB', '0')
+
+    def check_prepare_all_env_specs(dirname):
+        result = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare', '--directory', dirname, '--env-spec=bar',
+                                                 '--all-env-specs', '--jobs', '2'])
+        assert result == 0
+
+        assert ['bar', 'foo'] == sorted(created)
+        assert os.path.isfile(os.path.join(dirname, "envs", "foo", "conda-meta", "nonexistent_foo-0.1-pyNN.json"))
+        assert os.path.isfile(os.path.join(dirname, "envs", "bar", "conda-meta", "nonexistent_bar-0.1-pyNN.json"))
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+env_specs:
+  foo:
+    packages:
+        - nonexistent_foo
+  bar:
+    packages:
+        - nonexistent_bar
+"""}, check_prepare_all_env_specs)
+
+    out, err = capsys.readouterr()
+    assert "The project is ready to run commands.\n" in out
+    assert err == ""
+
+
+def test_prepare_command_all_env_specs_check_only(capsys):
+    def check_prepare_all_env_specs(dirname):
+        result = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare', '--directory', dirname, '--all-env-specs',
+                                                 '--mode=check'])
+        assert result == 1
+        assert not os.path.isdir(os.path.join(dirname, "envs"))
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+env_specs:
+  foo:
+    packages:
+        - nonexistent_foo
+"""}, check_prepare_all_env_specs)
+
+    out, err = capsys.readouterr()
+    assert "Failed to prepare environment specs: foo." in err
+
+
 def test_prepare_command_choose_environment_does_not_exist(capsys):
     def check_prepare_choose_environment_does_not_exist(dirname):
         project_dir_disable_dedicated_env(dirname)
@@ -546,3 +609,37 @@ variables:
 env_specs: 42
 
 """}, check)
+
+
+def test_prepare_many_command(capsys):
+    def check(dirname):
+        ready = os.path.join(dirname, "ready")
+        missing = os.path.join(dirname, "missing")
+        project_dir_disable_dedicated_env(ready)
+        project_dir_disable_dedicated_env(missing)
+        result = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare-many', '--mode=check', '--jobs', '2', ready,
+                                                 missing])
+        assert result == 1
+
+        out, err = capsys.readouterr()
+        lines = out.splitlines()
+        assert ("%s: ready" % ready) in lines
+        assert ("%s: failed" % missing) in lines
+        assert "1 of 2 projects are ready to run." == lines[-1]
+        assert "    Environment variable BAR is not set.\n" in err
+
+    with_directory_contents(
+        {"ready/" + DEFAULT_PROJECT_FILENAME: complete_project_file_content("variables:\n  FOO: { default: 'foo' }\n"),
+         "missing/" + DEFAULT_PROJECT_FILENAME: complete_project_file_content("variables:\n  BAR: {}\n")}, check)
+
+
+def test_prepare_many_command_with_broken_project(capsys):
+    def check(dirname):
+        result = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare-many', dirname])
+        assert result == 1
+
+        out, err = capsys.readouterr()
+        assert ("%s: failed\n" % dirname + "0 of 1 projects are ready to run.\n") == out
+        assert "should be dict or list of requirements" in err
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "variables:\n  42"}, check)
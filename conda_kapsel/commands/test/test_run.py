@@ -6,16 +6,22 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import codecs
 from copy import deepcopy
 import errno
+import json
 import platform
 import os
 
 from conda_kapsel.commands.main import _parse_args_and_run_subcommand
 from conda_kapsel.commands.run import run_command, main
 from conda_kapsel.commands.prepare_with_mode import UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT
+from conda_kapsel.internal.prepared_stamp import save_prepared_stamp
 from conda_kapsel.internal.test.tmpfile_utils import (with_directory_contents,
                                                       with_directory_contents_completing_project_file)
+from conda_kapsel.prepare import PrepareSuccess
+from conda_kapsel.project import Project
+from conda_kapsel.project_commands import CommandExecInfo
 from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 
 from conda_kapsel.test.project_utils import project_dir_disable_dedicated_env
@@ -81,6 +87,39 @@ commands:
 """}, check_run)
 
 
+def test_run_command_uses_prepared_stamp(monkeypatch):
+    executed = {}
+
+    def mock_execvpe(file, args, env):
+        executed['args'] = args
+        executed['env'] = env
+
+    monkeypatch.setattr('os.execvpe', mock_execvpe)
+
+    def check_run(dirname):
+        environ = dict(os.environ)
+        prepared = dict(environ, FOO='from_stamp')
+        exec_info = CommandExecInfo(cwd=dirname, args=['echo', 'hello'], shell=False, env=prepared)
+        result = PrepareSuccess(logs=[], statuses=(), command_exec_info=exec_info, environ=prepared, overrides=None)
+        save_prepared_stamp(Project(dirname), result,
+                            ['run', UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, None, None, None])
+
+        def mock_load_project(dirname):
+            raise RuntimeError("should not have loaded the project")
+
+        monkeypatch.setattr('conda_kapsel.commands.run.load_project', mock_load_project)
+
+        run_command(dirname,
+                    UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT,
+                    conda_environment=None,
+                    command_name=None,
+                    extra_command_args=None)
+        assert ['echo', 'hello'] == executed['args']
+        assert 'from_stamp' == executed['env']['FOO']
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "name: foo\n"}, check_run)
+
+
 def test_run_command_no_app_entry(capsys):
     def check_run_no_app_entry(dirname):
         project_dir_disable_dedicated_env(dirname)
@@ -175,6 +214,37 @@ commands:
     assert "" == err
 
 
+def test_main_saves_trace_before_exec(monkeypatch, capsys):
+    executed = {}
+
+    def check_run_main(dirname):
+        trace_filename = os.path.join(dirname, 'trace.json')
+
+        def mock_execvpe(file, args, env):
+            # once we exec, nobody is left to write the trace
+            with codecs.open(trace_filename, 'r', 'utf-8') as f:
+                executed['trace'] = json.load(f)
+
+        monkeypatch.setattr('os.execvpe', mock_execvpe)
+        project_dir_disable_dedicated_env(dirname)
+        result = _parse_args_and_run_subcommand(['conda-kapsel', '--trace', trace_filename, 'run', '--directory',
+                                                 dirname])
+
+        assert 1 == result
+        names = [event['name'] for event in executed['trace']['traceEvents']]
+        # we exec from inside this span, but it's saved anyway
+        assert "conda-kapsel run" in names
+        assert "check CONDA_PREFIX" in names
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+commands:
+  default:
+    conda_app_entry: python --version
+
+"""}, check_run_main)
+
+
 def test_main_failed_exec(monkeypatch, capsys):
     def mock_execvpe(file, args, env):
         raise OSError(errno.ENOMEM, "It did not work, Michael")
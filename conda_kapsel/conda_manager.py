@@ -10,6 +10,7 @@ from __future__ import absolute_import
 from abc import ABCMeta, abstractmethod
 
 from conda_kapsel.internal.metaclass import with_metaclass
+from conda_kapsel.internal.streaming_popen import callback_kwargs
 
 _conda_manager_classes = []
 
@@ -28,15 +29,20 @@ def pop_conda_manager_class():
     _conda_manager_classes.pop()
 
 
-def new_conda_manager():
-    """Create a new concrete ``CondaManager``."""
+def new_conda_manager(stdout_callback=None, stderr_callback=None):
+    """Create a new concrete ``CondaManager``.
+
+    Args:
+        stdout_callback (function): called with each line conda or pip prints to stdout
+        stderr_callback (function): called with each line conda or pip prints to stderr
+    """
     global _conda_manager_classes
     if len(_conda_manager_classes) == 0:
         from conda_kapsel.internal.default_conda_manager import DefaultCondaManager
         klass = DefaultCondaManager
     else:
         klass = _conda_manager_classes[-1]
-    return klass()
+    return klass(**callback_kwargs(stdout_callback, stderr_callback))
 
 
 class CondaManagerError(Exception):
@@ -118,6 +124,69 @@ class CondaManager(with_metaclass(ABCMeta)):
         """
         pass  # pragma: no cover
 
+    def plan_environment_fix(self, prefix, spec, deviations):
+        """Describe what ``fix_environment_deviations()`` would install, without changing anything.
+
+        The default only knows the package names from the
+        deviations; subclasses which can tell which package files
+        they'd download should override this.
+
+        Args:
+            prefix (str): the environment prefix (absolute path)
+            spec (EnvSpec): specification for the environment
+            deviations (CondaEnvironmentDeviations): result from find_environment_deviations()
+
+        Returns:
+            a ``CondaFixPlan`` instance
+        """
+        return CondaFixPlan(packages=(list(deviations.missing_packages) + list(deviations.wrong_version_packages)),
+                            pip_packages=deviations.missing_pip_packages)
+
+
+class CondaFixPlan(object):
+    """Represents the packages fixing an environment would install."""
+
+    def __init__(self, packages, pip_packages, urls=(), cached_urls=(), from_lockfile=False):
+        """Construct a ``CondaFixPlan``.
+
+        Args:
+          packages (iterable of str): conda packages to install, as names or ``name-version-build``
+          pip_packages (iterable of str): pip packages to install
+          urls (iterable of str): package files we'd have to download, if known
+          cached_urls (iterable of str): package files we'd install from the package cache
+          from_lockfile (bool): True if we'd install exactly the packages in the env spec's lockfile
+        """
+        self._packages = tuple(packages)
+        self._pip_packages = tuple(pip_packages)
+        self._urls = tuple(urls)
+        self._cached_urls = tuple(cached_urls)
+        self._from_lockfile = from_lockfile
+
+    @property
+    def packages(self):
+        """Iterable collection of conda packages to install."""
+        return self._packages
+
+    @property
+    def pip_packages(self):
+        """Iterable collection of pip packages to install."""
+        return self._pip_packages
+
+    @property
+    def urls(self):
+        """Iterable collection of package URLs we'd download; only known when ``from_lockfile``."""
+        return self._urls
+
+    @property
+    def cached_urls(self):
+        """Iterable collection of package URLs already in the package cache."""
+        return self._cached_urls
+
+    @property
+    def from_lockfile(self):
+        """True if the packages come from a lockfile, so ``urls`` lists every download."""
+        return self._from_lockfile
+
 
 class CondaEnvironmentDeviations(object):
     """Represents differences between actual and desired environment state."""
@@ -73,14 +73,14 @@ class CondaMetaFile(YamlFile):
             None if not found
 
         """
-        return self.get_value(['app', 'entry'], default=None)
+        return self.get_read_only_value(['app', 'entry'], default=None)
 
     @property
     def name(self):
         """Get the "package: name" field from the file."""
-        return self.get_value(['package', 'name'], default=None)
+        return self.get_read_only_value(['package', 'name'], default=None)
 
     @property
     def icon(self):
         """Get the "app: icon" field from the file."""
-        return self.get_value(['app', 'icon'], default=None)
+        return self.get_read_only_value(['app', 'icon'], default=None)
@@ -7,16 +7,35 @@
 """Environment class representing a conda environment."""
 from __future__ import absolute_import
 
+import hashlib
+import json
 import os
 
+try:
+    from types import MappingProxyType as _read_only_dict
+except ImportError:  # pragma: no cover (py2 only)
+    _read_only_dict = dict
+
 import conda_kapsel.internal.conda_api as conda_api
+from conda_kapsel.internal.conda_spec_matcher import SpecMatcher
 import conda_kapsel.internal.pip_api as pip_api
 
 
+def _index_specs(specs, parse):
+    # a spec that doesn't parse is reported as a project problem, so we skip it here;
+    # if a name appears twice the last spec wins.
+    index = dict()
+    for spec in specs:
+        parsed = parse(spec)
+        if parsed is not None:
+            index[parsed.name] = parsed
+    return _read_only_dict(index)
+
+
 class EnvSpec(object):
     """Represents a set of required conda packages we could potentially instantiate as a Conda environment."""
 
-    def __init__(self, name, conda_packages, channels, pip_packages=(), description=None):
+    def __init__(self, name, conda_packages, channels, pip_packages=(), description=None, lock_file=None):
         """Construct a package set with the given name and packages.
 
         Args:
@@ -25,12 +44,19 @@ class EnvSpec(object):
             channels (list): list of channel names
             pip_packages (list): list of pip package specs to pass to pip
             description (str or None): one-sentence-ish summary of what this env is
+            lock_file (str or None): path to a lockfile (which may not exist yet) to install exact packages from
         """
         self._name = name
         self._conda_packages = tuple(conda_packages)
         self._channels = tuple(channels)
         self._pip_packages = tuple(pip_packages)
         self._description = description
+        self._lock_file = lock_file
+        # computed when first needed, since the specs never change
+        self._conda_packages_by_name = None
+        self._pip_packages_by_name = None
+        self._conda_spec_matcher = None
+        self._content_hash = None
 
     @property
     def name(self):
@@ -60,22 +86,63 @@ class EnvSpec(object):
         """Get the pip packages to install in the environment as an iterable."""
         return self._pip_packages
 
+    @property
+    def lock_file(self):
+        """Get the path to the lockfile for this env spec, or None if it can't have one.
+
+        The file may not exist, and may be out of date if it does.
+        """
+        return self._lock_file
+
+    @property
+    def conda_packages_by_name(self):
+        """Read-only dict from conda package name to the ``ParsedSpec`` for it."""
+        if self._conda_packages_by_name is None:
+            self._conda_packages_by_name = _index_specs(self._conda_packages, conda_api.parse_spec)
+        return self._conda_packages_by_name
+
+    @property
+    def conda_spec_matcher(self):
+        """``SpecMatcher`` for our conda packages, compiled once and reused for every check."""
+        if self._conda_spec_matcher is None:
+            self._conda_spec_matcher = SpecMatcher(self._conda_packages)
+        return self._conda_spec_matcher
+
+    @property
+    def pip_packages_by_name(self):
+        """Read-only dict from pip package name to the ``ParsedPipSpec`` for it."""
+        if self._pip_packages_by_name is None:
+            self._pip_packages_by_name = _index_specs(self._pip_packages, pip_api.parse_spec)
+        return self._pip_packages_by_name
+
     @property
     def conda_package_names_set(self):
-        """Conda package names that we require, as a Python set."""
-        names = set()
-        for spec in self.conda_packages:
-            names.add(conda_api.parse_spec(spec).name)
-        return names
+        """Conda package names that we require, as a Python frozenset."""
+        return frozenset(self.conda_packages_by_name.keys())
 
     @property
     def pip_package_names_set(self):
-        """Pip package names that we require, as a Python set."""
-        names = set()
-        for spec in self.pip_packages:
-            names.add(pip_api.parse_spec(spec).name)
-        return names
+        """Pip package names that we require, as a Python frozenset."""
+        return frozenset(self.pip_packages_by_name.keys())
+
+    @property
+    def content_hash(self):
+        """Hash of the packages and channels, which stays the same across runs.
+
+        Two env specs with the same content hash install the same
+        things (the name and description don't count), so this can
+        be used as a cache key for anything derived from the packages.
+        """
+        if self._content_hash is None:
+            content = json.dumps([list(self._conda_packages), list(self._channels), list(self._pip_packages)])
+            self._content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        return self._content_hash
 
     def path(self, project_dir):
         """The filesystem path to the default conda env containing our packages."""
         return os.path.join(project_dir, "envs", self.name)
+
+
+def lock_file_path(project_dir, env_spec_name):
+    """The filesystem path to the lockfile for the named env spec."""
+    return os.path.join(project_dir, "kapsel-%s.lock" % env_spec_name)
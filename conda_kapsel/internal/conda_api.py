@@ -8,14 +8,17 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 
 import collections
 import errno
-import subprocess
 import json
 import os
 import platform
 import re
 import sys
+import threading
+from distutils.spawn import find_executable
 
+from conda_kapsel.internal import streaming_popen
 from conda_kapsel.internal.directory_contains import subdirectory_relative_to_directory
+from conda_kapsel.internal.user_cache import file_stat_key, load_cached_json, save_cached_json, user_cache_directory
 
 
 class CondaError(Exception):
@@ -38,21 +41,31 @@ def _get_conda_command(extra_args):
     return cmd_list
 
 
-def _call_conda(extra_args):
+# environment variable with the number of seconds a conda command may run
+CONDA_TIMEOUT_VARIABLE = 'CONDA_KAPSEL_CONDA_TIMEOUT'
+
+
+def _call_conda(extra_args, stdout_callback=None, stderr_callback=None):
     cmd_list = _get_conda_command(extra_args)
 
     try:
-        p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = streaming_popen.popen_and_stream(cmd_list,
+                                                  stdout_callback=stdout_callback,
+                                                  stderr_callback=stderr_callback,
+                                                  timeout=streaming_popen.timeout_from_environ(CONDA_TIMEOUT_VARIABLE))
     except OSError as e:
         raise CondaError("failed to run: %r: %r" % (" ".join(cmd_list), repr(e)))
-    (out, err) = p.communicate()
-    errstr = err.decode().strip()
-    if p.returncode != 0:
+    errstr = result.stderr.decode().strip()
+    if result.timed_out:
+        raise CondaError('%s: timed out after %.0f seconds: %s' % (" ".join(cmd_list), result.wall_time, errstr))
+    elif result.cancelled:
+        raise CondaError('%s: cancelled: %s' % (" ".join(cmd_list), errstr))
+    elif result.returncode != 0:
         raise CondaError('%s: %s' % (" ".join(cmd_list), errstr))
     elif errstr != '':
         for line in errstr.split("\n"):
             print("%s %s: %s" % (cmd_list[0], cmd_list[1], line), file=sys.stderr)
-    return out
+    return result.stdout
 
 
 def _call_and_parse_json(extra_args):
@@ -72,6 +85,95 @@ def info():
     return _call_and_parse_json(['info', '--json'])
 
 
+_INFO_CACHE_NAME = 'conda-info'
+
+# the last result of cached_info(), as [key, result]
+_info_memo = []
+_info_memo_lock = threading.Lock()
+
+# environment variables which change the configuration conda reports
+_info_config_variables = ('CONDARC', 'CONDA_ENVS_PATH', 'CONDA_ENVS_DIRS', 'CONDA_ROOT')
+
+
+def _condarc_paths(root_prefix):
+    paths = []
+    if platform.system() != 'Windows':
+        paths.extend(['/etc/conda/.condarc', '/etc/conda/condarc'])
+    if root_prefix is not None:
+        paths.extend([os.path.join(root_prefix, '.condarc'), os.path.join(root_prefix, 'condarc')])
+    paths.extend([os.path.expanduser(os.path.join('~', '.condarc')),
+                  os.path.expanduser(os.path.join('~', '.conda', '.condarc')),
+                  os.path.expanduser(os.path.join('~', '.conda', 'condarc')),
+                  # newer condas record named environments here
+                  os.path.expanduser(os.path.join('~', '.conda', 'environments.txt'))])
+    condarc = os.environ.get('CONDARC', '')
+    if condarc != '':
+        paths.append(condarc)
+    return paths
+
+
+def _info_cache_key():
+    cmd_list = _get_conda_command(['info', '--json'])
+    executable = find_executable(cmd_list[0])
+    if executable is None:
+        # we won't be able to run it anyway, so don't cache
+        return None
+    executable = os.path.realpath(executable)
+    cmd_list = [executable] + cmd_list[1:]
+
+    # conda lives in PREFIX/bin/conda on Unix and PREFIX\Scripts\conda.exe on Windows
+    root_prefix = os.path.dirname(os.path.dirname(executable))
+
+    return dict(command=cmd_list,
+                files=[file_stat_key(path) for path in ([executable] + _condarc_paths(root_prefix))],
+                environ=[[name, os.environ.get(name)] for name in _info_config_variables])
+
+
+def cached_info():
+    """Like ``info()``, but reuse a result saved in the user cache directory if it's still valid.
+
+    The saved result is keyed on the conda executable and the
+    ``.condarc`` files, and is discarded when any of them
+    change. Values such as the list of ``envs`` can change without
+    touching those files, so callers should fall back to ``info()``
+    if the cached value appears to be out of date.
+    """
+    key = _info_cache_key()
+    if key is not None:
+        # a process preparing many projects would otherwise re-read
+        # the file for each one
+        memo_key = (user_cache_directory(), key)
+        with _info_memo_lock:
+            if len(_info_memo) > 0 and _info_memo[0] == memo_key:
+                return _info_memo[1]
+        cached = load_cached_json(_INFO_CACHE_NAME, key)
+        if cached is not None:
+            _remember_info(memo_key, cached)
+            return cached
+
+    result = _call_and_parse_json(['info', '--json'])
+    if key is not None:
+        save_cached_json(_INFO_CACHE_NAME, key, result)
+        _remember_info(memo_key, result)
+    return result
+
+
+def _remember_info(memo_key, info_json):
+    with _info_memo_lock:
+        _info_memo[:] = [memo_key, info_json]
+
+
+def _resolve_env_name_in_info(info_json, name):
+    if name == 'root':
+        return info_json.get('root_prefix', None)
+
+    envs = info_json.get('envs', [])
+    for prefix in envs:
+        if os.path.basename(prefix) == name:
+            return prefix
+    return None
+
+
 def resolve_env_to_prefix(name_or_prefix):
     """Convert an env name or path into a canonical prefix path.
 
@@ -81,20 +183,20 @@ def resolve_env_to_prefix(name_or_prefix):
     if os.path.isabs(name_or_prefix):
         return name_or_prefix
 
-    json = info()
-    root_prefix = json.get('root_prefix', None)
-    if name_or_prefix == 'root':
-        return root_prefix
+    prefix = _resolve_env_name_in_info(cached_info(), name_or_prefix)
+    if prefix is None:
+        # the env may have been created since we cached the info
+        prefix = _resolve_env_name_in_info(info(), name_or_prefix)
+    return prefix
 
-    envs = json.get('envs', [])
-    for prefix in envs:
-        if os.path.basename(prefix) == name_or_prefix:
-            return prefix
-    return None
 
+def create(prefix, pkgs=None, channels=(), stdout_callback=None, stderr_callback=None):
+    """Create an environment either by name or path with a specified set of packages.
 
-def create(prefix, pkgs=None, channels=()):
-    """Create an environment either by name or path with a specified set of packages."""
+    ``stdout_callback`` and ``stderr_callback``, if given, are called with
+    each line of conda's output as it arrives (the same goes for the other
+    functions here which change an environment).
+    """
     if not pkgs or not isinstance(pkgs, (list, tuple)):
         raise TypeError('must specify a list of one or more packages to install into new environment')
 
@@ -107,10 +209,48 @@ def create(prefix, pkgs=None, channels=()):
         cmd_list.extend(['--channel', channel])
 
     cmd_list.extend(pkgs)
-    return _call_conda(cmd_list)
+    return _call_conda(cmd_list, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
+
+
+def clone(source_prefix, prefix, stdout_callback=None, stderr_callback=None):
+    """Create an environment at prefix with the same packages as the one at source_prefix.
+
+    Conda hardlinks package files from its package cache where it
+    can, and rewrites any files that embed the source prefix.
+    """
+    if os.path.exists(prefix):
+        raise CondaEnvExistsError('Conda environment [%s] already exists' % prefix)
+
+    cmd_list = ['create', '--yes', '--quiet', '--offline', '--prefix', prefix, '--clone', source_prefix]
+    return _call_conda(cmd_list, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
+
+
+def create_explicit(prefix, filename, stdout_callback=None, stderr_callback=None):
+    """Create an environment with exactly the packages in a conda explicit file, without solving."""
+    if os.path.exists(prefix):
+        raise CondaEnvExistsError('Conda environment [%s] already exists' % prefix)
+
+    cmd_list = ['create', '--yes', '--quiet', '--prefix', prefix, '--file', filename]
+    return _call_conda(cmd_list, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
+
+
+def install_explicit(prefix, filename, stdout_callback=None, stderr_callback=None):
+    """Install exactly the packages in a conda explicit file into an environment, without solving."""
+    cmd_list = ['install', '--yes', '--quiet', '--prefix', prefix, '--file', filename]
+    return _call_conda(cmd_list, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
+
+
+def current_platform():
+    """Get the conda platform name, such as ``linux-64``."""
+    return cached_info()['platform']
+
+
+def package_cache_dirs():
+    """Get the directories conda keeps downloaded packages in."""
+    return list(cached_info().get('pkgs_dirs', []))
 
 
-def install(prefix, pkgs=None, channels=()):
+def install(prefix, pkgs=None, channels=(), stdout_callback=None, stderr_callback=None):
     """Install packages into an environment either by name or path with a specified set of packages."""
     if not pkgs or not isinstance(pkgs, (list, tuple)):
         raise TypeError('must specify a list of one or more packages to install into existing environment')
@@ -122,10 +262,10 @@ def install(prefix, pkgs=None, channels=()):
         cmd_list.extend(['--channel', channel])
 
     cmd_list.extend(pkgs)
-    return _call_conda(cmd_list)
+    return _call_conda(cmd_list, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
 
 
-def remove(prefix, pkgs=None):
+def remove(prefix, pkgs=None, stdout_callback=None, stderr_callback=None):
     """Remove packages from an environment either by name or path."""
     if not pkgs or not isinstance(pkgs, (list, tuple)):
         raise TypeError('must specify a list of one or more packages to remove from existing environment')
@@ -134,7 +274,7 @@ def remove(prefix, pkgs=None):
     cmd_list.extend(['--prefix', prefix])
 
     cmd_list.extend(pkgs)
-    return _call_conda(cmd_list)
+    return _call_conda(cmd_list, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
 
 
 def installed(prefix):
@@ -332,7 +472,7 @@ def environ_set_prefix(environ, prefix, varname=conda_prefix_variable()):
         global _envs_dirs
         global _root_dir
         if _envs_dirs is None:
-            i = info()
+            i = cached_info()
             _envs_dirs = [os.path.normpath(d) for d in i.get('envs_dirs', [])]
             _root_dir = os.path.normpath(i.get('root_prefix'))
         if prefix == _root_dir:
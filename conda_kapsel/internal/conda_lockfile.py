@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Lockfiles listing the exact packages to put in an environment.
+
+A lockfile is a conda "explicit" file, so ``conda create --file``
+can install it without running the solver. Comment lines at the top
+record the env spec it was generated from, the conda platform, and
+pinned versions of the env spec's pip packages.
+"""
+from __future__ import absolute_import, print_function
+
+import codecs
+import json
+import os
+import uuid
+
+from conda_kapsel.internal import conda_api
+from conda_kapsel.internal import pip_api
+from conda_kapsel.internal.conda_spec_matcher import conda_meta_records
+from conda_kapsel.internal.rename import rename_over_existing
+
+_EXPLICIT_MARKER = "@EXPLICIT"
+_ENV_SPEC_PREFIX = "# env_spec: "
+_SPEC_PREFIX = "# spec: "
+_PLATFORM_PREFIX = "# platform: "
+_PIP_PREFIX = "# pip: "
+
+_package_extensions = ('.tar.bz2', '.conda')
+
+
+def _spec_content(spec):
+    return dict(conda_packages=list(spec.conda_packages),
+                channels=list(spec.channels),
+                pip_packages=list(spec.pip_packages))
+
+
+def dist_name_from_url(url):
+    """Get the ``name-version-build`` string for a package URL (with or without a ``#hash``)."""
+    basename = url.split('#', 1)[0].rstrip('/').split('/')[-1]
+    for extension in _package_extensions:
+        if basename.endswith(extension):
+            return basename[:-len(extension)]
+    return basename
+
+
+class CondaLockfile(object):
+    """The contents of a lockfile."""
+
+    def __init__(self, spec_name, spec_content, platform, urls, pip_pins):
+        """Create a lockfile.
+
+        Args:
+            spec_name (str): name of the env spec
+            spec_content (dict): the packages, channels, and pip packages of the env spec
+            platform (str): conda platform such as ``linux-64``
+            urls (list of str): package URLs, each followed by ``#`` and an md5
+            pip_pins (list of str): ``name==version`` for each pip package
+        """
+        self.spec_name = spec_name
+        self.spec_content = spec_content
+        self.platform = platform
+        self.urls = list(urls)
+        self.pip_pins = list(pip_pins)
+
+    def is_current(self, spec, platform):
+        """True if the lockfile was generated from this env spec on this platform."""
+        return self.platform == platform and self.spec_content == _spec_content(spec)
+
+    @property
+    def dists(self):
+        """Dict from ``name-version-build`` to URL, for every locked conda package."""
+        return dict((dist_name_from_url(url), url) for url in self.urls)
+
+    def pip_pin(self, name):
+        """Get the pinned ``name==version`` for a pip package name, or None."""
+        for pin in self.pip_pins:
+            if pin.split('==', 1)[0].lower() == name.lower():
+                return pin
+        return None
+
+    def to_string(self):
+        """Get the text to save in the lockfile."""
+        lines = ["# This file is generated by 'conda-kapsel lock'; don't edit it.",
+                 _ENV_SPEC_PREFIX + self.spec_name,
+                 _SPEC_PREFIX + json.dumps(self.spec_content, sort_keys=True),
+                 _PLATFORM_PREFIX + self.platform]
+        lines.extend([_PIP_PREFIX + pin for pin in self.pip_pins])
+        lines.append(_EXPLICIT_MARKER)
+        lines.extend(self.urls)
+        return "\n".join(lines) + "\n"
+
+
+def _parse_lockfile(contents):
+    spec_name = None
+    spec_content = None
+    platform = None
+    urls = []
+    pip_pins = []
+    explicit = False
+    for line in contents.splitlines():
+        line = line.strip()
+        if line == '':
+            continue
+        elif line == _EXPLICIT_MARKER:
+            explicit = True
+        elif line.startswith(_ENV_SPEC_PREFIX):
+            spec_name = line[len(_ENV_SPEC_PREFIX):].strip()
+        elif line.startswith(_SPEC_PREFIX):
+            spec_content = json.loads(line[len(_SPEC_PREFIX):])
+        elif line.startswith(_PLATFORM_PREFIX):
+            platform = line[len(_PLATFORM_PREFIX):].strip()
+        elif line.startswith(_PIP_PREFIX):
+            pip_pins.append(line[len(_PIP_PREFIX):].strip())
+        elif line.startswith('#'):
+            continue
+        elif explicit:
+            urls.append(line)
+    if not explicit or spec_content is None or platform is None:
+        return None
+    return CondaLockfile(spec_name=spec_name,
+                         spec_content=spec_content,
+                         platform=platform,
+                         urls=urls,
+                         pip_pins=pip_pins)
+
+
+def load_lockfile(filename):
+    """Load a lockfile, returning None if it's missing or we can't make sense of it."""
+    try:
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            contents = f.read()
+    except (IOError, OSError):
+        return None
+    try:
+        return _parse_lockfile(contents)
+    except ValueError:
+        return None
+
+
+def current_lockfile(spec):
+    """Load the env spec's lockfile if it exists and is up to date with the spec on this platform.
+
+    Returns:
+        a ``CondaLockfile``, or None if there's no lockfile we could use
+    """
+    if spec.lock_file is None:
+        return None
+    lockfile = load_lockfile(spec.lock_file)
+    if lockfile is None:
+        return None
+    try:
+        platform = conda_api.current_platform()
+    except conda_api.CondaError:
+        return None
+    if not lockfile.is_current(spec, platform):
+        return None
+    return lockfile
+
+
+def _write_file(filename, contents):
+    tmp = filename + ".tmp-" + str(uuid.uuid4())
+    try:
+        with codecs.open(tmp, 'w', 'utf-8') as f:
+            f.write(contents)
+        rename_over_existing(tmp, filename)
+    finally:
+        try:
+            os.remove(tmp)
+        except (IOError, OSError):
+            pass
+
+
+def save_lockfile(filename, lockfile):
+    """Replace the lockfile atomically (may raise IOError or OSError)."""
+    _write_file(filename, lockfile.to_string())
+
+
+def save_explicit_file(filename, urls):
+    """Save a conda explicit file with only the given URLs, for ``conda install --file``."""
+    _write_file(filename, "\n".join([_EXPLICIT_MARKER] + list(urls)) + "\n")
+
+
+def _records_needed_by_spec(records, spec):
+    """Get the records for the env spec's packages and everything they depend on.
+
+    An environment can hold packages the env spec never asked for
+    (installed by hand, or left over from an earlier version of the
+    spec), and we don't want to lock those in.
+    """
+    by_name = dict((record.name, record) for record in records)
+    # we always install python, and need pip to install pip packages
+    roots = set(['python']).union(spec.conda_package_names_set)
+    if len(spec.pip_packages) > 0:
+        roots.add('pip')
+    needed = dict()
+    pending = [name for name in roots if name in by_name]
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in needed:
+            continue
+        record = by_name[name]
+        needed[name] = record
+        for depend in record.record.get('depends', []):
+            # like "python >=3.5,<3.6.0a0"; virtual packages such as __glibc aren't in the prefix
+            depend_name = depend.split()[0] if depend.strip() else ''
+            if depend_name in by_name and depend_name not in needed:
+                pending.append(depend_name)
+    return list(needed.values())
+
+
+def lockfile_for_prefix(prefix, spec, platform):
+    """Create a lockfile listing the conda packages in prefix which the env spec needs, and pinning its pip packages.
+
+    Packages in prefix which aren't in the env spec, and aren't
+    dependencies of one that is, are left out.
+
+    Raises ``CondaError`` if a package doesn't record where it was
+    downloaded from, since we couldn't install it again from a URL.
+
+    Returns:
+        a ``CondaLockfile``
+    """
+    urls = []
+    records = _records_needed_by_spec(list(conda_meta_records(prefix)), spec)
+    for record in sorted(records, key=lambda r: r.name):
+        url = record.record.get('url')
+        if not url:
+            raise conda_api.CondaError("Package %s-%s-%s in %s doesn't record the URL it came from." %
+                                       (record.name, record.version, record.build, prefix))
+        md5 = record.record.get('md5')
+        if md5:
+            url = url + "#" + md5
+        urls.append(url)
+
+    pip_pins = []
+    if len(spec.pip_packages) > 0:
+        installed = dict((name.lower(), version) for (name, version) in pip_api.installed(prefix).values())
+        for name in sorted(spec.pip_package_names_set):
+            version = installed.get(name.lower())
+            if version is not None:
+                pip_pins.append("%s==%s" % (name, version))
+
+    return CondaLockfile(spec_name=spec.name,
+                         spec_content=_spec_content(spec),
+                         platform=platform,
+                         urls=urls,
+                         pip_pins=pip_pins)
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Check installed conda packages against package specs without invoking conda."""
+from __future__ import absolute_import, print_function
+
+import codecs
+import errno
+import fnmatch
+import json
+import os
+import re
+
+from conda_kapsel.internal import conda_api
+
+
+class CondaMetaRecord(object):
+    """One installed package, from a ``conda-meta/*.json`` file.
+
+    The name, version, and build come from the filename; the JSON
+    itself is only read if someone asks for ``record``.
+    """
+
+    def __init__(self, filename, name, version, build):
+        self.filename = filename
+        self.name = name
+        self.version = version
+        self.build = build
+        self._record = None
+
+    @property
+    def record(self):
+        """The parsed JSON (empty dict if it can't be read)."""
+        if self._record is None:
+            try:
+                with codecs.open(self.filename, 'r', 'utf-8') as f:
+                    self._record = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._record = dict()
+        return self._record
+
+    def __repr__(self):
+        return "CondaMetaRecord(%s-%s-%s)" % (self.name, self.version, self.build)
+
+
+def conda_meta_records(prefix):
+    """Iterate over a ``CondaMetaRecord`` for each package installed in the prefix."""
+    meta_dir = os.path.join(prefix, 'conda-meta')
+    try:
+        filenames = os.listdir(meta_dir)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        else:
+            raise conda_api.CondaError(str(e))
+    for filename in filenames:
+        if not filename.endswith('.json'):
+            continue
+        pieces = filename[:-5].rsplit('-', 2)
+        if len(pieces) == 3:
+            yield CondaMetaRecord(os.path.join(meta_dir, filename), *pieces)
+
+
+# conda orders these specially; everything else is alphabetical
+_special_version_strings = {'dev': -2, '_': -1, 'post': 1}
+_version_piece_re = re.compile(r'\d+|[a-z]+|_')
+
+
+def _version_component_key(component):
+    pieces = _version_piece_re.findall(component)
+    if len(pieces) == 0 or not pieces[0].isdigit():
+        # "1.a" is treated as "1.0a"
+        pieces.insert(0, '0')
+    key = []
+    for piece in pieces:
+        if piece.isdigit():
+            # numbers sort after all strings except 'post'
+            key.append((1, int(piece), ''))
+        elif piece in _special_version_strings:
+            special = _special_version_strings[piece]
+            key.append((2 if special > 0 else -1, special, ''))
+        else:
+            key.append((0, 0, piece))
+    return key
+
+
+_zero_piece = (1, 0, '')
+
+
+def _compare_padded(a, b, pad):
+    for i in range(max(len(a), len(b))):
+        x = a[i] if i < len(a) else pad
+        y = b[i] if i < len(b) else pad
+        if x != y:
+            if isinstance(x, list):
+                result = _compare_padded(x, y, _zero_piece)
+                if result != 0:
+                    return result
+            else:
+                return -1 if x < y else 1
+    return 0
+
+
+class _VersionKey(object):
+    def __init__(self, version):
+        version = version.strip().lower()
+        self.epoch = 0
+        if '!' in version:
+            (epoch_string, version) = version.split('!', 1)
+            if epoch_string.isdigit():
+                self.epoch = int(epoch_string)
+        (version, _, self.local) = version.partition('+')
+        self.components = [_version_component_key(c) for c in _version_components(version)]
+
+    def _compare(self, other):
+        if self.epoch != other.epoch:
+            return -1 if self.epoch < other.epoch else 1
+        # missing components are treated as 0 so that 1.1 == 1.1.0
+        result = _compare_padded(self.components, other.components, [_zero_piece])
+        if result == 0 and self.local != other.local:
+            result = -1 if self.local < other.local else 1
+        return result
+
+    def __eq__(self, other):
+        return self._compare(other) == 0
+
+    def __ne__(self, other):
+        return self._compare(other) != 0
+
+    def __lt__(self, other):
+        return self._compare(other) < 0
+
+    def __le__(self, other):
+        return self._compare(other) <= 0
+
+    def __gt__(self, other):
+        return self._compare(other) > 0
+
+    def __ge__(self, other):
+        return self._compare(other) >= 0
+
+    __hash__ = None
+
+
+def version_key(version):
+    """Get a sort key for a version string, ordering versions as conda does.
+
+    For example, ``1.10 > 1.9``, ``1.1a < 1.1``, ``1.1.post1 > 1.1``,
+    and ``1.1 == 1.1.0``.
+    """
+    return _VersionKey(version)
+
+
+def _version_components(version):
+    return [c for c in re.split(r'[._-]', version.strip().lower()) if c != '']
+
+
+def _is_component_prefix(prefix, version):
+    prefix_components = _version_components(prefix)
+    version_components = _version_components(version)
+    if len(prefix_components) > len(version_components):
+        return False
+    for (p, v) in zip(prefix_components, version_components):
+        if _version_component_key(p) != _version_component_key(v):
+            return False
+    return True
+
+
+def _prefix_matcher(prefix):
+    return lambda version: _is_component_prefix(prefix, version)
+
+
+def _glob_matcher(pattern):
+    regex = re.compile(fnmatch.translate(pattern.lower()))
+    return lambda version: regex.match(version.lower()) is not None
+
+
+def _compile_version_term(term):
+    """Compile one comparison such as ``>=1.2`` or ``1.2.*`` into a function from version string to bool."""
+    for operator in ('==', '!=', '>=', '<=', '~=', '>', '<', '='):
+        if term.startswith(operator):
+            operand = term[len(operator):]
+            break
+    else:
+        operator = '=='
+        operand = term
+
+    if operand == '':
+        raise ValueError("no version after '%s'" % operator)
+
+    if operator in ('==', '!=', '='):
+        if operand.endswith('.*') and '*' not in operand[:-2]:
+            equals = _prefix_matcher(operand[:-2])
+        elif '*' in operand:
+            equals = _glob_matcher(operand)
+        elif operator == '=':
+            # conda's "=1.2" means "1.2 or 1.2.anything"
+            equals = _prefix_matcher(operand)
+        else:
+            operand_key = version_key(operand)
+
+            def equals(version):
+                return version_key(version) == operand_key
+
+        if operator == '!=':
+            return lambda version: not equals(version)
+        else:
+            return equals
+
+    if operand.endswith('.*'):
+        operand = operand[:-2]
+    if '*' in operand:
+        raise ValueError("can't use a glob with '%s'" % operator)
+    operand_key = version_key(operand)
+
+    if operator == '>=':
+        return lambda version: version_key(version) >= operand_key
+    elif operator == '<=':
+        return lambda version: version_key(version) <= operand_key
+    elif operator == '>':
+        return lambda version: version_key(version) > operand_key
+    elif operator == '<':
+        return lambda version: version_key(version) < operand_key
+    else:
+        assert operator == '~='
+        # "~=1.2.3" means ">=1.2.3,=1.2"
+        components = _version_components(operand)
+        if len(components) < 2:
+            raise ValueError("'~=' needs a version with at least two components")
+        compatible_prefix = ".".join(components[:-1])
+        return lambda version: (version_key(version) >= operand_key and
+                                _is_component_prefix(compatible_prefix, version))
+
+
+def _compile_version_expression(expression):
+    """Compile ``a,b|c`` (meaning ``(a and b) or c``) into a function from version string to bool."""
+    alternatives = []
+    for alternative in expression.split('|'):
+        terms = [_compile_version_term(term) for term in alternative.split(',') if term != '']
+        if len(terms) == 0:
+            raise ValueError("empty version constraint")
+        alternatives.append(terms)
+    return lambda version: any(all(term(version) for term in terms) for terms in alternatives)
+
+
+def _conda_constraint_expression(version):
+    """Turn the version in ``=1.2|1.3`` into ``=1.2|=1.3``, since every bare version there is a prefix."""
+    alternatives = []
+    for alternative in version.split('|'):
+        terms = []
+        for term in alternative.split(','):
+            if term != '' and term[0] not in '=<>!~':
+                term = '=' + term
+            terms.append(term)
+        alternatives.append(",".join(terms))
+    return "|".join(alternatives)
+
+
+def _compile_build(pattern):
+    build_regex = re.compile(fnmatch.translate(pattern))
+    return lambda build: build_regex.match(build) is not None
+
+
+# conda's older "name version [build]" form, as in "numpy 1.11*" or "numpy 1.11.1 py35_0"
+_space_spec_re = re.compile(r'^\s*(?P<name>[^=<>!\s]+)\s+(?P<version>[^\s]+)(\s+(?P<build>[^\s]+))?\s*$')
+
+# the package name at the start of any spec, even one we can't otherwise understand
+_spec_name_re = re.compile(r'^\s*(?P<name>[^=<>!~\s]+)')
+
+
+class CompiledSpec(object):
+    """A conda package spec parsed and compiled once so it can be checked against many records."""
+
+    def __init__(self, spec):
+        """Compile the spec; raises ``ValueError`` if we can't understand it."""
+        self.spec = spec
+        self._version_matches = None
+        self._build_matches = None
+
+        parsed = conda_api.parse_spec(spec)
+        if parsed is None:
+            match = _space_spec_re.match(spec)
+            if match is None:
+                raise ValueError("invalid package specification: %s" % spec)
+            self.name = match.group('name').lower()
+            # here a bare version is exact, as with "=="
+            self._version_matches = _compile_version_expression(match.group('version'))
+            if match.group('build') is not None:
+                self._build_matches = _compile_build(match.group('build'))
+            return
+
+        self.name = parsed.name
+        if parsed.conda_constraint is not None:
+            # "=1.2" or "=1.2=py27_0"
+            pieces = parsed.conda_constraint[1:].split('=')
+            self._version_matches = _compile_version_expression(_conda_constraint_expression(pieces[0].strip()))
+            if len(pieces) > 1:
+                self._build_matches = _compile_build(pieces[1].strip())
+        elif parsed.pip_constraint is not None:
+            self._version_matches = _compile_version_expression(parsed.pip_constraint)
+
+    def matches(self, record):
+        """True if the installed ``CondaMetaRecord`` satisfies this spec."""
+        if record.name != self.name:
+            return False
+        if self._version_matches is not None and not self._version_matches(record.version):
+            return False
+        if self._build_matches is not None and not self._build_matches(record.build):
+            return False
+        return True
+
+    def __repr__(self):
+        return "CompiledSpec(%r)" % self.spec
+
+
+class SpecMatchResult(object):
+    """Which specs are satisfied by an environment."""
+
+    def __init__(self, missing, wrong_version, unsatisfied_specs, installed):
+        # names of packages that aren't installed at all
+        self.missing = missing
+        # names of packages installed with a version or build we can't use
+        self.wrong_version = wrong_version
+        # the original spec strings for the above two lists
+        self.unsatisfied_specs = unsatisfied_specs
+        # dict from name to CondaMetaRecord, only for names we have specs for
+        self.installed = installed
+
+    @property
+    def ok(self):
+        return len(self.missing) == 0 and len(self.wrong_version) == 0
+
+
+class SpecMatcher(object):
+    """A batch of conda specs compiled for checking against installed packages."""
+
+    def __init__(self, specs):
+        """Compile the given spec strings.
+
+        A spec with a constraint we can't compile still counts, but
+        we fall back to only checking that a package with its name is
+        installed, as we did before checking versions. Only a spec
+        without even a package name is left out (the project reports
+        those as problems).
+        """
+        self._by_name = dict()
+        self._order = []
+        for spec in specs:
+            try:
+                compiled = CompiledSpec(spec)
+            except ValueError:
+                match = _spec_name_re.match(spec)
+                if match is None:
+                    continue
+                compiled = CompiledSpec(match.group('name'))
+                compiled.spec = spec
+            if compiled.name not in self._by_name:
+                self._by_name[compiled.name] = []
+                self._order.append(compiled.name)
+            self._by_name[compiled.name].append(compiled)
+
+    @property
+    def names(self):
+        """Package names we have specs for, in the order they were first seen."""
+        return list(self._order)
+
+    def check_records(self, records):
+        """Check every spec in one pass over an iterable of ``CondaMetaRecord``.
+
+        Returns:
+            a ``SpecMatchResult``
+        """
+        installed = dict()
+        for record in records:
+            if record.name in self._by_name:
+                installed[record.name] = record
+
+        missing = []
+        wrong_version = []
+        unsatisfied_specs = []
+        for name in self._order:
+            compiled_specs = self._by_name[name]
+            record = installed.get(name)
+            if record is None:
+                missing.append(name)
+                unsatisfied_specs.extend(compiled.spec for compiled in compiled_specs)
+            else:
+                failed = [compiled.spec for compiled in compiled_specs if not compiled.matches(record)]
+                if len(failed) > 0:
+                    wrong_version.append(name)
+                    unsatisfied_specs.extend(failed)
+
+        return SpecMatchResult(missing=sorted(missing),
+                               wrong_version=sorted(wrong_version),
+                               unsatisfied_specs=unsatisfied_specs,
+                               installed=installed)
+
+    def check_prefix(self, prefix):
+        """Check every spec against the packages installed in prefix.
+
+        Raises ``CondaError`` if the ``conda-meta`` directory can't be listed.
+
+        Returns:
+            a ``SpecMatchResult``
+        """
+        return self.check_records(conda_meta_records(prefix))
+
+    def specs_for(self, names):
+        """Get the original spec strings for the given package names.
+
+        Names we have no spec for are left out.
+
+        Returns:
+            list of spec strings, grouped by name in the order they were first seen
+        """
+        specs = []
+        for name in self._order:
+            if name in names:
+                specs.extend([compiled.spec for compiled in self._by_name[name]])
+        return specs
@@ -7,30 +7,85 @@
 """Abstract high-level interface to Conda."""
 from __future__ import absolute_import
 
+import hashlib
 import os
+import tempfile
 
-from conda_kapsel.conda_manager import CondaManager, CondaEnvironmentDeviations, CondaManagerError
+from conda_kapsel.conda_manager import CondaManager, CondaEnvironmentDeviations, CondaFixPlan, CondaManagerError
+from conda_kapsel.internal.conda_lockfile import current_lockfile, dist_name_from_url, save_explicit_file
+from conda_kapsel.internal.conda_spec_matcher import conda_meta_records
+from conda_kapsel.internal.template_envs import TemplateEnvStore
+from conda_kapsel.internal.user_cache import file_stat_key, load_keyed_json, save_keyed_json
 import conda_kapsel.internal.conda_api as conda_api
 import conda_kapsel.internal.pip_api as pip_api
+from conda_kapsel.internal.streaming_popen import callback_kwargs
 
+# this lives in the env itself so it goes away with the env, but
+# not in conda-meta since adding it would change what we're fingerprinting.
+_FINGERPRINT_FILE = os.path.join('var', 'cache', 'conda-kapsel', 'env-fingerprint.json')
 
-class DefaultCondaManager(CondaManager):
-    def _find_conda_missing(self, prefix, spec):
-        try:
-            installed = conda_api.installed(prefix)
-        except conda_api.CondaError as e:
-            raise CondaManagerError("Conda failed while listing installed packages in %s: %s" % (prefix, str(e)))
 
-        # TODO: we don't verify that the environment contains the right versions
-        # https://github.com/Anaconda-Server/conda-kapsel/issues/77
+class DefaultCondaManager(CondaManager):
+    def __init__(self, stdout_callback=None, stderr_callback=None):
+        """Create a manager; the callbacks, if given, get each line of output from conda and pip."""
+        self._callbacks = callback_kwargs(stdout_callback, stderr_callback)
 
-        missing = set()
+    def _fingerprint_filename(self, prefix):
+        return os.path.join(prefix, _FINGERPRINT_FILE)
 
-        for name in spec.conda_package_names_set:
-            if name not in installed:
-                missing.add(name)
+    def _environment_fingerprint(self, prefix):
+        """Get a value that changes whenever packages are added to or removed from the env."""
+        meta_dir = os.path.join(prefix, 'conda-meta')
+        try:
+            meta_mtime = os.stat(meta_dir).st_mtime
+            names = sorted(os.listdir(meta_dir))
+        except OSError:
+            return None
+        listing_hash = hashlib.sha1("\n".join(names).encode('utf-8')).hexdigest()
+        # installing or removing a pip package adds or removes a
+        # *-info directory, which changes the mtime of site-packages.
+        site_packages = [file_stat_key(path)[:2] for path in pip_api.site_packages_dirs(prefix)]
+        return dict(conda_meta=[meta_mtime, listing_hash], site_packages=site_packages)
+
+    def _fingerprint_matches(self, prefix, spec):
+        fingerprint = self._environment_fingerprint(prefix)
+        if fingerprint is None:
+            return False
+        return load_keyed_json(self._fingerprint_filename(prefix), spec.content_hash) == fingerprint
+
+    def _save_fingerprint(self, prefix, spec):
+        fingerprint = self._environment_fingerprint(prefix)
+        if fingerprint is not None:
+            save_keyed_json(self._fingerprint_filename(prefix), spec.content_hash, fingerprint)
+
+    def _remove_fingerprint(self, prefix):
+        try:
+            os.remove(self._fingerprint_filename(prefix))
+        except OSError:
+            pass
+
+    def _urls_to_install(self, prefix, lockfile):
+        installed = set("%s-%s-%s" % (record.name, record.version, record.build)
+                        for record in conda_meta_records(prefix))
+        return [url for url in lockfile.urls if dist_name_from_url(url) not in installed]
+
+    def _install_from_lockfile(self, prefix, lockfile):
+        urls = self._urls_to_install(prefix, lockfile)
+        if len(urls) == 0:
+            return
+        (fd, filename) = tempfile.mkstemp(prefix="kapsel-", suffix=".txt")
+        os.close(fd)
+        try:
+            save_explicit_file(filename, urls)
+            conda_api.install_explicit(prefix=prefix, filename=filename, **self._callbacks)
+        finally:
+            os.remove(filename)
 
-        return sorted(list(missing))
+    def _find_conda_deviations(self, prefix, spec):
+        try:
+            return spec.conda_spec_matcher.check_prefix(prefix)
+        except conda_api.CondaError as e:
+            raise CondaManagerError("Conda failed while listing installed packages in %s: %s" % (prefix, str(e)))
 
     def _find_pip_missing(self, prefix, spec):
         # this is an important optimization to avoid a slow "pip
@@ -64,54 +119,127 @@ class DefaultCondaManager(CondaManager):
                 wrong_version_pip_packages=(),
                 broken=True)
 
-        conda_missing = self._find_conda_missing(prefix, spec)
-        pip_missing = self._find_pip_missing(prefix, spec)
-
-        if len(conda_missing) > 0 or len(pip_missing) > 0:
-            summary = "Conda environment is missing packages: %s" % (", ".join(conda_missing + pip_missing))
-            return CondaEnvironmentDeviations(summary=summary,
-                                              missing_packages=conda_missing,
-                                              wrong_version_packages=(),
-                                              missing_pip_packages=pip_missing,
-                                              wrong_version_pip_packages=())
-        else:
+        if self._fingerprint_matches(prefix, spec):
+            # nothing has changed since we last fixed this env for this spec
             return CondaEnvironmentDeviations(summary="OK",
                                               missing_packages=(),
                                               wrong_version_packages=(),
                                               missing_pip_packages=(),
                                               wrong_version_pip_packages=())
 
+        conda_result = self._find_conda_deviations(prefix, spec)
+        conda_missing = conda_result.missing
+        pip_missing = self._find_pip_missing(prefix, spec)
+
+        if len(conda_missing) > 0 or len(pip_missing) > 0:
+            summary = "Conda environment is missing packages: %s" % (", ".join(conda_missing + pip_missing))
+        elif len(conda_result.wrong_version) > 0:
+            wrong = []
+            for name in conda_result.wrong_version:
+                record = conda_result.installed[name]
+                wrong.append("%s (%s-%s installed)" % (name, record.version, record.build))
+            summary = "Conda environment has the wrong version of packages: %s" % (", ".join(wrong))
+        else:
+            summary = "OK"
+
+        return CondaEnvironmentDeviations(summary=summary,
+                                          missing_packages=conda_missing,
+                                          wrong_version_packages=conda_result.wrong_version,
+                                          missing_pip_packages=pip_missing,
+                                          wrong_version_pip_packages=())
+
     def fix_environment_deviations(self, prefix, spec, deviations=None):
         if deviations is None:
             deviations = self.find_environment_deviations(prefix, spec)
 
+        if deviations.ok and self._fingerprint_matches(prefix, spec):
+            return
+
         command_line_packages = set(['python']).union(set(spec.conda_packages))
+        # if we have an up-to-date lockfile we can skip the solver
+        lockfile = current_lockfile(spec)
 
         if os.path.isdir(os.path.join(prefix, 'conda-meta')):
-            missing = deviations.missing_packages
-            if len(missing) > 0:
+            missing = list(deviations.missing_packages) + list(deviations.wrong_version_packages)
+            if len(missing) > 0 and lockfile is not None:
+                try:
+                    self._install_from_lockfile(prefix, lockfile)
+                except conda_api.CondaError as e:
+                    raise CondaManagerError("Failed to install missing packages: %s: %s" %
+                                            (", ".join(missing), str(e)))
+            elif len(missing) > 0:
+                # only ask for the packages that need to change, but keep their
+                # version constraints so conda picks an acceptable version.
+                specs = spec.conda_spec_matcher.specs_for(missing)
+                covered = spec.conda_spec_matcher.names
+                specs.extend([name for name in missing if name not in covered])
                 try:
-                    # TODO we are ignoring package versions here
-                    # https://github.com/Anaconda-Server/conda-kapsel/issues/77
-                    conda_api.install(prefix=prefix, pkgs=list(missing), channels=spec.channels)
+                    conda_api.install(prefix=prefix, pkgs=specs, channels=spec.channels, **self._callbacks)
                 except conda_api.CondaError as e:
                     raise CondaManagerError("Failed to install missing packages: " + ", ".join(missing))
         else:
-            # Create environment from scratch
+            # Create environment from scratch, from the lockfile or by
+            # cloning a template env with the same packages if we can.
             try:
-                conda_api.create(prefix=prefix, pkgs=list(command_line_packages), channels=spec.channels)
+                if lockfile is not None:
+                    conda_api.create_explicit(prefix=prefix, filename=spec.lock_file, **self._callbacks)
+                else:
+                    store = TemplateEnvStore.for_current_user()
+                    if store is None or not store.clone_into(prefix, sorted(command_line_packages), spec.channels,
+                                                             **self._callbacks):
+                        conda_api.create(prefix=prefix,
+                                         pkgs=list(command_line_packages),
+                                         channels=spec.channels,
+                                         **self._callbacks)
             except conda_api.CondaError as e:
                 raise CondaManagerError("Failed to create environment at %s: %s" % (prefix, str(e)))
 
         # now add pip if needed
         if len(deviations.missing_pip_packages) > 0:
+            pip_packages = list(deviations.missing_pip_packages)
+            if lockfile is not None:
+                pip_packages = [lockfile.pip_pin(name) or name for name in pip_packages]
             try:
-                pip_api.install(prefix=prefix, pkgs=list(deviations.missing_pip_packages))
+                pip_api.install(prefix=prefix, pkgs=pip_packages, **self._callbacks)
             except pip_api.PipError as e:
                 raise CondaManagerError("Failed to install missing pip packages: " + ", ".join(missing))
 
+        # remember that this env was good, so we don't have to inspect it again
+        self._save_fingerprint(prefix, spec)
+
+    def _is_in_package_cache(self, url, pkgs_dirs):
+        dist = dist_name_from_url(url)
+        basename = url.split('#', 1)[0].rstrip('/').split('/')[-1]
+        for pkgs_dir in pkgs_dirs:
+            # conda keeps both the tarball and the extracted package
+            if os.path.isdir(os.path.join(pkgs_dir, dist, 'info')) or \
+               os.path.isfile(os.path.join(pkgs_dir, basename)):
+                return True
+        return False
+
+    def plan_environment_fix(self, prefix, spec, deviations):
+        lockfile = current_lockfile(spec)
+        if lockfile is None:
+            return super(DefaultCondaManager, self).plan_environment_fix(prefix, spec, deviations)
+
+        try:
+            urls = self._urls_to_install(prefix, lockfile)
+        except conda_api.CondaError as e:
+            raise CondaManagerError("Failed to list packages in %s: %s" % (prefix, str(e)))
+        try:
+            pkgs_dirs = conda_api.package_cache_dirs()
+        except conda_api.CondaError:
+            pkgs_dirs = []
+        cached = [url for url in urls if self._is_in_package_cache(url, pkgs_dirs)]
+        return CondaFixPlan(packages=[dist_name_from_url(url) for url in urls],
+                            pip_packages=deviations.missing_pip_packages,
+                            urls=[url for url in urls if url not in cached],
+                            cached_urls=cached,
+                            from_lockfile=True)
+
     def remove_packages(self, prefix, packages):
+        self._remove_fingerprint(prefix)
         try:
-            conda_api.remove(prefix, packages)
+            conda_api.remove(prefix, packages, **self._callbacks)
         except conda_api.CondaError as e:
             raise CondaManagerError("Failed to remove packages from %s: %s" % (prefix, str(e)))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Check or fix several conda environments at once."""
+from __future__ import absolute_import
+
+from conda_kapsel.conda_manager import CondaManagerError
+from conda_kapsel.internal import trace
+from conda_kapsel.internal.thread_pool import run_on_threads
+from conda_kapsel.status import Status
+
+# most of the time goes to conda downloading and linking, which
+# doesn't go faster with lots of simultaneous conda processes.
+DEFAULT_JOBS = 4
+
+
+class EnvJobResult(object):
+    """What happened to one environment."""
+
+    def __init__(self, env_spec_name, prefix, deviations, fixed, error):
+        """Create a result.
+
+        Args:
+            env_spec_name (str): name of the env spec
+            prefix (str): path to the environment
+            deviations (CondaEnvironmentDeviations): what was wrong before we did anything, or None if unknown
+            fixed (bool): True if we created or changed the environment
+            error (str): error message or None on success
+        """
+        self.env_spec_name = env_spec_name
+        self.prefix = prefix
+        self.deviations = deviations
+        self.fixed = fixed
+        self.error = error
+
+    @property
+    def ok(self):
+        """True if the environment is now good."""
+        return self.error is None and (self.fixed or (self.deviations is not None and self.deviations.ok))
+
+
+def _run_job(conda, env_spec, prefix, fix):
+    try:
+        deviations = conda.find_environment_deviations(prefix, env_spec)
+    except CondaManagerError as e:
+        return EnvJobResult(env_spec.name, prefix, deviations=None, fixed=False, error=str(e))
+
+    if deviations.ok or not fix:
+        return EnvJobResult(env_spec.name, prefix, deviations=deviations, fixed=False, error=None)
+
+    try:
+        conda.fix_environment_deviations(prefix, env_spec, deviations)
+    except CondaManagerError as e:
+        return EnvJobResult(env_spec.name, prefix, deviations=deviations, fixed=False, error=str(e))
+    return EnvJobResult(env_spec.name, prefix, deviations=deviations, fixed=True, error=None)
+
+
+def run_env_jobs(conda, envs, jobs=None, fix=True):
+    """Check, and optionally fix, each environment, several at a time.
+
+    ``CondaManager`` instances may be used from multiple threads,
+    and the slow part of each job is a conda or pip child process,
+    so the jobs run on a pool of threads.
+
+    Args:
+        conda (CondaManager): the conda manager
+        envs (list of (EnvSpec, str)): env specs and the prefixes to create them in
+        jobs (int): how many environments to work on at once, None for a default
+        fix (bool): False to only look for deviations
+
+    Returns:
+        list of ``EnvJobResult`` in the same order as envs
+    """
+    if jobs is None:
+        jobs = DEFAULT_JOBS
+
+    def run_one(env):
+        (env_spec, prefix) = env
+        try:
+            with trace.span("prepare env spec " + env_spec.name, 'env', prefix=prefix):
+                return _run_job(conda, env_spec, prefix, fix)
+        except Exception as e:
+            # don't leave a hole in the results if something unexpected breaks
+            return EnvJobResult(env_spec.name, prefix, deviations=None, fixed=False, error=str(e))
+
+    return run_on_threads(run_one, envs, jobs)
+
+
+class EnvJobsStatus(Status):
+    """Status of a batch of environments; ``results`` has an ``EnvJobResult`` for each one."""
+
+    def __init__(self, results):
+        """Create a status from a list of ``EnvJobResult``."""
+        self.results = list(results)
+
+    def __bool__(self):
+        return all(result.ok for result in self.results)
+
+    def __nonzero__(self):
+        return self.__bool__()  # pragma: no cover (py2 only)
+
+    @property
+    def deviations(self):
+        """Dict from env spec name to ``CondaEnvironmentDeviations`` (None if the check failed)."""
+        return dict((result.env_spec_name, result.deviations) for result in self.results)
+
+    @property
+    def status_description(self):
+        failed = [result.env_spec_name for result in self.results if not result.ok]
+        if len(failed) > 0:
+            return "Failed to prepare environment specs: %s." % ", ".join(failed)
+        else:
+            return "Environment specs are ready: %s." % ", ".join(result.env_spec_name for result in self.results)
+
+    @property
+    def logs(self):
+        logs = []
+        for result in self.results:
+            if result.fixed:
+                logs.append("%s: %s (fixed)" % (result.env_spec_name, result.deviations.summary))
+            elif result.deviations is not None:
+                logs.append("%s: %s" % (result.env_spec_name, result.deviations.summary))
+        return logs
+
+    @property
+    def errors(self):
+        return ["%s: %s" % (result.env_spec_name, result.error) for result in self.results
+                if result.error is not None]
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""An environment dict that records changes on top of another environment, without copying it."""
+from __future__ import absolute_import
+
+try:
+    from collections.abc import Mapping, MutableMapping  # pragma: no cover (py3 only)
+except ImportError:  # pragma: no cover (py2 only)
+    from collections import Mapping, MutableMapping
+
+# marks a key we deleted
+_REMOVED = object()
+# marks a key we haven't changed
+_UNCHANGED = object()
+
+
+class EnvironOverlay(MutableMapping):
+    """A mutable environment which reads through to a base environment and keeps its own changes.
+
+    The base is never modified, and it isn't copied either, so
+    making an overlay of ``os.environ`` is cheap. Changes to the
+    base made while the overlay is in use show through, unless
+    the overlay has set or deleted the same key.
+
+    Because the overlay knows what it changed, ``changed`` and
+    ``removed`` don't have to compare every variable.
+    """
+
+    def __init__(self, base):
+        """Construct an EnvironOverlay with no changes yet.
+
+        Args:
+            base (Mapping): environment to read through to, such as ``os.environ``
+        """
+        assert isinstance(base, Mapping)
+        self._base = base
+        self._changes = dict()
+
+    @property
+    def base(self):
+        """Get the environment this overlay reads through to."""
+        return self._base
+
+    def __getitem__(self, key):
+        """Get a variable."""
+        value = self._changes.get(key, _UNCHANGED)
+        if value is _UNCHANGED:
+            return self._base[key]
+        elif value is _REMOVED:
+            raise KeyError(key)
+        else:
+            return value
+
+    def __setitem__(self, key, value):
+        """Set a variable in the overlay."""
+        self._changes[key] = value
+
+    def __delitem__(self, key):
+        """Delete a variable in the overlay."""
+        if key not in self:
+            raise KeyError(key)
+        self._changes[key] = _REMOVED
+
+    def __contains__(self, key):
+        """Check whether we have a variable."""
+        value = self._changes.get(key, _UNCHANGED)
+        if value is _UNCHANGED:
+            return key in self._base
+        else:
+            return value is not _REMOVED
+
+    def __iter__(self):
+        """Iterate over variable names."""
+        for key in self._base:
+            if key not in self._changes:
+                yield key
+        for (key, value) in self._changes.items():
+            if value is not _REMOVED:
+                yield key
+
+    def __len__(self):
+        """Count the variables."""
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        """Repr of the overlay, including only the changes."""
+        return "EnvironOverlay(changed=%r, removed=%r)" % (self.changed, self.removed)
+
+    def copy(self):
+        """Get another overlay on the same base, with a copy of our changes."""
+        copied = EnvironOverlay(self._base)
+        copied._changes = dict(self._changes)
+        return copied
+
+    @property
+    def changed(self):
+        """Get a dict of the variables we've set to a value which differs from the base."""
+        result = dict()
+        for (key, value) in self._changes.items():
+            if value is not _REMOVED and self._base.get(key, _UNCHANGED) != value:
+                result[key] = value
+        return result
+
+    @property
+    def removed(self):
+        """Get a sorted list of the base's variables which we've deleted."""
+        return sorted([key for (key, value) in self._changes.items() if value is _REMOVED and key in self._base])
+
+
+def changed_since(environ, base):
+    """Get a dict of the variables in ``environ`` which are missing from or different in ``base``.
+
+    This is cheap when ``environ`` is an ``EnvironOverlay`` of
+    ``base``; otherwise it compares every variable.
+    """
+    if isinstance(environ, EnvironOverlay) and environ.base is base:
+        return environ.changed
+    else:
+        return dict((key, value) for (key, value) in environ.items() if base.get(key, _UNCHANGED) != value)
+
+
+def flatten(environ):
+    """Get ``environ`` as a plain dict, such as to pass to ``exec``.
+
+    Plain dicts are returned as-is, not copied.
+    """
+    if isinstance(environ, dict):
+        return environ
+    else:
+        return dict(environ)
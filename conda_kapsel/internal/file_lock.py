@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Advisory locks shared between processes."""
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+import errno
+import hashlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (Windows)
+    fcntl = None  # pragma: no cover
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+from conda_kapsel.internal.user_cache import user_cache_directory
+
+
+def _lock_filename(path):
+    # the lock file lives in the cache, not next to the file, so
+    # it never ends up in source control or a project archive
+    name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(user_cache_directory(), "locks", name + ".lock")
+
+
+def _acquire(fd, wait):
+    # returns False if wait is False and someone else has the lock
+    if fcntl is not None:
+        flags = fcntl.LOCK_EX
+        if not wait:
+            flags = flags | fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+        except (IOError, OSError) as e:
+            if not wait and e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return False
+            raise e
+    elif msvcrt is not None:  # pragma: no cover (Windows)
+        while True:
+            try:
+                if wait:
+                    # LK_LOCK gives up after about ten seconds
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                break
+            except (IOError, OSError) as e:
+                if not wait:
+                    return False
+                if e.errno != errno.EDEADLK:
+                    raise e
+    return True
+
+
+def _release(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    elif msvcrt is not None:  # pragma: no cover (Windows)
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked_file(path, wait=True):
+    """Context manager which holds an exclusive lock on behalf of the file at path.
+
+    Only code which also uses ``locked_file()`` on the same path is
+    locked out; the file itself can still be read and written by
+    anyone. Holders can be other processes or other threads.
+
+    If the lock can't be created (say the cache directory isn't
+    writable), the block runs without it, which is no worse than
+    not locking at all.
+
+    Args:
+        path (str): the file to lock (it doesn't have to exist)
+        wait (bool): False to not wait if someone else has the lock
+
+    Returns:
+        a context manager whose value is False if we didn't wait
+        and someone else had the lock, True otherwise
+    """
+    filename = _lock_filename(path)
+    try:
+        makedirs_ok_if_exists(os.path.dirname(filename))
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o666)
+    except (IOError, OSError):
+        fd = None
+
+    if fd is None:
+        yield True
+        return
+
+    try:
+        locked = _acquire(fd, wait)
+        try:
+            yield locked
+        finally:
+            if locked:
+                _release(fd)
+    finally:
+        os.close(fd)
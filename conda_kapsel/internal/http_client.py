@@ -8,6 +8,7 @@ from __future__ import absolute_import, print_function
 
 from tornado import httpclient
 from tornado import gen
+from tornado.ioloop import IOLoop
 
 import conda_kapsel.internal.makedirs as makedirs
 import conda_kapsel.internal.rename as rename
@@ -124,3 +125,55 @@ class FileDownloader(object):
     def errors(self):
         """List of errors if we failed to download, empty list if we succeeded."""
         return self._errors
+
+
+@gen.coroutine
+def _fetch_size(client, url, timeout_in_seconds):
+    # the #md5 on lockfile URLs isn't part of what we request
+    request = httpclient.HTTPRequest(url=url.split('#', 1)[0],
+                                     method='HEAD',
+                                     request_timeout=timeout_in_seconds)
+    response = None
+    try:
+        response = yield client.fetch(request)
+    except Exception:
+        pass
+
+    size = (None, None)
+    if response is not None:
+        length = response.headers.get('Content-Length')
+        if length is not None and length.isdigit():
+            length = int(length)
+        else:
+            length = None
+        size = (length, response.headers.get('Accept-Ranges', 'none').strip().lower() == 'bytes')
+    raise gen.Return(size)
+
+
+@gen.coroutine
+def fetch_sizes_async(urls, timeout_in_seconds=30):
+    """Ask the server for the size of each URL with a HEAD request, all at the same time.
+
+    Returns:
+        a dict from URL to a ``(length, accepts_ranges)`` tuple, where
+        both are None if the request failed, and the length is None if
+        the server didn't say
+    """
+    urls = sorted(set(urls))
+    client = httpclient.AsyncHTTPClient(max_clients=10, force_instance=True)
+    try:
+        sizes = yield [_fetch_size(client, url, timeout_in_seconds) for url in urls]
+    finally:
+        client.close()
+    raise gen.Return(dict(zip(urls, sizes)))
+
+
+def fetch_sizes(urls, timeout_in_seconds=30):
+    """Like ``fetch_sizes_async()``, but block until we have the sizes."""
+    if len(urls) == 0:
+        return dict()
+    io_loop = IOLoop(make_current=False)
+    try:
+        return io_loop.run_sync(lambda: fetch_sizes_async(urls, timeout_in_seconds))
+    finally:
+        io_loop.close()
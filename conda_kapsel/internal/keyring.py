@@ -16,6 +16,7 @@ except ImportError:  # pragma: no cover (py2 only)
 
 _fallback_keyring = 0
 _fake_in_memory_keyring = dict()
+_change_count = 0
 
 
 def enable_fallback_keyring():
@@ -31,6 +32,7 @@ def disable_fallback_keyring():
     if _fallback_keyring == 0:
         # forget everything whenever the fallback gets disabled
         _fake_in_memory_keyring = dict()
+        _note_change()
 
 
 def _use_fallback_keyring():
@@ -53,6 +55,7 @@ def reset_keyring_module():
     global _fallback_keyring
     _fake_in_memory_keyring = dict()
     _fallback_keyring = 0
+    _note_change()
 
 
 def fallback_data():
@@ -88,8 +91,19 @@ def get(env_prefix, variable):
     return _fake_in_memory_keyring.get(name, None)
 
 
+def change_count():
+    """Get a number which goes up every time we set or unset a password."""
+    return _change_count
+
+
+def _note_change():
+    global _change_count
+    _change_count = _change_count + 1
+
+
 def set(env_prefix, variable, value):
     assert value is not None
+    _note_change()
 
     name = _make_username(env_prefix, variable)
     if not _use_fallback_keyring():
@@ -106,6 +120,7 @@ def set(env_prefix, variable, value):
 
 
 def unset(env_prefix, variable):
+    _note_change()
     name = _make_username(env_prefix, variable)
     if not _use_fallback_keyring():
         try:
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Find the notebooks in a project, remembering them between runs.
+
+Finding notebooks means walking every unignored directory in the
+project and asking git which files it ignores, which is slow on
+projects full of data. We save what we found in the user cache
+directory, along with the modification time of each directory we
+walked and the stats of the files that decide what's ignored.
+Adding, removing, or renaming a file changes its directory's
+modification time, so if none of those changed, the saved list is
+still right and we don't walk the tree again.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import os
+
+from conda_kapsel.archiver import _enumerate_archive_files, _plugin_ignore_patterns
+from conda_kapsel.internal import trace
+from conda_kapsel.internal.user_cache import file_stat_key, load_keyed_json, save_keyed_json, user_cache_directory
+
+# bump this if the index contents change meaning
+_INDEX_FORMAT = 1
+
+# files outside the walked directories that change what's ignored
+_IGNORE_CONFIG_FILES = ('.kapselignore', os.path.join('.git', 'index'), os.path.join('.git', 'info', 'exclude'))
+
+
+def _index_filename(project_directory):
+    name = hashlib.sha1(project_directory.encode('utf-8')).hexdigest()
+    return os.path.join(user_cache_directory(), "notebooks", name + ".json")
+
+
+def _index_key(project_directory, requirements):
+    return dict(format=_INDEX_FORMAT,
+                directory=project_directory,
+                ignore_patterns=_plugin_ignore_patterns(requirements),
+                ignore_files=[file_stat_key(os.path.join(project_directory, name)) for name in _IGNORE_CONFIG_FILES])
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _stamps(project_directory, directories, gitignores):
+    return dict(directories=[[d, _mtime(os.path.join(project_directory, d))] for d in directories],
+                gitignores=[file_stat_key(os.path.join(project_directory, f)) for f in gitignores])
+
+
+def _index_is_current(project_directory, index):
+    # a .gitignore can be edited without touching its directory
+    for saved in index['gitignores']:
+        if file_stat_key(saved[0]) != saved:
+            return False
+    for (directory, mtime) in index['directories']:
+        if _mtime(os.path.join(project_directory, directory)) != mtime:
+            return False
+    return True
+
+
+def _is_notebook(relative_path):
+    # chop out hidden directories. The main reason to ignore dot
+    # directories is that they might contain packages or git cache
+    # data or other such gunk, not because we really care about
+    # ".foo.ipynb" per se.
+    return relative_path.endswith('.ipynb') and not relative_path.startswith('.')
+
+
+def find_notebooks(project_directory, errors, requirements):
+    """List the unignored notebooks in the project, reusing a saved list if nothing has changed.
+
+    Args:
+        project_directory (str): the project directory
+        errors (list of str): list to append errors to
+        requirements (list of Requirement): the project's requirements, which may ignore some files
+
+    Returns:
+        sorted list of notebook paths relative to the project directory, or None on error
+    """
+    filename = _index_filename(project_directory)
+    key = _index_key(project_directory, requirements)
+    index = load_keyed_json(filename, key)
+    if index is not None and _index_is_current(project_directory, index):
+        return list(index['notebooks'])
+
+    directories = ['']
+    gitignores = []
+    notebooks = []
+    with trace.span("find notebooks", 'project', directory=project_directory):
+        infos = _enumerate_archive_files(project_directory, errors, requirements=requirements)
+        if infos is None:
+            assert errors
+            return None
+
+        for info in infos:
+            if info.is_directory:
+                directories.append(info.relative_path)
+            if info.basename == '.gitignore':
+                gitignores.append(info.relative_path)
+            if _is_notebook(info.relative_path):
+                notebooks.append(info.relative_path)
+    notebooks.sort()
+
+    index = _stamps(project_directory, directories, gitignores)
+    index['notebooks'] = notebooks
+    save_keyed_json(filename, key, index)
+
+    return notebooks
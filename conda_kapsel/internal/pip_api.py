@@ -6,12 +6,15 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import codecs
 import collections
-import subprocess
 import os
+import platform
 import re
 import sys
 
+from conda_kapsel.internal import streaming_popen
+
 
 class PipError(Exception):
     """General pip error."""
@@ -38,25 +41,53 @@ def _get_pip_command(prefix, extra_args):
     return cmd_list
 
 
-def _call_pip(prefix, extra_args):
+# environment variable with the number of seconds a pip command may run
+PIP_TIMEOUT_VARIABLE = 'CONDA_KAPSEL_PIP_TIMEOUT'
+
+
+def _call_pip(prefix, extra_args, stdout_callback=None, stderr_callback=None):
     cmd_list = _get_pip_command(prefix, extra_args)
 
     try:
-        p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = streaming_popen.popen_and_stream(cmd_list,
+                                                  stdout_callback=stdout_callback,
+                                                  stderr_callback=stderr_callback,
+                                                  timeout=streaming_popen.timeout_from_environ(PIP_TIMEOUT_VARIABLE))
     except OSError as e:
         raise PipError("failed to run: %r: %r" % (" ".join(cmd_list), repr(e)))
-    (out, err) = p.communicate()
-    errstr = err.decode().strip()
-    if p.returncode != 0:
+    errstr = result.stderr.decode().strip()
+    if result.timed_out:
+        raise PipError('%s: timed out after %.0f seconds: %s' % (" ".join(cmd_list), result.wall_time, errstr))
+    elif result.cancelled:
+        raise PipError('%s: cancelled: %s' % (" ".join(cmd_list), errstr))
+    elif result.returncode != 0:
         raise PipError('%s: %s' % (" ".join(cmd_list), errstr))
     elif errstr != '':
         for line in errstr.split("\n"):
             print("%s %s: %s" % (cmd_list[0], cmd_list[1], line), file=sys.stderr)
-    return out
+    return result.stdout
+
+
+def site_packages_dirs(prefix):
+    """Get the list of existing site-packages directories in the environment."""
+    if platform.system() == 'Windows':
+        candidates = [os.path.join(prefix, 'Lib', 'site-packages')]
+    else:
+        lib = os.path.join(prefix, 'lib')
+        try:
+            names = sorted(os.listdir(lib))
+        except OSError:
+            names = []
+        candidates = [os.path.join(lib, name, 'site-packages') for name in names if name.startswith('python')]
+    return [candidate for candidate in candidates if os.path.isdir(candidate)]
+
 
+def install(prefix, pkgs=None, stdout_callback=None, stderr_callback=None):
+    """Install packages into an environment.
 
-def install(prefix, pkgs=None):
-    """Install packages into an environment."""
+    ``stdout_callback`` and ``stderr_callback``, if given, are called with
+    each line of pip's output as it arrives.
+    """
     if not pkgs or not isinstance(pkgs, (list, tuple)):
         raise TypeError('must specify a list of one or more packages to install into existing environment')
 
@@ -65,29 +96,106 @@ def install(prefix, pkgs=None):
     args = ['install', '--quiet', '--no-deps']
     args.extend(pkgs)
 
-    return _call_pip(prefix, extra_args=args)
+    return _call_pip(prefix, extra_args=args, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
 
 
-def remove(prefix, pkgs=None):
+def remove(prefix, pkgs=None, stdout_callback=None, stderr_callback=None):
     """Remove packages from an environment."""
     if not pkgs or not isinstance(pkgs, (list, tuple)):
         raise TypeError('must specify a list of one or more packages to remove from existing environment')
 
     args = ['uninstall', '--quiet', '--yes']
     args.extend(pkgs)
-    return _call_pip(prefix, extra_args=args)
+    return _call_pip(prefix, extra_args=args, stdout_callback=stdout_callback, stderr_callback=stderr_callback)
+
+
+# this is what pkg_resources.safe_name() does, which is how pip
+# list comes up with the names it shows
+_unsafe_name_chars = re.compile('[^A-Za-z0-9.]+')
+
+
+def _read_metadata_name_and_version(filename):
+    name = None
+    version = None
+    with codecs.open(filename, 'r', 'utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line == '':
+                # a blank line ends the headers
+                break
+            elif line.startswith("Name:"):
+                name = line[len("Name:"):].strip()
+            elif line.startswith("Version:"):
+                version = line[len("Version:"):].strip()
+            if name is not None and version is not None:
+                break
+    return (name, version)
+
+
+def _installed_from_metadata(prefix):
+    """Find installed packages by reading metadata in site-packages, without running pip.
+
+    Returns None if we don't understand the layout of the
+    environment, in which case pip has to tell us instead.
+    """
+    dirs = site_packages_dirs(prefix)
+    if len(dirs) == 0:
+        return None
+
+    result = dict()
+    for site_packages in dirs:
+        try:
+            entries = os.listdir(site_packages)
+        except OSError:
+            return None
+
+        for entry in entries:
+            path = os.path.join(site_packages, entry)
+            if entry.endswith(".dist-info"):
+                metadata = os.path.join(path, "METADATA")
+            elif entry.endswith(".egg-info"):
+                if os.path.isdir(path):
+                    metadata = os.path.join(path, "PKG-INFO")
+                else:
+                    metadata = path
+            elif entry.endswith(".egg") or entry.endswith(".egg-link"):
+                # eggs and "develop" installs are found via .pth
+                # files, which we don't try to interpret
+                return None
+            else:
+                continue
+
+            try:
+                (name, version) = _read_metadata_name_and_version(metadata)
+            except (IOError, OSError):
+                return None
+            if name is None or version is None:
+                return None
+
+            name = _unsafe_name_chars.sub('-', name)
+            result[name] = (name, version)
+
+    return result
 
 
 def installed(prefix):
     """Get a dict of package names to (name, version) tuples."""
     if not os.path.isdir(prefix):
         return dict()
+
     try:
-        out = _call_pip(prefix, extra_args=['list']).decode('utf-8')
-        # on Windows, $ in a regex doesn't match \r\n, we need to get rid of \r
-        out = out.replace("\r\n", "\n")
+        _get_pip_command(prefix, extra_args=[])
     except PipNotInstalledError:
-        out = ""  # if pip isn't installed, there are no pip packages
+        return dict()  # if pip isn't installed, there are no pip packages
+
+    # reading the metadata ourselves is much faster than starting up pip
+    result = _installed_from_metadata(prefix)
+    if result is not None:
+        return result
+
+    out = _call_pip(prefix, extra_args=['list']).decode('utf-8')
+    # on Windows, $ in a regex doesn't match \r\n, we need to get rid of \r
+    out = out.replace("\r\n", "\n")
     # the output to parse looks like:
     #   ympy (0.7.6.1)
     #   tables (3.2.2)
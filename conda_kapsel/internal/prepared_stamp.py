@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Remember successful preparations, so an unchanged project can skip prepare entirely.
+
+After ``run`` or ``activate`` prepares a project, we save a stamp
+in the project's ``envs`` directory. It records hashes of the
+project's config files and of the environment variables the
+project uses (not the whole environment, since shells change
+variables like ``SHLVL`` and ``OLDPWD`` all the time), stats of
+the files prepare produced (the conda environment and downloads),
+and the resulting environment and command. The next ``run`` or
+``activate`` with the same inputs can use the stamp without
+loading the project at all.
+
+Projects with services or encrypted variables never get a stamp;
+we can't cheaply tell whether a service is still running, and we
+don't want to write secrets to disk.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+
+from conda_kapsel.conda_meta_file import META_DIRECTORY, possible_meta_file_names
+from conda_kapsel.internal import conda_api
+from conda_kapsel.internal.environ_overlay import EnvironOverlay
+from conda_kapsel.internal import pip_api
+from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+from conda_kapsel.internal.user_cache import file_stat_key, load_keyed_json, save_keyed_json
+from conda_kapsel.local_state_file import possible_local_state_file_names
+from conda_kapsel.project_commands import CommandExecInfo
+from conda_kapsel.project_file import possible_project_file_names
+
+STAMP_DIRECTORY = os.path.join("envs", ".kapsel-prepared")
+
+# bump this if the stamp contents change meaning
+_STAMP_FORMAT = 2
+
+
+class PreparedStamp(object):
+    """The saved outcome of a successful prepare."""
+
+    def __init__(self, environ, command_exec_info):
+        """Construct a PreparedStamp.
+
+        Args:
+            environ (dict): the prepared environment
+            command_exec_info (CommandExecInfo): the prepared command, or None
+        """
+        self.environ = environ
+        self.command_exec_info = command_exec_info
+
+
+def _sha1_of_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def _config_filenames():
+    names = list(possible_project_file_names) + list(possible_local_state_file_names)
+    names.extend([os.path.join(META_DIRECTORY, name) for name in possible_meta_file_names])
+    return names
+
+
+def _stamp_filename(project_dir, request):
+    name = hashlib.sha1(json.dumps(request).encode('utf-8')).hexdigest()
+    return os.path.join(project_dir, STAMP_DIRECTORY, name + ".json")
+
+
+def _input_key(project_dir, request):
+    files = [[name, _sha1_of_file(os.path.join(project_dir, name))] for name in _config_filenames()]
+    return dict(format=_STAMP_FORMAT, directory=os.path.realpath(project_dir), request=request, files=files)
+
+
+def _variables_to_check(project):
+    # the config files decide which requirements there are, and they're
+    # already part of the input key, so we can save this list in the stamp
+    names = set(['PATH'])
+    names.update(conda_api._all_prefix_variables)
+    for requirement in project.requirements:
+        env_var = getattr(requirement, 'env_var', None)
+        if env_var is not None:
+            names.add(env_var)
+    return sorted(names)
+
+
+def _sha1_of_variables(environ, names):
+    values = [[name, environ.get(name)] for name in names]
+    return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+def _paths_to_stat(project, result):
+    from conda_kapsel.plugins.requirements.download import DownloadRequirement
+
+    # the project directory changes when notebooks are added or removed,
+    # which can change the default command
+    paths = [project.directory_path]
+    prefix = conda_api.environ_get_prefix(result.environ)
+    if prefix is not None:
+        paths.append(os.path.join(prefix, 'conda-meta'))
+        paths.extend(pip_api.site_packages_dirs(prefix))
+    for requirement in project.requirements:
+        if isinstance(requirement, DownloadRequirement) and requirement.env_var in result.environ:
+            paths.append(result.environ[requirement.env_var])
+    return paths
+
+
+def _can_stamp(project):
+    from conda_kapsel.plugins.requirement import EnvVarRequirement
+    from conda_kapsel.plugins.requirements.service import ServiceRequirement
+
+    for requirement in project.requirements:
+        if isinstance(requirement, ServiceRequirement):
+            return False
+        if isinstance(requirement, EnvVarRequirement) and requirement.encrypted:
+            return False
+    return True
+
+
+def save_prepared_stamp(project, result, request, environ=None):
+    """Save a stamp for a successful prepare, so ``load_prepared_stamp()`` can reuse it.
+
+    Failed results, and projects which can't be stamped, are
+    ignored. Failure to write the stamp is silently ignored.
+
+    Args:
+        project (Project): the project we prepared
+        result (PrepareResult): the result of preparing it
+        request (list): JSON-compatible description of what we asked prepare for (mode, command, ...)
+        environ (dict): the environment we started from, None for os.environ
+
+    Returns:
+        None
+    """
+    if environ is None:
+        environ = os.environ
+    if result.failed or not _can_stamp(project):
+        return
+
+    filename = _stamp_filename(project.directory_path, request)
+    # create the directory before we stat anything, since it may modify the stats
+    try:
+        makedirs_ok_if_exists(os.path.dirname(filename))
+    except (IOError, OSError):
+        return
+
+    # we only store what prepare changed, not the whole starting environment
+    changed = dict((key, value) for (key, value) in result.environ.items() if environ.get(key) != value)
+    removed = sorted([key for key in environ if key not in result.environ])
+
+    exec_info = result.command_exec_info
+    if exec_info is None:
+        command = None
+    else:
+        command = dict(cwd=exec_info.cwd,
+                       args=exec_info.args,
+                       shell=exec_info.shell,
+                       notebook=exec_info.notebook,
+                       bokeh_app=exec_info.bokeh_app)
+
+    variables = _variables_to_check(project)
+    value = dict(stats=[file_stat_key(path) for path in _paths_to_stat(project, result)],
+                 variables=variables,
+                 variables_sha1=_sha1_of_variables(environ, variables),
+                 changed=changed,
+                 removed=removed,
+                 command=command)
+    save_keyed_json(filename, _input_key(project.directory_path, request), value)
+
+
+def load_prepared_stamp(project_dir, request, environ=None):
+    """Load the stamp saved by ``save_prepared_stamp()``, if nothing it depends on has changed.
+
+    This reads the project's config files and stats a few others,
+    but doesn't load the project.
+
+    Args:
+        project_dir (str): the project directory
+        request (list): must be the same as the request passed to ``save_prepared_stamp()``
+        environ (dict): the environment we're starting from, None for os.environ
+
+    Returns:
+        a ``PreparedStamp``, or None if we have to prepare again
+    """
+    if environ is None:
+        environ = os.environ
+
+    saved = load_keyed_json(_stamp_filename(project_dir, request), _input_key(project_dir, request))
+    if saved is None:
+        return None
+
+    try:
+        if _sha1_of_variables(environ, saved['variables']) != saved['variables_sha1']:
+            return None
+
+        for stat_key in saved['stats']:
+            if file_stat_key(stat_key[0]) != stat_key:
+                return None
+
+        prepared_environ = EnvironOverlay(environ)
+        for key in saved['removed']:
+            prepared_environ.pop(key, None)
+        prepared_environ.update(saved['changed'])
+
+        command = saved['command']
+        if command is None:
+            exec_info = None
+        else:
+            exec_info = CommandExecInfo(cwd=command['cwd'],
+                                        args=command['args'],
+                                        shell=command['shell'],
+                                        env=prepared_environ,
+                                        notebook=command['notebook'],
+                                        bokeh_app=command['bokeh_app'])
+    except (KeyError, IndexError, TypeError):
+        # the stamp file was damaged somehow
+        return None
+
+    return PreparedStamp(environ=prepared_environ, command_exec_info=exec_info)
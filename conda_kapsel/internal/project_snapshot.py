@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Save what we learned from a project's config files, so loading it again can skip parsing them.
+
+Parsing ``kapsel.yml`` with ruamel.yaml's round-trip loader is
+the slowest part of loading a project. Once a project has been
+loaded without problems, we save its requirements, environment
+specs, and commands as JSON in the user cache directory, keyed on
+the size, modification time, and content hash of each config
+file. The next load of the same files uses the saved copy, and the
+YAML is only parsed if someone edits the project.
+
+Projects with problems are never saved; problems can carry fix
+functions, and a broken project is about to be edited anyway.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+
+from conda_kapsel.env_spec import EnvSpec, lock_file_path
+from conda_kapsel.internal.user_cache import load_keyed_json, save_keyed_json, user_cache_directory
+from conda_kapsel.plugins.registry import PluginRegistry
+from conda_kapsel.plugins.requirement import EnvVarRequirement
+from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
+from conda_kapsel.plugins.requirements.download import DownloadRequirement
+from conda_kapsel.plugins.requirements.redis import RedisRequirement
+
+# bump this if the snapshot contents change meaning
+_SNAPSHOT_FORMAT = 1
+
+
+def _snapshot_filename(directory_path):
+    name = hashlib.sha1(directory_path.encode('utf-8')).hexdigest()
+    return os.path.join(user_cache_directory(), "projects", name + ".json")
+
+
+def snapshot_key(directory_path, project_file, conda_meta_file):
+    """Get the key for a snapshot of the project as loaded from these files, or None if it can't have one."""
+    if project_file.content_key is None or conda_meta_file.content_key is None:
+        return None
+    return dict(format=_SNAPSHOT_FORMAT,
+                directory=directory_path,
+                project_file=project_file.content_key,
+                conda_meta_file=conda_meta_file.content_key)
+
+
+def can_snapshot(registry):
+    """Get whether we know how to re-create the requirements made by this registry."""
+    # a custom registry could make requirements we don't know about
+    return type(registry) is PluginRegistry
+
+
+def _requirement_to_json(requirement):
+    klass = type(requirement)
+    if klass is CondaEnvRequirement:
+        return dict(kind='conda_env')
+    elif klass is DownloadRequirement:
+        return dict(kind='download',
+                    env_var=requirement.env_var,
+                    url=requirement.url,
+                    filename=requirement.filename,
+                    hash_algorithm=requirement.hash_algorithm,
+                    hash_value=requirement.hash_value,
+                    unzip=requirement.unzip,
+                    description=requirement.options.get('description', None))
+    elif klass is RedisRequirement:
+        return dict(kind='service',
+                    service_type=requirement.service_type,
+                    env_var=requirement.env_var,
+                    options=requirement.options)
+    elif klass is EnvVarRequirement:
+        return dict(kind='variable', env_var=requirement.env_var, options=requirement.options)
+    else:
+        return None
+
+
+def _requirement_from_json(registry, env_specs, as_json):
+    kind = as_json['kind']
+    if kind == 'conda_env':
+        return CondaEnvRequirement(registry=registry, env_specs=env_specs)
+    elif kind == 'download':
+        return DownloadRequirement(registry,
+                                   env_var=as_json['env_var'],
+                                   url=as_json['url'],
+                                   filename=as_json['filename'],
+                                   hash_algorithm=as_json['hash_algorithm'],
+                                   hash_value=as_json['hash_value'],
+                                   unzip=as_json['unzip'],
+                                   description=as_json['description'])
+    elif kind == 'service':
+        return registry.find_requirement_by_service_type(service_type=as_json['service_type'],
+                                                         env_var=as_json['env_var'],
+                                                         options=as_json['options'])
+    else:
+        return registry.find_requirement_by_env_var(as_json['env_var'], options=as_json['options'])
+
+
+def _env_spec_to_json(env_spec):
+    return dict(name=env_spec.name,
+                conda_packages=list(env_spec.conda_packages),
+                pip_packages=list(env_spec.pip_packages),
+                channels=list(env_spec.channels),
+                description=env_spec.description)
+
+
+def _env_spec_from_json(directory_path, as_json):
+    return EnvSpec(name=as_json['name'],
+                   conda_packages=as_json['conda_packages'],
+                   pip_packages=as_json['pip_packages'],
+                   channels=as_json['channels'],
+                   description=as_json['description'],
+                   lock_file=lock_file_path(directory_path, as_json['name']))
+
+
+def save_snapshot(directory_path, key, name, description, icon, requirements, env_specs, default_env_spec_name,
+                  commands, app_entry, first_command_name):
+    """Save a snapshot of a project that loaded without problems.
+
+    Nothing is saved if something in the project can't be
+    re-created from JSON exactly.
+
+    Args:
+        directory_path (str): the project directory
+        key (dict): from ``snapshot_key()``
+        name (str): project name
+        description (str): project description
+        icon (str): absolute path to the icon, or None
+        requirements (list of Requirement): the requirements
+        env_specs (dict): env spec names to ``EnvSpec``, in file order
+        default_env_spec_name (str): name of the default env spec
+        commands (list): (name, attributes) for each command in the project file, in file order
+        app_entry (str): the conda meta.yaml app entry, or None
+        first_command_name (str): name of the first command in the project file, or None
+
+    Returns:
+        None
+    """
+    requirements_json = [_requirement_to_json(requirement) for requirement in requirements]
+    if None in requirements_json:
+        return
+    value = dict(name=name,
+                 description=description,
+                 icon=icon,
+                 requirements=requirements_json,
+                 env_specs=[_env_spec_to_json(env_spec) for env_spec in env_specs.values()],
+                 default_env_spec_name=default_env_spec_name,
+                 commands=[[command_name, attributes] for (command_name, attributes) in commands],
+                 app_entry=app_entry,
+                 first_command_name=first_command_name)
+
+    # YAML can hold things JSON can't, such as dates and non-string
+    # keys; a project using them just doesn't get a snapshot.
+    try:
+        if json.loads(json.dumps(value)) != value:
+            return
+    except (TypeError, ValueError):
+        return
+
+    save_keyed_json(_snapshot_filename(directory_path), key, value)
+
+
+class ProjectSnapshot(object):
+    """What a project's config files said, as re-created from a saved snapshot."""
+
+    def __init__(self, name, description, icon, requirements, env_specs, default_env_spec_name, commands, app_entry,
+                 first_command_name):
+        """Construct a ProjectSnapshot (see ``save_snapshot()`` for the fields)."""
+        self.name = name
+        self.description = description
+        self.icon = icon
+        self.requirements = requirements
+        self.env_specs = env_specs
+        self.default_env_spec_name = default_env_spec_name
+        self.commands = commands
+        self.app_entry = app_entry
+        self.first_command_name = first_command_name
+
+
+def load_snapshot(directory_path, key, registry):
+    """Load the snapshot saved with the given key, if it's still valid.
+
+    Args:
+        directory_path (str): the project directory
+        key (dict): from ``snapshot_key()``
+        registry (PluginRegistry): registry for the re-created requirements
+
+    Returns:
+        a ``ProjectSnapshot``, or None if there's no valid snapshot
+    """
+    value = load_keyed_json(_snapshot_filename(directory_path), key)
+    if value is None:
+        return None
+
+    # the config files aren't the only things that can make a
+    # project invalid
+    if not os.path.isdir(directory_path):
+        return None
+    if value['icon'] is not None and not os.path.isfile(value['icon']):
+        return None
+
+    try:
+        env_specs = dict()
+        for env_spec_json in value['env_specs']:
+            env_spec = _env_spec_from_json(directory_path, env_spec_json)
+            env_specs[env_spec.name] = env_spec
+        requirements = [_requirement_from_json(registry, env_specs, as_json) for as_json in value['requirements']]
+        if None in requirements:
+            return None
+        return ProjectSnapshot(name=value['name'],
+                               description=value['description'],
+                               icon=value['icon'],
+                               requirements=requirements,
+                               env_specs=env_specs,
+                               default_env_spec_name=value['default_env_spec_name'],
+                               commands=[(command_name, attributes)
+                                         for (command_name, attributes) in value['commands']],
+                               app_entry=value['app_entry'],
+                               first_command_name=value['first_command_name'])
+    except (KeyError, TypeError, ValueError):
+        # a snapshot from a buggy or different version of us
+        return None
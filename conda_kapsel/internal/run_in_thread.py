@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Run blocking code on a thread, so a coroutine can wait for it without blocking the IOLoop."""
+from __future__ import absolute_import
+
+import threading
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from conda_kapsel.internal import trace
+
+
+def run_in_thread(function, *args, **kwargs):
+    """Call ``function(*args, **kwargs)`` on a new thread.
+
+    Must be called from code running on an IOLoop; the returned
+    future is resolved on that IOLoop. Spans recorded by the
+    function go wherever the caller's spans would go (see
+    ``trace.bind()``).
+
+    Returns:
+        a tornado ``Future`` with the function's return value or exception
+    """
+    io_loop = IOLoop.current()
+    future = Future()
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(e):
+        if not future.done():
+            future.set_exception(e)
+
+    def run():
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            io_loop.add_callback(set_exception, e)
+        else:
+            io_loop.add_callback(set_result, result)
+
+    thread = threading.Thread(target=trace.bind(run))
+    thread.daemon = True
+    thread.start()
+    return future
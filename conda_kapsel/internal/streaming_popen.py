@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Run a child process, streaming its output line by line."""
+from __future__ import absolute_import
+
+import os
+import subprocess
+import threading
+import time
+
+from conda_kapsel.internal import trace
+
+# how long a cancelled or timed-out process gets to exit before we kill it
+_TERMINATE_GRACE_SECONDS = 5.0
+
+# how often we look at the timeout and cancel flag while waiting
+_POLL_SECONDS = 0.1
+
+# how long we wait for the rest of the output once the process has exited
+_OUTPUT_GRACE_SECONDS = 2.0
+
+
+class PopenResult(object):
+    """What happened when we ran a child process."""
+
+    def __init__(self, args, returncode, stdout, stderr, wall_time, timed_out=False, cancelled=False):
+        """Create a result.
+
+        Args:
+            args (list of str): the command line
+            returncode (int): exit code of the process
+            stdout (bytes): everything written to stdout
+            stderr (bytes): everything written to stderr
+            wall_time (float): seconds from starting the process until it exited
+            timed_out (bool): True if we stopped the process because it took too long
+            cancelled (bool): True if we stopped the process because we were asked to
+        """
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_time = wall_time
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+
+class OutputSink(object):
+    """Receives the output of every child process run by ``popen_and_stream``.
+
+    Subclass and override the methods you care about, then pass an
+    instance to ``add_sink``. Methods are called from the threads
+    reading the child's output, so they must be thread-safe.
+    """
+
+    def on_line(self, args, stream_name, line):
+        """Called with each line of output (without the newline); stream_name is 'stdout' or 'stderr'."""
+        pass
+
+    def on_finished(self, result):
+        """Called with a ``PopenResult`` after each process exits."""
+        pass
+
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+_running = set()
+_running_lock = threading.Lock()
+
+
+def add_sink(sink):
+    """Start sending the output of every child process to an ``OutputSink``."""
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    """Stop sending output to an ``OutputSink``."""
+    with _sinks_lock:
+        _sinks.remove(sink)
+
+
+def _current_sinks():
+    with _sinks_lock:
+        return list(_sinks)
+
+
+def cancel_all(signum=None, wait=False):
+    """Cancel every child process we're running, by sending it a signal.
+
+    Each cancelled ``popen_and_stream`` call returns a result with
+    ``cancelled`` set. The default signal is SIGTERM (on Windows,
+    the process is terminated). If ``wait`` is True, we stop the
+    processes ourselves before returning rather than leaving it to
+    the threads running them, which a signal handler about to exit
+    the program can't rely on.
+    """
+    with _running_lock:
+        running = list(_running)
+    for run in running:
+        run.cancel(signum)
+    if wait:
+        for run in running:
+            run.stop(signum)
+
+
+def callback_kwargs(stdout_callback=None, stderr_callback=None):
+    """Get keyword args passing on only the output callbacks which were given.
+
+    Lets a caller forward optional callbacks to a function without
+    requiring it to accept them when they aren't used.
+    """
+    kwargs = dict()
+    if stdout_callback is not None:
+        kwargs['stdout_callback'] = stdout_callback
+    if stderr_callback is not None:
+        kwargs['stderr_callback'] = stderr_callback
+    return kwargs
+
+
+def timeout_from_environ(name):
+    """Get a timeout in seconds from an environment variable, or None if unset, invalid, or not positive."""
+    try:
+        timeout = float(os.environ.get(name, ''))
+    except ValueError:
+        return None
+    if timeout > 0:
+        return timeout
+    else:
+        return None
+
+
+def _decode(line):
+    return line.decode('utf-8', 'replace').rstrip("\r\n")
+
+
+class _Run(object):
+    def __init__(self, process):
+        self.process = process
+        self.cancelled = threading.Event()
+        self.signum = None
+
+    def cancel(self, signum=None):
+        self.signum = signum
+        self.cancelled.set()
+
+    def stop(self, signum=None):
+        try:
+            if signum is None or os.name == 'nt':
+                self.process.terminate()
+            else:
+                self.process.send_signal(signum)
+        except OSError:
+            # already exited
+            pass
+        deadline = time.time() + _TERMINATE_GRACE_SECONDS
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(_POLL_SECONDS)
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+
+
+def _reader(args, pipe, stream_name, chunks, callback, sinks):
+    try:
+        for line in iter(pipe.readline, b''):
+            chunks.append(line)
+            if callback is not None or len(sinks) > 0:
+                text = _decode(line)
+                if callback is not None:
+                    callback(text)
+                for sink in sinks:
+                    sink.on_line(args, stream_name, text)
+    finally:
+        pipe.close()
+
+
+def popen_and_stream(args, stdout_callback=None, stderr_callback=None, timeout=None, cancel_event=None):
+    """Run a process to completion, passing each line of its output to callbacks as it arrives.
+
+    Raises ``OSError`` if the process can't be started. A process
+    which runs longer than ``timeout`` seconds, or which is still
+    running when ``cancel_event`` is set or ``cancel_all`` is called,
+    is sent a signal and then killed if it doesn't exit.
+
+    Args:
+        args (list of str): the command line
+        stdout_callback (function): called with each line of stdout, without the newline
+        stderr_callback (function): called with each line of stderr, without the newline
+        timeout (float): seconds to let the process run, None for no limit
+        cancel_event (threading.Event): set this to stop the process
+
+    Returns:
+        a ``PopenResult``
+    """
+    # name the span like "conda install" so runs of the same tool add up in the summary
+    name = " ".join([os.path.basename(args[0])] + list(args[1:2]))
+    with trace.span(name, 'subprocess', args=list(args)):
+        return _popen_and_stream(args, stdout_callback, stderr_callback, timeout, cancel_event)
+
+
+def _popen_and_stream(args, stdout_callback, stderr_callback, timeout, cancel_event):
+    sinks = _current_sinks()
+    start = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    run = _Run(process)
+    with _running_lock:
+        _running.add(run)
+
+    stdout_chunks = []
+    stderr_chunks = []
+    readers = [threading.Thread(target=_reader,
+                                args=(args, process.stdout, 'stdout', stdout_chunks, stdout_callback, sinks)),
+               threading.Thread(target=_reader,
+                                args=(args, process.stderr, 'stderr', stderr_chunks, stderr_callback, sinks))]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    timed_out = False
+    cancelled = False
+    exited_at = None
+    try:
+        while process.poll() is None or any(reader.is_alive() for reader in readers):
+            if cancel_event is not None and cancel_event.is_set():
+                run.cancel()
+            if process.poll() is None:
+                if run.cancelled.is_set():
+                    cancelled = True
+                    run.stop(run.signum)
+                elif timeout is not None and (time.time() - start) > timeout:
+                    timed_out = True
+                    run.stop()
+            else:
+                # A grandchild which inherited stdout or stderr (conda
+                # and pip both start helpers) can keep our readers going
+                # long after the process exits, so we only wait a little
+                # for the rest of the output. The readers are daemon
+                # threads and are left to finish on their own.
+                now = time.time()
+                if exited_at is None:
+                    exited_at = now
+                    # cancel_all(wait=True) may have stopped it before we looked
+                    cancelled = cancelled or run.cancelled.is_set()
+                if (now - exited_at) > _OUTPUT_GRACE_SECONDS or run.cancelled.is_set() or \
+                   (timeout is not None and (now - start) > timeout):
+                    break
+            # joining the reader returns as soon as the output is done
+            for reader in readers:
+                if reader.is_alive():
+                    reader.join(_POLL_SECONDS)
+                    break
+            else:
+                time.sleep(_POLL_SECONDS / 10)
+    except BaseException:
+        # KeyboardInterrupt most likely; don't leave the child behind
+        run.stop()
+        raise
+    finally:
+        with _running_lock:
+            _running.discard(run)
+
+    result = PopenResult(args=args,
+                         returncode=process.returncode,
+                         stdout=b''.join(list(stdout_chunks)),
+                         stderr=b''.join(list(stderr_chunks)),
+                         wall_time=(time.time() - start),
+                         timed_out=timed_out,
+                         cancelled=cancelled)
+    for sink in sinks:
+        sink.on_finished(result)
+    return result
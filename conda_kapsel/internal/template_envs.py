@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""A per-user store of template environments that new project environments are cloned from."""
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from conda_kapsel.internal import conda_api
+from conda_kapsel.internal.file_lock import locked_file
+from conda_kapsel.internal.streaming_popen import callback_kwargs
+from conda_kapsel.internal.user_cache import load_keyed_json, save_keyed_json, user_cache_directory
+
+# The template store is off unless this is set to how big it may
+# get. It only pays off when many environments share packages: the
+# first environment with a given set of packages costs a create of
+# the template plus a clone of it.
+TEMPLATE_ENVS_MAX_MB_VARIABLE = 'CONDA_KAPSEL_TEMPLATE_ENVS_MAX_MB'
+_DEFAULT_MAX_MB = 0
+
+# One lock per template key, so that several environments being
+# created at once with the same packages wait for one template
+# instead of racing to create it, and eviction skips templates in
+# use. The store is shared by all of the user's processes, so each
+# template is also guarded by a locked_file() on its prefix.
+_key_locks = dict()
+_key_locks_lock = threading.Lock()
+
+
+def _lock_for_key(key):
+    with _key_locks_lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _key_locks[key] = lock
+        return lock
+
+
+def _normalize_spec(spec):
+    parsed = conda_api.parse_spec(spec)
+    if parsed is None:
+        return spec.strip()
+    elif parsed.conda_constraint is not None:
+        return parsed.name + parsed.conda_constraint.replace(' ', '')
+    elif parsed.pip_constraint is not None:
+        return parsed.name + " " + parsed.pip_constraint
+    else:
+        return parsed.name
+
+
+def template_key(packages, channels):
+    """Get the name of the template for a list of conda package specs and channels.
+
+    Package order and spacing don't matter, but channel order does,
+    since it decides which channel a package comes from.
+    """
+    normalized = sorted(set(_normalize_spec(spec) for spec in packages))
+    content = json.dumps(dict(packages=normalized, channels=list(channels)))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _disk_usage(path):
+    # count each inode once, since templates are mostly hardlinks
+    # into the conda package cache.
+    seen = set()
+    total = 0
+    for (root, dirs, files) in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            inode = (st.st_dev, st.st_ino)
+            if inode not in seen:
+                seen.add(inode)
+                total += st.st_size
+    return total
+
+
+class TemplateEnvStore(object):
+    """Template environments keyed by ``template_key()``, evicted least-recently-used first.
+
+    Each template is an ordinary conda environment named after its
+    key. Next to it is a ``<key>.json`` file, written only once the
+    template is complete, whose mtime records when the template was
+    last cloned.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """Create a store in the given directory holding at most max_bytes of templates."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def for_current_user(cls):
+        """Get the store in the user cache directory, or None if it hasn't been turned on."""
+        try:
+            max_mb = int(os.environ.get(TEMPLATE_ENVS_MAX_MB_VARIABLE, _DEFAULT_MAX_MB))
+        except ValueError:
+            max_mb = _DEFAULT_MAX_MB
+        if max_mb <= 0:
+            return None
+        return cls(os.path.join(user_cache_directory(), 'template-envs'), max_mb * 1024 * 1024)
+
+    def _template_prefix(self, key):
+        return os.path.join(self.directory, key)
+
+    def _metadata_filename(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _load_metadata(self, key):
+        metadata = load_keyed_json(self._metadata_filename(key), key)
+        if metadata is None or not os.path.isdir(os.path.join(self._template_prefix(key), 'conda-meta')):
+            return None
+        return metadata
+
+    def _remove_template(self, key):
+        # remove the metadata first so a half-deleted template is never used
+        try:
+            os.remove(self._metadata_filename(key))
+        except OSError:
+            pass
+        shutil.rmtree(self._template_prefix(key), ignore_errors=True)
+
+    def _create_template(self, key, packages, channels, callbacks):
+        template = self._template_prefix(key)
+        # left over from an interrupted or failed creation
+        self._remove_template(key)
+        try:
+            conda_api.create(prefix=template, pkgs=list(packages), channels=channels, **callbacks)
+        except conda_api.CondaError:
+            shutil.rmtree(template, ignore_errors=True)
+            raise
+        metadata = dict(packages=list(packages), channels=list(channels), size=_disk_usage(template))
+        save_keyed_json(self._metadata_filename(key), key, metadata)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._metadata_filename(key), None)
+        except OSError:
+            pass
+
+    def templates(self):
+        """Get a list of (key, size, last_used) tuples, least-recently-used first."""
+        result = []
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return result
+        for filename in filenames:
+            if not filename.endswith('.json'):
+                continue
+            key = filename[:-5]
+            metadata = self._load_metadata(key)
+            if metadata is None:
+                continue
+            try:
+                last_used = os.path.getmtime(self._metadata_filename(key))
+            except OSError:
+                continue
+            result.append((key, metadata.get('size', 0), last_used))
+        return sorted(result, key=lambda template: template[2])
+
+    def evict(self, keep=None):
+        """Remove least-recently-used templates until the store fits in max_bytes.
+
+        Args:
+            keep (str): key of a template to never remove
+
+        Returns:
+            list of the keys that were removed
+        """
+        templates = self.templates()
+        total = sum(size for (key, size, last_used) in templates)
+        removed = []
+        for (key, size, last_used) in templates:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            lock = _lock_for_key(key)
+            if not lock.acquire(False):
+                # someone is cloning it right now
+                continue
+            try:
+                with locked_file(self._template_prefix(key), wait=False) as locked:
+                    if not locked:
+                        # another process is cloning it right now
+                        continue
+                    self._remove_template(key)
+            finally:
+                lock.release()
+            removed.append(key)
+            total -= size
+        return removed
+
+    def clone_into(self, prefix, packages, channels, stdout_callback=None, stderr_callback=None):
+        """Create an environment at prefix by cloning the template for packages and channels.
+
+        The template is created first if it doesn't exist yet, so
+        only the first environment with a given set of packages
+        costs a solve and download.
+
+        Raises ``CondaError`` if the template can't be created.
+        The callbacks, if given, get each line of output from conda.
+
+        Returns:
+            True if prefix was cloned, False if cloning failed and
+            the caller should create the environment some other way.
+        """
+        key = template_key(packages, channels)
+        callbacks = callback_kwargs(stdout_callback, stderr_callback)
+        with _lock_for_key(key), locked_file(self._template_prefix(key)):
+            if self._load_metadata(key) is None:
+                self._create_template(key, packages, channels, callbacks)
+                self.evict(keep=key)
+            else:
+                self._touch(key)
+
+            try:
+                conda_api.clone(source_prefix=self._template_prefix(key), prefix=prefix, **callbacks)
+            except conda_api.CondaEnvExistsError:
+                raise
+            except conda_api.CondaError:
+                # the template may have been damaged, so build it again next time
+                shutil.rmtree(prefix, ignore_errors=True)
+                self._remove_template(key)
+                return False
+            return True
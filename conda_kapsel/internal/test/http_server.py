@@ -50,6 +50,12 @@ class _DownloadView(RequestHandler):
 
         self.finish()
 
+    def head(self, *args, **kwargs):
+        self.set_status(200)
+        self.set_header('Content-Length', self.get_argument("length"))
+        self.set_header('Accept-Ranges', 'bytes')
+        self.finish()
+
 
 class _ErrorView(RequestHandler):
     def __init__(self, application, *args, **kwargs):
@@ -210,8 +210,47 @@ sys.exit(0)
     with_directory_contents(dict(), do_test)
 
 
+def test_conda_invoke_times_out(monkeypatch):
+    def get_command(extra_args):
+        return tmp_script_commandline("""import time
+time.sleep(60)
+""")
+
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command', get_command)
+        monkeypatch.setenv(conda_api.CONDA_TIMEOUT_VARIABLE, '0.5')
+        with pytest.raises(conda_api.CondaError) as excinfo:
+            conda_api.info()
+        assert 'timed out' in repr(excinfo.value)
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_conda_create_streams_output_to_callbacks(monkeypatch):
+    def get_command(extra_args):
+        return tmp_script_commandline("""from __future__ import print_function
+import sys
+print("Fetching packages")
+print("Linking packages")
+print("warning", file=sys.stderr)
+""")
+
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command', get_command)
+        stdout_lines = []
+        stderr_lines = []
+        conda_api.create(prefix=os.path.join(dirname, 'myenv'),
+                         pkgs=['python'],
+                         stdout_callback=stdout_lines.append,
+                         stderr_callback=stderr_lines.append)
+        assert ['Fetching packages', 'Linking packages'] == stdout_lines
+        assert ['warning'] == stderr_lines
+
+    with_directory_contents(dict(), do_test)
+
+
 def test_conda_create_gets_channels(monkeypatch):
-    def mock_call_conda(extra_args):
+    def mock_call_conda(extra_args, stdout_callback=None, stderr_callback=None):
         assert ['create', '--yes', '--quiet', '--prefix', '/prefix', '--channel', 'foo', 'python'] == extra_args
 
     monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
@@ -219,13 +258,29 @@ def test_conda_create_gets_channels(monkeypatch):
 
 
 def test_conda_install_gets_channels(monkeypatch):
-    def mock_call_conda(extra_args):
+    def mock_call_conda(extra_args, stdout_callback=None, stderr_callback=None):
         assert ['install', '--yes', '--quiet', '--prefix', '/prefix', '--channel', 'foo', 'python'] == extra_args
 
     monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
     conda_api.install(prefix='/prefix', pkgs=['python'], channels=['foo'])
 
 
+def test_conda_clone(monkeypatch):
+    def mock_call_conda(extra_args, stdout_callback=None, stderr_callback=None):
+        assert ['create', '--yes', '--quiet', '--offline', '--prefix', '/prefix', '--clone', '/template'] == extra_args
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+    conda_api.clone(source_prefix='/template', prefix='/prefix')
+
+
+def test_conda_clone_over_existing():
+    def do_test(dirname):
+        with pytest.raises(conda_api.CondaEnvExistsError):
+            conda_api.clone(source_prefix='/template', prefix=dirname)
+
+    with_directory_contents(dict(), do_test)
+
+
 def test_resolve_root_prefix():
     prefix = conda_api.resolve_env_to_prefix('root')
     assert prefix is not None
@@ -582,3 +637,116 @@ def test_environ_set_prefix_to_root():
     conda_api.environ_set_prefix(environ, prefix, varname='CONDA_PREFIX')
     assert environ['CONDA_PREFIX'] == prefix
     assert environ['CONDA_DEFAULT_ENV'] == 'root'
+
+
+def test_cached_info_saves_and_reuses_result(monkeypatch):
+    def do_test(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', dirname)
+
+        calls = []
+
+        def mock_call_and_parse_json(extra_args):
+            calls.append(extra_args)
+            return {'root_prefix': '/foo', 'envs_dirs': ['/foo/envs'], 'envs': []}
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._call_and_parse_json', mock_call_and_parse_json)
+
+        first = conda_api.cached_info()
+        assert first['root_prefix'] == '/foo'
+        assert len(calls) == 1
+        assert os.path.isfile(os.path.join(dirname, 'conda-info.json'))
+
+        second = conda_api.cached_info()
+        assert second == first
+        assert len(calls) == 1
+
+        # changing the conda configuration invalidates the cache
+        condarc = os.path.join(dirname, 'condarc')
+        with open(condarc, 'w') as f:
+            f.write("channels: []\n")
+        monkeypatch.setenv('CONDARC', condarc)
+        conda_api.cached_info()
+        assert len(calls) == 2
+        conda_api.cached_info()
+        assert len(calls) == 2
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_cached_info_remembers_result_in_process(monkeypatch):
+    def do_test(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', dirname)
+
+        def mock_call_and_parse_json(extra_args):
+            return {'root_prefix': '/foo', 'envs_dirs': ['/foo/envs'], 'envs': []}
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._call_and_parse_json', mock_call_and_parse_json)
+
+        first = conda_api.cached_info()
+
+        def mock_load_cached_json(name, key):
+            raise AssertionError("should not have re-read the cache file")
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.load_cached_json', mock_load_cached_json)
+        assert conda_api.cached_info() == first
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_cached_info_does_not_cache_when_conda_not_found(monkeypatch):
+    def do_test(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', dirname)
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command',
+                            lambda extra_args: ['this-is-not-a-conda'] + extra_args)
+
+        def mock_call_and_parse_json(extra_args):
+            return {'root_prefix': '/foo'}
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._call_and_parse_json', mock_call_and_parse_json)
+
+        assert conda_api.cached_info()['root_prefix'] == '/foo'
+        assert not os.path.exists(os.path.join(dirname, 'conda-info.json'))
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_resolve_named_env_refreshes_stale_cached_info(monkeypatch):
+    def mock_cached_info():
+        return {'root_prefix': '/foo', 'envs': []}
+
+    def mock_info():
+        return {'root_prefix': '/foo', 'envs': ['/foo/envs/bar']}
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.cached_info', mock_cached_info)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.info', mock_info)
+    assert "/foo/envs/bar" == conda_api.resolve_env_to_prefix('bar')
+    assert "/foo" == conda_api.resolve_env_to_prefix('root')
+
+
+def test_conda_create_explicit(monkeypatch):
+    def mock_call_conda(extra_args, stdout_callback=None, stderr_callback=None):
+        assert ['create', '--yes', '--quiet', '--prefix', '/prefix', '--file', '/kapsel-default.lock'] == extra_args
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+    conda_api.create_explicit(prefix='/prefix', filename='/kapsel-default.lock')
+
+
+def test_conda_create_explicit_over_existing():
+    def do_test(dirname):
+        with pytest.raises(conda_api.CondaEnvExistsError):
+            conda_api.create_explicit(prefix=dirname, filename='/kapsel-default.lock')
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_conda_install_explicit(monkeypatch):
+    def mock_call_conda(extra_args, stdout_callback=None, stderr_callback=None):
+        assert ['install', '--yes', '--quiet', '--prefix', '/prefix', '--file', '/explicit.txt'] == extra_args
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+    conda_api.install_explicit(prefix='/prefix', filename='/explicit.txt')
+
+
+def test_current_platform(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.cached_info', lambda: dict(platform='win-32'))
+    assert 'win-32' == conda_api.current_platform()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import codecs
+import json
+import os
+import pytest
+
+from conda_kapsel.env_spec import EnvSpec
+from conda_kapsel.internal import conda_api
+from conda_kapsel.internal.conda_lockfile import (CondaLockfile, dist_name_from_url, load_lockfile, lockfile_for_prefix,
+                                                  save_explicit_file, save_lockfile)
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+_spec = EnvSpec(name='default', conda_packages=['numpy=1.11'], channels=['foo'], pip_packages=['Flake8'])
+
+
+def _meta(url, md5=None):
+    record = dict(url=url)
+    if md5 is not None:
+        record['md5'] = md5
+    return json.dumps(record)
+
+
+def test_dist_name_from_url():
+    assert 'numpy-1.11.1-py35_0' == dist_name_from_url('https://example.com/linux-64/numpy-1.11.1-py35_0.tar.bz2#abc')
+    assert 'numpy-1.11.1-py35_0' == dist_name_from_url('https://example.com/linux-64/numpy-1.11.1-py35_0.conda')
+    assert 'numpy-1.11.1-py35_0' == dist_name_from_url('numpy-1.11.1-py35_0')
+
+
+def test_lockfile_for_prefix(monkeypatch):
+    def mock_installed(prefix):
+        return dict(flake8=('flake8', '3.0.4'), pep8=('pep8', '1.7.0'))
+
+    monkeypatch.setattr('conda_kapsel.internal.pip_api.installed', mock_installed)
+
+    def check(dirname):
+        lockfile = lockfile_for_prefix(dirname, _spec, 'linux-64')
+        assert 'default' == lockfile.spec_name
+        assert 'linux-64' == lockfile.platform
+        assert ['http://example.com/numpy-1.11.1-py35_0.tar.bz2#1234',
+                'http://example.com/python-3.5.2-0.tar.bz2'] == lockfile.urls
+        assert ['Flake8==3.0.4'] == lockfile.pip_pins
+        assert 'Flake8==3.0.4' == lockfile.pip_pin('flake8')
+        assert lockfile.pip_pin('pep8') is None
+        assert lockfile.is_current(_spec, 'linux-64')
+        assert not lockfile.is_current(_spec, 'osx-64')
+        assert not lockfile.is_current(EnvSpec(name='default', conda_packages=['numpy'], channels=['foo']), 'linux-64')
+        assert set(['numpy-1.11.1-py35_0', 'python-3.5.2-0']) == set(lockfile.dists.keys())
+
+    with_directory_contents(
+        {
+            'conda-meta/numpy-1.11.1-py35_0.json': _meta('http://example.com/numpy-1.11.1-py35_0.tar.bz2', '1234'),
+            'conda-meta/python-3.5.2-0.json': _meta('http://example.com/python-3.5.2-0.tar.bz2')
+        }, check)
+
+
+def test_lockfile_for_prefix_without_url():
+    def check(dirname):
+        with pytest.raises(conda_api.CondaError) as excinfo:
+            lockfile_for_prefix(dirname, _spec, 'linux-64')
+        assert "numpy-1.11.1-py35_0" in str(excinfo.value)
+
+    with_directory_contents({'conda-meta/numpy-1.11.1-py35_0.json': "{}"}, check)
+
+
+def test_save_and_load_lockfile():
+    def check(dirname):
+        filename = os.path.join(dirname, 'kapsel-default.lock')
+        lockfile = CondaLockfile(spec_name='default',
+                                 spec_content=dict(conda_packages=['numpy=1.11'], channels=['foo'],
+                                                   pip_packages=['Flake8']),
+                                 platform='linux-64',
+                                 urls=['http://example.com/numpy-1.11.1-py35_0.tar.bz2#1234'],
+                                 pip_pins=['Flake8==3.0.4'])
+        save_lockfile(filename, lockfile)
+
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            lines = f.read().splitlines()
+        # conda can read this as an explicit file
+        assert '@EXPLICIT' in lines
+        assert 'http://example.com/numpy-1.11.1-py35_0.tar.bz2#1234' == lines[-1]
+        assert all(line.startswith('#') for line in lines[:lines.index('@EXPLICIT')])
+
+        loaded = load_lockfile(filename)
+        assert 'default' == loaded.spec_name
+        assert lockfile.spec_content == loaded.spec_content
+        assert 'linux-64' == loaded.platform
+        assert lockfile.urls == loaded.urls
+        assert lockfile.pip_pins == loaded.pip_pins
+        assert loaded.is_current(_spec, 'linux-64')
+
+    with_directory_contents(dict(), check)
+
+
+def test_load_missing_or_broken_lockfile():
+    def check(dirname):
+        assert load_lockfile(os.path.join(dirname, 'nope.lock')) is None
+        assert load_lockfile(os.path.join(dirname, 'not-explicit.lock')) is None
+        assert load_lockfile(os.path.join(dirname, 'bad-json.lock')) is None
+
+    with_directory_contents(
+        {
+            'not-explicit.lock': "# spec: {}\n# platform: linux-64\n",
+            'bad-json.lock': "# spec: {\n# platform: linux-64\n@EXPLICIT\n"
+        }, check)
+
+
+def test_save_explicit_file():
+    def check(dirname):
+        filename = os.path.join(dirname, 'explicit.txt')
+        save_explicit_file(filename, ['http://example.com/a-1-0.tar.bz2', 'http://example.com/b-1-0.tar.bz2'])
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            assert "@EXPLICIT\nhttp://example.com/a-1-0.tar.bz2\nhttp://example.com/b-1-0.tar.bz2\n" == f.read()
+
+    with_directory_contents(dict(), check)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+import pytest
+
+from conda_kapsel.internal import conda_api
+from conda_kapsel.internal.conda_spec_matcher import (CondaMetaRecord, CompiledSpec, SpecMatcher, conda_meta_records,
+                                                      version_key)
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def _record(name, version, build='0'):
+    return CondaMetaRecord("/nope/%s-%s-%s.json" % (name, version, build), name, version, build)
+
+
+def test_version_ordering():
+    ordered = ['0.4', '0.4.1.rc', '0.4.1', '0.5a1', '0.5b3', '0.5', '0.9.6', '0.960923', '1.0', '1.1dev1',
+               '1.1a1', '1.1.0dev1', '1.1.a1', '1.1.0rc1', '1.1.0', '1.1.0post1', '1.1.post1', '1996.07.12',
+               '1!0.4.1', '1!3.1.1.6']
+    for (lower, higher) in zip(ordered[:-1], ordered[1:]):
+        assert version_key(lower) <= version_key(higher), "%s should be <= %s" % (lower, higher)
+
+    assert version_key('1.10') > version_key('1.9')
+    assert version_key('1.1') == version_key('1.1.0')
+    assert version_key('1.1.0dev1') == version_key('1.1.dev1')
+    assert version_key('1.1a') < version_key('1.1')
+    assert version_key('1.0+abc') > version_key('1.0')
+    assert version_key('1.0') != version_key('1.0.1')
+
+
+@pytest.mark.parametrize("spec,version,build,expected", [
+    ('numpy', '1.11.1', 'py35_0', True),
+    ('numpy=1.11', '1.11.1', 'py35_0', True),
+    ('numpy=1.11', '1.11', 'py35_0', True),
+    ('numpy=1.11', '1.1', 'py35_0', False),
+    ('numpy=1.1', '1.11.1', 'py35_0', False),
+    ('numpy=1.11*', '1.11.1', 'py35_0', True),
+    ('numpy=1.11.*', '1.12.0', 'py35_0', False),
+    ('numpy=1.11.1=py35_0', '1.11.1', 'py35_0', True),
+    ('numpy=1.11.1=py27_0', '1.11.1', 'py35_0', False),
+    ('numpy=1.11=py35*', '1.11.1', 'py35_2', True),
+    ('numpy==1.11', '1.11.0', 'py35_0', True),
+    ('numpy==1.11', '1.11.1', 'py35_0', False),
+    ('numpy==1.11.*', '1.11.1', 'py35_0', True),
+    ('numpy>=1.11', '1.11.0', 'py35_0', True),
+    ('numpy>=1.11', '1.9.0', 'py35_0', False),
+    ('numpy >=1.9,<1.12', '1.10.4', 'py35_0', True),
+    ('numpy >=1.9,<1.12', '1.12.0', 'py35_0', False),
+    ('numpy<1.10|>1.11', '1.12.0', 'py35_0', True),
+    ('numpy<1.10|>1.11', '1.10.4', 'py35_0', False),
+    ('numpy<=1.10', '1.10.0', 'py35_0', True),
+    ('numpy>1.10', '1.10.0', 'py35_0', False),
+    ('numpy!=1.10.4', '1.10.4', 'py35_0', False),
+    ('numpy!=1.10.4', '1.10.5', 'py35_0', True),
+    ('numpy >=1.0,~=1.10.2', '1.10.4', 'py35_0', True),
+    ('numpy >=1.0,~=1.10.2', '1.11.0', 'py35_0', False),
+    ('numpy >=1.0,~=1.10.2', '1.10.1', 'py35_0', False),
+    ('numpy=1.11|1.12', '1.11.1', 'py35_0', True),
+    ('numpy=1.11|1.12', '1.12.1', 'py35_0', True),
+    ('numpy=1.11|1.12', '1.13.0', 'py35_0', False),
+    ('numpy=1.11|>=1.13', '1.14.0', 'py35_0', True),
+    ('numpy 1.11*', '1.11.1', 'py35_0', True),
+    ('numpy 1.11*', '1.12.0', 'py35_0', False),
+    ('numpy 1.11', '1.11.0', 'py35_0', True),
+    ('numpy 1.11', '1.11.1', 'py35_0', False),
+    ('numpy 1.11.1 py35_0', '1.11.1', 'py35_0', True),
+    ('numpy 1.11.1 py27*', '1.11.1', 'py35_0', False),
+])
+def test_compiled_spec_matches(spec, version, build, expected):
+    assert expected == CompiledSpec(spec).matches(_record('numpy', version, build))
+
+
+def test_compiled_spec_wrong_name():
+    assert not CompiledSpec('numpy').matches(_record('scipy', '1.0'))
+
+
+@pytest.mark.parametrize("spec", ['numpy>=', 'numpy>=1.*.3', 'numpy >=1.0,~=1', '=1.0'])
+def test_compiled_spec_invalid(spec):
+    with pytest.raises(ValueError):
+        CompiledSpec(spec)
+
+
+def test_spec_matcher_check_records():
+    matcher = SpecMatcher(['python=3.5', 'numpy >=1.11', 'numpy<1.12', 'scipy', 'bokeh=0.12', 'weird>=1.*.2'])
+    result = matcher.check_records([_record('python', '3.5.2'), _record('numpy', '1.10.4'), _record('bokeh', '0.11.1'),
+                                    _record('weird', '0.1'), _record('zlib', '1.2.8')])
+    assert not result.ok
+    assert ['scipy'] == result.missing
+    assert ['bokeh', 'numpy'] == result.wrong_version
+    assert ['numpy >=1.11', 'scipy', 'bokeh=0.12'] == result.unsatisfied_specs
+    assert ['bokeh', 'numpy', 'python', 'weird'] == sorted(result.installed.keys())
+
+    ok = matcher.check_records([_record('python', '3.5.2'), _record('numpy', '1.11.1'), _record('bokeh', '0.12.0'),
+                                _record('scipy', '0.18.0'), _record('weird', '3')])
+    assert ok.ok
+    assert [] == ok.unsatisfied_specs
+
+
+def test_spec_matcher_checks_name_of_spec_it_cannot_compile():
+    spec = 'numpy 1.11 py35_0 nonsense'
+    with pytest.raises(ValueError):
+        CompiledSpec(spec)
+
+    matcher = SpecMatcher([spec])
+    assert ['numpy'] == matcher.names
+    assert matcher.check_records([_record('numpy', '1.10.4')]).ok
+    result = matcher.check_records([_record('scipy', '0.18.0')])
+    assert ['numpy'] == result.missing
+    assert [spec] == result.unsatisfied_specs
+
+
+def test_spec_matcher_specs_for():
+    matcher = SpecMatcher(['numpy >=1.11', 'python=3.5', 'numpy<1.12', 'weird>=1.*.2', '='])
+    assert ['numpy >=1.11', 'numpy<1.12', 'weird>=1.*.2'] == matcher.specs_for(['weird', 'numpy', 'scipy'])
+    assert [] == matcher.specs_for([])
+
+
+def test_conda_meta_records_reads_json_lazily():
+    def check(dirname):
+        records = sorted(conda_meta_records(dirname), key=lambda r: r.name)
+        assert ['ipython-notebook', 'numpy'] == [r.name for r in records]
+        assert ('4.0.4', 'py27_0') == (records[0].version, records[0].build)
+        assert records[0]._record is None
+        assert dict() == records[0].record
+        assert dict(url='http://example.com/numpy') == records[1].record
+
+    files = {
+        'conda-meta/numpy-1.11.1-py35_0.json': '{"url": "http://example.com/numpy"}',
+        'conda-meta/ipython-notebook-4.0.4-py27_0.json': "not json",
+        'conda-meta/history': "",
+        'conda-meta/no_version.json': ""
+    }
+    with_directory_contents(files, check)
+
+
+def test_conda_meta_records_no_conda_meta():
+    assert [] == list(conda_meta_records("/this/does/not/exist"))
+
+
+def test_conda_meta_records_cannot_list_dir(monkeypatch):
+    def mock_listdir(dirname):
+        raise OSError("cannot list this")
+
+    monkeypatch.setattr("os.listdir", mock_listdir)
+    with pytest.raises(conda_api.CondaError) as excinfo:
+        SpecMatcher(['numpy']).check_prefix(os.path.join("this", "does", "not", "exist"))
+    assert 'cannot list this' in repr(excinfo.value)
@@ -8,13 +8,15 @@ from __future__ import absolute_import, print_function
 
 import os
 import platform
+import shutil
 import pytest
 
 from conda_kapsel.env_spec import EnvSpec
-from conda_kapsel.conda_manager import CondaManagerError
+from conda_kapsel.conda_manager import CondaEnvironmentDeviations, CondaManagerError, new_conda_manager
 
 from conda_kapsel.internal.default_conda_manager import DefaultCondaManager
 import conda_kapsel.internal.pip_api as pip_api
+import conda_kapsel.internal.conda_api as conda_api
 
 from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
 from conda_kapsel.internal.test.test_conda_api import monkeypatch_conda_not_to_use_links
@@ -88,9 +90,330 @@ def test_conda_create_and_install_and_remove(monkeypatch):
             raise pip_api.PipError("pip fail")
 
         monkeypatch.setattr('conda_kapsel.internal.pip_api._call_pip', mock_call_pip)
+        # make us fall back to running pip to list packages
+        monkeypatch.setattr('conda_kapsel.internal.pip_api._installed_from_metadata', lambda prefix: None)
 
         with pytest.raises(CondaManagerError) as excinfo:
             deviations = manager.find_environment_deviations(envdir, spec)
         assert 'pip failed while listing' in str(excinfo.value)
 
     with_directory_contents(dict(), do_test)
+
+
+def test_fingerprint_skips_checking_unchanged_env(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['python'], channels=[])
+
+    def do_test(dirname):
+        envdir = os.path.join(dirname, 'myenv')
+        manager = DefaultCondaManager()
+
+        deviations = manager.find_environment_deviations(envdir, spec)
+        assert deviations.ok
+
+        # nothing to fix, but we should remember the env is OK
+        manager.fix_environment_deviations(envdir, spec, deviations)
+        assert os.path.isfile(os.path.join(envdir, 'var', 'cache', 'conda-kapsel', 'env-fingerprint.json'))
+
+        def mock_conda_meta_records(prefix):
+            raise AssertionError("should not have listed packages")
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_spec_matcher.conda_meta_records', mock_conda_meta_records)
+        assert manager.find_environment_deviations(envdir, spec).ok
+        manager.fix_environment_deviations(envdir, spec)
+
+        monkeypatch.undo()
+
+        # a different spec doesn't match the fingerprint
+        other_spec = EnvSpec(name='myenv', conda_packages=['python', 'numpy'], channels=[])
+        deviations = manager.find_environment_deviations(envdir, other_spec)
+        assert deviations.missing_packages == ('numpy', )
+
+        # and neither does a changed env
+        os.remove(os.path.join(envdir, 'conda-meta', 'python-3.5.2-0.json'))
+        deviations = manager.find_environment_deviations(envdir, spec)
+        assert deviations.missing_packages == ('python', )
+
+    with_directory_contents({'myenv/conda-meta/python-3.5.2-0.json': ""}, do_test)
+
+
+def test_remove_packages_removes_fingerprint(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['python'], channels=[])
+
+    def do_test(dirname):
+        envdir = os.path.join(dirname, 'myenv')
+        manager = DefaultCondaManager()
+        manager.fix_environment_deviations(envdir, spec)
+        fingerprint = os.path.join(envdir, 'var', 'cache', 'conda-kapsel', 'env-fingerprint.json')
+        assert os.path.isfile(fingerprint)
+
+        def mock_remove(prefix, pkgs):
+            pass
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.remove', mock_remove)
+        manager.remove_packages(envdir, ['python'])
+        assert not os.path.exists(fingerprint)
+
+    with_directory_contents({'myenv/conda-meta/python-3.5.2-0.json': ""}, do_test)
+
+
+def test_output_callbacks_passed_to_conda_and_pip(monkeypatch):
+    def callback(line):
+        pass
+
+    calls = []
+
+    def mock_remove(prefix, pkgs, **kwargs):
+        calls.append(('conda', kwargs))
+
+    def mock_pip_install(prefix, pkgs, **kwargs):
+        calls.append(('pip', kwargs))
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.remove', mock_remove)
+    monkeypatch.setattr('conda_kapsel.internal.pip_api.install', mock_pip_install)
+
+    spec = EnvSpec(name='myenv', conda_packages=['python'], pip_packages=['flake8'], channels=[])
+
+    def do_test(dirname):
+        envdir = os.path.join(dirname, 'myenv')
+        manager = new_conda_manager(stdout_callback=callback)
+        manager.remove_packages(envdir, ['python'])
+        manager.fix_environment_deviations(envdir, spec)
+        assert [('conda', dict(stdout_callback=callback)), ('pip', dict(stdout_callback=callback))] == calls
+
+    with_directory_contents({'myenv/conda-meta/python-3.5.2-0.json': ""}, do_test)
+
+
+def test_wrong_version_deviations_install_only_unsatisfied_specs(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['python=3.5', 'numpy >=1.11', 'bokeh', 'scipy'], channels=['foo'])
+
+    def do_test(dirname):
+        envdir = os.path.join(dirname, 'myenv')
+        manager = DefaultCondaManager()
+
+        deviations = manager.find_environment_deviations(envdir, spec)
+        assert not deviations.ok
+        assert deviations.missing_packages == ('scipy', )
+        assert deviations.wrong_version_packages == ('numpy', )
+
+        installs = []
+
+        def mock_install(prefix, pkgs, channels):
+            installs.append((prefix, pkgs, channels))
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.install', mock_install)
+        manager.fix_environment_deviations(envdir, spec, deviations)
+        assert installs == [(envdir, ['numpy >=1.11', 'scipy'], ('foo', ))]
+
+    with_directory_contents(
+        {
+            'myenv/conda-meta/python-3.5.2-0.json': "",
+            'myenv/conda-meta/numpy-1.10.4-py35_0.json': "",
+            'myenv/conda-meta/bokeh-0.12.0-py35_0.json': ""
+        }, do_test)
+
+
+def test_wrong_version_summary():
+    spec = EnvSpec(name='myenv', conda_packages=['python=3.5', 'numpy=1.11=py35*'], channels=[])
+
+    def do_test(dirname):
+        deviations = DefaultCondaManager().find_environment_deviations(os.path.join(dirname, 'myenv'), spec)
+        expected = "Conda environment has the wrong version of packages: numpy (1.11.1-py27_0 installed)"
+        assert expected == deviations.summary
+        assert deviations.missing_packages == ()
+
+    with_directory_contents(
+        {
+            'myenv/conda-meta/python-3.5.2-0.json': "",
+            'myenv/conda-meta/numpy-1.11.1-py27_0.json': ""
+        }, do_test)
+
+
+def test_new_env_is_cloned_from_template(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['numpy'], channels=['foo'])
+    calls = []
+
+    def mock_create(prefix, pkgs, channels):
+        calls.append(('create', prefix, sorted(pkgs), channels))
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+        for pkg in pkgs:
+            with open(os.path.join(prefix, 'conda-meta', pkg + '-1.0-0.json'), 'w') as f:
+                f.write("{}")
+
+    def mock_clone(source_prefix, prefix):
+        calls.append(('clone', source_prefix, prefix))
+        os.makedirs(prefix)
+        shutil.copytree(os.path.join(source_prefix, 'conda-meta'), os.path.join(prefix, 'conda-meta'))
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.clone', mock_clone)
+
+    def do_test(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, 'cache'))
+        monkeypatch.setenv('CONDA_KAPSEL_TEMPLATE_ENVS_MAX_MB', '1024')
+        manager = DefaultCondaManager()
+        manager.fix_environment_deviations(os.path.join(dirname, 'one'), spec)
+        manager.fix_environment_deviations(os.path.join(dirname, 'two'), spec)
+
+        assert ['create', 'clone', 'clone'] == [call[0] for call in calls]
+        template = calls[0][1]
+        assert template.startswith(os.path.join(dirname, 'cache', 'template-envs'))
+        assert ['numpy', 'python'] == calls[0][2]
+        assert ('foo', ) == calls[0][3]
+        assert ('clone', template, os.path.join(dirname, 'two')) == calls[2]
+        assert manager.find_environment_deviations(os.path.join(dirname, 'two'), spec).ok
+
+        # with the store turned off we create the env directly
+        monkeypatch.setenv('CONDA_KAPSEL_TEMPLATE_ENVS_MAX_MB', '0')
+        manager.fix_environment_deviations(os.path.join(dirname, 'three'), spec)
+        assert ('create', os.path.join(dirname, 'three'), ['numpy', 'python'], ('foo', )) == calls[3]
+
+    with_directory_contents(dict(), do_test)
+
+
+def _save_lockfile_for(spec, filename, urls, pip_pins=()):
+    from conda_kapsel.internal.conda_lockfile import CondaLockfile, save_lockfile
+    lockfile = CondaLockfile(spec_name=spec.name,
+                             spec_content=dict(conda_packages=list(spec.conda_packages),
+                                               channels=list(spec.channels),
+                                               pip_packages=list(spec.pip_packages)),
+                             platform='linux-64',
+                             urls=urls,
+                             pip_pins=pip_pins)
+    save_lockfile(filename, lockfile)
+
+
+def test_new_env_is_created_from_lockfile(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+    calls = []
+
+    def mock_create_explicit(prefix, filename):
+        calls.append(('create_explicit', prefix, filename))
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+
+    def mock_create(prefix, pkgs, channels):
+        raise AssertionError("should not have solved")
+
+    def mock_pip_install(prefix, pkgs):
+        calls.append(('pip', prefix, pkgs))
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create_explicit', mock_create_explicit)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+    monkeypatch.setattr('conda_kapsel.internal.pip_api.install', mock_pip_install)
+
+    def do_test(dirname):
+        lock_file = os.path.join(dirname, 'kapsel-myenv.lock')
+        spec = EnvSpec(name='myenv', conda_packages=['numpy'], channels=[], pip_packages=['flake8'],
+                       lock_file=lock_file)
+        _save_lockfile_for(spec, lock_file, ['http://example.com/numpy-1.11.1-py35_0.tar.bz2'], ['flake8==3.0.4'])
+        envdir = os.path.join(dirname, 'myenv')
+        DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert [('create_explicit', envdir, lock_file), ('pip', envdir, ['flake8==3.0.4'])] == calls
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_existing_env_is_repaired_from_lockfile(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+    installed_urls = []
+
+    def mock_install_explicit(prefix, filename):
+        with open(filename) as f:
+            installed_urls.extend(f.read().splitlines())
+
+    def mock_install(prefix, pkgs, channels):
+        raise AssertionError("should not have solved")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install_explicit', mock_install_explicit)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install', mock_install)
+
+    def do_test(dirname):
+        lock_file = os.path.join(dirname, 'kapsel-myenv.lock')
+        spec = EnvSpec(name='myenv', conda_packages=['numpy', 'python'], channels=[], lock_file=lock_file)
+        _save_lockfile_for(spec, lock_file, ['http://example.com/numpy-1.11.1-py35_0.tar.bz2#123',
+                                             'http://example.com/python-3.5.2-0.tar.bz2'])
+        envdir = os.path.join(dirname, 'myenv')
+        DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert ['@EXPLICIT', 'http://example.com/numpy-1.11.1-py35_0.tar.bz2#123'] == installed_urls
+
+    with_directory_contents({'myenv/conda-meta/python-3.5.2-0.json': ""}, do_test)
+
+
+def test_repair_from_lockfile_fails(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+
+    def mock_install_explicit(prefix, filename):
+        raise conda_api.CondaError("no network")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install_explicit', mock_install_explicit)
+
+    def do_test(dirname):
+        lock_file = os.path.join(dirname, 'kapsel-myenv.lock')
+        spec = EnvSpec(name='myenv', conda_packages=['numpy', 'python'], channels=[], lock_file=lock_file)
+        _save_lockfile_for(spec, lock_file, ['http://example.com/numpy-1.11.1-py35_0.tar.bz2#123',
+                                             'http://example.com/python-3.5.2-0.tar.bz2'])
+        envdir = os.path.join(dirname, 'myenv')
+        with pytest.raises(CondaManagerError) as excinfo:
+            DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert "Failed to install missing packages: numpy: no network" == str(excinfo.value)
+
+    with_directory_contents({'myenv/conda-meta/python-3.5.2-0.json': ""}, do_test)
+
+
+def test_plan_environment_fix_from_lockfile(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+
+    def do_test(dirname):
+        pkgs_dir = os.path.join(dirname, 'pkgs')
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.package_cache_dirs', lambda: [pkgs_dir])
+        lock_file = os.path.join(dirname, 'kapsel-myenv.lock')
+        spec = EnvSpec(name='myenv', conda_packages=['numpy', 'python', 'six'], channels=[], lock_file=lock_file)
+        _save_lockfile_for(spec, lock_file, ['http://example.com/numpy-1.11.1-py35_0.tar.bz2#123',
+                                             'http://example.com/python-3.5.2-0.tar.bz2',
+                                             'http://example.com/six-1.10.0-py35_0.tar.bz2',
+                                             'http://example.com/zlib-1.2.8-3.tar.bz2'])
+        envdir = os.path.join(dirname, 'myenv')
+        manager = DefaultCondaManager()
+        deviations = CondaEnvironmentDeviations(summary="missing",
+                                                missing_packages=('numpy', 'six'),
+                                                wrong_version_packages=(),
+                                                missing_pip_packages=(),
+                                                wrong_version_pip_packages=())
+        plan = manager.plan_environment_fix(envdir, spec, deviations)
+        assert plan.from_lockfile
+        assert ('numpy-1.11.1-py35_0', 'six-1.10.0-py35_0', 'zlib-1.2.8-3') == plan.packages
+        # six is extracted and numpy is only downloaded, but both are in the package cache
+        assert ('http://example.com/zlib-1.2.8-3.tar.bz2',) == plan.urls
+        assert 2 == len(plan.cached_urls)
+
+        os.remove(lock_file)
+        plan = manager.plan_environment_fix(envdir, spec, deviations)
+        assert not plan.from_lockfile
+        assert ('numpy', 'six') == plan.packages
+
+    with_directory_contents({'myenv/conda-meta/python-3.5.2-0.json': "",
+                             'pkgs/six-1.10.0-py35_0/info/index.json': "",
+                             'pkgs/numpy-1.11.1-py35_0.tar.bz2': ""}, do_test)
+
+
+def test_stale_lockfile_is_ignored(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+    installs = []
+
+    def mock_install(prefix, pkgs, channels):
+        installs.append(pkgs)
+
+    def mock_install_explicit(prefix, filename):
+        raise AssertionError("should not have used the lockfile")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install', mock_install)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install_explicit', mock_install_explicit)
+
+    def do_test(dirname):
+        lock_file = os.path.join(dirname, 'kapsel-myenv.lock')
+        old_spec = EnvSpec(name='myenv', conda_packages=['python'], channels=[], lock_file=lock_file)
+        _save_lockfile_for(old_spec, lock_file, ['http://example.com/python-3.5.2-0.tar.bz2'])
+        spec = EnvSpec(name='myenv', conda_packages=['python', 'numpy'], channels=[], lock_file=lock_file)
+        DefaultCondaManager().fix_environment_deviations(os.path.join(dirname, 'myenv'), spec)
+        assert [['numpy']] == installs
+
+    with_directory_contents({'myenv/conda-meta/python-3.5.2-0.json': ""}, do_test)
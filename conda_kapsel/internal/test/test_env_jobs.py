@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+
+from conda_kapsel.conda_manager import CondaManager, CondaManagerError, CondaEnvironmentDeviations
+from conda_kapsel.env_spec import EnvSpec
+from conda_kapsel.internal.env_jobs import run_env_jobs, EnvJobsStatus
+
+
+def _deviations(missing):
+    return CondaEnvironmentDeviations(summary=("missing " + ", ".join(missing)) if missing else "ok",
+                                      missing_packages=tuple(missing),
+                                      wrong_version_packages=(),
+                                      missing_pip_packages=(),
+                                      wrong_version_pip_packages=())
+
+
+class FakeCondaManager(CondaManager):
+    def __init__(self, missing=None, find_errors=(), fix_errors=(), delay=0.0):
+        self.missing = dict(missing or {})
+        self.find_errors = find_errors
+        self.fix_errors = fix_errors
+        self.delay = delay
+        self.fixed = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def find_environment_deviations(self, prefix, spec):
+        if spec.name in self.find_errors:
+            raise CondaManagerError("cannot check " + spec.name)
+        return _deviations(self.missing.get(spec.name, ()))
+
+    def fix_environment_deviations(self, prefix, spec, deviations=None):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if spec.name in self.fix_errors:
+                raise CondaManagerError("cannot fix " + spec.name)
+            with self.lock:
+                self.fixed.append(spec.name)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def remove_packages(self, prefix, packages):
+        pass
+
+
+def _envs(*names):
+    return [(EnvSpec(name=name, conda_packages=['python'], channels=[]), "/envs/" + name) for name in names]
+
+
+def test_run_env_jobs_fixes_in_order():
+    conda = FakeCondaManager(missing=dict(a=['python'], c=['python']))
+    results = run_env_jobs(conda, _envs('a', 'b', 'c'), jobs=3)
+    assert ['a', 'b', 'c'] == [result.env_spec_name for result in results]
+    assert ['/envs/a', '/envs/b', '/envs/c'] == [result.prefix for result in results]
+    assert [True, False, True] == [result.fixed for result in results]
+    assert ['a', 'c'] == sorted(conda.fixed)
+
+    status = EnvJobsStatus(results)
+    assert status
+    assert "Environment specs are ready: a, b, c." == status.status_description
+    assert ["a: missing python (fixed)", "b: ok", "c: missing python (fixed)"] == status.logs
+    assert [] == status.errors
+    assert ('python', ) == status.deviations['a'].missing_packages
+
+
+def test_run_env_jobs_collects_errors():
+    conda = FakeCondaManager(missing=dict(a=['python'], b=['python']), find_errors=('c', ), fix_errors=('b', ))
+    results = run_env_jobs(conda, _envs('a', 'b', 'c', 'd'), jobs=2)
+    assert [True, False, False, True] == [result.ok for result in results]
+    assert ['a'] == conda.fixed
+
+    status = EnvJobsStatus(results)
+    assert not status
+    assert "Failed to prepare environment specs: b, c." == status.status_description
+    assert ["b: cannot fix b", "c: cannot check c"] == status.errors
+    assert status.deviations['c'] is None
+
+
+def test_run_env_jobs_without_fixing():
+    conda = FakeCondaManager(missing=dict(a=['python']))
+    results = run_env_jobs(conda, _envs('a', 'b'), fix=False)
+    assert [] == conda.fixed
+    assert [False, True] == [result.ok for result in results]
+    assert not EnvJobsStatus(results)
+
+
+def test_run_env_jobs_limits_concurrency():
+    names = [str(i) for i in range(6)]
+    conda = FakeCondaManager(missing=dict((name, ['python']) for name in names), delay=0.05)
+    results = run_env_jobs(conda, _envs(*names), jobs=2)
+    assert all(result.ok for result in results)
+    assert sorted(names) == sorted(conda.fixed)
+    assert conda.max_running <= 2
+
+
+def test_run_env_jobs_serially():
+    conda = FakeCondaManager(missing=dict(a=['python'], b=['python']), delay=0.01)
+    results = run_env_jobs(conda, _envs('a', 'b'), jobs=1)
+    assert ['a', 'b'] == conda.fixed
+    assert 1 == conda.max_running
+    assert all(result.ok for result in results)
+
+
+def test_run_env_jobs_nothing_to_do():
+    assert [] == run_env_jobs(FakeCondaManager(), [])
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+import pytest
+
+from conda_kapsel.internal.environ_overlay import changed_since, EnvironOverlay, flatten
+
+
+def test_overlay_reads_through_and_records_changes():
+    base = dict(A='a', B='b', C='c')
+    overlay = EnvironOverlay(base)
+    assert base is overlay.base
+    assert base == overlay
+    assert 3 == len(overlay)
+
+    overlay['A'] = 'x'
+    overlay['B'] = 'b'
+    overlay['D'] = 'd'
+    del overlay['C']
+    with pytest.raises(KeyError):
+        del overlay['C']
+    with pytest.raises(KeyError):
+        overlay['C']
+
+    assert dict(A='a', B='b', C='c') == base
+    assert dict(A='x', B='b', D='d') == overlay
+    assert 'C' not in overlay
+    assert 'D' in overlay
+    assert ['A', 'B', 'D'] == sorted(overlay.keys())
+    assert 3 == len(overlay)
+
+    # setting a value to what the base already had isn't a change
+    assert dict(A='x', D='d') == overlay.changed
+    assert ['C'] == overlay.removed
+    assert "EnvironOverlay(changed={'A': 'x', 'D': 'd'}, removed=['C'])" == repr(overlay)
+
+    # adding then removing a variable is no change at all
+    overlay['E'] = 'e'
+    del overlay['E']
+    assert ['C'] == overlay.removed
+    assert 'E' not in overlay
+
+    # changes in the base show through unless we changed the same key
+    base['A'] = 'y'
+    base['F'] = 'f'
+    assert 'x' == overlay['A']
+    assert 'f' == overlay['F']
+
+
+def test_overlay_copy():
+    base = dict(A='a')
+    overlay = EnvironOverlay(base)
+    overlay['B'] = 'b'
+    copied = overlay.copy()
+    copied['C'] = 'c'
+    del copied['A']
+
+    assert dict(A='a', B='b') == overlay
+    assert dict(B='b', C='c') == copied
+    assert base is copied.base
+
+
+def test_changed_since():
+    base = dict(A='a', B='b')
+    overlay = EnvironOverlay(base)
+    overlay['A'] = 'x'
+    overlay['C'] = 'c'
+    del overlay['B']
+
+    assert dict(A='x', C='c') == changed_since(overlay, base)
+    assert dict(C='c') == changed_since(overlay, dict(A='x'))
+    assert dict(A='x', C='c') == changed_since(dict(overlay), base)
+
+
+def test_flatten():
+    environ = dict(A='a')
+    assert environ is flatten(environ)
+    overlay = EnvironOverlay(environ)
+    overlay['B'] = 'b'
+    flat = flatten(overlay)
+    assert isinstance(flat, dict)
+    assert dict(A='a', B='b') == flat
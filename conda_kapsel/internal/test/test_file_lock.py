@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+import threading
+import time
+
+from conda_kapsel.internal.file_lock import locked_file
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def test_locked_file_excludes_other_holders(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        path = os.path.join(dirname, "foo.yml")
+        events = []
+
+        def hold_lock():
+            with locked_file(path):
+                events.append('thread locked')
+                time.sleep(0.2)
+                events.append('thread unlocking')
+
+        with locked_file(path):
+            thread = threading.Thread(target=hold_lock)
+            thread.start()
+            time.sleep(0.1)
+            events.append('main unlocking')
+        thread.join()
+
+        assert ['main unlocking', 'thread locked', 'thread unlocking'] == events
+        assert not os.path.exists(path)
+        assert 1 == len(os.listdir(os.path.join(dirname, "cache", "locks")))
+
+    with_directory_contents(dict(), check)
+
+
+def test_locked_file_without_lock_directory(monkeypatch):
+    def check(dirname):
+        # the "cache directory" is a file, so we can't make lock files
+        cache = os.path.join(dirname, "cache")
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', cache)
+        ran = []
+        with locked_file(os.path.join(dirname, "foo.yml")):
+            ran.append(True)
+        assert [True] == ran
+
+    with_directory_contents({"cache": ""}, check)
+
+
+def test_locked_file_without_waiting(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        path = os.path.join(dirname, "foo.yml")
+        with locked_file(path) as locked:
+            assert locked
+            with locked_file(path, wait=False) as other:
+                assert not other
+        with locked_file(path, wait=False) as locked:
+            assert locked
+
+    with_directory_contents(dict(), check)
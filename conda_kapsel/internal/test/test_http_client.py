@@ -6,7 +6,7 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
-from conda_kapsel.internal.http_client import FileDownloader
+from conda_kapsel.internal.http_client import FileDownloader, fetch_sizes, fetch_sizes_async
 from conda_kapsel.internal.test.http_server import HttpServerTestContext
 from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
 
@@ -191,3 +191,14 @@ def test_download_fail_to_rename_tmp_file(monkeypatch):
             assert not os.path.isfile(filename + ".part")
 
     with_directory_contents(dict(), inside_directory_fail_to_rename_tmp_file)
+
+
+def test_fetch_sizes():
+    with HttpServerTestContext() as server:
+        url = server.new_download_url(download_length=1234, hash_algorithm=None)
+        sizes = IOLoop.current().run_sync(lambda: fetch_sizes_async([url, url + "#abc", server.error_url]))
+        assert {url: (1234, True), url + "#abc": (1234, True), server.error_url: (None, None)} == sizes
+
+
+def test_fetch_no_sizes():
+    assert dict() == fetch_sizes([])
@@ -144,3 +144,16 @@ def test_unset_using_broken(monkeypatch, capsys):
     assert (expected_broken_message % "deleting") == err
 
     keyring.reset_keyring_module()
+
+
+def test_change_count():
+    def check():
+        before = keyring.change_count()
+        keyring.get('abc', 'FOO')
+        assert before == keyring.change_count()
+        keyring.set('abc', 'FOO', 'bar')
+        assert before + 1 == keyring.change_count()
+        keyring.unset('abc', 'FOO')
+        assert before + 2 == keyring.change_count()
+
+    _with_fallback_keyring(check)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+import subprocess
+
+from conda_kapsel.internal.notebook_index import find_notebooks
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
+from conda_kapsel.plugins.registry import PluginRegistry
+
+
+def _count_walks(monkeypatch, project_dir):
+    walks = []
+    real_scandir = os.scandir
+
+    def mock_scandir(path):
+        if path == project_dir:
+            walks.append(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr('os.scandir', mock_scandir)
+    return walks
+
+
+def _bump_mtime(path):
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+
+def test_find_notebooks(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        dirname = os.path.join(dirname, "project")
+        requirements = [CondaEnvRequirement(registry=PluginRegistry())]
+        errors = []
+        notebooks = find_notebooks(dirname, errors, requirements)
+        assert [] == errors
+        assert ['a.ipynb', os.path.join('sub', 'b.ipynb')] == notebooks
+
+    with_directory_contents(
+        {'project/a.ipynb': '',
+         'project/sub/b.ipynb': '',
+         'project/sub/c.py': '',
+         'project/envs/default/d.ipynb': '',
+         'project/.hidden/e.ipynb': ''}, check)
+
+
+def test_find_notebooks_reuses_index_until_tree_changes(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        dirname = os.path.join(dirname, "project")
+        walks = _count_walks(monkeypatch, dirname)
+
+        assert ['a.ipynb'] == find_notebooks(dirname, [], [])
+        assert 1 == len(walks)
+        assert ['a.ipynb'] == find_notebooks(dirname, [], [])
+        assert 1 == len(walks)
+
+        # a new file changes its directory's modification time
+        sub = os.path.join(dirname, 'sub')
+        with open(os.path.join(sub, 'b.ipynb'), 'w') as f:
+            f.write('')
+        _bump_mtime(sub)
+        assert ['a.ipynb', os.path.join('sub', 'b.ipynb')] == find_notebooks(dirname, [], [])
+        assert 2 == len(walks)
+        assert ['a.ipynb', os.path.join('sub', 'b.ipynb')] == find_notebooks(dirname, [], [])
+        assert 2 == len(walks)
+
+        # changing what's ignored throws away the index
+        with open(os.path.join(dirname, '.kapselignore'), 'w') as f:
+            f.write('/sub\n')
+        assert ['a.ipynb'] == find_notebooks(dirname, [], [])
+        assert 3 == len(walks)
+
+    with_directory_contents({'project/a.ipynb': '', 'project/sub/c.py': ''}, check)
+
+
+def test_find_notebooks_notices_edited_gitignore(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        dirname = os.path.join(dirname, "project")
+        walks = _count_walks(monkeypatch, dirname)
+
+        assert [os.path.join('sub', 'a.ipynb')] == find_notebooks(dirname, [], [])
+        gitignore = os.path.join(dirname, 'sub', '.gitignore')
+        with open(gitignore, 'w') as f:
+            f.write('a.ipynb\n')
+        _bump_mtime(gitignore)
+        find_notebooks(dirname, [], [])
+        assert 2 == len(walks)
+
+    with_directory_contents({'project/sub/a.ipynb': '', 'project/sub/.gitignore': ''}, check)
+
+
+def test_find_notebooks_in_directory_of_git_ignored_files(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        dirname = os.path.join(dirname, "project")
+        subprocess.check_call(['git', 'init', '-q'], cwd=dirname)
+
+        # git lists "build/" since every file in it is ignored, but
+        # build/ itself isn't, so we still have to notice new files there
+        assert ['a.ipynb'] == find_notebooks(dirname, [], [])
+        build = os.path.join(dirname, 'build')
+        with open(os.path.join(build, 'b.ipynb'), 'w') as f:
+            f.write('')
+        _bump_mtime(build)
+        assert ['a.ipynb', os.path.join('build', 'b.ipynb')] == find_notebooks(dirname, [], [])
+
+    with_directory_contents({'project/a.ipynb': '',
+                             'project/.gitignore': '*.pyc\n',
+                             'project/build/c.pyc': ''}, check)
+
+
+def test_find_notebooks_fails_to_walk(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        dirname = os.path.join(dirname, "project")
+
+        real_scandir = os.scandir
+
+        def mock_scandir(path):
+            if path == dirname:
+                raise OSError("NOPE")
+            return real_scandir(path)
+
+        monkeypatch.setattr('os.scandir', mock_scandir)
+        errors = []
+        assert find_notebooks(dirname, errors, []) is None
+        assert ["Could not list files in %s: NOPE." % dirname] == errors
+        assert not os.path.exists(os.path.join(os.path.dirname(dirname), "cache"))
+
+    with_directory_contents({'project/a.ipynb': ''}, check)
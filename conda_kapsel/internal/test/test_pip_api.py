@@ -140,6 +140,99 @@ def test_installed_on_nonexistent_prefix():
     assert dict() == installed
 
 
+def test_site_packages_dirs():
+    def check(dirname):
+        if platform.system() == 'Windows':
+            expected = [os.path.join(dirname, 'Lib', 'site-packages')]
+        else:
+            expected = [os.path.join(dirname, 'lib', 'python3.5', 'site-packages')]
+        assert expected == pip_api.site_packages_dirs(dirname)
+
+    with_directory_contents({'Lib/site-packages': None,
+                             'lib/python3.5/site-packages': None,
+                             'lib/pkgconfig': None}, check)
+
+
+def test_site_packages_dirs_on_nonexistent_prefix():
+    assert [] == pip_api.site_packages_dirs("/this/does/not/exist")
+
+
+def _site_packages_path(name):
+    if platform.system() == 'Windows':
+        return 'Lib/site-packages/' + name
+    else:
+        return 'lib/python3.5/site-packages/' + name
+
+
+def _with_pip_installed(files):
+    files = dict(files)
+    if platform.system() == 'Windows':
+        files['Scripts/pip.exe'] = ""
+    else:
+        files['bin/pip'] = ""
+    return files
+
+
+def test_installed_reads_metadata_without_running_pip(monkeypatch):
+    def mock_call_pip(prefix, extra_args):
+        raise AssertionError("should not have run pip")
+
+    monkeypatch.setattr('conda_kapsel.internal.pip_api._call_pip', mock_call_pip)
+
+    def check(dirname):
+        expected = {
+            'flake8': ('flake8', '2.6.2'),
+            'ruamel.yaml': ('ruamel.yaml', '0.11.14'),
+            'typing-extensions': ('typing-extensions', '3.7.4'),
+            'six': ('six', '1.10.0')
+        }
+        assert expected == pip_api.installed(dirname)
+
+    files = {
+        _site_packages_path('flake8-2.6.2.dist-info/METADATA'): "Metadata-Version: 2.0\nName: flake8\n" +
+        "Version: 2.6.2\n\nVersion: not a header\n",
+        _site_packages_path('ruamel.yaml-0.11.14-py3.5.egg-info/PKG-INFO'): "Name: ruamel.yaml\r\nVersion: 0.11.14\r\n",
+        _site_packages_path('typing_extensions-3.7.4.dist-info/METADATA'): "Name: typing_extensions\n" +
+        "Version: 3.7.4\n",
+        _site_packages_path('six-1.10.0-py3.5.egg-info'): "Name: six\nVersion: 1.10.0\n",
+        _site_packages_path('six.py'): ""
+    }
+    with_directory_contents(_with_pip_installed(files), check)
+
+
+def _check_installed_falls_back_to_pip(monkeypatch, files):
+    def mock_call_pip(prefix, extra_args):
+        assert ['list'] == extra_args
+        return "foo (1.0)\n".encode('utf-8')
+
+    monkeypatch.setattr('conda_kapsel.internal.pip_api._call_pip', mock_call_pip)
+
+    def check(dirname):
+        assert {'foo': ('foo', '1.0')} == pip_api.installed(dirname)
+
+    with_directory_contents(_with_pip_installed(files), check)
+
+
+def test_installed_falls_back_to_pip_without_site_packages(monkeypatch):
+    _check_installed_falls_back_to_pip(monkeypatch, dict())
+
+
+def test_installed_falls_back_to_pip_with_eggs(monkeypatch):
+    _check_installed_falls_back_to_pip(monkeypatch, {_site_packages_path('foo-1.0-py3.5.egg/EGG-INFO/PKG-INFO'): ""})
+
+
+def test_installed_falls_back_to_pip_with_develop_install(monkeypatch):
+    _check_installed_falls_back_to_pip(monkeypatch, {_site_packages_path('foo.egg-link'): "/somewhere\n."})
+
+
+def test_installed_falls_back_to_pip_with_incomplete_metadata(monkeypatch):
+    _check_installed_falls_back_to_pip(monkeypatch, {_site_packages_path('foo-1.0.dist-info/METADATA'): "Name: foo\n"})
+
+
+def test_installed_falls_back_to_pip_with_missing_metadata(monkeypatch):
+    _check_installed_falls_back_to_pip(monkeypatch, {_site_packages_path('foo-1.0.dist-info/RECORD'): ""})
+
+
 def test_parse_spec():
     # just a package name
     assert "foo" == pip_api.parse_spec("foo").name
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import codecs
+import os
+
+from conda_kapsel.internal.prepared_stamp import (load_prepared_stamp, save_prepared_stamp, STAMP_DIRECTORY)
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents_completing_project_file
+from conda_kapsel.prepare import PrepareFailure, PrepareSuccess
+from conda_kapsel.project import Project
+from conda_kapsel.project_commands import CommandExecInfo
+from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
+
+_request = ['run', 'some_mode', None, 'default', None]
+
+
+def _success(dirname, environ, **changes):
+    prepared = dict(environ)
+    prepared.pop('REMOVED', None)
+    prepared['PROJECT_DIR'] = dirname
+    prepared.update(changes)
+    exec_info = CommandExecInfo(cwd=dirname, args=['echo', 'hello'], shell=False, env=prepared)
+    return PrepareSuccess(logs=[], statuses=(), command_exec_info=exec_info, environ=prepared, overrides=None)
+
+
+def test_save_and_load_prepared_stamp():
+    def check(dirname):
+        project = Project(dirname)
+        environ = dict(PATH='/bin', REMOVED='x', KEPT='y')
+        save_prepared_stamp(project, _success(dirname, environ, FOO='bar'), _request, environ)
+        assert os.path.isdir(os.path.join(dirname, STAMP_DIRECTORY))
+
+        stamp = load_prepared_stamp(dirname, _request, environ)
+        assert stamp is not None
+        assert dict(PATH='/bin', KEPT='y', FOO='bar', PROJECT_DIR=dirname) == stamp.environ
+        exec_info = stamp.command_exec_info
+        assert ['echo', 'hello'] == exec_info.args
+        assert dirname == exec_info.cwd
+        assert not exec_info.shell
+        assert exec_info.notebook is None
+        assert stamp.environ == exec_info.env
+
+        # anything else we asked for, or a different starting point, needs a real prepare
+        assert load_prepared_stamp(dirname, ['run', 'some_mode', None, 'other', None], environ) is None
+        assert load_prepared_stamp(dirname, _request, dict(environ, PATH='/usr/bin')) is None
+
+        # so does editing the project
+        with codecs.open(os.path.join(dirname, DEFAULT_PROJECT_FILENAME), 'a', 'utf-8') as f:
+            f.write("\n# a comment\n")
+        assert load_prepared_stamp(dirname, _request, environ) is None
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "name: foo\n"}, check)
+
+
+def test_prepared_stamp_ignores_unrelated_variables():
+    def check(dirname):
+        project = Project(dirname)
+        environ = dict(PATH='/bin', FOO='foo', SHLVL='1', OLDPWD='/tmp')
+        save_prepared_stamp(project, _success(dirname, environ), _request, environ)
+
+        # shells change these all the time
+        unrelated = dict(PATH='/bin', FOO='foo', SHLVL='2', OLDPWD='/home', TERM_SESSION_ID='abc')
+        stamp = load_prepared_stamp(dirname, _request, unrelated)
+        assert stamp is not None
+        assert '2' == stamp.environ['SHLVL']
+        assert 'abc' == stamp.environ['TERM_SESSION_ID']
+
+        # but the project's own variables and the conda env matter
+        assert load_prepared_stamp(dirname, _request, dict(environ, FOO='bar')) is None
+        assert load_prepared_stamp(dirname, _request, dict(environ, CONDA_PREFIX='/opt/env')) is None
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "name: foo\nvariables:\n  FOO: {}\n"},
+                                                    check)
+
+
+def test_prepared_stamp_checks_downloads():
+    def check(dirname):
+        project = Project(dirname)
+        downloaded = os.path.join(dirname, 'data.csv')
+        environ = dict(PATH='/bin')
+        save_prepared_stamp(project, _success(dirname, environ, DATA=downloaded), _request, environ)
+        assert load_prepared_stamp(dirname, _request, environ) is not None
+
+        os.remove(downloaded)
+        assert load_prepared_stamp(dirname, _request, environ) is None
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+downloads:
+  DATA: http://localhost/data.csv
+""",
+         'data.csv': "a,b\n1,2\n"}, check)
+
+
+def test_no_prepared_stamp_for_failure_or_services():
+    def check(dirname):
+        project = Project(dirname)
+        environ = dict(PATH='/bin')
+        failure = PrepareFailure(logs=[], statuses=(), errors=['nope'], environ=environ, overrides=None)
+        save_prepared_stamp(project, failure, _request, environ)
+        assert load_prepared_stamp(dirname, _request, environ) is None
+
+        save_prepared_stamp(project, _success(dirname, environ, REDIS_URL='redis://localhost'), _request, environ)
+        assert load_prepared_stamp(dirname, _request, environ) is None
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "services:\n  REDIS_URL: redis\n"},
+                                                    check)
+
+
+def test_damaged_prepared_stamp():
+    def check(dirname):
+        project = Project(dirname)
+        environ = dict(PATH='/bin')
+        save_prepared_stamp(project, _success(dirname, environ), _request, environ)
+        stamp_dir = os.path.join(dirname, STAMP_DIRECTORY)
+        for name in os.listdir(stamp_dir):
+            with codecs.open(os.path.join(stamp_dir, name), 'w', 'utf-8') as f:
+                f.write("{")
+        assert load_prepared_stamp(dirname, _request, environ) is None
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "name: foo\n"}, check)
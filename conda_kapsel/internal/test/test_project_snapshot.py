@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents, complete_project_file_content
+from conda_kapsel.plugins.registry import PluginRegistry
+from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
+from conda_kapsel.plugins.requirements.download import DownloadRequirement
+from conda_kapsel.plugins.requirements.redis import RedisRequirement
+from conda_kapsel.project import Project
+from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
+
+_complicated_project = complete_project_file_content("""
+name: snapshotted
+description: "A project to snapshot"
+packages: [python]
+channels: [foo]
+variables:
+  FOO: { default: 42 }
+  BAR: {}
+downloads:
+  DATAFILE:
+    url: http://example.com/data.zip
+    md5: 12345abcdef
+services:
+  REDIS_URL: redis
+env_specs:
+  first:
+    description: "The first one"
+    packages: [numpy, {pip: [flask]}]
+  second:
+    packages: [pandas]
+commands:
+  hello:
+    unix: echo hello
+    env_spec: second
+  bye:
+    unix: echo bye
+""")
+
+
+def _count_parses(monkeypatch):
+    parsed = []
+
+    from conda_kapsel import yaml_file
+
+    def counting(real_load):
+        def mock_load(contents):
+            parsed.append(contents)
+            return real_load(contents)
+
+        return mock_load
+
+    monkeypatch.setattr('conda_kapsel.yaml_file._load_string', counting(yaml_file._load_string))
+    monkeypatch.setattr('conda_kapsel.yaml_file._load_string_read_only', counting(yaml_file._load_string_read_only))
+    return parsed
+
+
+def _describe(project):
+    def describe_requirement(req):
+        if isinstance(req, CondaEnvRequirement):
+            return ('conda_env', sorted(req.env_specs.keys()))
+        elif isinstance(req, DownloadRequirement):
+            return ('download', req.env_var, req.url, req.filename, req.hash_algorithm, req.hash_value, req.unzip)
+        else:
+            return (type(req).__name__, req.env_var, req.options)
+
+    return dict(name=project.name,
+                description=project.description,
+                problems=project.problems,
+                requirements=[describe_requirement(req) for req in project.requirements],
+                env_specs=[(spec.name, spec.conda_packages, spec.pip_packages, spec.channels, spec.description,
+                            spec.lock_file) for spec in project.env_specs.values()],
+                default_env_spec_name=project.default_env_spec_name,
+                commands=sorted((name, command.unix_shell_commandline, command.default_env_spec_name)
+                                for (name, command) in project.commands.items()),
+                default_command=project.default_command.name)
+
+
+def test_snapshot_skips_parsing_unchanged_project(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        parsed = _count_parses(monkeypatch)
+
+        first = _describe(Project(project_dir))
+        assert [] == first['problems']
+        assert 'snapshotted' == first['name']
+        assert len(parsed) > 0
+        assert [RedisRequirement] == [type(req) for req in Project(project_dir).service_requirements]
+
+        del parsed[:]
+        project = Project(project_dir)
+        assert first == _describe(project)
+        assert [] == parsed
+
+        # editing the project parses it, and the edit is noticed
+        project.project_file.set_value('description', "Edited")
+        project.project_file.save()
+        assert 1 == len(parsed)
+        assert "Edited" == project.description
+
+        del parsed[:]
+        assert "Edited" == Project(project_dir).description
+        assert [] == parsed
+
+    with_directory_contents({"project/" + DEFAULT_PROJECT_FILENAME: _complicated_project}, check)
+
+
+def test_no_snapshot_of_project_with_problems(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        parsed = _count_parses(monkeypatch)
+
+        assert len(Project(project_dir).problems) > 0
+        del parsed[:]
+        assert len(Project(project_dir).problems) > 0
+        assert len(parsed) > 0
+
+    with_directory_contents({"project/" + DEFAULT_PROJECT_FILENAME: "variables:\n  42\n"}, check)
+
+
+def test_no_snapshot_with_custom_registry(monkeypatch):
+    class CustomRegistry(PluginRegistry):
+        pass
+
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        parsed = _count_parses(monkeypatch)
+
+        Project(project_dir, plugin_registry=CustomRegistry()).requirements
+        Project(project_dir, plugin_registry=CustomRegistry()).requirements
+        assert 2 == len(parsed)
+        assert not os.path.exists(os.path.join(dirname, "cache", "projects"))
+
+    with_directory_contents({"project/" + DEFAULT_PROJECT_FILENAME: _complicated_project}, check)
+
+
+def test_snapshot_not_used_when_icon_is_deleted(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+
+        assert [] == Project(project_dir).problems
+        os.remove(os.path.join(project_dir, "foo.png"))
+        assert ["Icon file %s does not exist." % os.path.join(project_dir, "foo.png")] == \
+            Project(project_dir).problems
+
+    with_directory_contents(
+        {"project/" + DEFAULT_PROJECT_FILENAME: complete_project_file_content("icon: foo.png\n"),
+         "project/foo.png": ""}, check)
+
+
+def test_no_snapshot_of_values_json_cannot_hold(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+
+        project = Project(project_dir)
+        assert [] == project.problems
+        assert not os.path.exists(os.path.join(dirname, "cache", "projects"))
+
+    with_directory_contents(
+        {"project/" + DEFAULT_PROJECT_FILENAME: complete_project_file_content(
+            "commands:\n  foo:\n    unix: echo\n    when: 2016-01-01\n")}, check)
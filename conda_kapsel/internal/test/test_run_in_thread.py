@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+import threading
+
+import pytest
+from tornado.ioloop import IOLoop
+
+from conda_kapsel.internal import trace
+from conda_kapsel.internal.run_in_thread import run_in_thread
+
+
+def _run_sync(function):
+    io_loop = IOLoop(make_current=False)
+    try:
+        return io_loop.run_sync(function)
+    finally:
+        io_loop.close()
+
+
+def test_run_in_thread_returns_result():
+    def work(a, b=None):
+        with trace.span("working", 'test'):
+            return (a, b, threading.current_thread())
+
+    timings = trace.Timings()
+    with timings.recording():
+        (a, b, thread) = _run_sync(lambda: run_in_thread(work, 1, b=2))
+    assert (1, 2) == (a, b)
+    assert threading.current_thread() is not thread
+    assert ["working"] == [span.name for span in timings.spans]
+
+
+def test_run_in_thread_raises_exception():
+    def work():
+        raise ValueError("nope")
+
+    with pytest.raises(ValueError) as excinfo:
+        _run_sync(lambda: run_in_thread(work))
+    assert "nope" in str(excinfo.value)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from conda_kapsel.internal import streaming_popen
+from conda_kapsel.internal.test.tmpfile_utils import tmp_script_commandline
+
+
+def _script(contents):
+    return tmp_script_commandline("from __future__ import print_function\nimport sys\nimport time\n" + contents)
+
+
+def test_streams_lines_to_callbacks():
+    stdout_lines = []
+    stderr_lines = []
+    result = streaming_popen.popen_and_stream(_script("""
+print("one")
+print("two")
+print("oops", file=sys.stderr)
+sys.exit(3)
+"""),
+                                              stdout_callback=stdout_lines.append,
+                                              stderr_callback=stderr_lines.append)
+    assert ["one", "two"] == stdout_lines
+    assert ["oops"] == stderr_lines
+    assert 3 == result.returncode
+    assert b"one\ntwo\n" == result.stdout.replace(b"\r\n", b"\n")
+    assert b"oops" == result.stderr.strip()
+    assert result.wall_time >= 0
+    assert not result.timed_out
+    assert not result.cancelled
+
+
+def test_lines_arrive_before_exit():
+    seen = []
+
+    def on_line(line):
+        seen.append((line, time.time()))
+
+    result = streaming_popen.popen_and_stream(_script("""
+print("early")
+sys.stdout.flush()
+time.sleep(1)
+"""), stdout_callback=on_line)
+    assert 0 == result.returncode
+    assert ["early"] == [line for (line, when) in seen]
+    assert seen[0][1] < time.time() - 0.5
+
+
+def test_timeout():
+    start = time.time()
+    result = streaming_popen.popen_and_stream(_script("time.sleep(60)"), timeout=0.5)
+    assert result.timed_out
+    assert not result.cancelled
+    assert 0 != result.returncode
+    assert time.time() - start < 30
+
+
+def test_grandchild_holding_output_open(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.streaming_popen._OUTPUT_GRACE_SECONDS', 0.5)
+    start = time.time()
+    # the grandchild inherits our stdout and stderr, and outlives the child
+    result = streaming_popen.popen_and_stream(_script("""
+import subprocess
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"])
+print(child.pid)
+sys.stdout.flush()
+"""))
+    try:
+        assert 0 == result.returncode
+        assert not result.timed_out
+        assert time.time() - start < 8
+    finally:
+        pid = int(result.stdout.decode('utf-8').strip())
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def test_timeout_while_grandchild_holds_output_open(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.streaming_popen._OUTPUT_GRACE_SECONDS', 60)
+    start = time.time()
+    result = streaming_popen.popen_and_stream(_script("""
+import subprocess
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"])
+print(child.pid)
+sys.stdout.flush()
+"""), timeout=1)
+    try:
+        assert 0 == result.returncode
+        assert time.time() - start < 8
+    finally:
+        pid = int(result.stdout.decode('utf-8').strip())
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def test_cancel_event():
+    cancel = threading.Event()
+    timer = threading.Timer(0.5, cancel.set)
+    timer.start()
+    try:
+        result = streaming_popen.popen_and_stream(_script("time.sleep(60)"), cancel_event=cancel)
+    finally:
+        timer.cancel()
+    assert result.cancelled
+    assert not result.timed_out
+    assert 0 != result.returncode
+
+
+def test_cancel_all():
+    def cancel_when_running():
+        deadline = time.time() + 10
+        while len(streaming_popen._running) == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        streaming_popen.cancel_all()
+
+    thread = threading.Thread(target=cancel_when_running)
+    thread.start()
+    result = streaming_popen.popen_and_stream(_script("time.sleep(60)"))
+    thread.join()
+    assert result.cancelled
+    assert 0 == len(streaming_popen._running)
+
+
+def test_cancel_all_and_wait():
+    args = _script("time.sleep(60)")
+    result = []
+
+    def run_it():
+        result.append(streaming_popen.popen_and_stream(args))
+
+    def our_runs():
+        # other tests in this process may be running things too
+        return [run for run in list(streaming_popen._running) if run.process.args == args]
+
+    thread = threading.Thread(target=run_it)
+    thread.start()
+    deadline = time.time() + 10
+    while len(our_runs()) == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    (run, ) = our_runs()
+    streaming_popen.cancel_all(wait=True)
+    # the process is gone before cancel_all returns
+    assert run.process.poll() is not None
+    thread.join()
+    assert result[0].cancelled
+
+
+def test_callback_kwargs():
+    def callback(line):
+        pass
+
+    assert dict() == streaming_popen.callback_kwargs()
+    assert dict(stdout_callback=callback) == streaming_popen.callback_kwargs(stdout_callback=callback)
+    assert dict(stdout_callback=callback, stderr_callback=callback) == \
+        streaming_popen.callback_kwargs(callback, callback)
+
+
+def test_sinks():
+    class RecordingSink(streaming_popen.OutputSink):
+        def __init__(self):
+            self.lines = []
+            self.results = []
+
+        def on_line(self, args, stream_name, line):
+            self.lines.append((stream_name, line))
+
+        def on_finished(self, result):
+            self.results.append(result)
+
+    sink = RecordingSink()
+    streaming_popen.add_sink(sink)
+    try:
+        result = streaming_popen.popen_and_stream(_script('print("hello")'))
+    finally:
+        streaming_popen.remove_sink(sink)
+    assert [('stdout', 'hello')] == sink.lines
+    assert [result] == sink.results
+
+    # removed sinks hear nothing more
+    streaming_popen.popen_and_stream(_script('print("again")'))
+    assert 1 == len(sink.results)
+
+
+def test_cannot_start():
+    with pytest.raises(OSError):
+        streaming_popen.popen_and_stream(['this-command-does-not-exist-kapsel'])
+
+
+def test_timeout_from_environ(monkeypatch):
+    monkeypatch.delenv('CONDA_KAPSEL_TEST_TIMEOUT', raising=False)
+    assert streaming_popen.timeout_from_environ('CONDA_KAPSEL_TEST_TIMEOUT') is None
+    monkeypatch.setenv('CONDA_KAPSEL_TEST_TIMEOUT', '2.5')
+    assert 2.5 == streaming_popen.timeout_from_environ('CONDA_KAPSEL_TEST_TIMEOUT')
+    monkeypatch.setenv('CONDA_KAPSEL_TEST_TIMEOUT', '0')
+    assert streaming_popen.timeout_from_environ('CONDA_KAPSEL_TEST_TIMEOUT') is None
+    monkeypatch.setenv('CONDA_KAPSEL_TEST_TIMEOUT', 'forever')
+    assert streaming_popen.timeout_from_environ('CONDA_KAPSEL_TEST_TIMEOUT') is None
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+import pytest
+
+from conda_kapsel.internal import conda_api
+from conda_kapsel.internal.file_lock import locked_file
+from conda_kapsel.internal.template_envs import TemplateEnvStore, template_key
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def _mock_conda(monkeypatch, size=10, clone_fails=False):
+    calls = []
+
+    def mock_create(prefix, pkgs, channels):
+        calls.append(('create', prefix, pkgs))
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+        with open(os.path.join(prefix, 'conda-meta', 'python-3.5.2-0.json'), 'w') as f:
+            f.write("x" * size)
+
+    def mock_clone(source_prefix, prefix):
+        calls.append(('clone', source_prefix, prefix))
+        if clone_fails:
+            raise conda_api.CondaError("clone failed")
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.clone', mock_clone)
+    return calls
+
+
+def test_template_key_normalizes_packages():
+    assert template_key(['python', 'numpy >= 1.11'], ['foo']) == template_key(['numpy>=1.11', 'python'], ['foo'])
+    assert template_key(['python', 'numpy=1.11'], []) == template_key(['numpy =1.11', 'python', 'python'], [])
+    assert template_key(['python'], []) != template_key(['python=3.5'], [])
+    assert template_key(['python'], ['foo', 'bar']) != template_key(['python'], ['bar', 'foo'])
+
+
+def test_for_current_user(monkeypatch):
+    monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', '/cache')
+    # the store is off unless asked for
+    monkeypatch.delenv('CONDA_KAPSEL_TEMPLATE_ENVS_MAX_MB', raising=False)
+    assert TemplateEnvStore.for_current_user() is None
+
+    monkeypatch.setenv('CONDA_KAPSEL_TEMPLATE_ENVS_MAX_MB', '3')
+    store = TemplateEnvStore.for_current_user()
+    assert os.path.join('/cache', 'template-envs') == store.directory
+    assert 3 * 1024 * 1024 == store.max_bytes
+
+    monkeypatch.setenv('CONDA_KAPSEL_TEMPLATE_ENVS_MAX_MB', '0')
+    assert TemplateEnvStore.for_current_user() is None
+
+
+def test_clone_creates_template_once(monkeypatch):
+    calls = _mock_conda(monkeypatch)
+
+    def do_test(dirname):
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 1024)
+        template = os.path.join(store.directory, template_key(['python'], []))
+
+        assert store.clone_into(os.path.join(dirname, 'a'), ['python'], [])
+        assert store.clone_into(os.path.join(dirname, 'b'), ['python'], [])
+
+        assert [('create', template, ['python']), ('clone', template, os.path.join(dirname, 'a')),
+                ('clone', template, os.path.join(dirname, 'b'))] == calls
+        assert [(template_key(['python'], []), 10)] == [(key, size) for (key, size, last_used) in store.templates()]
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_incomplete_template_is_recreated(monkeypatch):
+    calls = _mock_conda(monkeypatch)
+    key = template_key(['python'], [])
+
+    def do_test(dirname):
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 1024)
+        assert [] == store.templates()
+        assert store.clone_into(os.path.join(dirname, 'a'), ['python'], [])
+        assert 'create' == calls[0][0]
+        assert not os.path.exists(os.path.join(store.directory, key, 'leftover'))
+
+    with_directory_contents({'templates/%s/leftover' % key: ""}, do_test)
+
+
+def test_template_creation_fails(monkeypatch):
+    def mock_create(prefix, pkgs, channels):
+        os.makedirs(prefix)
+        raise conda_api.CondaError("no such package")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+
+    def do_test(dirname):
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 1024)
+        with pytest.raises(conda_api.CondaError) as excinfo:
+            store.clone_into(os.path.join(dirname, 'a'), ['nope'], [])
+        assert 'no such package' in str(excinfo.value)
+        assert [] == os.listdir(store.directory)
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_clone_fails(monkeypatch):
+    calls = _mock_conda(monkeypatch, clone_fails=True)
+
+    def do_test(dirname):
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 1024)
+        assert not store.clone_into(os.path.join(dirname, 'a'), ['python'], [])
+        assert ['create', 'clone'] == [call[0] for call in calls]
+        # we don't trust the template anymore
+        assert [] == store.templates()
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_evict_least_recently_used(monkeypatch):
+    _mock_conda(monkeypatch, size=10)
+
+    def do_test(dirname):
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 25)
+        for (i, name) in enumerate(['a', 'b']):
+            assert store.clone_into(os.path.join(dirname, 'env-' + name), [name], [])
+            # make the mtimes distinct regardless of filesystem resolution
+            os.utime(os.path.join(store.directory, template_key([name], []) + ".json"), (i, i))
+
+        # using 'a' again makes 'b' the least recently used
+        assert store.clone_into(os.path.join(dirname, 'env-a2'), ['a'], [])
+        assert store.clone_into(os.path.join(dirname, 'env-c'), ['c'], [])
+
+        keys = set(key for (key, size, last_used) in store.templates())
+        assert set([template_key(['a'], []), template_key(['c'], [])]) == keys
+        assert not os.path.exists(os.path.join(store.directory, template_key(['b'], [])))
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_evict_keeps_requested_template(monkeypatch):
+    _mock_conda(monkeypatch, size=10)
+
+    def do_test(dirname):
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 5)
+        assert store.clone_into(os.path.join(dirname, 'env-a'), ['a'], [])
+        assert [template_key(['a'], [])] == [key for (key, size, last_used) in store.templates()]
+        assert [] == store.evict(keep=template_key(['a'], []))
+        assert [template_key(['a'], [])] == store.evict()
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_evict_skips_template_locked_by_another_process(monkeypatch):
+    _mock_conda(monkeypatch, size=10)
+
+    def do_test(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, 'cache'))
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 5)
+        assert store.clone_into(os.path.join(dirname, 'env-a'), ['a'], [])
+        key = template_key(['a'], [])
+
+        # another process holding the template's lock looks the same as this
+        with locked_file(os.path.join(store.directory, key)):
+            assert [] == store.evict()
+        assert [key] == store.evict()
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_clone_waits_for_another_process(monkeypatch):
+    calls = _mock_conda(monkeypatch)
+
+    def do_test(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, 'cache'))
+        store = TemplateEnvStore(os.path.join(dirname, 'templates'), 1024)
+        template = os.path.join(store.directory, template_key(['python'], []))
+        locked = []
+
+        def mock_locked_file(path, wait=True):
+            locked.append(path)
+            return locked_file(path, wait)
+
+        monkeypatch.setattr('conda_kapsel.internal.template_envs.locked_file', mock_locked_file)
+        assert store.clone_into(os.path.join(dirname, 'a'), ['python'], [])
+        assert [template] == locked
+        assert ['create', 'clone'] == [call[0] for call in calls]
+
+    with_directory_contents(dict(), do_test)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+
+from conda_kapsel.internal.thread_pool import run_on_threads
+
+
+def test_run_on_threads_keeps_results_in_order():
+    def slow_square(item):
+        # finish out of order
+        time.sleep(0.01 * (5 - item))
+        return item * item
+
+    reported = []
+    results = run_on_threads(slow_square, [1, 2, 3, 4], 4, on_result=lambda item, result: reported.append(item))
+    assert [1, 4, 9, 16] == results
+    assert [1, 2, 3, 4] == sorted(reported)
+
+
+def test_run_on_threads_limits_jobs():
+    lock = threading.Lock()
+    running = [0]
+    most = [0]
+
+    def work(item):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return item
+
+    assert list(range(6)) == run_on_threads(work, list(range(6)), 2)
+    assert most[0] <= 2
+
+
+def test_run_on_threads_one_job_runs_inline():
+    threads = []
+
+    def work(item):
+        threads.append(threading.current_thread())
+        return item
+
+    assert ['a', 'b'] == run_on_threads(work, ['a', 'b'], 1)
+    assert [threading.current_thread()] * 2 == threads
+
+
+def test_run_on_threads_no_items():
+    assert [] == run_on_threads(lambda item: item, [], 3)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import codecs
+import json
+import os
+import threading
+
+import pytest
+
+from io import StringIO
+
+from conda_kapsel.internal import trace
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def test_span_without_recording():
+    with trace.span("nothing", 'test'):
+        pass
+    timings = trace.Timings()
+    assert [] == timings.spans
+
+
+def test_recording_spans():
+    timings = trace.Timings()
+    with timings.recording():
+        with trace.span("a", 'test', detail=1):
+            pass
+        with pytest.raises(ValueError):
+            with trace.span("b", 'test'):
+                raise ValueError("oops")
+    with trace.span("after", 'test'):
+        pass
+
+    spans = timings.spans
+    assert ['a', 'b'] == [span.name for span in spans]
+    assert dict(detail=1) == spans[0].args
+    assert spans[0].duration >= 0
+    assert "Span('test', 'a'" in repr(spans[0])
+
+
+def test_timings_span():
+    outer = trace.Timings()
+    inner = trace.Timings()
+    with outer.recording():
+        with inner.span("both", 'test'):
+            pass
+    with inner.span("inner only", 'test'):
+        pass
+    with outer.recording():
+        with outer.span("not twice", 'test'):
+            pass
+
+    assert ['both', 'not twice'] == [span.name for span in outer.spans]
+    assert ['both', 'inner only'] == [span.name for span in inner.spans]
+
+
+def test_bind_records_other_threads():
+    timings = trace.Timings()
+
+    def work():
+        with trace.span("in thread", 'test'):
+            pass
+
+    with timings.recording():
+        threads = [threading.Thread(target=trace.bind(work)), threading.Thread(target=work)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # only the bound function was recorded
+    assert ["in thread"] == [span.name for span in timings.spans]
+    assert threading.current_thread().ident != timings.spans[0].thread_id
+
+
+def test_chrome_trace_and_summary():
+    timings = trace.Timings()
+    timings.add(trace.Span("conda install", 'subprocess', start=10.0, duration=2.0, thread_id=1, args=dict()))
+    timings.add(trace.Span("conda install", 'subprocess', start=13.0, duration=1.0, thread_id=1, args=dict()))
+    timings.add(trace.Span("check FOO", 'check_status', start=12.0, duration=0.5, thread_id=2, args=dict(x=1)))
+
+    events = timings.to_chrome_trace()['traceEvents']
+    assert 3 == len(events)
+    assert dict(name="check FOO", cat='check_status', ph='X', ts=12000000, dur=500000, pid=os.getpid(), tid=2,
+                args=dict(x=1)) == events[2]
+
+    summary = timings.summary()
+    assert 3 == len(summary)
+    assert "total" in summary[0]
+    assert summary[1].split() == ['3.000', '2.000', '2', 'subprocess', 'conda', 'install']
+    assert summary[2].split() == ['0.500', '0.500', '1', 'check_status', 'check', 'FOO']
+
+
+def test_record_to_file():
+    def check(dirname):
+        filename = os.path.join(dirname, "trace.json")
+        summary = StringIO()
+        timings = trace.record_to_file(filename, summary_file=summary)
+
+        def work():
+            with trace.span("in thread", 'test'):
+                pass
+
+        # recording to a file sees every thread
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+        assert [timings] == trace.write_files()
+        assert [] == trace.write_files()
+        with trace.span("too late", 'test'):
+            pass
+
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            saved = json.load(f)
+        assert ["in thread"] == [event['name'] for event in saved['traceEvents']]
+        assert "in thread" in summary.getvalue()
+
+    with_directory_contents(dict(), check)
+
+
+def test_write_files_finishes_unfinished_spans():
+    def check(dirname):
+        filename = os.path.join(dirname, "trace.json")
+        trace.record_to_file(filename)
+        with trace.span("outside", 'test'):
+            with trace.span("finished", 'test'):
+                pass
+            # as happens when we exec
+            trace.write_files()
+
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            saved = json.load(f)
+        assert ["finished", "outside"] == [event['name'] for event in saved['traceEvents']]
+
+    with_directory_contents(dict(), check)
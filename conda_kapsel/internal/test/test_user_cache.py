@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import codecs
+import os
+
+from conda_kapsel.internal.user_cache import (user_cache_directory, file_stat_key, load_cached_json,
+                                              save_cached_json)
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def test_user_cache_directory_override(monkeypatch):
+    monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', '/some/where')
+    assert '/some/where' == user_cache_directory()
+
+
+def test_user_cache_directory_default(monkeypatch):
+    monkeypatch.delenv('CONDA_KAPSEL_CACHE_DIR', raising=False)
+    assert 'conda-kapsel' in user_cache_directory()
+
+
+def test_save_and_load_cached_json(monkeypatch):
+    def do_test(dirname):
+        cache_dir = os.path.join(dirname, 'cache')
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', cache_dir)
+
+        assert load_cached_json('foo', key=[1, 2]) is None
+
+        save_cached_json('foo', key=(1, 2), value=dict(a=1))
+        assert os.path.isfile(os.path.join(cache_dir, 'foo.json'))
+        assert dict(a=1) == load_cached_json('foo', key=[1, 2])
+        assert load_cached_json('foo', key=[1, 3]) is None
+
+        # saving with a new key replaces the old value
+        save_cached_json('foo', key=[1, 3], value=dict(a=2))
+        assert load_cached_json('foo', key=[1, 2]) is None
+        assert dict(a=2) == load_cached_json('foo', key=[1, 3])
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_load_cached_json_corrupt(monkeypatch):
+    def do_test(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', dirname)
+        assert load_cached_json('corrupt', key=1) is None
+
+    with_directory_contents({'corrupt.json': "{ not json"}, do_test)
+
+
+def test_save_cached_json_fails_silently(monkeypatch):
+    def do_test(dirname):
+        # a file where the cache directory should be
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, 'notadir'))
+        save_cached_json('foo', key=1, value=2)
+        assert load_cached_json('foo', key=1) is None
+
+    with_directory_contents({'notadir': "hello"}, do_test)
+
+
+def test_file_stat_key():
+    def do_test(dirname):
+        path = os.path.join(dirname, 'foo')
+        missing = file_stat_key(path)
+        assert [path, None, None] == missing
+        with codecs.open(path, 'w', 'utf-8') as f:
+            f.write("hello")
+        present = file_stat_key(path)
+        assert present[0] == path
+        assert present[2] == 5
+
+    with_directory_contents(dict(), do_test)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Run a function on each of a list of items, several at a time."""
+from __future__ import absolute_import
+
+import threading
+
+from conda_kapsel.internal import trace
+
+
+def run_on_threads(function, items, jobs, on_result=None):
+    """Call ``function(item)`` for each item, on up to ``jobs`` threads.
+
+    The function shouldn't raise; turn errors into a result
+    instead, so one bad item doesn't leave a hole in the results.
+    Spans recorded by the function go wherever the caller's spans
+    would go (see ``trace.bind()``).
+
+    Args:
+        function (callable): called with each item, returns its result
+        items (list): things to work on
+        jobs (int): how many items to work on at once
+        on_result (callable): if not None, called with ``(item, result)``
+                              as each item finishes, one call at a time
+
+    Returns:
+        list of results in the same order as items
+    """
+    jobs = max(1, min(jobs, len(items)))
+
+    results = [None] * len(items)
+    next_index = [0]
+    lock = threading.Lock()
+    report_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next_index[0]
+                if index >= len(items):
+                    return
+                next_index[0] = index + 1
+            results[index] = function(items[index])
+            if on_result is not None:
+                with report_lock:
+                    on_result(items[index], results[index])
+
+    if jobs == 1:
+        worker()
+    else:
+        worker = trace.bind(worker)
+        threads = [threading.Thread(target=worker) for i in range(jobs)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return results
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Record how long things take, as a list of spans.
+
+Code wraps interesting work in ``span()``, which costs almost
+nothing unless a ``Timings`` is recording. Recording is turned on
+either for the current thread (``Timings.recording()``, used by
+prepare) or for the whole process (``record_to_file()``, used by
+``conda-kapsel --trace FILE``). Worker threads don't inherit the
+current thread's recording unless the function they run is wrapped
+with ``bind()``.
+"""
+from __future__ import absolute_import, print_function
+
+import codecs
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+_global_lock = threading.Lock()
+_global_timings = []
+
+
+class Span(object):
+    """One timed piece of work."""
+
+    __slots__ = ('name', 'category', 'start', 'duration', 'thread_id', 'args')
+
+    def __init__(self, name, category, start, duration, thread_id, args):
+        """Construct a Span.
+
+        Args:
+            name (str): what we did, such as the command line we ran
+            category (str): kind of work, such as "subprocess" or "provide"
+            start (float): time the work started, from ``time.time()``
+            duration (float): seconds the work took
+            thread_id (int): thread the work happened on
+            args (dict): extra JSON-compatible details
+        """
+        self.name = name
+        self.category = category
+        self.start = start
+        self.duration = duration
+        self.thread_id = thread_id
+        self.args = args
+
+    def __repr__(self):
+        """Repr of the span."""
+        return "Span(%r, %r, %.3fs)" % (self.category, self.name, self.duration)
+
+
+class Timings(object):
+    """A thread-safe collection of spans."""
+
+    def __init__(self):
+        """Construct an empty Timings."""
+        self._spans = []
+        # spans which have started but not finished, by a key unique to each
+        self._unfinished = dict()
+        self._lock = threading.Lock()
+        self._filename = None
+        self._summary_file = None
+
+    def add(self, span):
+        """Add a span."""
+        with self._lock:
+            self._spans.append(span)
+
+    def _start(self, key, span):
+        with self._lock:
+            self._unfinished[key] = span
+
+    def _finish_while_locked(self, key, end):
+        started = self._unfinished.pop(key, None)
+        # None if finish_unfinished() already recorded it
+        if started is not None:
+            self._spans.append(Span(name=started.name,
+                                    category=started.category,
+                                    start=started.start,
+                                    duration=(end - started.start),
+                                    thread_id=started.thread_id,
+                                    args=started.args))
+
+    def _finish(self, key, end):
+        with self._lock:
+            self._finish_while_locked(key, end)
+
+    def finish_unfinished(self):
+        """Record every span still in progress as if it finished now.
+
+        Used before we ``exec``, since the spans around that never finish.
+        """
+        now = time.time()
+        with self._lock:
+            for key in list(self._unfinished.keys()):
+                self._finish_while_locked(key, now)
+
+    @property
+    def spans(self):
+        """Get a list of all the spans, in the order they finished."""
+        with self._lock:
+            return list(self._spans)
+
+    def to_chrome_trace(self):
+        """Get a dict in Chrome's trace event format, which you can save as JSON.
+
+        Load the file in chrome://tracing or https://ui.perfetto.dev to see it.
+        """
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            events.append(dict(name=span.name,
+                               cat=span.category,
+                               ph='X',
+                               ts=int(span.start * 1000000),
+                               dur=int(span.duration * 1000000),
+                               pid=pid,
+                               tid=span.thread_id,
+                               args=span.args))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def write_chrome_trace(self, filename):
+        """Save the spans to a file as Chrome trace event JSON."""
+        with codecs.open(filename, 'w', 'utf-8') as f:
+            json.dump(self.to_chrome_trace(), f, indent=1)
+
+    def summary(self):
+        """Get a table of where the time went, as a list of lines.
+
+        Spans with the same category and name are added together,
+        and the most expensive come first.
+        """
+        totals = dict()
+        for span in self.spans:
+            key = (span.category, span.name)
+            (count, total, longest) = totals.get(key, (0, 0.0, 0.0))
+            totals[key] = (count + 1, total + span.duration, max(longest, span.duration))
+
+        rows = sorted(totals.items(), key=lambda item: (-item[1][1], item[0]))
+        lines = ["%10s %10s %6s  %-12s %s" % ("total (s)", "max (s)", "count", "category", "name")]
+        for ((category, name), (count, total, longest)) in rows:
+            lines.append("%10.3f %10.3f %6d  %-12s %s" % (total, longest, count, category, name))
+        return lines
+
+    def span(self, name, category, **args):
+        """Like the ``span()`` function, but always records into this ``Timings``.
+
+        Unlike ``recording()``, this is safe to hold across a
+        coroutine's ``yield``, since it doesn't affect what other
+        code on the same thread records into.
+        """
+        active = _active()
+        if self not in active:
+            active.append(self)
+        return _span(active, name, category, args)
+
+    @contextmanager
+    def recording(self):
+        """Context manager which records spans from the current thread into this ``Timings``."""
+        stack = _thread_stack()
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.remove(self)
+
+
+def _thread_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = []
+        _local.stack = stack
+    return stack
+
+
+def _active():
+    active = list(getattr(_local, 'stack', ()))
+    if _global_timings:
+        with _global_lock:
+            active.extend(_global_timings)
+    return active
+
+
+def span(name, category, **args):
+    """Context manager which records how long the code inside it takes.
+
+    Args:
+        name (str): what we're doing
+        category (str): kind of work, such as "subprocess" or "provide"
+        args: extra JSON-compatible details to record
+    """
+    return _span(_active(), name, category, args)
+
+
+@contextmanager
+def _span(active, name, category, args):
+    if len(active) == 0:
+        yield
+        return
+
+    start = time.time()
+    started = Span(name=name,
+                   category=category,
+                   start=start,
+                   duration=None,
+                   thread_id=threading.current_thread().ident,
+                   args=args)
+    key = object()
+    for timings in active:
+        timings._start(key, started)
+    try:
+        yield
+    finally:
+        end = time.time()
+        for timings in active:
+            timings._finish(key, end)
+
+
+def bind(function):
+    """Wrap a function so it records into the current thread's ``Timings`` even when run on another thread."""
+    stack = list(getattr(_local, 'stack', ()))
+    if len(stack) == 0:
+        return function
+
+    def bound(*args, **kwargs):
+        saved = getattr(_local, 'stack', None)
+        _local.stack = list(stack)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.stack = saved
+
+    return bound
+
+
+def record_to_file(filename, summary_file=None):
+    """Start recording spans from every thread, to be saved as Chrome trace JSON by ``write_files()``.
+
+    Args:
+        filename (str): where to save the trace
+        summary_file (file): if not None, also print ``Timings.summary()`` here
+
+    Returns:
+        the ``Timings`` we'll save
+    """
+    timings = Timings()
+    timings._filename = filename
+    timings._summary_file = summary_file
+    with _global_lock:
+        _global_timings.append(timings)
+    return timings
+
+
+def write_files():
+    """Stop everything started by ``record_to_file()`` and save the files.
+
+    This must happen before we replace our process with ``exec``,
+    since nothing runs after that.
+
+    Returns:
+        list of the ``Timings`` we saved
+    """
+    with _global_lock:
+        finished = list(_global_timings)
+        del _global_timings[:]
+    for timings in finished:
+        # such as the span around the whole command, when we exec from inside it
+        timings.finish_unfinished()
+        timings.write_chrome_trace(timings._filename)
+        if timings._summary_file is not None:
+            for line in timings.summary():
+                print(line, file=timings._summary_file)
+    return finished
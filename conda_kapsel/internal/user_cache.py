@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Persistent caches of JSON values, usually in the per-user cache directory."""
+from __future__ import absolute_import, print_function
+
+import codecs
+import json
+import os
+import platform
+import uuid
+
+from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+from conda_kapsel.internal.rename import rename_over_existing
+
+# this can be set to relocate the cache, which is mostly useful
+# for CI machines and for tests.
+CACHE_DIRECTORY_VARIABLE = 'CONDA_KAPSEL_CACHE_DIR'
+
+
+def user_cache_directory():
+    """Get the directory where we keep caches for the current user (it may not exist yet)."""
+    override = os.environ.get(CACHE_DIRECTORY_VARIABLE, '')
+    if override != '':
+        return override
+
+    if platform.system() == 'Windows':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser("~\\AppData\\Local"))
+        return os.path.join(base, "conda-kapsel", "Cache")
+    elif platform.system() == 'Darwin':
+        return os.path.expanduser("~/Library/Caches/conda-kapsel")
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', '')
+        if base == '':
+            base = os.path.expanduser("~/.cache")
+        return os.path.join(base, "conda-kapsel")
+
+
+def file_stat_key(path):
+    """Get a JSON-compatible value which changes whenever the file at path is modified, created, or deleted."""
+    try:
+        st = os.stat(path)
+        return [path, st.st_mtime, st.st_size]
+    except OSError:
+        return [path, None, None]
+
+
+def load_keyed_json(filename, key):
+    """Load the value saved by ``save_keyed_json()`` in the given file.
+
+    A cache miss (the file is missing, unreadable, corrupt, or was
+    saved with a different key) is never an error.
+
+    Args:
+        filename (str): path to the cache file
+        key: JSON-compatible value the saved key must be equal to
+
+    Returns:
+        the cached value, or None if there isn't a valid one
+    """
+    try:
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            saved = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    # round-trip the key so tuples and lists compare equal
+    if not isinstance(saved, dict) or saved.get('key') != json.loads(json.dumps(key)):
+        return None
+    return saved.get('value', None)
+
+
+def save_keyed_json(filename, key, value):
+    """Save a value and the key it was computed from, replacing the file atomically.
+
+    Failure to write the file is silently ignored, since the
+    cache is only an optimization.
+
+    Args:
+        filename (str): path to the cache file
+        key: JSON-compatible value identifying what ``value`` was computed from
+        value: JSON-compatible value to save
+
+    Returns:
+        None
+    """
+    tmp = filename + ".tmp-" + str(uuid.uuid4())
+    try:
+        makedirs_ok_if_exists(os.path.dirname(filename))
+        with codecs.open(tmp, 'w', 'utf-8') as f:
+            json.dump(dict(key=key, value=value), f)
+        rename_over_existing(tmp, filename)
+    except (IOError, OSError, TypeError, ValueError):
+        pass
+    finally:
+        try:
+            os.remove(tmp)
+        except (IOError, OSError):
+            pass
+
+
+def _cache_filename(name):
+    return os.path.join(user_cache_directory(), name + ".json")
+
+
+def load_cached_json(name, key):
+    """Load a value from the named file in the user cache directory (see ``load_keyed_json()``)."""
+    return load_keyed_json(_cache_filename(name), key)
+
+
+def save_cached_json(name, key, value):
+    """Save a value to the named file in the user cache directory (see ``save_keyed_json()``)."""
+    save_keyed_json(_cache_filename(name), key, value)
@@ -7,8 +7,10 @@
 """Project "local state" file loading and manipulation."""
 from __future__ import absolute_import
 
+from copy import deepcopy
 import os
 
+from conda_kapsel.internal.file_lock import locked_file
 from conda_kapsel.yaml_file import YamlFile
 
 # these are in the order we'll use them if multiple are present
@@ -30,6 +32,11 @@ class LocalStateFile(YamlFile):
     save in a way that conflicts with your loads and saves.
     """
 
+    # several processes running the same project may save their
+    # variables and service run states at once; merging inside
+    # the sections means they don't lose each other's entries.
+    _merge_depth = 2
+
     @classmethod
     def load_for_directory(cls, directory):
         """Load the project local state file from the given directory, even if it doesn't exist.
@@ -82,6 +89,33 @@ class LocalStateFile(YamlFile):
             raise ValueError("service state should be a dict")
         self.set_value([SERVICE_RUN_STATES_SECTION, service_name], state)
 
+    def transform_service_run_state(self, service_name, func):
+        """Run a function which takes and potentially modifies the state of a service, then save it.
+
+        Another process may be checking or starting the same
+        service, so this holds a lock on the file, picks up that
+        service's state from disk (unless we've changed it in
+        memory), and saves any change before letting go.
+
+        Args:
+            service_name (str): environment variable identifying the service
+            func (function): function to run, passing it a copy of the current state dict
+
+        Returns:
+            Whatever ``func`` returns.
+        """
+        path = [SERVICE_RUN_STATES_SECTION, service_name]
+        with locked_file(self.filename):
+            reloaded = self._reload_value_if_unchanged(path)
+            old_state = self.get_service_run_state(service_name)
+            modified = deepcopy(old_state)
+            result = func(modified)
+            if modified != old_state:
+                self.set_service_run_state(service_name, modified)
+            if reloaded or modified != old_state:
+                self._save_while_locked()
+        return result
+
     def get_service_run_state(self, service_name):
         """Get the running instance state for a service.
 
@@ -12,14 +12,20 @@ from copy import deepcopy
 import os
 import shutil
 import subprocess
+import threading
 
 from conda_kapsel.internal import conda_api
 from conda_kapsel.internal.metaclass import with_metaclass
 from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+from conda_kapsel.internal.run_in_thread import run_in_thread
 from conda_kapsel.internal.simple_status import SimpleStatus
 import conda_kapsel.internal.keyring as keyring
 
 
+# providers may run in parallel, and several of them may save run states
+_service_run_state_lock = threading.Lock()
+
+
 def _service_directory(local_state_file, relative_name):
     return os.path.join(os.path.dirname(local_state_file.filename), "services", relative_name)
 
@@ -69,13 +75,8 @@ class ProvideContext(object):
         Returns:
             Whatever ``func`` returns.
         """
-        old_state = self._local_state_file.get_service_run_state(service_name)
-        modified = deepcopy(old_state)
-        result = func(modified)
-        if modified != old_state:
-            self._local_state_file.set_service_run_state(service_name, modified)
-            self._local_state_file.save()
-        return result
+        with _service_run_state_lock:
+            return self._local_state_file.transform_service_run_state(service_name, func)
 
     @property
     def status(self):
@@ -241,6 +242,95 @@ class ProvideResult(object):
 _emptyProvideResult = ProvideResult()
 
 
+class PlanStep(object):
+    """One thing ``provide()`` would do, as described by ``Provider.plan()``.
+
+    Instances of this class are immutable.
+    """
+
+    def __init__(self, requirement, action, description, urls=(), download_bytes=None, resumable=None,
+                 details=None):
+        """Create a PlanStep.
+
+        Args:
+            requirement (Requirement): requirement the step is for
+            action (str): kind of step, such as "create_environment", "download", or "start_service"
+            description (str): one-line description of the step
+            urls (iterable of str): files we'd download, so their sizes can be looked up
+            download_bytes (int): total size of the downloads, or None if unknown
+            resumable (bool): whether the downloads could resume after failing, or None if unknown
+            details (dict): extra JSON-compatible information about the step
+        """
+        if details is None:
+            details = dict()
+        self._requirement = requirement
+        self._action = action
+        self._description = description
+        self._urls = tuple(urls)
+        self._download_bytes = download_bytes
+        self._resumable = resumable
+        self._details = details
+
+    def __repr__(self):
+        """Repr of the step."""
+        return "PlanStep(%r, %r)" % (self._action, self._description)
+
+    def copy_with_sizes(self, download_bytes, resumable):
+        """Copy this step, filling in the size of its downloads."""
+        return PlanStep(requirement=self._requirement,
+                        action=self._action,
+                        description=self._description,
+                        urls=self._urls,
+                        download_bytes=download_bytes,
+                        resumable=resumable,
+                        details=self._details)
+
+    @property
+    def requirement(self):
+        """Get the requirement the step is for."""
+        return self._requirement
+
+    @property
+    def action(self):
+        """Get the kind of step, such as "create_environment", "download", or "start_service"."""
+        return self._action
+
+    @property
+    def description(self):
+        """Get a one-line description of the step."""
+        return self._description
+
+    @property
+    def urls(self):
+        """Get the URLs of files this step would download."""
+        return self._urls
+
+    @property
+    def download_bytes(self):
+        """Get the total size of the downloads, or None if unknown."""
+        return self._download_bytes
+
+    @property
+    def resumable(self):
+        """Get whether the downloads could resume after failing, or None if unknown."""
+        return self._resumable
+
+    @property
+    def details(self):
+        """Get a dict of extra information about the step."""
+        return self._details
+
+    def to_json(self):
+        """Get the step as a JSON-compatible dict."""
+        return dict(env_var=getattr(self._requirement, 'env_var', None),
+                    action=self._action,
+                    description=self._description,
+                    urls=list(self._urls),
+                    download_bytes=self._download_bytes,
+                    resumable=self._resumable,
+                    details=self._details)
+
+
 class Provider(with_metaclass(ABCMeta)):
     """A Provider can take some action to meet a Requirement."""
 
@@ -339,6 +429,37 @@ class Provider(with_metaclass(ABCMeta)):
                                 missing_env_vars_to_configure=missing_to_configure,
                                 missing_env_vars_to_provide=missing_to_provide)
 
+    def analysis_environ_keys(self, requirement):
+        """Get the names of the environment variables ``analyze()`` looks at.
+
+        Prepare reuses an analysis until one of these variables
+        changes. Return None (the default) if the analysis may
+        depend on any variable.
+
+        Args:
+            requirement (Requirement): requirement we want to meet
+
+        Returns:
+            iterable of environment variable names, or None for all of them
+        """
+        return None
+
+    def provide_depends_on_conda_env(self, requirement):
+        """Get whether ``provide()`` needs the project's conda environment to exist first.
+
+        Prepare runs providers at the same time when they don't
+        depend on each other. Providers which run programs from the
+        environment, or look things up by its prefix, must return
+        True so they wait for the environment to be set up.
+
+        Args:
+            requirement (Requirement): requirement we want to meet
+
+        Returns:
+            True if provide() has to run after the conda environment is ready
+        """
+        return True
+
     @abstractmethod
     def provide(self, requirement, context):
         """Execute the provider, fulfilling the requirement.
@@ -357,6 +478,48 @@ class Provider(with_metaclass(ABCMeta)):
         """
         pass  # pragma: no cover
 
+    def provide_async(self, requirement, context):
+        """Execute the provider as a coroutine on the current tornado ``IOLoop``.
+
+        The default runs ``provide()`` on a new thread, so the
+        ``IOLoop`` isn't blocked while it works. Providers which
+        wait on network or other IO can override this with a
+        coroutine which doesn't need the thread.
+
+        Args:
+            requirement (Requirement): requirement we want to meet
+            context (ProvideContext): context containing project state
+
+        Returns:
+            a tornado ``Future`` with a ``ProvideResult`` instance
+
+        """
+        return run_in_thread(self.provide, requirement, context)
+
+    def plan(self, requirement, context, mode):
+        """Describe what ``provide()`` would do in the given mode, without doing it.
+
+        The context is always in ``PROVIDE_MODE_CHECK``, so it's
+        safe to call ``provide()`` with it. Set the values
+        ``provide()`` would set in ``context.environ`` (as far as
+        they can be known in advance), so requirements planned
+        later see them.
+
+        The default describes an unmet requirement as one step.
+
+        Args:
+            requirement (Requirement): requirement we want to meet
+            context (ProvideContext): context containing project state, in check mode
+            mode (str): the mode ``provide()`` would run in
+
+        Returns:
+            a list of ``PlanStep``
+        """
+        if context.status:
+            return []
+        else:
+            return [PlanStep(requirement, 'provide', "provide %s" % requirement.title)]
+
     @abstractmethod
     def unprovide(self, requirement, environ, local_state_file, overrides, requirement_status=None):
         """Undo the provide, cleaning up any files or processes we created.
@@ -397,6 +560,14 @@ class EnvVarProvider(Provider):
         """Override superclass to require env prefix."""
         return self.missing_env_vars_to_configure(requirement, environ, local_state_file)
 
+    def analysis_environ_keys(self, requirement):
+        """Override superclass; we only read our own variable, plus the env prefix for the keyring."""
+        return (requirement.env_var, 'PROJECT_DIR', conda_api.conda_prefix_variable())
+
+    def provide_depends_on_conda_env(self, requirement):
+        """Override superclass; only encrypted variables use the environment, to find the keyring entry."""
+        return requirement.encrypted
+
     def _get_env_prefix(self, environ):
         # on unix, ENV_PATH is the prefix and DEFAULT_ENV can be just a name,
         # on windows DEFAULT_ENV is always the prefix
@@ -603,6 +774,14 @@ class EnvVarProvider(Provider):
 
         return ProvideResult.empty().copy_with_additions(errors, logs)
 
+    def plan(self, requirement, context, mode):
+        """Override superclass to set the variable as provide() would, or say it needs configuring."""
+        EnvVarProvider.provide(self, requirement, context)
+        if requirement.env_var in context.environ:
+            return []
+        else:
+            return [PlanStep(requirement, 'configure', "configure %s" % requirement.env_var, download_bytes=0)]
+
     def unprovide(self, requirement, environ, local_state_file, overrides, requirement_status=None):
         """Override superclass to return success always."""
         return SimpleStatus(success=True, description=("Nothing to clean up for %s." % requirement.env_var))
@@ -13,7 +13,7 @@ import shutil
 from conda_kapsel.internal import conda_api
 from conda_kapsel.internal.simple_status import SimpleStatus
 from conda_kapsel.conda_manager import new_conda_manager, CondaManagerError
-from conda_kapsel.plugins.provider import EnvVarProvider
+from conda_kapsel.plugins.provider import EnvVarProvider, PlanStep
 from conda_kapsel.provide import PROVIDE_MODE_CHECK
 
 
@@ -183,6 +183,20 @@ class CondaEnvProvider(EnvVarProvider):
 </form>
 """ % (options_html)
 
+    def analysis_environ_keys(self, requirement):
+        """Override superclass; our config depends on the inherited environment too, so look at all of it."""
+        return None
+
+    def provide_depends_on_conda_env(self, requirement):
+        """Override superclass; this provider is what creates the environment."""
+        return False
+
+    def _env_spec_for_prefix(self, requirement, project_dir, prefix):
+        for env in requirement.env_specs.values():
+            if env.path(project_dir) == prefix:
+                return env
+        return None
+
     def provide(self, requirement, context):
         """Override superclass to create or update our environment."""
         assert 'PATH' in context.environ
@@ -214,11 +228,7 @@ class CondaEnvProvider(EnvVarProvider):
         if context.mode != PROVIDE_MODE_CHECK:
             # we update the environment in both prod and dev mode
 
-            env_spec = None
-            for env in requirement.env_specs.values():
-                if env.path(project_dir) == prefix:
-                    env_spec = env
-                    break
+            env_spec = self._env_spec_for_prefix(requirement, project_dir, prefix)
 
             # TODO if not creating a named env, we could use the
             # shared packages, but for now we leave it alone
@@ -240,6 +250,55 @@ class CondaEnvProvider(EnvVarProvider):
 
         return super_result
 
+    def plan(self, requirement, context, mode):
+        """Override superclass to describe creating or updating our environment."""
+        # in check mode this only sets the prefix and PATH
+        self.provide(requirement, context)
+
+        prefix = context.environ[requirement.env_var]
+        env_spec = self._env_spec_for_prefix(requirement, context.environ['PROJECT_DIR'], prefix)
+        if env_spec is None:
+            # an inherited environment we don't manage
+            return []
+
+        if os.path.isdir(os.path.join(prefix, 'conda-meta')):
+            action = 'update_environment'
+        else:
+            action = 'create_environment'
+        verb = action.split('_')[0]
+        details = dict(env_spec=env_spec.name, prefix=prefix)
+
+        try:
+            deviations = self._conda.find_environment_deviations(prefix, env_spec)
+            if deviations.ok:
+                return []
+            fix = self._conda.plan_environment_fix(prefix, env_spec, deviations)
+        except CondaManagerError as e:
+            details['error'] = str(e)
+            return [PlanStep(requirement, action, "%s environment %s (%s)" % (verb, env_spec.name, str(e)),
+                             details=details)]
+
+        counts = ["%d packages" % len(fix.packages)]
+        if fix.from_lockfile:
+            counts.append("%d already downloaded" % len(fix.cached_urls))
+        if len(fix.pip_packages) > 0:
+            counts.append("%d pip packages" % len(fix.pip_packages))
+        details.update(packages=list(fix.packages),
+                       pip_packages=list(fix.pip_packages),
+                       cached_packages=len(fix.cached_urls),
+                       from_lockfile=fix.from_lockfile)
+        if fix.from_lockfile and len(fix.urls) == 0 and len(fix.pip_packages) == 0:
+            # everything is in the package cache
+            download_bytes = 0
+        else:
+            download_bytes = None
+        return [PlanStep(requirement,
+                         action,
+                         "%s environment %s (%s)" % (verb, env_spec.name, ", ".join(counts)),
+                         urls=fix.urls,
+                         download_bytes=download_bytes,
+                         details=details)]
+
     def unprovide(self, requirement, environ, local_state_file, overrides, requirement_status=None):
         """Override superclass to delete project-scoped envs directory."""
         config = self.read_config(requirement,
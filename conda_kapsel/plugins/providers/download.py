@@ -10,12 +10,14 @@ from __future__ import print_function
 import os
 import shutil
 
+from tornado import gen
 from tornado.ioloop import IOLoop
 
 from conda_kapsel.internal.http_client import FileDownloader
+from conda_kapsel.internal import trace
 from conda_kapsel.internal.ziputils import unpack_zip
 from conda_kapsel.internal.simple_status import SimpleStatus
-from conda_kapsel.plugins.provider import EnvVarProvider, ProviderAnalysis
+from conda_kapsel.plugins.provider import EnvVarProvider, PlanStep, ProviderAnalysis
 from conda_kapsel.provide import PROVIDE_MODE_CHECK
 
 
@@ -95,11 +97,16 @@ class DownloadProvider(EnvVarProvider):
                                          analysis.missing_env_vars_to_provide,
                                          existing_filename=existing_filename)
 
-    def _provide_download(self, requirement, context, errors, logs):
+    def provide_depends_on_conda_env(self, requirement):
+        """Override superclass; downloading doesn't need the conda environment."""
+        return False
+
+    @gen.coroutine
+    def _provide_download(self, requirement, context, errors, logs, io_loop):
         filename = context.status.analysis.existing_filename
         if filename is not None:
             logs.append("Previously downloaded file located at {}".format(filename))
-            return filename
+            raise gen.Return(filename)
 
         filename = os.path.abspath(os.path.join(context.environ['PROJECT_DIR'], requirement.filename))
         if requirement.unzip:
@@ -110,33 +117,29 @@ class DownloadProvider(EnvVarProvider):
                                   filename=download_filename,
                                   hash_algorithm=requirement.hash_algorithm)
 
+        # gen.Return is an exception, so we can't raise it inside the try
+        result = None
         try:
-            _ioloop = IOLoop(make_current=False)
-            response = _ioloop.run_sync(lambda: download.run(_ioloop))
+            with trace.span("download " + requirement.env_var, 'download', url=requirement.url):
+                response = yield download.run(io_loop)
             if response is None:
                 for error in download.errors:
                     errors.append(error)
-                return None
             elif response.code == 200:
                 if requirement.hash_value is not None and requirement.hash_value != download.hash:
                     errors.append("Error downloading {}: mismatched hashes. Expected: {}, calculated: {}".format(
                         requirement.url, requirement.hash_value, download.hash))
-                    return None
-                if requirement.unzip:
+                elif requirement.unzip:
                     if unpack_zip(download_filename, filename, errors):
                         os.remove(download_filename)
-                        return filename
-                    else:
-                        return None
-                return filename
+                        result = filename
+                else:
+                    result = filename
             else:
                 errors.append("Error downloading {}: response code {}".format(requirement.url, response.code))
-                return None
         except Exception as e:
             errors.append("Error downloading {}: {}".format(requirement.url, str(e)))
-            return None
-        finally:
-            _ioloop.close()
+        raise gen.Return(result)
 
     def provide(self, requirement, context):
         """Override superclass to start a download..
@@ -144,21 +147,53 @@ class DownloadProvider(EnvVarProvider):
         If it locates a downloaded file with matching checksum, it sets the
         requirement's env var to that filename.
 
+        This runs ``provide_async()`` on a private ``IOLoop``.
         """
+        _ioloop = IOLoop(make_current=False)
+        try:
+            return _ioloop.run_sync(lambda: self._provide_on_loop(requirement, context, _ioloop))
+        finally:
+            _ioloop.close()
+
+    def provide_async(self, requirement, context):
+        """Override superclass to download on the current ``IOLoop`` rather than a thread."""
+        return self._provide_on_loop(requirement, context, IOLoop.current())
+
+    @gen.coroutine
+    def _provide_on_loop(self, requirement, context, io_loop):
         super_result = super(DownloadProvider, self).provide(requirement, context)
 
         if context.mode == PROVIDE_MODE_CHECK:
-            return super_result
+            raise gen.Return(super_result)
         # we do the download in both prod and dev mode
 
         errors = []
         logs = []
         if requirement.env_var not in context.environ or context.status.analysis.config['source'] == 'download':
-            filename = self._provide_download(requirement, context, errors, logs)
+            filename = yield self._provide_download(requirement, context, errors, logs, io_loop)
             if filename is not None:
                 context.environ[requirement.env_var] = filename
 
-        return super_result.copy_with_additions(errors=errors, logs=logs)
+        raise gen.Return(super_result.copy_with_additions(errors=errors, logs=logs))
+
+    def plan(self, requirement, context, mode):
+        """Override superclass to describe the download, if we'd need one."""
+        super(DownloadProvider, self).provide(requirement, context)
+        if requirement.env_var in context.environ and context.status.analysis.config['source'] != 'download':
+            return []
+
+        existing_filename = context.status.analysis.existing_filename
+        if existing_filename is not None:
+            context.environ[requirement.env_var] = existing_filename
+            return []
+
+        filename = os.path.abspath(os.path.join(context.environ['PROJECT_DIR'], requirement.filename))
+        context.environ[requirement.env_var] = filename
+        return [PlanStep(requirement,
+                         'download',
+                         "download %s from %s" % (requirement.env_var, requirement.url),
+                         urls=[requirement.url],
+                         details=dict(filename=filename, unzip=requirement.unzip))]
 
     def unprovide(self, requirement, environ, local_state_file, overrides, requirement_status=None):
         """Override superclass to delete the downloaded file."""
@@ -14,11 +14,11 @@ import subprocess
 import sys
 import time
 
-from conda_kapsel.plugins.provider import (EnvVarProvider, ProviderAnalysis, shutdown_service_run_state,
+from conda_kapsel.plugins.provider import (EnvVarProvider, PlanStep, ProviderAnalysis, shutdown_service_run_state,
                                            delete_service_directory)
 import conda_kapsel.plugins.network_util as network_util
 from conda_kapsel.provide import PROVIDE_MODE_DEVELOPMENT
-from conda_kapsel.internal import py2_compat
+from conda_kapsel.internal import environ_overlay, py2_compat
 
 _DEFAULT_SYSTEM_REDIS_HOST = "localhost"
 _DEFAULT_SYSTEM_REDIS_PORT = 6379
@@ -182,6 +182,14 @@ class RedisProvider(EnvVarProvider):
                                       existing_scoped_instance_url=previous,
                                       default_system_exists=systemwide)
 
+    def _find_free_port(self, lower, upper):
+        port = lower
+        while port <= upper:
+            if not network_util.can_connect_to_socket(host='localhost', port=port):
+                return port
+            port += 1
+        return None
+
     def _provide_system(self, requirement, context, errors, logs):
         if context.status.analysis.default_system_exists:
             logs.append("Found system default Redis at %s" % _DEFAULT_SYSTEM_REDIS_URL)
@@ -218,12 +226,8 @@ class RedisProvider(EnvVarProvider):
             # pick the port" mode.
             LOWER_PORT = config['lower_port']
             UPPER_PORT = config['upper_port']
-            port = LOWER_PORT
-            while port <= UPPER_PORT:
-                if not network_util.can_connect_to_socket(host='localhost', port=port):
-                    break
-                port += 1
-            if port > UPPER_PORT:
+            port = self._find_free_port(LOWER_PORT, UPPER_PORT)
+            if port is None:
                 errors.append(("All ports from {lower} to {upper} were in use, " +
                                "could not start redis-server on one of them.").format(lower=LOWER_PORT,
                                                                                       upper=UPPER_PORT))
@@ -247,7 +251,7 @@ class RedisProvider(EnvVarProvider):
             try:
                 popen = subprocess.Popen(args=command,
                                          stderr=subprocess.PIPE,
-                                         env=py2_compat.env_without_unicode(context.environ))
+                                         env=py2_compat.env_without_unicode(environ_overlay.flatten(context.environ)))
             except Exception as e:
                 errors.append("Error executing redis-server: %s" % (str(e)))
                 return None
@@ -303,6 +307,10 @@ class RedisProvider(EnvVarProvider):
 
         return context.transform_service_run_state(requirement.env_var, ensure_redis)
 
+    def provide_depends_on_conda_env(self, requirement):
+        """Override superclass; redis-server may come from the conda environment."""
+        return True
+
     def provide(self, requirement, context):
         """Override superclass to start a project-scoped redis-server.
 
@@ -335,6 +343,35 @@ class RedisProvider(EnvVarProvider):
 
         return super_result.copy_with_additions(errors=errors, logs=logs)
 
+    def plan(self, requirement, context, mode):
+        """Override superclass to describe starting a redis-server, if we'd need one."""
+        # in check mode this finds a configured or system Redis, but doesn't start one
+        self.provide(requirement, context)
+        if requirement.env_var in context.environ:
+            return []
+
+        config = context.status.analysis.config
+        if mode != PROVIDE_MODE_DEVELOPMENT or config['source'] not in ('find_project', 'find_all'):
+            return super(RedisProvider, self).plan(requirement, context, mode)
+
+        url = context.status.analysis.existing_scoped_instance_url
+        if url is not None:
+            context.environ[requirement.env_var] = url
+            return []
+
+        port = self._find_free_port(config['lower_port'], config['upper_port'])
+        if port is None:
+            description = "start redis-server (but all ports from %d to %d are in use)" % (
+                config['lower_port'], config['upper_port'])
+            return [PlanStep(requirement, 'start_service', description, download_bytes=0)]
+
+        context.environ[requirement.env_var] = "redis://localhost:{port}".format(port=port)
+        return [PlanStep(requirement,
+                         'start_service',
+                         "start redis-server on port %d" % port,
+                         download_bytes=0,
+                         details=dict(port=port))]
+
     def unprovide(self, requirement, environ, local_state_file, overrides, requirement_status=None):
         """Override superclass to shut down any redis-server we started."""
         status = shutdown_service_run_state(local_state_file, requirement.env_var)
@@ -19,6 +19,7 @@ from conda_kapsel.test.environ_utils import minimal_environ, strip_environ
 from conda_kapsel.internal.test.http_utils import http_get_async, http_post_async
 from conda_kapsel.local_state_file import DEFAULT_LOCAL_STATE_FILENAME
 from conda_kapsel.local_state_file import LocalStateFile
+from conda_kapsel.plugins.provider import ProvideContext
 from conda_kapsel.plugins.registry import PluginRegistry
 from conda_kapsel.plugins.requirement import UserConfigOverrides
 from conda_kapsel.plugins.providers.download import DownloadProvider
@@ -28,6 +29,7 @@ from conda_kapsel import provide
 from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 
 from tornado import gen
+from tornado.ioloop import IOLoop
 
 DATAFILE_CONTENT = ("downloads:\n"
                     "    DATAFILE:\n"
@@ -201,6 +203,47 @@ def test_provide_minimal(monkeypatch):
     with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: MIN_DATAFILE_CONTENT}, provide_download)
 
 
+def test_provide_async_downloads_on_current_loop(monkeypatch):
+    def provide_download(dirname):
+        loops = []
+
+        @gen.coroutine
+        def mock_downloader_run(self, loop):
+            loops.append(loop)
+
+            class Res:
+                pass
+
+            res = Res()
+            res.code = 200
+            with open(os.path.join(dirname, 'data.csv'), 'w') as out:
+                out.write('data')
+            raise gen.Return(res)
+
+        monkeypatch.setattr("conda_kapsel.internal.http_client.FileDownloader.run", mock_downloader_run)
+        requirement = _download_requirement()
+        local_state_file = LocalStateFile.load_for_directory(dirname)
+        environ = minimal_environ(PROJECT_DIR=dirname)
+        status = requirement.check_status(environ, local_state_file, 'default', UserConfigOverrides())
+        context = ProvideContext(environ=environ,
+                                 local_state_file=local_state_file,
+                                 default_env_spec_name='default',
+                                 status=status,
+                                 mode=provide.PROVIDE_MODE_DEVELOPMENT)
+
+        io_loop = IOLoop(make_current=False)
+        try:
+            result = io_loop.run_sync(lambda: status.provider.provide_async(requirement, context))
+        finally:
+            io_loop.close()
+
+        assert [] == result.errors
+        assert [io_loop] == loops
+        assert os.path.join(dirname, 'data.csv') == context.environ['DATAFILE']
+
+    with_directory_contents(dict(), provide_download)
+
+
 def test_provide_no_download_in_check_mode(monkeypatch):
     MIN_DATAFILE_CONTENT = ("downloads:\n" "    DATAFILE: http://localhost/data.csv\n")
 
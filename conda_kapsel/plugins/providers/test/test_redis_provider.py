@@ -20,7 +20,7 @@ from conda_kapsel.plugins.registry import PluginRegistry
 from conda_kapsel.plugins.requirement import UserConfigOverrides
 from conda_kapsel.plugins.providers.redis import RedisProvider
 from conda_kapsel.plugins.requirements.redis import RedisRequirement
-from conda_kapsel.prepare import prepare_without_interaction, unprepare
+from conda_kapsel.prepare import prepare_plan, prepare_without_interaction, unprepare
 from conda_kapsel import provide
 from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 
@@ -820,3 +820,38 @@ def test_set_scope_in_local_state(monkeypatch):
 services:
   REDIS_URL: redis
 """}, prepare_after_setting_scope)
+
+
+def test_plan_local_redis_server(monkeypatch):
+    def mock_can_connect_to_socket(host, port, timeout_seconds=0.5):
+        # no system redis, and something else is on the first port
+        return port == 6380
+
+    monkeypatch.setattr("conda_kapsel.plugins.network_util.can_connect_to_socket", mock_can_connect_to_socket)
+
+    def plan_local_redis(dirname):
+        project = project_no_dedicated_env(dirname)
+        plan = prepare_plan(project, environ=minimal_environ(), provide_whitelist=['REDIS_URL'])
+        assert plan
+        assert 1 == len(plan.steps)
+        assert 'start_service' == plan.steps[0].action
+        assert "start redis-server on port 6381" == plan.steps[0].description
+        assert dict(port=6381) == plan.steps[0].details
+
+        # in production mode we wouldn't start one
+        plan = prepare_plan(project,
+                            environ=minimal_environ(),
+                            mode=provide.PROVIDE_MODE_PRODUCTION,
+                            provide_whitelist=['REDIS_URL'])
+        assert ['configure'] == [step.action for step in plan.steps]
+
+        # nothing to do if it's already set
+        plan = prepare_plan(project, environ=minimal_environ(REDIS_URL="redis://example.com:1234/"),
+                            provide_whitelist=['REDIS_URL'])
+        assert () == plan.steps
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, plan_local_redis)
@@ -7,9 +7,13 @@
 """Types related to project requirements."""
 from __future__ import absolute_import
 
+import threading
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 from copy import deepcopy
 
+import conda_kapsel.internal.keyring as keyring
+import conda_kapsel.internal.trace as trace
 from conda_kapsel.internal.metaclass import with_metaclass
 from conda_kapsel.internal.py2_compat import is_string
 from conda_kapsel.status import Status
@@ -39,6 +43,94 @@ class UserConfigOverrides(object):
         self._env_spec_name = value
 
 
+_active_analysis_cache = threading.local()
+
+
+class AnalysisCache(object):
+    """Remembers ``Provider.analyze()`` results while nothing they depend on changes.
+
+    Analysis can mean network and filesystem IO, and prepare checks
+    every requirement several times in a row. An entry is reused as
+    long as the provider class, the environment variables the provider
+    reads (see ``Provider.analysis_environ_keys()``), the local
+    state file's ``change_count``, the keyring, the default env spec
+    and the overrides are all the same as last time. After a
+    provider changes the world outside of those inputs, for example
+    by starting a service, call ``invalidate()`` for its requirement.
+
+    The cache is only consulted by ``check_status()`` while it's
+    active, see ``activated()``.
+    """
+
+    def __init__(self):
+        """Create an empty cache."""
+        self._entries = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, provider, requirement, environ, local_state_file, default_env_spec_name, overrides):
+        environ_keys = provider.analysis_environ_keys(requirement)
+        if environ_keys is None:
+            environ_part = tuple(sorted(environ.items()))
+        else:
+            environ_part = tuple((key, environ.get(key)) for key in environ_keys)
+        if overrides is None:
+            overrides_part = None
+        else:
+            overrides_part = (overrides.env_spec_name, overrides.inherited_env)
+        return (type(provider), environ_part, id(local_state_file), local_state_file.change_count,
+                keyring.change_count(), default_env_spec_name, overrides_part)
+
+    def analyze(self, provider, requirement, environ, local_state_file, default_env_spec_name, overrides):
+        """Get ``provider.analyze()`` for the requirement, reusing the last result if it's still valid."""
+        if local_state_file.has_uncounted_changes:
+            # change_count only moves on load and save, so it doesn't cover these edits
+            return _timed_analyze(provider, requirement, environ, local_state_file, default_env_spec_name, overrides)
+
+        key = self._key(provider, requirement, environ, local_state_file, default_env_spec_name, overrides)
+        with self._lock:
+            entry = self._entries.get(requirement)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        analysis = _timed_analyze(provider, requirement, environ, local_state_file, default_env_spec_name, overrides)
+        with self._lock:
+            self._entries[requirement] = (key, analysis)
+        return analysis
+
+    def invalidate(self, requirement):
+        """Forget the analysis for a requirement, if we have one."""
+        with self._lock:
+            self._entries.pop(requirement, None)
+
+    @contextmanager
+    def activated(self):
+        """Context manager which makes ``check_status()`` on this thread use the cache."""
+        previous = getattr(_active_analysis_cache, 'cache', None)
+        _active_analysis_cache.cache = self
+        try:
+            yield self
+        finally:
+            _active_analysis_cache.cache = previous
+
+
+def _timed_analyze(provider, requirement, environ, local_state_file, default_env_spec_name, overrides):
+    name = "analyze " + getattr(requirement, 'env_var', type(requirement).__name__)
+    with trace.span(name, 'analyze', provider=type(provider).__name__):
+        return provider.analyze(requirement, environ, local_state_file, default_env_spec_name, overrides)
+
+
+def _analyze(provider, requirement, environ, local_state_file, default_env_spec_name, overrides):
+    cache = getattr(_active_analysis_cache, 'cache', None)
+    if cache is None:
+        return _timed_analyze(provider, requirement, environ, local_state_file, default_env_spec_name, overrides)
+    else:
+        return cache.analyze(provider, requirement, environ, local_state_file, default_env_spec_name, overrides)
+
+
 class RequirementStatus(Status):
     """Class describing the status of a requirement.
 
@@ -184,7 +276,7 @@ class Requirement(with_metaclass(ABCMeta)):
     def _create_status(self, environ, local_state_file, default_env_spec_name, overrides, latest_provide_result,
                        has_been_provided, status_description, provider_class_name):
         provider = self.registry.find_provider_by_class_name(provider_class_name)
-        analysis = provider.analyze(self, environ, local_state_file, default_env_spec_name, overrides)
+        analysis = _analyze(provider, self, environ, local_state_file, default_env_spec_name, overrides)
         return RequirementStatus(self,
                                  has_been_provided=has_been_provided,
                                  status_description=status_description,
@@ -195,7 +287,7 @@ class Requirement(with_metaclass(ABCMeta)):
     def _create_status_from_analysis(self, environ, local_state_file, default_env_spec_name, overrides,
                                      latest_provide_result, provider_class_name, status_getter):
         provider = self.registry.find_provider_by_class_name(provider_class_name)
-        analysis = provider.analyze(self, environ, local_state_file, default_env_spec_name, overrides)
+        analysis = _analyze(provider, self, environ, local_state_file, default_env_spec_name, overrides)
         (has_been_provided, status_description) = status_getter(environ, local_state_file, analysis)
         return RequirementStatus(self,
                                  has_been_provided=has_been_provided,
@@ -77,7 +77,7 @@ def test_conda_fails_while_listing_installed(monkeypatch):
             from conda_kapsel.internal import conda_api
             raise conda_api.CondaError("sabotage!")
 
-        monkeypatch.setattr('conda_kapsel.internal.conda_api.installed', sabotaged_installed_command)
+        monkeypatch.setattr('conda_kapsel.internal.conda_spec_matcher.conda_meta_records', sabotaged_installed_command)
 
         project_dir_disable_dedicated_env(dirname)
         local_state = LocalStateFile.load_for_directory(dirname)
@@ -73,6 +73,27 @@ def test_provider_default_method_implementations():
                                           values=dict())
     # this is supposed to return None by default
     provider.config_html(requirement=None, environ=None, local_state_file=None, overrides=None, status=None) is None
+    # be safe and wait for the environment by default
+    assert provider.provide_depends_on_conda_env(requirement=None)
+
+
+def test_provide_depends_on_conda_env():
+    registry = PluginRegistry()
+    provider = EnvVarProvider()
+    assert not provider.provide_depends_on_conda_env(EnvVarRequirement(registry, env_var='FOO'))
+    assert provider.provide_depends_on_conda_env(EnvVarRequirement(registry, env_var='FOO_PASSWORD'))
+    assert not registry.find_provider_by_class_name('CondaEnvProvider').provide_depends_on_conda_env(None)
+    assert not registry.find_provider_by_class_name('DownloadProvider').provide_depends_on_conda_env(None)
+    assert registry.find_provider_by_class_name('RedisProvider').provide_depends_on_conda_env(None)
+
+
+def test_analysis_environ_keys():
+    registry = PluginRegistry()
+    keys = EnvVarProvider().analysis_environ_keys(EnvVarRequirement(registry, env_var='FOO'))
+    assert 'FOO' in keys
+    assert 'PROJECT_DIR' in keys
+    assert conda_api.conda_prefix_variable() in keys
+    assert registry.find_provider_by_class_name('CondaEnvProvider').analysis_environ_keys(None) is None
 
 
 def _load_env_var_requirement(dirname, env_var):
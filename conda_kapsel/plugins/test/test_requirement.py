@@ -4,8 +4,9 @@
 #
 # The full license is in the file LICENSE.txt, distributed with this software.
 # ----------------------------------------------------------------------------
+from conda_kapsel.plugins.provider import EnvVarProvider
 from conda_kapsel.plugins.registry import PluginRegistry
-from conda_kapsel.plugins.requirement import EnvVarRequirement, UserConfigOverrides
+from conda_kapsel.plugins.requirement import AnalysisCache, EnvVarRequirement, UserConfigOverrides
 
 from conda_kapsel.internal.test.tmpfile_utils import tmp_local_state_file
 
@@ -67,3 +68,68 @@ def test_requirement_status_repr():
     status = requirement.check_status(dict(FOO=''), tmp_local_state_file(), 'default', UserConfigOverrides())
     assert "RequirementStatus(False,'Environment variable FOO is not set.',EnvVarRequirement(env_var='FOO'))" == repr(
         status)
+
+
+def _counting_analyze(monkeypatch):
+    calls = []
+    real_analyze = EnvVarProvider.analyze
+
+    def counting_analyze(*args, **kwargs):
+        calls.append(args)
+        return real_analyze(*args, **kwargs)
+
+    monkeypatch.setattr(EnvVarProvider, 'analyze', counting_analyze)
+    return calls
+
+
+def test_analysis_cache_reuses_analysis(monkeypatch):
+    registry = PluginRegistry()
+    requirement = EnvVarRequirement(registry=registry, env_var='FOO')
+    calls = _counting_analyze(monkeypatch)
+    local_state = tmp_local_state_file()
+    cache = AnalysisCache()
+    environ = dict(FOO='bar', UNRELATED='1')
+
+    with cache.activated():
+        first = requirement.check_status(environ, local_state, 'default', UserConfigOverrides())
+        environ['UNRELATED'] = '2'
+        second = requirement.check_status(environ, local_state, 'default', UserConfigOverrides())
+    assert 1 == len(calls)
+    assert first.analysis is second.analysis
+    assert (1, 1) == (cache.hits, cache.misses)
+
+    # not active, so not used
+    requirement.check_status(environ, local_state, 'default', UserConfigOverrides())
+    assert 2 == len(calls)
+
+
+def test_analysis_cache_notices_changes(monkeypatch):
+    registry = PluginRegistry()
+    requirement = EnvVarRequirement(registry=registry, env_var='FOO')
+    calls = _counting_analyze(monkeypatch)
+    local_state = tmp_local_state_file()
+    cache = AnalysisCache()
+    environ = dict(FOO='bar')
+
+    def check():
+        with cache.activated():
+            return requirement.check_status(environ, local_state, 'default', UserConfigOverrides())
+
+    check()
+    environ['FOO'] = 'baz'
+    assert 'baz' == check().analysis.config['value']
+    assert 2 == len(calls)
+
+    # edits bypass the cache until they are saved, since only then does change_count move
+    local_state.set_value(['variables', 'FOO'], 'from_state')
+    assert 'from_state' == check().analysis.config['value']
+    assert 3 == len(calls)
+    local_state.save()
+    check()
+    check()
+    assert 4 == len(calls)
+
+    cache.invalidate(requirement)
+    cache.invalidate(requirement)
+    check()
+    assert 5 == len(calls)
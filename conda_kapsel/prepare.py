@@ -11,18 +11,27 @@ from __future__ import print_function
 from abc import ABCMeta, abstractmethod
 import os
 import sys
-from copy import deepcopy
+import threading
+
+from tornado import gen
+from tornado.locks import Semaphore
 
 from conda_kapsel.internal.metaclass import with_metaclass
 from conda_kapsel.internal import prepare_ui
 from conda_kapsel.internal.simple_status import SimpleStatus
 from conda_kapsel.internal.toposort import toposort_from_dependency_info
 from conda_kapsel.internal import conda_api
+from conda_kapsel.internal import http_client
+from conda_kapsel.internal import trace
+from conda_kapsel.internal.environ_overlay import changed_since, EnvironOverlay, Mapping
+from conda_kapsel.internal.run_in_thread import run_in_thread
+from conda_kapsel.internal.thread_pool import run_on_threads
 from conda_kapsel.internal.py2_compat import is_string
 from conda_kapsel.local_state_file import LocalStateFile
-from conda_kapsel.provide import (_all_provide_modes, PROVIDE_MODE_DEVELOPMENT)
+from conda_kapsel.provide import (_all_provide_modes, PROVIDE_MODE_CHECK, PROVIDE_MODE_DEVELOPMENT)
 from conda_kapsel.plugins.provider import ProvideContext
-from conda_kapsel.plugins.requirement import EnvVarRequirement, UserConfigOverrides
+from conda_kapsel.plugins.requirement import AnalysisCache, EnvVarRequirement, UserConfigOverrides
+from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
 
 
 def _update_environ(dest, src):
@@ -32,9 +41,8 @@ def _update_environ(dest, src):
     """
     # updating os.environ can be a memory leak, so we only update
     # those values that actually changed.
-    for key, value in src.items():
-        if key not in dest or dest[key] != value:
-            dest[key] = value
+    for key, value in changed_since(src, dest).items():
+        dest[key] = value
 
 
 class PrepareResult(with_metaclass(ABCMeta)):
@@ -46,6 +54,7 @@ class PrepareResult(with_metaclass(ABCMeta)):
         self._statuses = tuple(statuses)
         self._environ = environ
         self._overrides = overrides
+        self._timings = None
 
     def __bool__(self):
         """True if we were successful."""
@@ -81,6 +90,16 @@ class PrepareResult(with_metaclass(ABCMeta)):
             # be sure we print all these before the errors
             sys.stdout.flush()
 
+    @property
+    def timings(self):
+        """Get a ``Timings`` with spans for everything prepare did, or None if not available.
+
+        ``timings.summary()`` is a table of where the time went,
+        and ``timings.write_chrome_trace(filename)`` saves the spans
+        in a format Chrome's trace viewer can show.
+        """
+        return self._timings
+
     @property
     def statuses(self):
         """Get latest RequirementStatus if available.
@@ -106,6 +125,9 @@ class PrepareResult(with_metaclass(ABCMeta)):
 
         If ``failed`` is True, this environ dict may be unmodified
         from the original provided to the prepare function.
+
+        This is a mutable mapping but not necessarily a ``dict``;
+        use ``dict(result.environ)`` if you need one.
         """
         return self._environ
 
@@ -212,6 +234,16 @@ class PrepareStage(with_metaclass(ABCMeta)):
         """Run this step and return a new stage, or None if we are done or failed."""
         pass  # pragma: no cover
 
+    def execute_async(self):
+        """Run this step as a coroutine on the current tornado ``IOLoop``.
+
+        The default runs ``execute()`` on a new thread.
+
+        Returns:
+            a tornado ``Future`` with the new stage, or None if we are done or failed
+        """
+        return run_in_thread(self.execute)
+
     @property
     @abstractmethod
     def result(self):
@@ -269,8 +301,16 @@ def _refresh_status_list(old_statuses, rechecked_statuses):
 class _FunctionPrepareStage(PrepareStage):
     """A stage chain where the description and the execute function are passed in to the constructor."""
 
-    def __init__(self, environ, overrides, description, statuses, execute, config_context=None):
-        assert isinstance(environ, dict)
+    def __init__(self,
+                 environ,
+                 overrides,
+                 description,
+                 statuses,
+                 execute,
+                 config_context=None,
+                 timings=None,
+                 execute_async=None):
+        assert isinstance(environ, Mapping)
         assert config_context is None or isinstance(config_context, ConfigurePrepareContext)
         self._environ = environ
         self._overrides = overrides
@@ -281,7 +321,9 @@ class _FunctionPrepareStage(PrepareStage):
         self._description = description
         self._statuses_before_execute = statuses
         self._execute = execute
+        self._execute_async = execute_async
         self._config_context = config_context
+        self._timings = timings
 
     # def __repr__(self):
     #    return "_FunctionPrepareStage(%r)" % (self._description)
@@ -298,7 +340,16 @@ class _FunctionPrepareStage(PrepareStage):
         return self._config_context
 
     def execute(self):
-        return self._execute(self)
+        if self._timings is None:
+            return self._execute(self)
+        with self._timings.recording():
+            return self._execute(self)
+
+    def execute_async(self):
+        if self._execute_async is None:
+            return super(_FunctionPrepareStage, self).execute_async()
+        else:
+            return self._execute_async(self)
 
     @property
     def result(self):
@@ -331,6 +382,8 @@ class _FunctionPrepareStage(PrepareStage):
         assert result is not None
         self._statuses_after_execute = _refresh_status_list(self._statuses_before_execute, rechecked_statuses)
         self._result = result
+        if self._timings is not None:
+            result._timings = self._timings
 
 
 class _AndThenPrepareStage(PrepareStage):
@@ -356,6 +409,14 @@ class _AndThenPrepareStage(PrepareStage):
 
     def execute(self):
         next = self._stage.execute()
+        return self._after_execute(next)
+
+    @gen.coroutine
+    def execute_async(self):
+        next = yield self._stage.execute_async()
+        raise gen.Return(self._after_execute(next))
+
+    def _after_execute(self, next):
         if next is None:
             if self._stage.failed:
                 return None
@@ -433,49 +494,266 @@ def _in_provide_whitelist(provide_whitelist, requirement):
     return False
 
 
+# at most this many providers run at once
+_MAX_CONCURRENT_PROVIDERS = 4
+
+_REMOVED = object()
+
+
+def _provide_dependencies(to_provide):
+    # each status waits for earlier statuses (in toposort order) which
+    # provide env vars it needs, and for the conda environment if its
+    # provider uses the environment.
+    dependencies = dict()
+    for (index, status) in enumerate(to_provide):
+        missing = set(status.analysis.missing_env_vars_to_provide)
+        needs_env = status.provider.provide_depends_on_conda_env(status.requirement)
+        dependencies[status] = []
+        for earlier in to_provide[:index]:
+            if isinstance(earlier.requirement, CondaEnvRequirement):
+                if needs_env:
+                    dependencies[status].append(earlier)
+            elif getattr(earlier.requirement, 'env_var', None) in missing:
+                dependencies[status].append(earlier)
+    return dependencies
+
+
+def _environ_changes(overlay):
+    changes = sorted(overlay.changed.items())
+    changes.extend([(key, _REMOVED) for key in overlay.removed])
+    return changes
+
+
+def _apply_environ_changes(environ, changes):
+    for (key, value) in changes:
+        if value is _REMOVED:
+            environ.pop(key, None)
+        else:
+            environ[key] = value
+
+
+def _provide(status, context):
+    with trace.span("provide " + status.requirement.env_var, 'provide', provider=type(status.provider).__name__):
+        return status.provider.provide(status.requirement, context)
+
+
+@gen.coroutine
+def _provide_async(status, context, timings):
+    # recording() must not be held across a yield, since other
+    # coroutines on this thread would record into it; Timings.span() is fine.
+    with timings.span("provide " + status.requirement.env_var, 'provide', provider=type(status.provider).__name__):
+        with timings.recording():
+            future = status.provider.provide_async(status.requirement, context)
+        result = yield future
+    raise gen.Return(result)
+
+
+def _recheck(status, environ, local_state, default_env_spec_name, overrides, latest_provide_result=None):
+    with trace.span("check " + status.requirement.env_var, 'check_status'):
+        return status.recheck(environ, local_state, default_env_spec_name, overrides, latest_provide_result)
+
+
+def _all_dependencies(dependencies, status):
+    found = set()
+    pending = list(dependencies[status])
+    while pending:
+        dependency = pending.pop()
+        if dependency not in found:
+            found.add(dependency)
+            pending.extend(dependencies[dependency])
+    return found
+
+
+def _environ_for_provider(environ, to_provide, dependencies, changes, status):
+    # environ itself isn't modified until every provider is done;
+    # the provider sees only the changes from providers it depends on.
+    needed_environ = EnvironOverlay(environ)
+    needed = _all_dependencies(dependencies, status)
+    for earlier in to_provide:
+        if earlier in needed:
+            _apply_environ_changes(needed_environ, changes[earlier])
+    return EnvironOverlay(needed_environ)
+
+
+def _provide_all(to_provide, environ, local_state, default_env_spec_name, mode):
+    """Call provide() for each status, at the same time for those which don't depend on each other.
+
+    A provider sees the environ changes made by the providers it
+    depends on, but not those made by unrelated providers running
+    alongside it. When all are done, each provider's changes are
+    applied to ``environ`` in the order of ``to_provide``, so the
+    result doesn't depend on which provider finished first.
+
+    Returns:
+        dict from status to ``ProvideResult``
+    """
+    results = dict()
+    if len(to_provide) < 2:
+        for status in to_provide:
+            context = ProvideContext(environ, local_state, default_env_spec_name, status, mode)
+            results[status] = _provide(status, context)
+        return results
+
+    dependencies = _provide_dependencies(to_provide)
+    changes = dict()
+    started = set()
+    done = set()
+    failures = []
+    condition = threading.Condition()
+
+    def provide_one(status):
+        status_environ = _environ_for_provider(environ, to_provide, dependencies, changes, status)
+        context = ProvideContext(status_environ, local_state, default_env_spec_name, status, mode)
+        results[status] = _provide(status, context)
+        changes[status] = _environ_changes(status_environ)
+
+    def next_ready():
+        for status in to_provide:
+            if status not in started and all(dependency in done for dependency in dependencies[status]):
+                return status
+        return None
+
+    def worker():
+        while True:
+            with condition:
+                status = next_ready()
+                while status is None:
+                    if len(failures) > 0 or len(started) == len(to_provide):
+                        return
+                    condition.wait()
+                    status = next_ready()
+                if len(failures) > 0:
+                    return
+                started.add(status)
+            try:
+                provide_one(status)
+            except Exception as e:
+                with condition:
+                    failures.append(e)
+            with condition:
+                done.add(status)
+                condition.notify_all()
+
+    worker = trace.bind(worker)
+    threads = [threading.Thread(target=worker) for i in range(min(_MAX_CONCURRENT_PROVIDERS, len(to_provide)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if len(failures) > 0:
+        raise failures[0]
+
+    for status in to_provide:
+        _apply_environ_changes(environ, changes[status])
+    return results
+
+
+@gen.coroutine
+def _provide_all_async(to_provide, environ, local_state, default_env_spec_name, mode, timings):
+    """Like ``_provide_all()``, but calls ``provide_async()`` on the current ``IOLoop``.
+
+    Returns:
+        a tornado ``Future`` with a dict from status to ``ProvideResult``
+    """
+    results = dict()
+    if len(to_provide) < 2:
+        for status in to_provide:
+            context = ProvideContext(environ, local_state, default_env_spec_name, status, mode)
+            results[status] = yield _provide_async(status, context, timings)
+        raise gen.Return(results)
+
+    dependencies = _provide_dependencies(to_provide)
+    changes = dict()
+    futures = dict()
+    semaphore = Semaphore(_MAX_CONCURRENT_PROVIDERS)
+
+    @gen.coroutine
+    def provide_one(status):
+        for dependency in dependencies[status]:
+            yield futures[dependency]
+        with (yield semaphore.acquire()):
+            status_environ = _environ_for_provider(environ, to_provide, dependencies, changes, status)
+            context = ProvideContext(status_environ, local_state, default_env_spec_name, status, mode)
+            results[status] = yield _provide_async(status, context, timings)
+            changes[status] = _environ_changes(status_environ)
+
+    # dependencies always come earlier in to_provide, so their futures exist
+    for status in to_provide:
+        futures[status] = provide_one(status)
+    yield [futures[status] for status in to_provide]
+
+    for status in to_provide:
+        _apply_environ_changes(environ, changes[status])
+    raise gen.Return(results)
+
+
 def _configure_and_provide(project, environ, local_state, statuses, all_statuses, keep_going_until_success, mode,
-                           provide_whitelist, overrides, command, extra_command_args):
+                           provide_whitelist, overrides, command, extra_command_args, analysis_cache, timings):
 
     default_env_spec_name = project.default_env_spec_name_for_command(command)
 
-    def provide_stage(stage):
+    def check_before_providing():
         def get_missing_to_provide(status):
             return status.analysis.missing_env_vars_to_provide
 
         sorted = _sort_statuses(environ, local_state, statuses, get_missing_to_provide)
 
-        # we have to recheck all the statuses in case configuration happened
+        # we have to recheck all the statuses in case configuration happened;
+        # the cache notices configuration changes, so this is cheap if there weren't any
         rechecked = []
-        for status in sorted:
-            rechecked.append(status.recheck(environ, local_state, default_env_spec_name, overrides))
+        with analysis_cache.activated():
+            for status in sorted:
+                rechecked.append(_recheck(status, environ, local_state, default_env_spec_name, overrides))
 
+        to_provide = [status for status in rechecked
+                      if _in_provide_whitelist(provide_whitelist, status.requirement) and not status.has_been_provided]
+        return (rechecked, to_provide)
+
+    def provide_stage(stage):
+        (rechecked, to_provide) = check_before_providing()
+        results_by_status = _provide_all(to_provide, environ, local_state, default_env_spec_name, mode)
+        return finish_providing(stage, rechecked, to_provide, results_by_status)
+
+    def run_recorded_in_thread(function, *args):
+        def recorded():
+            with timings.recording():
+                return function(*args)
+
+        return run_in_thread(recorded)
+
+    @gen.coroutine
+    def provide_stage_async(stage):
+        # checking can block (analyze() may connect to a service or run
+        # "pip list"), so the checks go on a thread like plain stages do
+        (rechecked, to_provide) = yield run_recorded_in_thread(check_before_providing)
+        results_by_status = yield _provide_all_async(to_provide, environ, local_state, default_env_spec_name, mode,
+                                                     timings)
+        next_stage = yield run_recorded_in_thread(finish_providing, stage, rechecked, to_provide, results_by_status)
+        raise gen.Return(next_stage)
+
+    def finish_providing(stage, rechecked, to_provide, results_by_status):
         logs = []
         errors = []
-        did_any_providing = False
-        results_by_status = dict()
-
-        for status in rechecked:
-            if not _in_provide_whitelist(provide_whitelist, status.requirement):
-                continue
-            elif status.has_been_provided:
-                continue
-            else:
-                did_any_providing = True
-                context = ProvideContext(environ, local_state, default_env_spec_name, status, mode)
-                result = status.provider.provide(status.requirement, context)
-                logs.extend(result.logs)
-                errors.extend(result.errors)
-                results_by_status[status] = result
-
-        if did_any_providing:
+        for status in to_provide:
+            logs.extend(results_by_status[status].logs)
+            errors.extend(results_by_status[status].errors)
+
+        if len(to_provide) > 0:
+            # providing may have done things the cache key can't see, like starting a service
+            for status in to_provide:
+                analysis_cache.invalidate(status.requirement)
             old = rechecked
             rechecked = []
-            for status in old:
-                rechecked.append(status.recheck(environ,
-                                                local_state,
-                                                default_env_spec_name,
-                                                overrides,
-                                                latest_provide_result=results_by_status.get(status)))
+            with analysis_cache.activated():
+                for status in old:
+                    rechecked.append(_recheck(status,
+                                              environ,
+                                              local_state,
+                                              default_env_spec_name,
+                                              overrides,
+                                              latest_provide_result=results_by_status.get(status)))
 
         failed = False
         for status in rechecked:
@@ -518,8 +796,14 @@ def _configure_and_provide(project, environ, local_state, statuses, all_statuses
                                                     default_env_spec_name=default_env_spec_name,
                                                     overrides=overrides,
                                                     statuses=updated_statuses)
-        return _FunctionPrepareStage(environ, overrides, "Set up project.", updated_all_statuses, provide_stage,
-                                     configure_context)
+        return _FunctionPrepareStage(environ,
+                                     overrides,
+                                     "Set up project.",
+                                     updated_all_statuses,
+                                     provide_stage,
+                                     configure_context,
+                                     timings,
+                                     execute_async=provide_stage_async)
 
     return _start_over(all_statuses, statuses)
 
@@ -558,7 +842,7 @@ def _partition_first_group_to_configure(environ, local_state, statuses):
 
 def _process_requirement_statuses(project, environ, local_state, current_statuses, all_statuses,
                                   keep_going_until_success, mode, provide_whitelist, overrides, command,
-                                  extra_command_args):
+                                  extra_command_args, analysis_cache, timings):
     (initial, remaining) = _partition_first_group_to_configure(environ, local_state, current_statuses)
 
     # a surprising thing here is that the "stages" from
@@ -571,7 +855,8 @@ def _process_requirement_statuses(project, environ, local_state, current_statuse
 
     def _stages_for(statuses):
         return _configure_and_provide(project, environ, local_state, statuses, all_statuses, keep_going_until_success,
-                                      mode, provide_whitelist, overrides, command, extra_command_args)
+                                      mode, provide_whitelist, overrides, command, extra_command_args, analysis_cache,
+                                      timings)
 
     if len(initial) > 0 and len(remaining) > 0:
 
@@ -580,7 +865,7 @@ def _process_requirement_statuses(project, environ, local_state, current_statuse
             updated = _refresh_status_list(remaining, updated_all_statuses)
             return _process_requirement_statuses(project, environ, local_state, updated, updated_all_statuses,
                                                  keep_going_until_success, mode, provide_whitelist, overrides, command,
-                                                 extra_command_args)
+                                                 extra_command_args, analysis_cache, timings)
 
         return _after_stage_success(_stages_for(initial), process_remaining)
     elif len(initial) > 0:
@@ -631,14 +916,14 @@ def _assert_no_missing_env_var_requirements(project, environ, local_state, overr
 
 
 def _first_stage(project, environ, local_state, statuses, keep_going_until_success, mode, provide_whitelist, overrides,
-                 command, extra_command_args):
+                 command, extra_command_args, analysis_cache, timings):
     assert 'PROJECT_DIR' in environ
 
     _assert_no_missing_env_var_requirements(project, environ, local_state, overrides, command, statuses)
 
     first_stage = _process_requirement_statuses(project, environ, local_state, statuses, statuses,
                                                 keep_going_until_success, mode, provide_whitelist, overrides, command,
-                                                extra_command_args)
+                                                extra_command_args, analysis_cache, timings)
 
     return first_stage
 
@@ -649,25 +934,15 @@ def _prepare_environ_and_overrides(project, environ=None, env_spec_name=None):
 
     assert 'PATH' in environ
 
-    # we modify a copy, which 1) makes all our changes atomic and
-    # 2) minimizes memory leaks on systems that use putenv().
-    #
-    # On Linux, it appears we must use deepcopy (vs plain copy) or
-    # we still modify os.environ somehow.
-    #
-    # On the Windows CI server, but NOT on my local Windows 10
-    # machine, deepcopy() didn't work but adding the extra .copy()
-    # fixed it. The failure mode was that changes to PATH in the
-    # copy were not visible via os.environ or os.getenv('PATH'),
-    # but they DID affect what subprocess.Popen was able to see,
-    # so that a test which modified PATH in this environ_copy
-    # would break subsequent tests (such as test_conda_api which
-    # tries to run conda). Anyway, presumably this is a bug in
-    # something, but I'm not sure in what. If you can remove the
-    # extra copy() and still pass all tests on all platforms at
-    # some point in the future, feel free to clean up this
-    # hackery.
-    environ_copy = deepcopy(environ.copy())
+    # we modify an overlay rather than environ itself, which 1)
+    # makes all our changes atomic and 2) minimizes memory leaks
+    # on systems that use putenv(). The overlay never writes to
+    # environ, so (unlike a plain copy of os.environ, which
+    # needed a deepcopy to be safe on some platforms) it can't
+    # leak changes into our own process's environment. It also
+    # avoids copying the whole environment for every prepare,
+    # and records what we changed so nobody has to diff it later.
+    environ_copy = EnvironOverlay(environ)
 
     # many requirements and providers might need this, plus
     # it's useful for scripts to find their source tree.
@@ -699,17 +974,23 @@ def _internal_prepare_in_stages(project, environ_copy, overrides, keep_going_unt
 
     local_state = LocalStateFile.load_for_directory(project.directory_path)
 
+    # one cache for the whole run, so later stages can reuse these analyses
+    analysis_cache = AnalysisCache()
+    timings = trace.Timings()
+
     statuses = []
-    for requirement in project.requirements:
-        status = requirement.check_status(environ_copy,
-                                          local_state,
-                                          project.default_env_spec_name_for_command(command),
-                                          overrides,
-                                          latest_provide_result=None)
-        statuses.append(status)
+    with analysis_cache.activated(), timings.recording():
+        for requirement in project.requirements:
+            with trace.span("check " + requirement.env_var, 'check_status'):
+                status = requirement.check_status(environ_copy,
+                                                  local_state,
+                                                  project.default_env_spec_name_for_command(command),
+                                                  overrides,
+                                                  latest_provide_result=None)
+            statuses.append(status)
 
     return _first_stage(project, environ_copy, local_state, statuses, keep_going_until_success, mode, provide_whitelist,
-                        overrides, command, extra_command_args)
+                        overrides, command, extra_command_args, analysis_cache, timings)
 
 
 def prepare_in_stages(project,
@@ -876,6 +1157,113 @@ def prepare_without_interaction(project,
     return prepare_execute_without_interaction(stage)
 
 
+@gen.coroutine
+def prepare_without_interaction_async(project,
+                                      environ=None,
+                                      mode=PROVIDE_MODE_DEVELOPMENT,
+                                      provide_whitelist=None,
+                                      env_spec_name=None,
+                                      command_name=None,
+                                      command=None,
+                                      extra_command_args=None):
+    """Coroutine which prepares a project to run one of its commands, on the current tornado ``IOLoop``.
+
+    This is the same as ``prepare_without_interaction()``, but
+    the ``IOLoop`` keeps running while we prepare. Providers
+    which have a native ``provide_async()`` (such as downloads)
+    run on the ``IOLoop``; the rest, and the status checks, run
+    on their own threads.
+
+    Tornado uses the asyncio event loop, so this can be awaited
+    from asyncio code.
+
+    Args:
+        project (Project): from the ``load_project`` method
+        environ (dict): os.environ or the previously-prepared environ; not modified in-place
+        mode (str): mode from ``PROVIDE_MODE_PRODUCTION``, ``PROVIDE_MODE_DEVELOPMENT``, ``PROVIDE_MODE_CHECK``
+        provide_whitelist (iterable of str): ONLY call provide() for the listed env vars' requirements
+        env_spec_name (str): the environment spec name to require, or None for default
+        command_name (str): which named command to choose from the project, None for default
+        command (ProjectCommand): command object, None for default
+        extra_command_args (list): extra args to include in the returned command argv
+
+    Returns:
+        a tornado ``Future`` with a ``PrepareResult`` instance
+
+    """
+    (environ_copy, overrides) = _prepare_environ_and_overrides(project, environ, env_spec_name)
+
+    failure = _check_prepare_prerequisites(project, env_spec_name, command_name, command, environ_copy, overrides)
+    if failure is not None:
+        raise gen.Return(failure)
+
+    # this runs the first check of every requirement, which can block
+    stage = yield run_in_thread(_internal_prepare_in_stages,
+                                project,
+                                environ_copy=environ_copy,
+                                overrides=overrides,
+                                keep_going_until_success=False,
+                                mode=mode,
+                                provide_whitelist=provide_whitelist,
+                                command_name=command_name,
+                                command=command,
+                                extra_command_args=extra_command_args)
+
+    result = yield prepare_execute_without_interaction_async(stage)
+    raise gen.Return(result)
+
+
+# like environments, most of the time goes to conda and downloads
+_DEFAULT_PROJECT_JOBS = 4
+
+
+def prepare_projects_without_interaction(projects,
+                                         environ=None,
+                                         mode=PROVIDE_MODE_DEVELOPMENT,
+                                         env_spec_name=None,
+                                         jobs=None,
+                                         on_result=None):
+    """Prepare several projects in this process, several at a time.
+
+    Each project is prepared as ``prepare_without_interaction()``
+    would prepare it, on a pool of ``jobs`` threads. Caches kept
+    by this process, such as ``conda info`` and the template
+    environments to clone from, are shared by all the projects,
+    which is much cheaper than a process per project.
+
+    A failure in one project doesn't stop the others.
+
+    Args:
+        projects (list of Project): the projects, from the ``load_project`` method
+        environ (dict): os.environ or the previously-prepared environ; not modified in-place
+        mode (str): mode from ``PROVIDE_MODE_PRODUCTION``, ``PROVIDE_MODE_DEVELOPMENT``, ``PROVIDE_MODE_CHECK``
+        env_spec_name (str): the environment spec name to require, or None for each project's default
+        jobs (int): how many projects to prepare at once, or None for a default
+        on_result (callable): if not None, called with ``(project, result)`` as each project finishes
+
+    Returns:
+        list of ``PrepareResult``, in the same order as projects
+
+    """
+    if environ is None:
+        environ = os.environ
+    if jobs is None:
+        jobs = _DEFAULT_PROJECT_JOBS
+
+    def prepare_one(project):
+        with trace.span("prepare " + project.directory_path, 'project'):
+            try:
+                return prepare_without_interaction(project, environ=environ, mode=mode, env_spec_name=env_spec_name)
+            except Exception as e:
+                # don't let one broken project stop the others
+                error = "Failed to prepare %s: %s" % (project.directory_path, str(e))
+                # an overlay, like other results, so nobody edits the caller's environ through it
+                return PrepareFailure(logs=[], statuses=(), errors=[error], environ=EnvironOverlay(environ),
+                                      overrides=UserConfigOverrides(env_spec_name=env_spec_name))
+
+    return run_on_threads(prepare_one, list(projects), jobs, on_result=on_result)
+
+
 def prepare_with_browser_ui(project,
                             environ=None,
                             env_spec_name=None,
@@ -962,6 +1350,26 @@ def prepare_execute_without_interaction(stage):
     return result
 
 
+@gen.coroutine
+def prepare_execute_without_interaction_async(stage):
+    """Coroutine which advances through the PrepareStage without any interactivity.
+
+    Uses each stage's ``execute_async()``, so stages from
+    ``prepare_in_stages()`` don't block the current ``IOLoop``.
+
+    Returns:
+       a tornado ``Future`` with a ``PrepareResult`` instance
+    """
+    result = None
+    while stage is not None:
+        next_stage = yield stage.execute_async()
+        result = stage.result
+        if result.failed:
+            break
+        stage = next_stage
+    raise gen.Return(result)
+
+
 def prepare_execute_with_browser_ui(project, stage, io_loop=None, show_url=None):
     """Advance through the PrepareStage using a browser UI.
 
@@ -982,6 +1390,151 @@ def prepare_execute_with_browser_ui(project, stage, io_loop=None, show_url=None)
     return prepare_ui.prepare_browser(project=project, stage=stage, io_loop=io_loop, show_url=show_url)
 
 
+class PreparePlan(object):
+    """What prepare would do, as described by ``prepare_plan()``."""
+
+    def __init__(self, steps, errors):
+        """Construct a PreparePlan."""
+        self._steps = tuple(steps)
+        self._errors = list(errors)
+
+    def __bool__(self):
+        """True if we were able to make the plan."""
+        return not self.failed
+
+    def __nonzero__(self):
+        """True if we were able to make the plan."""
+        return self.__bool__()  # pragma: no cover (py2 only)
+
+    @property
+    def failed(self):
+        """True if we couldn't make the plan, for example because the project has problems."""
+        return len(self._errors) > 0
+
+    @property
+    def errors(self):
+        """Get the errors if we failed."""
+        return self._errors
+
+    @property
+    def steps(self):
+        """Get the ``PlanStep`` list, in the order prepare would do them."""
+        return self._steps
+
+    @property
+    def total_download_bytes(self):
+        """Get the total size of the downloads we know the size of."""
+        return sum([step.download_bytes for step in self._steps if step.download_bytes is not None])
+
+    @property
+    def has_unknown_sizes(self):
+        """True if some steps would download an unknown amount, so ``total_download_bytes`` is too low."""
+        return any([step.download_bytes is None for step in self._steps])
+
+    def to_json(self):
+        """Get the plan as a JSON-compatible dict."""
+        return dict(steps=[step.to_json() for step in self._steps],
+                    errors=list(self._errors),
+                    total_download_bytes=self.total_download_bytes,
+                    has_unknown_sizes=self.has_unknown_sizes)
+
+
+def _add_download_sizes(steps):
+    urls = [url for step in steps for url in step.urls]
+    if len(urls) == 0:
+        return steps
+    with trace.span("fetch sizes of %d downloads" % len(urls), 'plan'):
+        sizes = http_client.fetch_sizes(urls)
+
+    sized = []
+    for step in steps:
+        if len(step.urls) == 0:
+            sized.append(step)
+            continue
+        lengths = [sizes[url][0] for url in step.urls]
+        resumable = [sizes[url][1] for url in step.urls]
+        sized.append(step.copy_with_sizes(download_bytes=(None if None in lengths else sum(lengths)),
+                                          resumable=(None if None in resumable else all(resumable))))
+    return sized
+
+
+def prepare_plan(project,
+                 environ=None,
+                 mode=PROVIDE_MODE_DEVELOPMENT,
+                 provide_whitelist=None,
+                 env_spec_name=None,
+                 command_name=None,
+                 command=None,
+                 check_sizes=True):
+    """Describe what ``prepare_without_interaction()`` would do, without doing any of it.
+
+    Each requirement which isn't met yet is checked as prepare
+    would check it, and its provider describes the steps it would
+    take, such as creating the environment or downloading a
+    file. Nothing is installed, downloaded, or started, and no
+    configuration is saved.
+
+    Download sizes come from HTTP HEAD requests, made all at
+    once, for the files we know we'd download: the download
+    requirements, and the packages an up-to-date lockfile lists
+    which aren't in the conda package cache. Without a lockfile
+    the packages aren't known until conda solves, so those sizes
+    are unknown.
+
+    Args:
+        project (Project): from the ``load_project`` method
+        environ (dict): os.environ or the previously-prepared environ; not modified in-place
+        mode (str): mode prepare would use, ``PROVIDE_MODE_PRODUCTION`` or ``PROVIDE_MODE_DEVELOPMENT``
+        provide_whitelist (iterable of str): ONLY plan the listed env vars' requirements
+        env_spec_name (str): the environment spec name to require, or None for default
+        command_name (str): which named command to choose from the project, None for default
+        command (ProjectCommand): command object, None for default
+        check_sizes (bool): False to skip the HEAD requests, leaving sizes unknown
+
+    Returns:
+        a ``PreparePlan`` instance, which has a ``failed`` flag
+
+    """
+    if mode not in _all_provide_modes:
+        raise ValueError("invalid provide mode " + mode)
+
+    (environ_copy, overrides) = _prepare_environ_and_overrides(project, environ, env_spec_name)
+
+    failure = _check_prepare_prerequisites(project, env_spec_name, command_name, command, environ_copy, overrides)
+    if failure is not None:
+        return PreparePlan(steps=[], errors=failure.errors)
+
+    if command is None:
+        command = project.command_for_name(command_name)
+    default_env_spec_name = project.default_env_spec_name_for_command(command)
+    local_state = LocalStateFile.load_for_directory(project.directory_path)
+
+    statuses = []
+    for requirement in project.requirements:
+        with trace.span("check " + requirement.env_var, 'check_status'):
+            statuses.append(requirement.check_status(environ_copy, local_state, default_env_spec_name, overrides))
+
+    def get_missing_to_provide(status):
+        return status.analysis.missing_env_vars_to_provide
+
+    steps = []
+    for status in _sort_statuses(environ_copy, local_state, statuses, get_missing_to_provide):
+        if not _in_provide_whitelist(provide_whitelist, status.requirement):
+            continue
+        # earlier plans may have set variables this requirement looks at
+        status = _recheck(status, environ_copy, local_state, default_env_spec_name, overrides)
+        if status.has_been_provided:
+            continue
+        context = ProvideContext(environ_copy, local_state, default_env_spec_name, status, PROVIDE_MODE_CHECK)
+        with trace.span("plan " + status.requirement.env_var, 'plan', provider=type(status.provider).__name__):
+            steps.extend(status.provider.plan(status.requirement, context, mode))
+
+    if check_sizes:
+        steps = _add_download_sizes(steps)
+
+    return PreparePlan(steps=steps, errors=[])
+
+
 def unprepare(project, prepare_result, whitelist=None):
     """Attempt to clean up project-scoped resources allocated by prepare().
 
@@ -1019,8 +1572,9 @@ def unprepare(project, prepare_result, whitelist=None):
             continue
 
         provider = status.provider
-        unprovide_status = provider.unprovide(requirement, prepare_result.environ, local_state_file,
-                                              prepare_result.overrides, status)
+        with trace.span("unprovide " + requirement.env_var, 'unprovide', provider=type(provider).__name__):
+            unprovide_status = provider.unprovide(requirement, prepare_result.environ, local_state_file,
+                                                  prepare_result.overrides, status)
         if not unprovide_status:
             failed_requirements.append(requirement)
             failed_statuses.append(unprovide_status)
@@ -10,7 +10,7 @@ from __future__ import absolute_import
 from copy import deepcopy, copy
 import os
 
-from conda_kapsel.env_spec import EnvSpec
+from conda_kapsel.env_spec import EnvSpec, lock_file_path
 from conda_kapsel.conda_meta_file import CondaMetaFile, META_DIRECTORY
 from conda_kapsel.plugins.registry import PluginRegistry
 from conda_kapsel.plugins.requirement import EnvVarRequirement
@@ -19,11 +19,13 @@ from conda_kapsel.plugins.requirements.download import DownloadRequirement
 from conda_kapsel.plugins.requirements.service import ServiceRequirement
 from conda_kapsel.project_commands import ProjectCommand
 from conda_kapsel.project_file import ProjectFile
-from conda_kapsel.archiver import _list_relative_paths_for_unignored_project_files
 
+from conda_kapsel.internal.notebook_index import find_notebooks
+from conda_kapsel.internal import project_snapshot
 from conda_kapsel.internal.py2_compat import is_string
 from conda_kapsel.internal.simple_status import SimpleStatus
 import conda_kapsel.internal.conda_api as conda_api
+import conda_kapsel.internal.trace as trace
 import conda_kapsel.internal.pip_api as pip_api
 
 # These strings are used in the command line options to conda-kapsel,
@@ -82,8 +84,9 @@ class _ConfigCache(object):
         self.name = None
         self.description = ''
         self.icon = None
-        self.commands = dict()
-        self.default_command_name = None
+        self._unfinished_commands = None
+        self._commands = dict()
+        self._default_command_name = None
         self.project_file_count = 0
         self.conda_meta_file_count = 0
         self.env_specs = dict()
@@ -97,6 +100,53 @@ class _ConfigCache(object):
         self.project_file_count = project_file.change_count
         self.conda_meta_file_count = conda_meta_file.change_count
 
+        key = None
+        if project_snapshot.can_snapshot(self.registry):
+            key = project_snapshot.snapshot_key(self.directory_path, project_file, conda_meta_file)
+        if key is not None:
+            with trace.span("load project snapshot", 'project', directory=self.directory_path):
+                snapshot = project_snapshot.load_snapshot(self.directory_path, key, self.registry)
+            if snapshot is not None:
+                self._update_from_snapshot(snapshot)
+                return
+
+        with trace.span("parse project config", 'project', directory=self.directory_path):
+            self._update_all(project_file, conda_meta_file)
+
+        if key is not None and len(self.problems) == 0:
+            (commands, failed, app_entry, first_command_name, requirements) = self._unfinished_commands
+            project_snapshot.save_snapshot(self.directory_path,
+                                           key,
+                                           name=self.name,
+                                           description=self.description,
+                                           icon=self.icon,
+                                           requirements=self.requirements,
+                                           env_specs=self.env_specs,
+                                           default_env_spec_name=self.default_env_spec_name,
+                                           commands=self._command_attributes,
+                                           app_entry=app_entry,
+                                           first_command_name=first_command_name)
+
+    def _update_from_snapshot(self, snapshot):
+        self.name = snapshot.name
+        self.description = snapshot.description
+        self.icon = snapshot.icon
+        self.env_specs = snapshot.env_specs
+        self.default_env_spec_name = snapshot.default_env_spec_name
+        self.requirements = snapshot.requirements
+        self.problems = []
+        self.problem_strings = []
+
+        commands = dict()
+        for (name, attributes) in snapshot.commands:
+            commands[name] = ProjectCommand(name=name, attributes=attributes)
+        self._command_attributes = snapshot.commands
+        self._unfinished_commands = (commands, False, snapshot.app_entry, snapshot.first_command_name,
+                                     snapshot.requirements)
+        self._commands = None
+        self._default_command_name = None
+
+    def _update_all(self, project_file, conda_meta_file):
         requirements = []
         problems = []
 
@@ -133,7 +183,7 @@ class _ConfigCache(object):
         self.problem_strings = list([p.text for p in self.problems])
 
     def _update_name(self, problems, project_file, conda_meta_file):
-        name = project_file.get_value('name', None)
+        name = project_file.get_read_only_value('name', None)
         if name is not None:
             if not is_string(name):
                 problems.append("%s: name: field should have a string value not %r" % (project_file.filename, name))
@@ -155,7 +205,7 @@ class _ConfigCache(object):
         self.name = name
 
     def _update_description(self, problems, project_file):
-        desc = project_file.get_value('description', None)
+        desc = project_file.get_read_only_value('description', None)
         if desc is not None and not is_string(desc):
             problems.append("%s: description: field should have a string value not %r" % (project_file.filename, desc))
             desc = None
@@ -166,7 +216,7 @@ class _ConfigCache(object):
         self.description = desc
 
     def _update_icon(self, problems, project_file, conda_meta_file):
-        icon = project_file.get_value('icon', None)
+        icon = project_file.get_read_only_value('icon', None)
         if icon is not None and not is_string(icon):
             problems.append("%s: icon: field should have a string value not %r" % (project_file.filename, icon))
             icon = None
@@ -190,7 +240,7 @@ class _ConfigCache(object):
         self.icon = icon
 
     def _update_variables(self, requirements, problems, project_file):
-        variables = project_file.get_value("variables")
+        variables = project_file.get_read_only_value("variables")
 
         def check_conda_reserved(key):
             if key in ('CONDA_DEFAULT_ENV', 'CONDA_ENV_PATH', 'CONDA_PREFIX'):
@@ -246,7 +296,7 @@ class _ConfigCache(object):
                     value=variables))
 
     def _update_downloads(self, requirements, problems, project_file):
-        downloads = project_file.get_value('downloads')
+        downloads = project_file.get_read_only_value('downloads')
 
         if downloads is None:
             return
@@ -263,7 +313,7 @@ class _ConfigCache(object):
             DownloadRequirement._parse(self.registry, varname, item, problems, requirements)
 
     def _update_services(self, requirements, problems, project_file):
-        services = project_file.get_value('services')
+        services = project_file.get_read_only_value('services')
 
         if services is None:
             return
@@ -326,9 +376,12 @@ class _ConfigCache(object):
             return (deps, pip_deps)
 
         self.env_specs = dict()
-        (shared_deps, shared_pip_deps) = _parse_packages(project_file.root)
-        shared_channels = _parse_channels(project_file.root)
-        env_specs = project_file.get_value('env_specs', default={})
+        # the top-level packages and channels are shared by all the env specs
+        shared = dict(packages=project_file.get_read_only_value('packages', []),
+                      channels=project_file.get_read_only_value('channels', []))
+        (shared_deps, shared_pip_deps) = _parse_packages(shared)
+        shared_channels = _parse_channels(shared)
+        env_specs = project_file.get_read_only_value('env_specs', default={})
         first_env_spec_name = None
         env_specs_is_empty_or_missing = False  # this should be iff it's an empty dict or absent entirely
 
@@ -357,7 +410,8 @@ class _ConfigCache(object):
                                                conda_packages=all_deps,
                                                pip_packages=all_pip_deps,
                                                channels=all_channels,
-                                               description=description)
+                                               description=description,
+                                               lock_file=lock_file_path(self.directory_path, name))
                 if first_env_spec_name is None:
                     first_env_spec_name = name
         else:
@@ -406,7 +460,8 @@ class _ConfigCache(object):
 
         first_command_name = None
         commands = dict()
-        commands_section = project_file.get_value('commands', None)
+        command_attributes = []
+        commands_section = project_file.get_read_only_value('commands', None)
         if commands_section is not None and not isinstance(commands_section, dict):
             problems.append("%s: 'commands:' section should be a dictionary from command names to attributes, not %r" %
                             (project_file.filename, commands_section))
@@ -479,13 +534,40 @@ class _ConfigCache(object):
                 # note that once one command fails, we don't add any more
                 if not failed:
                     commands[name] = ProjectCommand(name=name, attributes=copied_attrs)
+                    command_attributes.append((name, copied_attrs))
 
-        self._add_notebook_commands(commands, problems, requirements)
+        # finding notebooks walks the whole project, so we wait
+        # until someone asks for the commands
+        self._command_attributes = command_attributes
+        self._unfinished_commands = (commands, failed, app_entry_from_meta_yaml, first_command_name, requirements)
+        self._commands = None
+        self._default_command_name = None
+
+    @property
+    def commands(self):
+        self._finish_commands()
+        return self._commands
+
+    @property
+    def default_command_name(self):
+        self._finish_commands()
+        return self._default_command_name
+
+    def _finish_commands(self):
+        if self._unfinished_commands is None:
+            return
+        (commands, failed, app_entry_from_meta_yaml, first_command_name, requirements) = self._unfinished_commands
+        self._unfinished_commands = None
 
         if failed:
-            self.commands = dict()
-            self.default_command_name = None
+            self._commands = dict()
         else:
+            problems = []
+            self._add_notebook_commands(commands, problems, requirements)
+            if len(problems) > 0:
+                self.problems = self.problems + _make_problems_into_objects(problems)
+                self.problem_strings = list([p.text for p in self.problems])
+
             # if no commands and we have a meta.yaml app entry, use the meta.yaml
             if app_entry_from_meta_yaml is not None and len(commands) == 0:
                 commands['default'] = ProjectCommand(name='default',
@@ -493,42 +575,32 @@ class _ConfigCache(object):
                                                                      auto_generated=True,
                                                                      env_spec=self.default_env_spec_name))
 
-            self.commands = commands
+            self._commands = commands
 
-        if first_command_name is None and len(commands) > 0:
+        if first_command_name is None and len(self._commands) > 0:
             # this happens if we created a command automatically
             # from a notebook file or conda meta.yaml
-            first_command_name = sorted(commands.keys())[0]
+            first_command_name = sorted(self._commands.keys())[0]
 
-        if 'default' in self.commands:
-            self.default_command_name = 'default'
+        if 'default' in self._commands:
+            self._default_command_name = 'default'
         else:
             # 'default' is always mapped to the first-listed if none is named 'default'
             # note: this may be None
-            self.default_command_name = first_command_name
+            self._default_command_name = first_command_name
 
     def _add_notebook_commands(self, commands, problems, requirements):
-        files = _list_relative_paths_for_unignored_project_files(self.directory_path,
-                                                                 problems,
-                                                                 requirements=requirements)
-        if files is None:
+        notebooks = find_notebooks(self.directory_path, problems, requirements=requirements)
+        if notebooks is None:
             assert problems != []
             return
 
-        # chop out hidden directories. The
-        # main reason to ignore dot directories is that they
-        # might contain packages or git cache data or other
-        # such gunk, not because we really care about
-        # ".foo.ipynb" per se.
-        files = [f for f in files if not f[0] == '.']
-
-        for relative_name in files:
-            if relative_name.endswith('.ipynb'):
-                if relative_name not in commands:
-                    commands[relative_name] = ProjectCommand(name=relative_name,
-                                                             attributes={'notebook': relative_name,
-                                                                         'auto_generated': True,
-                                                                         'env_spec': self.default_env_spec_name})
+        for relative_name in notebooks:
+            if relative_name not in commands:
+                commands[relative_name] = ProjectCommand(name=relative_name,
+                                                         attributes={'notebook': relative_name,
+                                                                     'auto_generated': True,
+                                                                     'env_spec': self.default_env_spec_name})
 
 
 class Project(object):
@@ -547,8 +619,9 @@ class Project(object):
             plugin_registry (PluginRegistry): where to look up Requirement and Provider instances, None for default
         """
         self._directory_path = os.path.realpath(directory_path)
-        self._project_file = ProjectFile.load_for_directory(directory_path)
-        self._conda_meta_file = CondaMetaFile.load_for_directory(directory_path)
+        with trace.span("load project files", 'project', directory=self._directory_path):
+            self._project_file = ProjectFile.load_for_directory(directory_path)
+            self._conda_meta_file = CondaMetaFile.load_for_directory(directory_path)
         self._directory_basename = os.path.basename(self._directory_path)
         self._config_cache = _ConfigCache(self._directory_path, plugin_registry)
 
@@ -556,6 +629,12 @@ class Project(object):
         self._config_cache.update(self._project_file, self._conda_meta_file)
         return self._config_cache
 
+    def _updated_cache_with_commands(self):
+        # finding notebook commands can fail, which is a problem too
+        cache = self._updated_cache()
+        cache._finish_commands()
+        return cache
+
     @property
     def directory_path(self):
         """Get path to the project directory."""
@@ -636,12 +715,12 @@ class Project(object):
         config files; it does not contain missing requirements and other "expected"
         problems.
         """
-        return self._updated_cache().problem_strings
+        return self._updated_cache_with_commands().problem_strings
 
     @property
     def problem_objects(self):
         """List of ProjectProblem instances describing problems with the project configuration."""
-        return self._updated_cache().problems
+        return self._updated_cache_with_commands().problems
 
     @property
     def fixable_problems(self):
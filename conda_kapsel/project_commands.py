@@ -14,7 +14,7 @@ import os
 import platform
 import sys
 
-from conda_kapsel.internal import (conda_api, py2_compat)
+from conda_kapsel.internal import (conda_api, environ_overlay, py2_compat, trace)
 
 try:  # pragma: no cover
     from shlex import quote  # pragma: no cover
@@ -102,7 +102,7 @@ class CommandExecInfo(object):
 
             args = self._args
         return subprocess.Popen(args=args,
-                                env=py2_compat.env_without_unicode(self._env),
+                                env=py2_compat.env_without_unicode(environ_overlay.flatten(self._env)),
                                 cwd=self._cwd,
                                 shell=self._shell,
                                 **kwargs)
@@ -113,6 +113,9 @@ class CommandExecInfo(object):
         Returns:
             Does not return. May raise an OSError though.
         """
+        # nothing runs after exec, so save any trace we were asked for now
+        trace.write_files()
+
         args = copy(self._args)
         if self._shell:
             assert len(args) == 1
@@ -134,7 +137,7 @@ class CommandExecInfo(object):
             os.chdir(self._cwd)
             sys.stderr.flush()
             sys.stdout.flush()
-            os.execvpe(args[0], args, self._env)
+            os.execvpe(args[0], args, environ_overlay.flatten(self._env))
         finally:
             # avoid side effect if exec fails (or is mocked in tests)
             os.chdir(old_dir)
@@ -25,7 +25,11 @@ from conda_kapsel.plugins.requirements.service import ServiceRequirement
 from conda_kapsel.plugins.providers.conda_env import _remove_env_path
 from conda_kapsel.internal.simple_status import SimpleStatus
 import conda_kapsel.conda_manager as conda_manager
+from conda_kapsel.internal import conda_api
+from conda_kapsel.internal import pip_api
 from conda_kapsel.internal.conda_api import parse_spec
+from conda_kapsel.internal.conda_lockfile import load_lockfile, lockfile_for_prefix, save_lockfile
+from conda_kapsel.internal.env_jobs import EnvJobsStatus, run_env_jobs
 from conda_kapsel.internal import keyring
 
 _default_projectignore = """
@@ -547,6 +551,99 @@ def remove_packages(project, env_spec_name, packages):
     return status
 
 
+def lock(project, env_spec_name=None):
+    """Write a lockfile listing the exact packages for each environment spec.
+
+    The lockfile for an env spec is written next to kapsel.yml,
+    from the packages in the env spec's environment (which is
+    created or updated first if needed). Later, environments are
+    created from the lockfile without running the conda solver,
+    as long as the env spec hasn't changed since it was locked.
+    Lockfiles which are already up to date are left alone.
+
+    Args:
+        project (Project): the project
+        env_spec_name (str): environment spec name or None for all environment specs
+
+    Returns:
+        ``Status`` instance
+    """
+    failed = project.problems_status()
+    if failed is not None:
+        return failed
+
+    if env_spec_name is None:
+        envs = [project.env_specs[name] for name in sorted(project.env_specs.keys())]
+    else:
+        env = project.env_specs.get(env_spec_name, None)
+        if env is None:
+            problem = "Environment spec {} doesn't exist.".format(env_spec_name)
+            return SimpleStatus(success=False, description=problem)
+        envs = [env]
+
+    try:
+        platform = conda_api.current_platform()
+    except conda_api.CondaError as e:
+        return SimpleStatus(success=False, description="Could not lock environment specs.", errors=[str(e)])
+
+    conda = conda_manager.new_conda_manager()
+    locked = []
+    for env in envs:
+        existing = load_lockfile(env.lock_file)
+        if existing is not None and existing.is_current(env, platform):
+            continue
+        prefix = env.path(project.directory_path)
+        try:
+            conda.fix_environment_deviations(prefix, env)
+            save_lockfile(env.lock_file, lockfile_for_prefix(prefix, env, platform))
+        except (conda_manager.CondaManagerError, conda_api.CondaError, pip_api.PipError, IOError, OSError) as e:
+            return SimpleStatus(success=False,
+                                description="Could not lock environment spec {}.".format(env.name),
+                                errors=[str(e)])
+        locked.append(env.name)
+
+    if len(locked) == 0:
+        description = "Lockfiles were already up to date."
+    else:
+        description = "Updated lockfiles for: {}.".format(", ".join(locked))
+    return SimpleStatus(success=True, description=description)
+
+
+def prepare_env_specs(project, env_spec_names=None, jobs=None, fix=True):
+    """Create or update the environments for several env specs at once.
+
+    Each environment is checked and fixed independently; a failure
+    in one doesn't stop the others. The returned status has the
+    deviations found for every env spec in its ``deviations``
+    property, and its ``errors`` list every env spec that failed.
+
+    Args:
+        project (Project): the project
+        env_spec_names (list of str): env spec names or None for all environment specs
+        jobs (int): how many environments to work on at once, or None for a default
+        fix (bool): False to only check the environments without changing them
+
+    Returns:
+        ``Status`` instance
+    """
+    failed = project.problems_status()
+    if failed is not None:
+        return failed
+
+    if env_spec_names is None:
+        env_spec_names = sorted(project.env_specs.keys())
+    envs = []
+    for name in env_spec_names:
+        env = project.env_specs.get(name, None)
+        if env is None:
+            problem = "Environment spec {} doesn't exist.".format(name)
+            return SimpleStatus(success=False, description=problem)
+        envs.append((env, env.path(project.directory_path)))
+
+    conda = conda_manager.new_conda_manager()
+    return EnvJobsStatus(run_env_jobs(conda, envs, jobs=jobs, fix=fix))
+
+
 def _prepare_env_prefix(project, env_spec_name):
     failed = project.problems_status()
     if failed is not None:
@@ -636,11 +733,13 @@ def remove_variables(project, vars_to_remove, env_spec_name=None):
         return status
 
     local_state = LocalStateFile.load_for_directory(project.directory_path)
-    for varname in vars_to_remove:
-        _unset_variable(project, env_prefix, varname, local_state)
-        project.project_file.unset_value(['variables', varname])
-        project.project_file.save()
-        local_state.save()
+    # write each file once, rather than once per variable
+    with project.project_file.batch_changes(), local_state.batch_changes():
+        for varname in vars_to_remove:
+            _unset_variable(project, env_prefix, varname, local_state)
+            project.project_file.unset_value(['variables', varname])
+            project.project_file.save()
+            local_state.save()
 
     return SimpleStatus(success=True, description="Variables removed from the project file.")
 
@@ -131,6 +131,52 @@ def test_prepare_project_browser(monkeypatch):
     assert kwargs == params['kwargs']
 
 
+def test_prepare_plan(monkeypatch):
+    from conda_kapsel.prepare import prepare_plan
+    _verify_args_match(api.AnacondaProject.prepare_plan, prepare_plan)
+
+    params = dict(args=(), kwargs=dict())
+
+    def mock_prepare_plan(*args, **kwargs):
+        params['args'] = args
+        params['kwargs'] = kwargs
+        return 42
+
+    monkeypatch.setattr('conda_kapsel.prepare.prepare_plan', mock_prepare_plan)
+    p = api.AnacondaProject()
+    kwargs = dict(project=43,
+                  environ=57,
+                  mode=44,
+                  provide_whitelist=45,
+                  env_spec_name=46,
+                  command_name=47,
+                  command=48,
+                  check_sizes=49)
+    result = p.prepare_plan(**kwargs)
+    assert 42 == result
+    assert kwargs == params['kwargs']
+
+
+def test_prepare_projects(monkeypatch):
+    from conda_kapsel.prepare import prepare_projects_without_interaction
+    _verify_args_match(api.AnacondaProject.prepare_projects, prepare_projects_without_interaction)
+
+    params = dict(args=(), kwargs=dict())
+
+    def mock_prepare_projects_without_interaction(*args, **kwargs):
+        params['args'] = args
+        params['kwargs'] = kwargs
+        return 42
+
+    monkeypatch.setattr('conda_kapsel.prepare.prepare_projects_without_interaction',
+                        mock_prepare_projects_without_interaction)
+    p = api.AnacondaProject()
+    kwargs = dict(projects=43, environ=57, mode=44, env_spec_name=45, jobs=46, on_result=47)
+    result = p.prepare_projects(**kwargs)
+    assert 42 == result
+    assert kwargs == params['kwargs']
+
+
 def test_unprepare(monkeypatch):
     from conda_kapsel.prepare import unprepare
     _verify_args_match(api.AnacondaProject.unprepare, unprepare)
@@ -370,6 +416,46 @@ def test_remove_packages(monkeypatch):
     assert kwargs == params['kwargs']
 
 
+def test_lock(monkeypatch):
+    import conda_kapsel.project_ops as project_ops
+    _verify_args_match(api.AnacondaProject.lock, project_ops.lock)
+
+    params = dict(args=(), kwargs=dict())
+
+    def mock_lock(*args, **kwargs):
+        params['args'] = args
+        params['kwargs'] = kwargs
+        return 42
+
+    monkeypatch.setattr('conda_kapsel.project_ops.lock', mock_lock)
+
+    p = api.AnacondaProject()
+    kwargs = dict(project=43, env_spec_name='foo')
+    result = p.lock(**kwargs)
+    assert 42 == result
+    assert kwargs == params['kwargs']
+
+
+def test_prepare_env_specs(monkeypatch):
+    import conda_kapsel.project_ops as project_ops
+    _verify_args_match(api.AnacondaProject.prepare_env_specs, project_ops.prepare_env_specs)
+
+    params = dict(args=(), kwargs=dict())
+
+    def mock_prepare_env_specs(*args, **kwargs):
+        params['args'] = args
+        params['kwargs'] = kwargs
+        return 42
+
+    monkeypatch.setattr('conda_kapsel.project_ops.prepare_env_specs', mock_prepare_env_specs)
+
+    p = api.AnacondaProject()
+    kwargs = dict(project=43, env_spec_names=['foo'], jobs=2, fix=False)
+    result = p.prepare_env_specs(**kwargs)
+    assert 42 == result
+    assert kwargs == params['kwargs']
+
+
 def test_add_command(monkeypatch):
     import conda_kapsel.project_ops as project_ops
     _verify_args_match(api.AnacondaProject.add_command, project_ops.add_command)
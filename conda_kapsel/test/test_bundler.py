@@ -7,6 +7,7 @@
 from __future__ import absolute_import, print_function
 
 import os
+import subprocess
 
 from conda_kapsel import archiver
 from conda_kapsel import project_ops
@@ -159,3 +160,134 @@ def test_file_pattern_matcher_with_directories():
     tests['/foo/'] = tests['/foo']
 
     _test_file_pattern_matcher(tests, is_directory=True)
+
+
+def _fnmatch_pattern_matches(pattern, path, is_directory):
+    # the straightforward way to match one pattern, which the
+    # compiled matcher has to agree with
+    import fnmatch
+
+    def match(path, glob):
+        while path != '/':
+            if fnmatch.fnmatch(path, glob):
+                return True
+            path = os.path.dirname(path)
+        return False
+
+    glob = pattern if pattern.startswith("/") else "*/" + pattern
+    if glob.endswith("/"):
+        return is_directory and match("/" + path, glob[:-1])
+    else:
+        return match("/" + path, glob)
+
+
+def test_pattern_matcher_agrees_with_fnmatch():
+    class FakeInfo(object):
+        def __init__(self, path, is_directory):
+            self.unixified_relative_path = path
+            self.is_directory = is_directory
+
+    patterns = ['foo', '/foo', 'foo/', '/foo/', '*.pyc', '/a/b', 'a/b', 'b/', '/*', 'f?o', '[fg]oo', '[!f]oo', '[]x]',
+                '[!]x]', '[oops', 'x^y', '[^f]oo', 'a.b', '*/c/', '/a/*/d', '/', 'd*', '.ipynb_checkpoints']
+    paths = ['foo', 'goo', 'boo', 'f.o', 'foo/bar', 'bar/foo', 'bar/foo/baz', 'a/b', 'a/b/c', 'x/a/b', 'a/x/d',
+             'a/x/d/e', 'x.pyc', 'x/y.pyc', 'x', ']', '[oops', 'x^y', 'aab', 'a.b', 'c', 'q/c', 'q/c/r', 'dd/e',
+             '.ipynb_checkpoints/x']
+
+    for is_directory in (True, False):
+        # one pattern at a time, and all together
+        for pattern in patterns:
+            matcher = archiver._PatternMatcher([pattern])
+            for path in paths:
+                expected = _fnmatch_pattern_matches(pattern, path, is_directory)
+                assert (pattern, path, expected) == (pattern, path, matcher.matches(FakeInfo(path, is_directory)))
+
+        matcher = archiver._PatternMatcher(patterns)
+        for path in paths:
+            expected = any(_fnmatch_pattern_matches(pattern, path, is_directory) for pattern in patterns)
+            assert (path, expected) == (path, matcher.matches(FakeInfo(path, is_directory)))
+
+    assert not archiver._PatternMatcher([]).matches(FakeInfo('foo', False))
+
+
+def test_list_project_in_archive_order():
+    def check(dirname):
+        os.makedirs(os.path.join(dirname, "empty"))
+        os.symlink(os.path.join(dirname, "a"), os.path.join(dirname, "link"))
+        errors = []
+        infos = archiver._list_project(dirname, lambda info: info.basename == 'ignored', errors)
+        assert [] == errors
+        infos = list(infos)
+        # "a-b" comes before the contents of "a", as when sorting paths
+        assert [('a-b', False), ('a', True), (os.path.join('a', 'b'), False), (os.path.join('a', 'c'), True),
+                (os.path.join('a', 'c', 'd'), False), ('empty', True), ('link', True),
+                ('z', False)] == [(info.relative_path, info.is_directory) for info in infos]
+        assert os.path.join(dirname, 'a', 'b') == infos[2].full_path
+        assert 'b' == infos[2].basename
+
+        leaves = list(archiver._leaf_infos(iter(infos)))
+        assert ['a-b', os.path.join('a', 'b'), os.path.join('a', 'c', 'd'), 'empty', 'link', 'z'] == \
+            [info.relative_path for info in leaves]
+
+    with_directory_contents({'z': '',
+                             'a-b': '',
+                             'a/b': '',
+                             'a/c/d': '',
+                             'a/ignored/e': ''}, check)
+
+
+def test_list_project_skips_unreadable_subdirectory(monkeypatch):
+    def check(dirname):
+        real_scandir = os.scandir
+        unreadable = os.path.join(dirname, 'a')
+
+        def mock_scandir(path):
+            if path == unreadable:
+                raise OSError("NOPE")
+            return real_scandir(path)
+
+        monkeypatch.setattr('os.scandir', mock_scandir)
+        errors = []
+        infos = archiver._list_project(dirname, lambda info: False, errors)
+        assert [('a', True), ('b', False)] == [(info.relative_path, info.is_directory) for info in infos]
+        assert [] == errors
+
+    with_directory_contents({'a/b': '', 'b': ''}, check)
+
+
+def test_git_ignored_files_collapses_directories(monkeypatch):
+    def check(dirname):
+        calls = []
+
+        def mock_check_output(args, cwd):
+            calls.append(args)
+            return b"envs/\0sub dir/ignored.pyc\0"
+
+        def mock_check_ignore(project_directory, paths):
+            calls.append(paths)
+            return set(['envs'])
+
+        monkeypatch.setattr('subprocess.check_output', mock_check_output)
+        monkeypatch.setattr('conda_kapsel.archiver._git_check_ignore', mock_check_ignore)
+        errors = []
+        assert ['.git', 'envs', os.path.join('sub dir', 'ignored.pyc')] == archiver._git_ignored_files(dirname, errors)
+        assert [] == errors
+        assert ['git', 'ls-files', '--others', '--ignored', '--exclude-standard', '--directory', '-z'] == calls[0]
+        assert [['envs']] == calls[1:]
+
+    with_directory_contents({'.git/HEAD': 'ref: refs/heads/master\n'}, check)
+
+
+def test_git_ignored_files_only_collapses_ignored_directories():
+    def check(dirname):
+        subprocess.check_call(['git', 'init', '-q'], cwd=dirname)
+        errors = []
+        ignored = archiver._git_ignored_files(dirname, errors)
+        assert [] == errors
+        # envs/ is ignored itself, but build/ only has ignored files in it
+        assert ['.git', os.path.join('build', 'a.pyc'), os.path.join('build', 'sub', 'b.pyc'), 'envs'] == \
+            sorted(ignored)
+
+    with_directory_contents({'.gitignore': '*.pyc\n/envs/\n',
+                             'envs/default/c.py': '',
+                             'build/a.pyc': '',
+                             'build/sub/b.pyc': ''}, check)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from conda_kapsel.env_spec import EnvSpec
+
+
+def test_packages_by_name():
+    spec = EnvSpec(name="foo",
+                   conda_packages=['Numpy=1.11', 'python >=3.5', 'python'],
+                   channels=[],
+                   pip_packages=['flake8==3.0.4', 'requests'])
+    assert set(['numpy', 'python']) == set(spec.conda_packages_by_name.keys())
+    assert '=1.11' == spec.conda_packages_by_name['numpy'].conda_constraint
+    # the last spec for a name wins
+    assert spec.conda_packages_by_name['python'].conda_constraint is None
+    assert set(['flake8', 'requests']) == set(spec.pip_packages_by_name.keys())
+
+    assert frozenset(['numpy', 'python']) == spec.conda_package_names_set
+    assert frozenset(['flake8', 'requests']) == spec.pip_package_names_set
+
+    # parsed only once
+    assert spec.conda_packages_by_name is spec.conda_packages_by_name
+    assert spec.pip_packages_by_name is spec.pip_packages_by_name
+
+
+def test_conda_spec_matcher_is_compiled_once(monkeypatch):
+    spec = EnvSpec(name="foo", conda_packages=['numpy=1.11', 'python'], channels=[])
+    matcher = spec.conda_spec_matcher
+    assert ['numpy=1.11'] == matcher.specs_for(['numpy'])
+
+    def mock_parse_spec(spec):
+        raise AssertionError("should not parse again")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.parse_spec', mock_parse_spec)
+    assert matcher is spec.conda_spec_matcher
+
+
+def test_packages_by_name_is_read_only():
+    spec = EnvSpec(name="foo", conda_packages=['numpy'], channels=[])
+    with pytest.raises(TypeError):
+        spec.conda_packages_by_name['python'] = None
+    with pytest.raises(AttributeError):
+        spec.conda_package_names_set.add('python')
+
+
+def test_packages_by_name_skips_invalid_specs():
+    spec = EnvSpec(name="foo", conda_packages=['numpy', '='], channels=[], pip_packages=['@'])
+    assert ['numpy'] == list(spec.conda_packages_by_name.keys())
+    assert 0 == len(spec.pip_packages_by_name)
+
+
+def test_content_hash():
+    spec = EnvSpec(name="foo", conda_packages=['numpy'], channels=['bar'], pip_packages=['flake8'])
+    same = EnvSpec(name="other", conda_packages=['numpy'], channels=['bar'], pip_packages=['flake8'],
+                   description="Described")
+    assert spec.content_hash == same.content_hash
+    assert 40 == len(spec.content_hash)
+
+    assert spec.content_hash != EnvSpec(name="foo", conda_packages=['numpy'], channels=[],
+                                        pip_packages=['flake8']).content_hash
+    assert spec.content_hash != EnvSpec(name="foo", conda_packages=['numpy'], channels=['bar']).content_hash
+    assert spec.content_hash != EnvSpec(name="foo", conda_packages=['numpy=1.11'], channels=['bar'],
+                                        pip_packages=['flake8']).content_hash
+
+    # stable across processes, so it can name things on disk
+    assert 'd78a7506c6d327e9493f91c0a35edb5c22f2e2d8' == EnvSpec(name="x", conda_packages=[], channels=[]).content_hash
@@ -6,6 +6,8 @@
 # ----------------------------------------------------------------------------
 import codecs
 import os
+import threading
+import time
 
 import pytest
 
@@ -110,3 +112,130 @@ def test_run_state_must_be_dict():
         assert "service state should be a dict" in repr(excinfo.value)
 
     with_directory_contents(dict(), check_cannot_use_non_dict)
+
+
+def test_merge_with_concurrent_save(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        first = LocalStateFile.load_for_directory(project_dir)
+        second = LocalStateFile.load_for_directory(project_dir)
+
+        first.set_service_run_state('FIRST', dict(port=1))
+        first.set_value(['variables', 'SHARED'], 'first')
+        first.unset_value(['variables', 'GONE'])
+        first.save()
+
+        # second doesn't know about first's changes
+        second.set_service_run_state('SECOND', dict(port=2))
+        second.set_value(['variables', 'SHARED'], 'second')
+        second.set_value('default_env_spec_name', 'foo')
+        second.save()
+
+        for local_state in (second, LocalStateFile.load_for_directory(project_dir)):
+            assert dict(EXISTING=dict(port=0), FIRST=dict(port=1), SECOND=dict(port=2)) == \
+                local_state.get_all_service_run_states()
+            # where both changed the same thing, the last save wins
+            assert dict(KEPT='kept', SHARED='second') == local_state.get_value('variables')
+            assert 'foo' == local_state.get_value('default_env_spec_name')
+        with codecs.open(second.filename, 'r', 'utf-8') as f:
+            assert "# my comment" in f.read()
+
+        # the merged file is what we have now, so first can merge again
+        first.set_service_run_state('FIRST', dict(port=3))
+        first.save()
+        assert dict(EXISTING=dict(port=0), FIRST=dict(port=3), SECOND=dict(port=2)) == \
+            LocalStateFile.load_for_directory(project_dir).get_all_service_run_states()
+
+    with_directory_contents(
+        {"project/" + DEFAULT_LOCAL_STATE_FILENAME: """
+# my comment
+variables:
+  KEPT: kept
+  GONE: gone
+service_run_states:
+  EXISTING: { port: 0 }
+"""}, check)
+
+
+def test_merge_with_concurrent_save_of_new_file(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        local_states = [LocalStateFile.load_for_directory(project_dir) for i in range(3)]
+        for (i, local_state) in enumerate(local_states):
+            local_state.set_service_run_state('S%d' % i, dict(port=i))
+            local_state.save()
+        assert dict(S0=dict(port=0), S1=dict(port=1), S2=dict(port=2)) == \
+            LocalStateFile.load_for_directory(project_dir).get_all_service_run_states()
+
+    with_directory_contents(dict(), check)
+
+
+def test_transform_service_run_state_from_two_instances(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        local_states = [LocalStateFile.load_for_directory(project_dir) for i in range(2)]
+        local_states[1].set_value(['variables', 'FOO'], 'bar')
+        started = []
+
+        def start_service(state):
+            if 'port' not in state:
+                # slow enough for the other instance to try at the same time
+                time.sleep(0.2)
+                started.append(True)
+                state['port'] = 6380
+            return state['port']
+
+        ports = []
+
+        def transform(local_state):
+            ports.append(local_state.transform_service_run_state('REDIS_URL', start_service))
+
+        threads = [threading.Thread(target=transform, args=(local_state, )) for local_state in local_states]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # only one of them started the service, and both know about it
+        assert [True] == started
+        assert [6380, 6380] == ports
+        for local_state in local_states + [LocalStateFile.load_for_directory(project_dir)]:
+            assert dict(port=6380) == local_state.get_service_run_state('REDIS_URL')
+        # unrelated keys are still merged
+        assert 'bar' == LocalStateFile.load_for_directory(project_dir).get_value(['variables', 'FOO'])
+
+    with_directory_contents(dict(), check)
+
+
+def test_transform_service_run_state_keeps_state_changed_in_memory(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        first = LocalStateFile.load_for_directory(project_dir)
+        second = LocalStateFile.load_for_directory(project_dir)
+        first.set_service_run_state('FOO', dict(port=1))
+        first.save()
+
+        # we changed it ourselves, so the state on disk doesn't replace it
+        second.set_service_run_state('FOO', dict(port=2))
+        assert 2 == second.transform_service_run_state('FOO', lambda state: state['port'])
+        assert dict(port=2) == second.get_service_run_state('FOO')
+
+    with_directory_contents(dict(), check)
+
+
+def test_replace_corrupted_file_saved_concurrently(monkeypatch):
+    def check(dirname):
+        monkeypatch.setenv('CONDA_KAPSEL_CACHE_DIR', os.path.join(dirname, "cache"))
+        project_dir = os.path.join(dirname, "project")
+        local_state = LocalStateFile.load_for_directory(project_dir)
+        with codecs.open(local_state.filename, 'w', 'utf-8') as f:
+            f.write("[not: closed\n")
+        local_state.set_service_run_state('FOO', dict(port=1))
+        local_state.save()
+        assert dict(FOO=dict(port=1)) == LocalStateFile.load_for_directory(project_dir).get_all_service_run_states()
+
+    with_directory_contents({"project/" + DEFAULT_LOCAL_STATE_FILENAME: "variables: {}\n"}, check)
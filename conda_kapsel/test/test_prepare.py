@@ -7,25 +7,41 @@
 from __future__ import absolute_import
 
 from copy import deepcopy
+from functools import partial
 import os
 import platform
 import pytest
 import subprocess
+import threading
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
 
 from conda_kapsel.test.environ_utils import minimal_environ, strip_environ
 from conda_kapsel.test.project_utils import project_no_dedicated_env
 from conda_kapsel.internal.test.tmpfile_utils import (with_directory_contents,
-                                                      with_directory_contents_completing_project_file)
+                                                      with_directory_contents_completing_project_file,
+                                                      complete_project_file_content)
 from conda_kapsel.internal import conda_api
+from conda_kapsel.internal import trace
 from conda_kapsel.prepare import (prepare_without_interaction, prepare_with_browser_ui, unprepare, prepare_in_stages,
-                                  PrepareSuccess, PrepareFailure, _after_stage_success, _FunctionPrepareStage)
+                                  prepare_without_interaction_async, prepare_execute_without_interaction_async,
+                                  PrepareSuccess, PrepareFailure, _after_stage_success, _FunctionPrepareStage,
+                                  _provide_all, _provide_all_async, prepare_plan,
+                                  prepare_projects_without_interaction)
 from conda_kapsel.project import Project
 from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 from conda_kapsel.project_commands import ProjectCommand
 from conda_kapsel.local_state_file import LocalStateFile
+from conda_kapsel.plugins.provider import EnvVarProvider, Provider, ProvideResult
+from conda_kapsel.plugins.registry import PluginRegistry
+from conda_kapsel.internal.environ_overlay import EnvironOverlay
+from conda_kapsel.provide import PROVIDE_MODE_CHECK
 from conda_kapsel.plugins.requirement import (EnvVarRequirement, UserConfigOverrides)
+from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
 from conda_kapsel.conda_manager import (push_conda_manager_class, pop_conda_manager_class, CondaManager,
-                                        CondaEnvironmentDeviations)
+                                        CondaEnvironmentDeviations, CondaFixPlan)
 import conda_kapsel.internal.keyring as keyring
 
 
@@ -133,6 +149,24 @@ variables:
 """}, prepare_some_env_var)
 
 
+def test_prepare_records_timings():
+    def prepare_with_timings(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        result = prepare_without_interaction(project, environ=environ, mode=PROVIDE_MODE_CHECK)
+        assert not result
+        spans = result.timings.spans
+        assert "check FOO" in [span.name for span in spans if span.category == 'check_status']
+        assert "analyze FOO" in [span.name for span in spans if span.category == 'analyze']
+        assert all(span.duration >= 0 for span in spans)
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+"""}, prepare_with_timings)
+
+
 def test_prepare_some_env_var_not_set():
     def prepare_some_env_var(dirname):
         project = project_no_dedicated_env(dirname)
@@ -372,6 +406,29 @@ variables:
 """}, prepare_then_update_environ)
 
 
+def test_prepare_environ_is_overlay():
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ(FOO='bar')
+        original = dict(environ)
+        # check mode, so whether we succeed depends on the conda env;
+        # either way we should have made an overlay
+        result = prepare_without_interaction(project, environ=environ, mode=PROVIDE_MODE_CHECK)
+
+        # we didn't copy or modify environ, we recorded our changes on top of it
+        assert original == environ
+        assert isinstance(result.environ, EnvironOverlay)
+        assert environ is result.environ.base
+        assert dirname == result.environ.changed['PROJECT_DIR']
+        assert 'FOO' not in result.environ.changed
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+"""}, check)
+
+
 def test_attempt_to_grab_result_early():
     def early_result_grab(dirname):
         project = project_no_dedicated_env(dirname)
@@ -705,3 +762,414 @@ def test_prepare_success_properties():
     assert result.status_for('FOO') is None
     assert result.status_for(EnvVarRequirement) is None
     assert result.overrides is not None
+
+
+class _FakeProvider(object):
+    def __init__(self, log, sets, depends_on_env=True, delay=0.0, error=None):
+        self.log = log
+        self.sets = sets
+        self.depends_on_env = depends_on_env
+        self.delay = delay
+        self.error = error
+
+    def provide_depends_on_conda_env(self, requirement):
+        return self.depends_on_env
+
+    def provide(self, requirement, context):
+        self.log.append(('start', requirement.env_var, dict(context.environ)))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        context.environ.update(self.sets)
+        self.log.append(('end', requirement.env_var, None))
+        return ProvideResult(logs=["provided " + requirement.env_var])
+
+
+class _FakeAsyncProvider(_FakeProvider):
+    @gen.coroutine
+    def provide_async(self, requirement, context):
+        self.log.append(('start', requirement.env_var, dict(context.environ)))
+        yield gen.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        context.environ.update(self.sets)
+        self.log.append(('end', requirement.env_var, None))
+        raise gen.Return(ProvideResult(logs=["provided " + requirement.env_var]))
+
+
+class _FakeAnalysis(object):
+    def __init__(self, missing):
+        self.missing_env_vars_to_provide = missing
+
+
+class _FakeStatus(object):
+    def __init__(self, requirement, provider, missing=()):
+        self.requirement = requirement
+        self.provider = provider
+        self.analysis = _FakeAnalysis(missing)
+
+
+def _fake_statuses(log, delay=0.0, error=None, provider_class=_FakeProvider):
+    registry = PluginRegistry()
+    env = CondaEnvRequirement(registry)
+    env_status = _FakeStatus(env,
+                             provider_class(log, {env.env_var: '/env', 'PATH': '/env/bin'}, depends_on_env=False,
+                                            delay=delay))
+    download = _FakeStatus(EnvVarRequirement(registry, env_var='DATA'),
+                           provider_class(log, dict(DATA='/data', SHARED='download'), depends_on_env=False,
+                                          delay=delay))
+    redis = _FakeStatus(EnvVarRequirement(registry, env_var='REDIS_URL'),
+                        provider_class(log, dict(REDIS_URL='redis://', SHARED='redis'), delay=delay, error=error))
+    uses_data = _FakeStatus(EnvVarRequirement(registry, env_var='USES_DATA'),
+                            provider_class(log, dict(USES_DATA='yes'), depends_on_env=False), missing=('DATA', ))
+    return [env_status, download, redis, uses_data]
+
+
+def _run_provide_all_async(statuses, environ, timings=None):
+    if timings is None:
+        timings = trace.Timings()
+    io_loop = IOLoop(make_current=False)
+    try:
+        return io_loop.run_sync(lambda: _provide_all_async(statuses,
+                                                           environ,
+                                                           local_state=None,
+                                                           default_env_spec_name='default',
+                                                           mode=None,
+                                                           timings=timings))
+    finally:
+        io_loop.close()
+
+
+@pytest.mark.parametrize('provide_all', ['sync', 'async'])
+def test_provide_all_runs_independent_providers_together(provide_all):
+    log = []
+    environ = dict(PATH='/bin', GONE='x')
+    start = time.time()
+    if provide_all == 'sync':
+        statuses = _fake_statuses(log, delay=0.5)
+        results = _provide_all(statuses, environ, local_state=None, default_env_spec_name='default', mode=None)
+    else:
+        statuses = _fake_statuses(log, delay=0.5, provider_class=_FakeAsyncProvider)
+        results = _run_provide_all_async(statuses, environ)
+    # env and download run together, then redis and the download consumer
+    assert time.time() - start < 1.5
+
+    assert ["provided " + status.requirement.env_var for status in statuses] == \
+        [results[status].logs[0] for status in statuses]
+
+    starts = dict((name, seen) for (what, name, seen) in log if what == 'start')
+    ends = [name for (what, name, seen) in log if what == 'end']
+    # redis waited for the env and sees its PATH
+    assert ends.index(statuses[0].requirement.env_var) < [name for (what, name, seen) in log].index('REDIS_URL')
+    assert '/env/bin' == starts['REDIS_URL']['PATH']
+    # the download didn't wait for the env
+    assert '/bin' == starts['DATA']['PATH']
+    # the consumer sees the download but not the unrelated env
+    assert '/data' == starts['USES_DATA']['DATA']
+    assert '/bin' == starts['USES_DATA']['PATH']
+
+    # merged in order, so redis (later) wins over the download
+    assert 'redis' == environ['SHARED']
+    assert '/env/bin' == environ['PATH']
+    assert 'yes' == environ['USES_DATA']
+    assert 'x' == environ['GONE']
+
+
+def test_provide_all_is_deterministic():
+    environs = []
+    for i in range(5):
+        environ = dict(PATH='/bin')
+        _provide_all(_fake_statuses([]), environ, local_state=None, default_env_spec_name='default', mode=None)
+        environs.append(environ)
+    assert all(environ == environs[0] for environ in environs)
+
+
+def test_provide_all_raises_provider_exception():
+    log = []
+    environ = dict(PATH='/bin')
+    with pytest.raises(RuntimeError) as excinfo:
+        _provide_all(_fake_statuses(log, error=RuntimeError("redis exploded")),
+                     environ,
+                     local_state=None,
+                     default_env_spec_name='default',
+                     mode=None)
+    assert "redis exploded" in str(excinfo.value)
+    # nothing half-merged into the environ
+    assert dict(PATH='/bin') == environ
+
+
+def test_provide_all_async_raises_provider_exception():
+    environ = dict(PATH='/bin')
+    with pytest.raises(RuntimeError) as excinfo:
+        _run_provide_all_async(_fake_statuses([], error=RuntimeError("redis exploded"),
+                                              provider_class=_FakeAsyncProvider), environ)
+    assert "redis exploded" in str(excinfo.value)
+    assert dict(PATH='/bin') == environ
+
+
+def test_provide_all_async_uses_threads_for_sync_providers():
+    log = []
+    environ = dict(PATH='/bin')
+    statuses = _fake_statuses(log)
+    for status in statuses:
+        status.provider.provide_async = partial(Provider.provide_async, status.provider)
+    timings = trace.Timings()
+    results = _run_provide_all_async(statuses, environ, timings)
+
+    assert ["provided " + status.requirement.env_var for status in statuses] == \
+        [results[status].logs[0] for status in statuses]
+    assert 'redis' == environ['SHARED']
+    assert sorted(["provide " + status.requirement.env_var for status in statuses]) == \
+        sorted([span.name for span in timings.spans])
+
+
+def test_prepare_without_interaction_async():
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        sync_result = prepare_without_interaction(project, environ=environ, mode=PROVIDE_MODE_CHECK)
+
+        io_loop = IOLoop(make_current=False)
+        try:
+            result = io_loop.run_sync(lambda: prepare_without_interaction_async(project,
+                                                                                environ=environ,
+                                                                                mode=PROVIDE_MODE_CHECK))
+        finally:
+            io_loop.close()
+
+        assert not result
+        assert sync_result.errors == result.errors
+        assert "check FOO" in [span.name for span in result.timings.spans]
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+"""}, check)
+
+
+def test_prepare_without_interaction_async_checks_in_a_thread(monkeypatch):
+    original_analyze = EnvVarProvider.analyze
+    analyzing = []
+    ticks_while_analyzing = []
+
+    def slow_analyze(self, *args):
+        analyzing.append(True)
+        try:
+            time.sleep(0.2)
+            return original_analyze(self, *args)
+        finally:
+            analyzing.pop()
+
+    monkeypatch.setattr(EnvVarProvider, 'analyze', slow_analyze)
+
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+
+        @gen.coroutine
+        def prepare_and_tick():
+            future = prepare_without_interaction_async(project, environ=environ, mode=PROVIDE_MODE_CHECK)
+            while not future.done():
+                if analyzing:
+                    ticks_while_analyzing.append(True)
+                yield gen.sleep(0.01)
+            result = yield future
+            raise gen.Return(result)
+
+        io_loop = IOLoop(make_current=False)
+        try:
+            result = io_loop.run_sync(prepare_and_tick)
+        finally:
+            io_loop.close()
+
+        assert not result
+        # another coroutine kept running while analyze() was blocked
+        assert len(ticks_while_analyzing) > 0
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+"""}, check)
+
+
+def test_prepare_execute_async_runs_plain_stages_in_a_thread():
+    threads = []
+
+    def do_first(stage):
+        threads.append(threading.current_thread())
+        stage.set_result(PrepareSuccess(logs=["first"], statuses=(), command_exec_info=None, environ=dict(),
+                                        overrides=UserConfigOverrides()), [])
+        return None
+
+    stage = _after_stage_success(_FunctionPrepareStage(dict(), UserConfigOverrides(), "first", [], do_first),
+                                 lambda statuses: None)
+    io_loop = IOLoop(make_current=False)
+    try:
+        result = io_loop.run_sync(lambda: prepare_execute_without_interaction_async(stage))
+    finally:
+        io_loop.close()
+
+    assert ["first"] == result.logs
+    assert [threading.current_thread()] != threads
+
+
+def test_prepare_plan(monkeypatch):
+    class MissingPackagesCondaManager(CondaManager):
+        def find_environment_deviations(self, prefix, spec):
+            return CondaEnvironmentDeviations(summary="missing",
+                                              missing_packages=('a', 'b'),
+                                              wrong_version_packages=(),
+                                              missing_pip_packages=(),
+                                              wrong_version_pip_packages=(),
+                                              broken=True)
+
+        def plan_environment_fix(self, prefix, spec, deviations):
+            return CondaFixPlan(packages=['a-1-0', 'b-1-0'],
+                                pip_packages=(),
+                                urls=['http://example.com/a-1-0.tar.bz2#abc'],
+                                cached_urls=['http://example.com/b-1-0.tar.bz2#def'],
+                                from_lockfile=True)
+
+        def fix_environment_deviations(self, prefix, spec, deviations=None):
+            raise AssertionError("plan shouldn't change the environment")
+
+        def remove_packages(self, prefix, packages):
+            pass
+
+    requested = []
+
+    def mock_fetch_sizes(urls):
+        requested.extend(urls)
+        return {'http://example.com/a-1-0.tar.bz2#abc': (1000, True), 'http://example.com/data.csv': (None, False)}
+
+    monkeypatch.setattr('conda_kapsel.internal.http_client.fetch_sizes', mock_fetch_sizes)
+
+    def check(dirname):
+        push_conda_manager_class(MissingPackagesCondaManager)
+        try:
+            project = Project(dirname)
+            environ = minimal_environ()
+            plan = prepare_plan(project, environ=environ)
+        finally:
+            pop_conda_manager_class()
+
+        assert plan
+        assert [] == plan.errors
+        # the environment comes first, the rest in no particular order
+        assert 'create_environment' == plan.steps[0].action
+        steps = dict((step.action, step) for step in plan.steps)
+        assert ['configure', 'create_environment', 'download'] == sorted(steps.keys())
+        (env_step, configure_step, download_step) = (steps['create_environment'], steps['configure'],
+                                                     steps['download'])
+        assert "create environment default (2 packages, 1 already downloaded)" == env_step.description
+        assert 1000 == env_step.download_bytes
+        assert env_step.resumable
+        assert "configure FOO" == configure_step.description
+        assert 0 == configure_step.download_bytes
+        assert "download DATAFILE from http://example.com/data.csv" == download_step.description
+        assert download_step.download_bytes is None
+        assert os.path.join(dirname, 'data.csv') == download_step.details['filename']
+
+        assert sorted(requested) == ['http://example.com/a-1-0.tar.bz2#abc', 'http://example.com/data.csv']
+        assert 1000 == plan.total_download_bytes
+        assert plan.has_unknown_sizes
+        as_json = plan.to_json()
+        assert 'DATAFILE' == [step for step in as_json['steps'] if step['action'] == 'download'][0]['env_var']
+        assert 1000 == as_json['total_download_bytes']
+
+        # nothing was created or saved
+        assert not os.path.exists(os.path.join(dirname, 'envs'))
+        assert not os.path.exists(os.path.join(dirname, 'data.csv'))
+
+        # without sizes, we don't ask the server
+        del requested[:]
+        push_conda_manager_class(MissingPackagesCondaManager)
+        try:
+            plan = prepare_plan(project, environ=environ, provide_whitelist=['BAR', 'DATAFILE'], check_sizes=False)
+        finally:
+            pop_conda_manager_class()
+        assert ['download'] == [step.action for step in plan.steps]
+        assert [] == requested
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+  BAR: { default: "bar" }
+downloads:
+  DATAFILE: http://example.com/data.csv
+"""}, check)
+
+
+def test_prepare_plan_nothing_to_do():
+    def check(dirname):
+        _push_fake_env_creator()
+        try:
+            project = Project(dirname)
+            plan = prepare_plan(project, environ=minimal_environ(FOO='foo'))
+        finally:
+            _pop_fake_env_creator()
+        assert plan
+        assert () == plan.steps
+        assert 0 == plan.total_download_bytes
+        assert not plan.has_unknown_sizes
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+"""}, check)
+
+
+def test_prepare_plan_bad_command_name():
+    def check(dirname):
+        project = Project(dirname)
+        plan = prepare_plan(project, environ=minimal_environ(), command_name="blah")
+        assert not plan
+        assert "Command name 'blah' is not in" in plan.errors[0]
+        assert [] == plan.to_json()['steps']
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: ""}, check)
+
+
+def test_prepare_projects_without_interaction():
+    def check(dirname):
+        ready = project_no_dedicated_env(os.path.join(dirname, "ready"))
+        missing = project_no_dedicated_env(os.path.join(dirname, "missing"))
+        reported = []
+
+        results = prepare_projects_without_interaction([ready, missing],
+                                                       environ=minimal_environ(),
+                                                       mode=PROVIDE_MODE_CHECK,
+                                                       jobs=2,
+                                                       on_result=lambda project, result: reported.append(project))
+        assert [bool(result) for result in results] == [True, False]
+        assert 'foo' == results[0].environ['FOO']
+        assert "  Environment variable BAR is not set." in results[1].errors
+        assert sorted([ready, missing], key=id) == sorted(reported, key=id)
+
+    with_directory_contents(
+        {"ready/" + DEFAULT_PROJECT_FILENAME: complete_project_file_content("variables:\n  FOO: { default: 'foo' }\n"),
+         "missing/" + DEFAULT_PROJECT_FILENAME: complete_project_file_content("variables:\n  BAR: {}\n")}, check)
+
+
+def test_prepare_projects_without_interaction_exception(monkeypatch):
+    def check(dirname):
+        def mock_prepare_without_interaction(project, **kwargs):
+            raise IOError("disk on fire")
+
+        monkeypatch.setattr('conda_kapsel.prepare.prepare_without_interaction', mock_prepare_without_interaction)
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        results = prepare_projects_without_interaction([project], environ=environ)
+        assert 1 == len(results)
+        assert not results[0]
+        assert ["Failed to prepare %s: disk on fire" % dirname] == results[0].errors
+
+        # the result doesn't share the caller's environ
+        results[0].environ['FOO'] = 'bar'
+        assert 'FOO' not in environ
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: ""}, check)
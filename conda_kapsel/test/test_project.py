@@ -238,18 +238,51 @@ def test_project_dir_not_readable(monkeypatch):
         project_dir = os.path.join(dirname, 'foo')
         os.makedirs(project_dir)
 
-        def mock_os_walk(dirname):
-            raise OSError("NOPE")
+        real_scandir = os.scandir
 
-        monkeypatch.setattr('os.walk', mock_os_walk)
+        def mock_scandir(path):
+            if path == project_dir:
+                raise OSError("NOPE")
+            return real_scandir(path)
+
+        monkeypatch.setattr('os.scandir', mock_scandir)
 
         project = Project(project_dir)
 
         assert ["Could not list files in %s: NOPE." % project_dir] == project.problems
+        assert dict() == project.commands
 
     with_directory_contents(dict(), check_not_readable)
 
 
+def test_loading_project_does_not_look_for_notebooks(monkeypatch):
+    def check(dirname):
+        walked = []
+        real_scandir = os.scandir
+
+        def mock_scandir(path):
+            if path == dirname:
+                walked.append(path)
+            return real_scandir(path)
+
+        monkeypatch.setattr('os.scandir', mock_scandir)
+
+        project = project_no_dedicated_env(dirname)
+        assert 2 == len(project.requirements)
+        assert [] == walked
+
+        # failing to find notebooks is a problem, so checking for problems finds them
+        assert [] == project.problems
+        assert [dirname] == walked
+
+        assert ['foo.ipynb'] == list(project.commands.keys())
+        assert 'foo.ipynb' == project.default_command.name
+        assert [dirname] == walked
+
+    with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "variables:\n  FOO: {}\n",
+                                                     'foo.ipynb': ''}, check)
+
+
 def test_single_env_var_requirement_with_options():
     def check_some_env_var(dirname):
         project = project_no_dedicated_env(dirname)
@@ -496,6 +529,7 @@ def test_get_package_requirements_from_project_file():
         assert ("pip1", "pip2==1.3", "pip3") == env.pip_packages
         assert set(["foo", "hello", "world"]) == env.conda_package_names_set
         assert set(["pip1", "pip2", "pip3"]) == env.pip_package_names_set
+        assert os.path.join(dirname, "kapsel-default.lock") == env.lock_file
 
         # find CondaEnvRequirement
         conda_env_req = None
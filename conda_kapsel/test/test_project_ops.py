@@ -7,6 +7,7 @@
 from __future__ import absolute_import, print_function
 
 import codecs
+import json
 import os
 from tornado import gen
 import pytest
@@ -27,6 +28,7 @@ from conda_kapsel.test.project_utils import project_no_dedicated_env
 from conda_kapsel.internal.test.test_conda_api import monkeypatch_conda_not_to_use_links
 from conda_kapsel.test.fake_server import fake_server
 import conda_kapsel.internal.keyring as keyring
+from conda_kapsel.internal.conda_lockfile import load_lockfile
 
 
 def test_create(monkeypatch):
@@ -1411,6 +1413,165 @@ def test_remove_packages_with_project_file_problems():
     with_directory_contents_completing_project_file({DEFAULT_PROJECT_FILENAME: "variables:\n  42"}, check)
 
 
+def test_lock(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+
+    def check(dirname):
+        def attempt():
+            project = Project(dirname)
+            status = project_ops.lock(project)
+            assert status
+            assert "Updated lockfiles for: bar, foo." == status.status_description
+
+            lockfile = load_lockfile(os.path.join(dirname, 'kapsel-foo.lock'))
+            assert ['http://example.com/python-3.5.2-0.tar.bz2#abc'] == lockfile.urls
+            assert lockfile.is_current(project.env_specs['foo'], 'linux-64')
+            assert os.path.isfile(os.path.join(dirname, 'kapsel-bar.lock'))
+
+            # nothing changed, so nothing to do
+            status = project_ops.lock(project, env_spec_name='foo')
+            assert status
+            assert "Lockfiles were already up to date." == status.status_description
+
+        _with_conda_test(attempt)
+
+    meta = '{"url": "http://example.com/python-3.5.2-0.tar.bz2", "md5": "abc"}'
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+env_specs:
+  foo:
+    packages: [python]
+  bar:
+    packages: [python]
+""",
+         'envs/foo/conda-meta/python-3.5.2-0.json': meta,
+         'envs/bar/conda-meta/python-3.5.2-0.json': meta}, check)
+
+
+def test_lock_leaves_out_packages_the_env_spec_does_not_need(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+
+    def meta(dist, depends):
+        return json.dumps(dict(url="http://example.com/%s.tar.bz2" % dist, depends=depends))
+
+    def check(dirname):
+        def attempt():
+            project = Project(dirname)
+            status = project_ops.lock(project)
+            assert status
+
+            lockfile = load_lockfile(os.path.join(dirname, 'kapsel-default.lock'))
+            assert ['http://example.com/numpy-1.11.1-py35_0.tar.bz2',
+                    'http://example.com/openblas-0.2.18-0.tar.bz2',
+                    'http://example.com/openssl-1.0.2h-1.tar.bz2',
+                    'http://example.com/python-3.5.2-0.tar.bz2'] == lockfile.urls
+
+        _with_conda_test(attempt)
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+packages: [numpy]
+""",
+         'envs/default/conda-meta/numpy-1.11.1-py35_0.json': meta('numpy-1.11.1-py35_0',
+                                                                  ["openblas 0.2.18*", "python 3.5*"]),
+         'envs/default/conda-meta/openblas-0.2.18-0.json': meta('openblas-0.2.18-0', []),
+         'envs/default/conda-meta/python-3.5.2-0.json': meta('python-3.5.2-0', ["openssl 1.0.2*"]),
+         'envs/default/conda-meta/openssl-1.0.2h-1.json': meta('openssl-1.0.2h-1', []),
+         # installed by hand, so it shouldn't end up in the lockfile
+         'envs/default/conda-meta/requests-2.10.0-py35_0.json': meta('requests-2.10.0-py35_0',
+                                                                     ["python 3.5*", "openssl"])}, check)
+
+
+def test_lock_nonexistent_env_spec():
+    def check(dirname):
+        project = Project(dirname)
+        status = project_ops.lock(project, env_spec_name='nope')
+        assert not status
+        assert "Environment spec nope doesn't exist." == status.status_description
+
+    with_directory_contents_completing_project_file(dict(), check)
+
+
+def test_lock_fails(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', lambda: 'linux-64')
+
+    def check(dirname):
+        def attempt():
+            project = Project(dirname)
+            status = project_ops.lock(project)
+            assert not status
+            assert "Could not lock environment spec default." == status.status_description
+            assert "doesn't record the URL it came from" in status.errors[0]
+            assert not os.path.exists(os.path.join(dirname, 'kapsel-default.lock'))
+
+        _with_conda_test(attempt)
+
+    with_directory_contents_completing_project_file({'envs/default/conda-meta/python-3.5.2-0.json': '{}'}, check)
+
+
+def test_lock_cannot_get_platform(monkeypatch):
+    def mock_current_platform():
+        from conda_kapsel.internal import conda_api
+        raise conda_api.CondaError("no conda")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.current_platform', mock_current_platform)
+
+    def check(dirname):
+        project = Project(dirname)
+        status = project_ops.lock(project)
+        assert not status
+        assert ["no conda"] == status.errors
+
+    with_directory_contents_completing_project_file(dict(), check)
+
+
+def test_prepare_env_specs():
+    def check(dirname):
+        def attempt():
+            project = Project(dirname)
+            status = project_ops.prepare_env_specs(project, jobs=2)
+            assert status
+            assert "Environment specs are ready: bar, foo." == status.status_description
+            assert ['bar', 'foo'] == sorted(status.deviations.keys())
+            assert [] == status.errors
+
+        _with_conda_test(attempt, missing_packages=('python', ))
+
+    with_directory_contents_completing_project_file(
+        {DEFAULT_PROJECT_FILENAME: """
+env_specs:
+  foo:
+    packages: [python]
+  bar:
+    packages: [python]
+"""}, check)
+
+
+def test_prepare_env_specs_check_only():
+    def check(dirname):
+        def attempt():
+            project = Project(dirname)
+            status = project_ops.prepare_env_specs(project, env_spec_names=['default'], fix=False)
+            assert not status
+            assert "Failed to prepare environment specs: default." == status.status_description
+            assert ["default: test"] == status.logs
+            assert ('python', ) == status.deviations['default'].missing_packages
+
+        _with_conda_test(attempt, missing_packages=('python', ))
+
+    with_directory_contents_completing_project_file(dict(), check)
+
+
+def test_prepare_env_specs_nonexistent_env_spec():
+    def check(dirname):
+        project = Project(dirname)
+        status = project_ops.prepare_env_specs(project, env_spec_names=['nope'])
+        assert not status
+        assert "Environment spec nope doesn't exist." == status.status_description
+
+    with_directory_contents_completing_project_file(dict(), check)
+
+
 def _monkeypatch_can_connect_to_socket_on_standard_redis_port(monkeypatch):
     from conda_kapsel.plugins.network_util import can_connect_to_socket as real_can_connect_to_socket
 
@@ -1906,6 +2067,39 @@ name: archivedproj
     with_directory_contents_completing_project_file(dict(), archivetest)
 
 
+def test_archive_zip_does_not_walk_git_ignored_directory(monkeypatch):
+    def archivetest(archive_dest_dir):
+        archivefile = os.path.join(archive_dest_dir, "foo.zip")
+
+        def check(dirname):
+            project = project_no_dedicated_env(dirname)
+
+            ignored_dir = os.path.join(dirname, "data")
+            real_scandir = os.scandir
+
+            def mock_scandir(path):
+                assert path != ignored_dir
+                return real_scandir(path)
+
+            monkeypatch.setattr('os.scandir', mock_scandir)
+
+            status = project_ops.archive(project, archivefile)
+
+            assert status
+            _assert_zip_contains(archivefile, ['foo.py', '.gitignore', 'kapsel.yml', 'kapsel-local.yml'])
+
+        with_directory_contents_completing_project_file(
+            _add_empty_git({DEFAULT_PROJECT_FILENAME: """
+name: archivedproj
+        """,
+                            "foo.py": "print('hello')\n",
+                            '.gitignore': "/data/\n",
+                            'data/a.csv': '1,2\n',
+                            'data/more/b.csv': '3,4\n'}), check)
+
+    with_directory_contents_completing_project_file(dict(), archivetest)
+
+
 def test_archive_zip_with_failing_git_command(monkeypatch):
     def archivetest(archive_dest_dir):
         archivefile = os.path.join(archive_dest_dir, "foo.zip")
@@ -1987,10 +2181,14 @@ def test_archive_zip_with_inability_to_walk_directory(monkeypatch):
             project = project_no_dedicated_env(dirname)
             assert project.problems == []
 
-            def mock_os_walk(dirname):
-                raise OSError("NOPE")
+            real_scandir = os.scandir
 
-            monkeypatch.setattr('os.walk', mock_os_walk)
+            def mock_scandir(path):
+                if path == dirname:
+                    raise OSError("NOPE")
+                return real_scandir(path)
+
+            monkeypatch.setattr('os.scandir', mock_scandir)
 
             status = project_ops.archive(project, archivefile)
 
@@ -2127,6 +2325,28 @@ name: archivedproj
                         'foo.zip': ""}), check)
 
 
+def test_archive_zip_into_project_subdirectory():
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+
+        # the subdirectory is listed after we start writing, so
+        # the temporary file is there when we list it
+        archivefile = os.path.join(dirname, "dist", "foo.zip")
+        status = project_ops.archive(project, archivefile)
+
+        assert status
+        assert os.path.exists(archivefile)
+        _assert_zip_contains(archivefile, ['foo.py', 'kapsel.yml', 'kapsel-local.yml', 'dist/README'])
+        assert ['README', 'foo.zip'] == sorted(os.listdir(os.path.join(dirname, "dist")))
+
+    with_directory_contents_completing_project_file(
+        _add_empty_git({DEFAULT_PROJECT_FILENAME: """
+name: archivedproj
+""",
+                        "foo.py": "print('hello')\n",
+                        'dist/README': "archives go here\n"}), check)
+
+
 def test_archive_zip_with_projectignore():
     def archivetest(archive_dest_dir):
         archivefile = os.path.join(archive_dest_dir, "foo.zip")
@@ -2185,10 +2405,14 @@ def test_upload_cannot_walk_directory(monkeypatch):
         project = project_no_dedicated_env(dirname)
         assert [] == project.problems
 
-        def mock_os_walk(dirname):
-            raise OSError("NOPE")
+        real_scandir = os.scandir
+
+        def mock_scandir(path):
+            if path == dirname:
+                raise OSError("NOPE")
+            return real_scandir(path)
 
-        monkeypatch.setattr('os.walk', mock_os_walk)
+        monkeypatch.setattr('os.scandir', mock_scandir)
 
         status = project_ops.upload(project, site='unit_test')
         assert not status
@@ -10,6 +10,8 @@ from conda_kapsel.internal.test.tmpfile_utils import with_file_contents, with_di
 import errno
 import os
 import pytest
+import threading
+import time
 
 
 def test_read_yaml_file_and_get_value():
@@ -309,8 +311,11 @@ def test_multiple_saves_ignored_if_not_dirty():
         assert not os.path.exists(filename)
         yaml = YamlFile(filename)
         assert yaml.change_count == 1
+        assert not yaml.has_uncounted_changes
         yaml.set_value(["a", "b"], 42)
+        assert yaml.has_uncounted_changes
         yaml.save()
+        assert not yaml.has_uncounted_changes
         assert yaml.change_count == 2
         assert os.path.exists(filename)
         time1 = os.path.getmtime(filename)
@@ -542,3 +547,192 @@ def test_read_yaml_file_and_set_get_empty_string():
         assert value == ' '
 
     with_file_contents("", check)
+
+
+def test_content_key_and_lazy_parse(monkeypatch):
+    def check_content_key(dirname):
+        filename = os.path.join(dirname, "foo.yaml")
+        yaml = YamlFile(filename)
+        assert [filename, None, None, None] == yaml.content_key
+
+        yaml.set_value(["a", "b"], 42)
+        assert yaml.content_key is None
+        yaml.save()
+        saved_key = yaml.content_key
+        assert saved_key is not None
+        assert os.path.getsize(filename) == saved_key[1]
+
+        parsed = []
+
+        from conda_kapsel import yaml_file
+        real_load_string = yaml_file._load_string
+
+        def mock_load_string(contents):
+            parsed.append(contents)
+            return real_load_string(contents)
+
+        monkeypatch.setattr('conda_kapsel.yaml_file._load_string', mock_load_string)
+
+        yaml2 = YamlFile(filename)
+        assert saved_key == yaml2.content_key
+        # we don't parse until someone looks at the content
+        assert [] == parsed
+        assert 42 == yaml2.get_value(["a", "b"])
+        assert not yaml2.corrupted
+        # and reading doesn't need the round-trip parse
+        assert [] == parsed
+        yaml2.set_value(["a", "c"], 43)
+        assert 1 == len(parsed)
+        assert 42 == yaml2.get_value(["a", "b"])
+
+        yaml2.use_changes_without_saving()
+        assert yaml2.content_key is None
+        yaml2.load()
+        assert yaml2.get_value(["a", "c"]) is None
+        assert saved_key == yaml2.content_key
+
+    with_directory_contents(dict(), check_content_key)
+
+
+def test_read_only_values_until_modified():
+    def check(filename):
+        yaml = YamlFile(filename)
+        assert dict(b=[1, 2]) == yaml.get_read_only_value("a")
+        assert 'default' == yaml.get_read_only_value(["a", "c"], default='default')
+
+        # values that can be modified in place come from the tree we save
+        value = yaml.get_value("a")
+        value['b'].append(3)
+        yaml.use_changes_without_saving()
+        assert [1, 2, 3] == yaml.get_read_only_value(["a", "b"])
+        yaml.save()
+
+        assert [1, 2, 3] == YamlFile(filename).get_read_only_value(["a", "b"])
+
+    with_file_contents("""
+# comment
+a:
+  b: [1, 2]
+""", check)
+
+
+def test_read_while_another_thread_parses(monkeypatch):
+    def check(filename):
+        from conda_kapsel import yaml_file
+        real_load_string = yaml_file._load_string
+        parsing = threading.Event()
+
+        def slow_load_string(contents):
+            parsing.set()
+            time.sleep(0.2)
+            return real_load_string(contents)
+
+        monkeypatch.setattr(yaml_file, '_load_string', slow_load_string)
+        yaml = YamlFile(filename)
+
+        # setting a value needs the full parse, which is slow
+        thread = threading.Thread(target=lambda: yaml.set_value(["a", "c"], 3))
+        thread.start()
+        parsing.wait()
+        try:
+            assert [1, 2] == yaml.get_read_only_value(["a", "b"])
+        finally:
+            thread.join()
+        assert 3 == yaml.get_value(["a", "c"])
+
+    with_file_contents("""
+a:
+  b: [1, 2]
+""", check)
+
+
+def _count_dumps(monkeypatch):
+    dumps = []
+    from conda_kapsel import yaml_file
+    real_dump = yaml_file.ryaml.dump
+
+    def mock_dump(*args, **kwargs):
+        dumps.append(args)
+        return real_dump(*args, **kwargs)
+
+    monkeypatch.setattr(yaml_file.ryaml, 'dump', mock_dump)
+    return dumps
+
+
+def test_batch_changes_saves_once(monkeypatch):
+    def check(dirname):
+        filename = os.path.join(dirname, "foo.yaml")
+        dumps = _count_dumps(monkeypatch)
+        yaml = YamlFile(filename)
+        with yaml.batch_changes():
+            for i in range(10):
+                yaml.set_value(["variables", "VAR%d" % i], i)
+                yaml.save()
+                # the change is applied, but not written yet
+                assert not yaml.has_uncounted_changes
+                assert not os.path.exists(filename)
+            with yaml.batch_changes():
+                yaml.unset_value(["variables", "VAR0"])
+                yaml.save()
+            assert not os.path.exists(filename)
+        assert 1 == len(dumps)
+        assert os.path.exists(filename)
+        assert yaml.content_key is not None
+
+        yaml2 = YamlFile(filename)
+        assert None is yaml2.get_value(["variables", "VAR0"])
+        assert 9 == yaml2.get_value(["variables", "VAR9"])
+
+        # nothing to save
+        with yaml2.batch_changes():
+            yaml2.save()
+        assert 1 == len(dumps)
+
+    with_directory_contents(dict(), check)
+
+
+def test_batch_changes_does_not_save_on_exception():
+    def check(dirname):
+        filename = os.path.join(dirname, "foo.yaml")
+        yaml = YamlFile(filename)
+        with pytest.raises(RuntimeError):
+            with yaml.batch_changes():
+                yaml.set_value("a", 1)
+                yaml.save()
+                raise RuntimeError("oops")
+        assert not os.path.exists(filename)
+        # the change is still there to save or discard
+        assert 1 == yaml.get_value("a")
+        yaml.load()
+        assert None is yaml.get_value("a")
+
+    with_directory_contents(dict(), check)
+
+
+def test_save_without_validating(monkeypatch):
+    def check(dirname):
+        filename = os.path.join(dirname, "foo.yaml")
+        from conda_kapsel import yaml_file
+        loads = []
+        real_load = yaml_file.ryaml.load
+
+        def mock_load(*args, **kwargs):
+            loads.append(args)
+            return real_load(*args, **kwargs)
+
+        monkeypatch.setattr(yaml_file.ryaml, 'load', mock_load)
+
+        yaml = YamlFile(filename)
+        yaml.set_value("a", 1)
+        yaml.save(validate=False)
+        assert [] == loads
+        with yaml.batch_changes(validate=False):
+            yaml.set_value("a", 2)
+            yaml.save()
+        assert [] == loads
+        yaml.set_value("a", 3)
+        yaml.save()
+        assert 1 == len(loads)
+        assert 3 == YamlFile(filename).get_value("a")
+
+    with_directory_contents(dict(), check)
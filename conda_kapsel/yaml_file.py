@@ -24,11 +24,16 @@ except ImportError:  # pragma: no cover
     from ruamel.yaml.comments import CommentedMap  # pragma: no cover
 
 import codecs
+from contextlib import contextmanager
 import errno
+import functools
+import hashlib
 import os
 import sys
+import threading
 import uuid
 
+from conda_kapsel.internal.file_lock import locked_file
 from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
 from conda_kapsel.internal.rename import rename_over_existing
 from conda_kapsel.internal.py2_compat import is_string
@@ -56,6 +61,71 @@ def _load_string(contents):
     return ryaml.load(contents, Loader=ryaml.RoundTripLoader)
 
 
+def _find_read_only_loader():
+    # the libyaml-based loader is many times faster than the
+    # round-trip one; the pure-Python safe loader isn't, so
+    # without libyaml we always use the round-trip loader.
+    try:
+        ryaml.load("{}", Loader=ryaml.CSafeLoader)
+        return ryaml.CSafeLoader
+    except (AttributeError, ImportError, TypeError):  # pragma: no cover (no libyaml)
+        return None  # pragma: no cover
+
+
+_read_only_loader = _find_read_only_loader()
+
+
+def _load_string_read_only(contents):
+    # plain dicts and lists, with no comments or formatting
+    return ryaml.load(contents, Loader=_read_only_loader)
+
+
+def _dump_string(tree, validate):
+    contents = ryaml.dump(tree, Dumper=ryaml.RoundTripDumper)
+
+    if validate:
+        try:
+            # This is to ensure we don't corrupt the file, even if ruamel.yaml is broken
+            ryaml.load(contents, Loader=ryaml.RoundTripLoader)
+        except YAMLError as e:  # pragma: no cover (should not happen)
+            print("ruamel.yaml bug; it failed to parse a file that it generated.", file=sys.stderr)
+            print("  the parse error was: " + str(e), file=sys.stderr)
+            print("Generated file was:", file=sys.stderr)
+            print(contents, file=sys.stderr)
+            raise RuntimeError("Bug in ruamel.yaml library; failed to parse a file that it generated: " + str(e))
+
+    return contents
+
+
+def _merge_changes(base, ours, theirs, depth):
+    # apply the changes from base to ours onto theirs, looking
+    # inside dicts down to the given depth; where we and they
+    # changed the same thing, we win.
+    for key in list(base.keys()):
+        if key not in ours and key in theirs:
+            del theirs[key]
+    for (key, value) in ours.items():
+        if key in base and base[key] == value:
+            continue
+        if depth > 1 and isinstance(value, dict) and isinstance(theirs.get(key, None), dict):
+            base_value = base.get(key, None)
+            if not isinstance(base_value, dict):
+                base_value = dict()
+            _merge_changes(base_value, value, theirs[key], depth - 1)
+        else:
+            theirs[key] = value
+
+
+def _synchronized(method):
+    # providers running on several threads share one file object
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class YamlFile(object):
     """Abstract YAML file, base class for ``ProjectFile`` and ``LocalStateFile``.
 
@@ -65,6 +135,12 @@ class YamlFile(object):
 
     """
 
+    # When saving, the file may have been saved by someone else
+    # since we loaded it. With a depth of 0 we overwrite their
+    # changes; otherwise we put our changes on top of theirs,
+    # merging dicts down to this many levels.
+    _merge_depth = 0
+
     def __init__(self, filename):
         """Load a YamlFile with the given filename.
 
@@ -79,10 +155,17 @@ class YamlFile(object):
 
         """
         self.filename = filename
+        self._lock = threading.RLock()
         self._dirty = False
+        self._edited = False
         self._change_count = 0
+        self._content_key = None
+        self._batch_depth = 0
+        self._batch_save_pending = False
+        self._batch_validate = True
         self.load()
 
+    @_synchronized
     def load(self):
         """Reload the file from disk, discarding any unsaved changes.
 
@@ -97,26 +180,83 @@ class YamlFile(object):
         self._corrupted = False
         self._corrupted_error_message = None
         self._change_count = self._change_count + 1
+        self._edited = False
+        # we just threw away whatever a batch was going to save
+        self._batch_save_pending = False
 
         try:
             with codecs.open(self.filename, 'r', 'utf-8') as file:
                 contents = file.read()
-            self._yaml = _load_string(contents)
+                st = os.fstat(file.fileno())
+            self._content_key = [self.filename, st.st_size, st.st_mtime,
+                                 hashlib.sha1(contents.encode('utf-8')).hexdigest()]
             self._dirty = False
         except IOError as e:
             if e.errno == errno.ENOENT:
-                self._yaml = None
+                contents = None
+                self._content_key = [self.filename, None, None, None]
+                self._dirty = True
             else:
                 raise e
-        except YAMLError as e:
-            self._corrupted = True
-            self._corrupted_error_message = str(e)
-            self._yaml = None
 
-        if self._yaml is None:
-            self._yaml = self._default_content()
+        # parsing is slow, and callers with a cached copy of what
+        # they need from the file never look at the parse tree
+        self._unparsed_contents = contents
+        self._base_contents = contents
+        self._parsed = False
+        self._tree = None
+        self._read_only_tree = None
+
+    @_synchronized
+    def _parse(self):
+        contents = self._unparsed_contents
+        tree = None
+        if contents is not None:
+            try:
+                tree = _load_string(contents)
+            except YAMLError as e:
+                self._corrupted = True
+                self._corrupted_error_message = str(e)
+
+        if tree is None:
+            tree = self._default_content()
             self._dirty = True
 
+        # only claim to be parsed once the tree is there
+        self._tree = tree
+        self._unparsed_contents = None
+        self._read_only_tree = None
+        self._parsed = True
+
+    @property
+    def _yaml(self):
+        with self._lock:
+            if not self._parsed:
+                self._parse()
+            return self._tree
+
+    @_synchronized
+    def _read_only_yaml(self):
+        # we only need the round-trip parse tree (slow to build)
+        # once someone wants to change the file
+        if self._parsed:
+            return self._tree
+        if self._read_only_tree is None:
+            contents = self._unparsed_contents
+            if contents is None or _read_only_loader is None:
+                return self._yaml
+            try:
+                tree = _load_string_read_only(contents)
+            except YAMLError:
+                # let the round-trip parse decide how it's corrupted,
+                # so the error message doesn't depend on libyaml
+                return self._yaml
+            if tree is None:
+                # an empty file gets our default content
+                return self._yaml
+            self._read_only_tree = tree
+        return self._read_only_tree
+
     def _default_comment(self):
         return "yaml file"
 
@@ -128,6 +268,9 @@ class YamlFile(object):
         return root
 
     def _throw_if_corrupted(self):
+        # only called before changes, which need the round-trip parse anyway
+        if not self._parsed:
+            self._parse()
         if self._corrupted:
             raise ValueError("Cannot modify corrupted YAML file %s\n%s" %
                              (self.filename, self._corrupted_error_message))
@@ -142,6 +285,7 @@ class YamlFile(object):
         Returns:
             True if file is corrupted.
         """
+        self._read_only_yaml()
         return self._corrupted
 
     @property
@@ -153,6 +297,7 @@ class YamlFile(object):
         Returns:
             Corruption message or None.
         """
+        self._read_only_yaml()
         return self._corrupted_error_message
 
     @property
@@ -165,6 +310,26 @@ class YamlFile(object):
         """
         return self._change_count
 
+    @property
+    def has_uncounted_changes(self):
+        """Get True if we've modified the file in memory since ``change_count`` last incremented.
+
+        Caches keyed on ``change_count`` can't trust it while this is True.
+        """
+        return self._edited
+
+    @property
+    def content_key(self):
+        """Get a JSON-compatible value identifying the file content we have, or None if it's been changed in memory.
+
+        The value has the file's size, modification time, and a
+        hash of its contents as of the last ``load()`` or
+        ``save()``, so caches of anything computed from the
+        content can be keyed on it.
+        """
+        return self._content_key
+
+    @_synchronized
     def use_changes_without_saving(self):
         """Apply any in-memory changes as if we'd saved, but don't actually save.
 
@@ -173,40 +338,180 @@ class YamlFile(object):
         """
         self._change_count = self._change_count + 1
         self._dirty = True
+        self._edited = False
+        self._content_key = None
 
-    def save(self):
+    @_synchronized
+    def save(self, validate=True):
         """Write the file to disk, only if any changes have been made.
 
+        Inside ``batch_changes()``, this only applies the changes
+        in memory (as ``use_changes_without_saving()`` does), and
+        the file is written once at the end of the batch.
+
         Raises ``IOError`` if it fails for some reason.
 
+        Args:
+            validate (bool): parse the YAML we generate before writing it, in case ruamel.yaml is broken
+
         Returns:
             None
         """
+        # dump before taking the lock, so the lock is only held
+        # for long if we have to merge
+        contents = self._contents_to_save(validate)
+        if contents is not None:
+            with locked_file(self.filename):
+                self._write_while_locked(contents, validate)
+
+    @_synchronized
+    def _save_while_locked(self, validate=True):
+        # like save(), for callers already holding locked_file() on our filename
+        contents = self._contents_to_save(validate)
+        if contents is not None:
+            self._write_while_locked(contents, validate)
+
+    def _contents_to_save(self, validate):
+        # returns None if there's nothing to write right now
         self._throw_if_corrupted()
 
+        if self._batch_depth > 0:
+            if self._edited:
+                self.use_changes_without_saving()
+            self._batch_save_pending = True
+            self._batch_validate = self._batch_validate and validate
+            return None
+
         if not self._dirty:
-            return
+            return None
 
-        contents = ryaml.dump(self._yaml, Dumper=ryaml.RoundTripDumper)
-
-        try:
-            # This is to ensure we don't corrupt the file, even if ruamel.yaml is broken
-            ryaml.load(contents, Loader=ryaml.RoundTripLoader)
-        except YAMLError as e:  # pragma: no cover (should not happen)
-            print("ruamel.yaml bug; it failed to parse a file that it generated.", file=sys.stderr)
-            print("  the parse error was: " + str(e), file=sys.stderr)
-            print("Generated file was:", file=sys.stderr)
-            print(contents, file=sys.stderr)
-            raise RuntimeError("Bug in ruamel.yaml library; failed to parse a file that it generated: " + str(e))
+        return _dump_string(self._yaml, validate)
 
+    def _write_while_locked(self, contents, validate):
         if not os.path.isfile(self.filename):
             # might have to make the directory
             dirname = os.path.dirname(self.filename)
             makedirs_ok_if_exists(dirname)
+        if self._merge_depth > 0:
+            merged = self._merge_with_file_on_disk()
+            if merged is not None:
+                self._tree = merged
+                contents = _dump_string(merged, validate)
         _atomic_replace(self.filename, contents)
+        st = os.stat(self.filename)
+        self._base_contents = contents
+        self._content_key = [self.filename, st.st_size, st.st_mtime,
+                             hashlib.sha1(contents.encode('utf-8')).hexdigest()]
         self._change_count = self._change_count + 1
         self._dirty = False
+        self._edited = False
+
+    @_synchronized
+    def _reload_value_if_unchanged(self, path):
+        # for callers holding locked_file() on our filename: if we
+        # haven't changed the value at path since we last loaded or
+        # saved, pick up whatever is on disk now. Returns True if
+        # that changed our value.
+        try:
+            with codecs.open(self.filename, 'r', 'utf-8') as file:
+                their_contents = file.read()
+        except IOError:
+            return False
+        if their_contents == self._base_contents:
+            return False
+
+        try:
+            if _read_only_loader is None:
+                theirs = _load_string(their_contents)  # pragma: no cover (no libyaml)
+                base = _load_string(self._base_contents or "")  # pragma: no cover (no libyaml)
+            else:
+                theirs = _load_string_read_only(their_contents)
+                base = _load_string_read_only(self._base_contents or "")
+        except YAMLError:
+            return False
+        if not isinstance(theirs, dict):
+            theirs = dict()
+        if not isinstance(base, dict):
+            base = dict()
+
+        path = self._path(path)
+        ours = self.get_read_only_value(path)
+        if ours != self._get_value_in(base, path, None):
+            # ours wins, as it would when merging
+            return False
+        value = self._get_value_in(theirs, path, None)
+        if value == ours:
+            return False
+        if value is None:
+            self.unset_value(path)
+        else:
+            self.set_value(path, value)
+        return True
+
+    def _merge_with_file_on_disk(self):
+        # returns None if there's nothing on disk to merge with
+        try:
+            with codecs.open(self.filename, 'r', 'utf-8') as file:
+                their_contents = file.read()
+        except IOError:
+            return None
+        if their_contents == self._base_contents:
+            return None
+
+        try:
+            theirs = _load_string(their_contents)
+            if self._base_contents is None:
+                base = None
+            elif _read_only_loader is None:
+                base = _load_string(self._base_contents)  # pragma: no cover (no libyaml)
+            else:
+                base = _load_string_read_only(self._base_contents)
+        except YAMLError:
+            # they broke it, so we replace it as we always did
+            return None
+        if not isinstance(theirs, dict):
+            return None
+        if not isinstance(base, dict):
+            base = dict()
+
+        _merge_changes(base, self._yaml, theirs, self._merge_depth)
+        return theirs
+
+    @contextmanager
+    def batch_changes(self, validate=True):
+        """Context manager which turns every ``save()`` inside it into one save at the end.
+
+        Serializing the whole file is the slow part of saving, so
+        code making many changes, each followed by ``save()``, can
+        do them all inside this and write the file only once.
+        Batches can be nested; the outermost one saves.
+
+        If the block raises an exception, nothing is saved, but
+        the changes are still in memory; use ``load()`` to
+        discard them.
+
+        Args:
+            validate (bool): False to skip parsing the YAML we generate before writing it
 
+        """
+        self._batch_depth = self._batch_depth + 1
+        if self._batch_depth == 1:
+            self._batch_save_pending = False
+            self._batch_validate = True
+        self._batch_validate = self._batch_validate and validate
+        succeeded = False
+        try:
+            yield self
+            succeeded = True
+        finally:
+            self._batch_depth = self._batch_depth - 1
+            if self._batch_depth == 0:
+                save_pending = self._batch_save_pending
+                self._batch_save_pending = False
+                if succeeded and save_pending:
+                    self.save(validate=self._batch_validate)
+
+    @_synchronized
     def transform_yaml(self, transformer):
         """Modify the YAML parse tree.
 
@@ -230,6 +535,8 @@ class YamlFile(object):
         result = transformer(self._yaml)
         if result is not True:
             self._dirty = True
+            self._edited = True
+            self._content_key = None
 
     @classmethod
     def _path(cls, path):
@@ -241,8 +548,7 @@ class YamlFile(object):
             except TypeError:
                 raise ValueError("YAML file path must be a string or an iterable of strings")
 
-    def _get_dict_or_none(self, pieces):
-        current = self._yaml
+    def _get_dict_or_none(self, current, pieces):
         for p in pieces:
             if p in current and isinstance(current[p], dict):
                 current = current[p]
@@ -258,10 +564,13 @@ class YamlFile(object):
             if p not in current or not isinstance(current[p], dict):
                 current[p] = dict()
                 self._dirty = True
+                self._edited = True
+                self._content_key = None
 
             current = current[p]
         return current
 
+    @_synchronized
     def set_value(self, path, value):
         """Set a single value at the given path.
 
@@ -279,7 +588,10 @@ class YamlFile(object):
         existing = self._ensure_dicts_at_path(path[:-1])
         existing[path[-1]] = value
         self._dirty = True
+        self._edited = True
+        self._content_key = None
 
+    @_synchronized
     def unset_value(self, path):
         """Remove a single value at the given path.
 
@@ -292,15 +604,30 @@ class YamlFile(object):
 
         path = self._path(path)
 
-        existing = self._get_dict_or_none(path[:-1])
+        existing = self._get_dict_or_none(self._yaml, path[:-1])
         key = path[-1]
         if existing is not None and key in existing:
             del existing[key]
             self._dirty = True
+            self._edited = True
+            self._content_key = None
+
+    def _get_value_in(self, tree, path, default):
+        existing = self._get_dict_or_none(tree, path[:-1])
+        if existing is None:
+            return default
+        else:
+            return existing.get(path[-1], default)
 
+    @_synchronized
     def get_value(self, path, default=None):
         """Get a single value from the YAML file.
 
+        A dict or list value can be modified in place, as long as
+        you then call ``use_changes_without_saving()`` or
+        ``save()``. If you won't modify it, use
+        ``get_read_only_value()``, which is faster.
+
         Args:
             path (str or list of str): single key, or list of nested keys
             default: any YAML-compatible value type
@@ -309,11 +636,29 @@ class YamlFile(object):
             the value from the file or the provided default
         """
         path = self._path(path)
-        existing = self._get_dict_or_none(path[:-1])
-        if existing is None:
-            return default
-        else:
-            return existing.get(path[-1], default)
+        value = self._get_value_in(self._read_only_yaml(), path, default)
+        if isinstance(value, (dict, list)) and value is not default and not self._parsed:
+            # the caller may modify it, so it has to be part of
+            # the tree we save
+            value = self._get_value_in(self._yaml, path, default)
+        return value
+
+    @_synchronized
+    def get_read_only_value(self, path, default=None):
+        """Get a single value from the YAML file, which must not be modified.
+
+        Until the file is modified, values come from a plain
+        (no comments or formatting) parse, which is much faster
+        than the parse we need to save changes.
+
+        Args:
+            path (str or list of str): single key, or list of nested keys
+            default: any YAML-compatible value type
+
+        Returns:
+            the value from the file or the provided default
+        """
+        return self._get_value_in(self._read_only_yaml(), self._path(path), default)
 
     @property
     def root(self):